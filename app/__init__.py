@@ -125,34 +125,29 @@ def create_app(config=None):
     # Register context processor
     @app.context_processor
     def inject_admin_flag():
-        """Inject admin flag and cluster info into all templates."""
-        from app.services.user_manager import is_admin_user
+        """Inject admin flag and cluster info into all templates.
+        
+        Roles come from the session identity claim resolved at login, so
+        rendering a page makes no Proxmox calls and no per-render user lookups.
+        """
+        from app.services.user_manager import get_session_identity
+        from app.services.proxmox_service import get_cluster_choices
         
         user = session.get("user")
-        is_admin = is_admin_user(user) if user else False
+        identity = get_session_identity() if user else None
+        is_admin = bool(identity and identity.get("is_admin"))
         
         # Log admin status for debugging
         if user:
             app.logger.debug("inject_admin_flag: user=%s is_admin=%s", user, is_admin)
         
-        # Inject cluster info for dropdown (load from database)
-        from app.services.proxmox_service import get_clusters_from_db
-        db_clusters = get_clusters_from_db()
-        current_cluster = session.get("cluster_id", db_clusters[0]["id"] if db_clusters else "")
-        clusters = [{"id": c["id"], "name": c["name"]} for c in db_clusters]
+        # Inject cluster info for dropdown (cached list of active clusters)
+        clusters = get_cluster_choices()
+        current_cluster = session.get("cluster_id", clusters[0]["id"] if clusters else "")
         
-        # Check if user has local account with role info
-        local_user = None
-        local_user_role = None
-        if user:
-            try:
-                from app.services.class_service import get_user_by_username
-                username = user.split('@')[0] if '@' in user else user
-                local_user = get_user_by_username(username)
-                if local_user:
-                    local_user_role = local_user.role
-            except Exception:
-                pass
+        # Local account role info (from the identity claim)
+        local_user = identity.get("local_user") if identity else None
+        local_user_role = local_user["role"] if local_user else None
         
         return {
             "is_admin": is_admin,
@@ -162,6 +157,25 @@ def create_app(config=None):
             "local_user_role": local_user_role,
         }
     
+    # Background daemons (opt out with BACKGROUND_SERVICES=False in config)
+    if app.config.get('BACKGROUND_SERVICES', True):
+        start_background_services(app)
+    else:
+        logger.info("Background services disabled by config")
+    
+    logger.info("Flask app created successfully")
+    return app
+
+
+def start_background_services(app):
+    """Start the DB writer, sync daemons and the daemon monitor for app."""
+    # Start the SQLite single-writer queue before any daemon that writes
+    try:
+        from app.services.db_writer import start_db_writer
+        start_db_writer(app)
+    except Exception as e:
+        logger.error(f"Failed to start DB writer: {e}", exc_info=True)
+    
     # Start background IP scanner
     try:
         from app.services.proxmox_service import start_background_ip_scanner
@@ -269,6 +283,3 @@ def create_app(config=None):
         logger.error(f"Failed to start daemon monitor: {e}", exc_info=True)
     
     # Depl0y integration removed
-    
-    logger.info("Flask app created successfully")
-    return app
@@ -9,7 +9,8 @@ Schema:
 - VMAssignment: VMs cloned for classes, assigned to users
 - Token: Invite links for joining classes
 
-All tables use SQLite via SQLAlchemy.
+All tables use SQLAlchemy: SQLite by default, PostgreSQL when
+SQLALCHEMY_DATABASE_URI points at one (see app/utils/db_dialect.py).
 """
 
 import os
@@ -290,6 +291,8 @@ class Class(db.Model):
     token_expires_at = db.Column(db.DateTime, nullable=True)
     token_never_expires = db.Column(db.Boolean, default=False)
     pool_size = db.Column(db.Integer, default=0)  # Target number of VMs in pool
+    warm_pool_size = db.Column(db.Integer, default=0)  # Spare (unassigned) student VMs kept ready (0=off)
+    warm_pool_boot = db.Column(db.Boolean, default=False)  # Keep the spares running so their IPs are known
     cpu_cores = db.Column(db.Integer, default=2)  # CPU cores per VM
     memory_mb = db.Column(db.Integer, default=2048)  # RAM in MB per VM
     disk_size_gb = db.Column(db.Integer, default=32)  # Disk size in GB (for template-less classes)
@@ -457,6 +460,8 @@ class Class(db.Model):
             'token_never_expires': self.token_never_expires,
             'token_expires_at': self.token_expires_at.isoformat() if self.token_expires_at else None,
             'pool_size': self.pool_size,
+            'warm_pool_size': self.warm_pool_size or 0,
+            'warm_pool_boot': bool(self.warm_pool_boot),
             'cpu_cores': self.cpu_cores,
             'memory_mb': self.memory_mb,
             'disk_size_gb': self.disk_size_gb,
@@ -712,6 +717,32 @@ class VMInventory(db.Model):
         return f'<VMInventory {self.cluster_id}:{self.vmid} {self.name} [{self.status}]>'
 
 
+class VMIDReservation(db.Model):
+    """A VMID range held by an in-flight allocation (see app/services/vmid_allocator.py).
+    
+    Single IDs and aligned 100-blocks (class prefixes) are reserved here
+    between allocation and the VM/class showing up in VMInventory/Class, so
+    concurrent deployments - in any worker process - never get the same ID.
+    Rows with expires_at in the past are ignored and purged.
+    """
+    __tablename__ = 'vmid_reservations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cluster_id = db.Column(db.String(50), nullable=False, default='*')  # '*' = all clusters
+    start_vmid = db.Column(db.Integer, nullable=False)
+    end_vmid = db.Column(db.Integer, nullable=False)  # inclusive
+    owner = db.Column(db.String(120), nullable=True, index=True)  # e.g. "class:12", "deploy"
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)  # NULL = until released
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('cluster_id', 'start_vmid', name='uix_vmid_reservation_start'),
+    )
+    
+    def __repr__(self):
+        return f'<VMIDReservation {self.cluster_id}:{self.start_vmid}-{self.end_vmid} {self.owner}>'
+
+
 class ProxmoxNode(db.Model):
     """Cached mapping of Proxmox node hostnames to IP addresses.
     
@@ -791,6 +822,45 @@ class ProxmoxNode(db.Model):
         return f'<ProxmoxNode {self.cluster_id}:{self.hostname}={self.ip_address}>'
 
 
+class NodeStorageProbe(db.Model):
+    """Latest storage path measurement from one node to one shared storage.
+
+    Written by the storage probe sync job (app/services/storage_probe.py) and
+    read by the placement engine to steer overlay-backed VMs toward nodes
+    with a fast path to the storage holding their base image.
+    """
+    __tablename__ = 'node_storage_probes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cluster_id = db.Column(db.String(50), nullable=False, index=True)
+    node = db.Column(db.String(255), nullable=False)
+    storage = db.Column(db.String(120), nullable=False)
+    latency_ms = db.Column(db.Float, nullable=True)  # mean 4K direct read
+    throughput_mbps = db.Column(db.Float, nullable=True)  # sequential direct write, MB/s
+    error = db.Column(db.Text, nullable=True)  # last probe failure (measurements kept)
+    error_at = db.Column(db.DateTime, nullable=True)  # when that failure happened
+    probed_at = db.Column(db.DateTime, nullable=True)  # last successful measurement
+
+    __table_args__ = (
+        db.UniqueConstraint('cluster_id', 'node', 'storage', name='uix_node_storage_probe'),
+    )
+
+    def to_dict(self) -> dict:
+        return {
+            'cluster_id': self.cluster_id,
+            'node': self.node,
+            'storage': self.storage,
+            'latency_ms': self.latency_ms,
+            'throughput_mbps': self.throughput_mbps,
+            'error': self.error,
+            'error_at': self.error_at.isoformat() if self.error_at else None,
+            'probed_at': self.probed_at.isoformat() if self.probed_at else None,
+        }
+
+    def __repr__(self):
+        return f'<NodeStorageProbe {self.cluster_id}:{self.node}/{self.storage} {self.latency_ms}ms {self.throughput_mbps}MB/s>'
+
+
 class Resource(db.Model):
     """Resource cards with URLs accessible to teachers and admins.
     
@@ -837,23 +907,27 @@ class Resource(db.Model):
 def init_db(app):
     """Initialize database with Flask app context.
     
-    Call this in create_app() to set up the database.
+    Call this in create_app() to set up the database. The backend comes from
+    SQLALCHEMY_DATABASE_URI (app.config or environment); without it the
+    bundled SQLite file app/lab_portal.db is used.
     """
-    # Set database URI if not already configured
+    from app.config import DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT, SQLALCHEMY_DATABASE_URI
+    from app.utils.db_dialect import engine_options_for, install_sqlite_pragmas
+    
+    # Set database URI if not already configured (tests pass their own URI)
     if 'SQLALCHEMY_DATABASE_URI' not in app.config:
-        db_path = os.path.join(os.path.dirname(__file__), 'lab_portal.db')
-        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-        # Improve SQLite concurrency: allow cross-thread access and increase lock timeout to 60s
-        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-            'connect_args': {
-                'check_same_thread': False,
-                'timeout': 60,  # 60 second timeout for write locks (handles background thread contention)
-            },
-            'pool_pre_ping': True,  # Verify connections are alive
-            'pool_recycle': 3600,  # Recycle connections after 1 hour
-            'pool_size': 20,  # Increase from default 5 to handle background threads
-            'max_overflow': 30,  # Increase from default 10 to handle bursts
-        }
+        if SQLALCHEMY_DATABASE_URI:
+            app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+        else:
+            db_path = os.path.join(os.path.dirname(__file__), 'lab_portal.db')
+            app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+        # Pool sizing / SQLite lock timeouts per backend
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_for(
+            app.config['SQLALCHEMY_DATABASE_URI'],
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
     
     # Disable modification tracking (not needed and impacts performance)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -863,13 +937,6 @@ def init_db(app):
     
     # Create tables if they don't exist
     with app.app_context():
-        # Enable WAL journal mode to reduce write-lock contention
-        # WAL allows multiple concurrent readers with one writer
-        try:
-            db.session.execute("PRAGMA journal_mode=WAL;")
-            db.session.execute("PRAGMA busy_timeout=60000;")  # 60 second busy timeout in milliseconds
-            db.session.execute("PRAGMA synchronous=NORMAL;")  # Faster writes, still crash-safe with WAL
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+        # SQLite: WAL + busy timeout on every pooled connection (no-op for other backends)
+        install_sqlite_pragmas(db.engine)
         db.create_all()
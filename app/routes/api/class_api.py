@@ -469,26 +469,18 @@ def delete_class_route(class_id: int):
         logger.error(f"Failed to delete class {class_id} from database: {msg}")
         return jsonify({"ok": False, "error": msg}), 400
     
-    logger.info(f"Class {class_id} deleted from database, now deleting {len(vm_assignments_to_delete)} VMs from Proxmox")
+    logger.info(f"Class {class_id} deleted from database, queueing teardown of {len(vm_assignments_to_delete)} VMs")
     
-    # First, stop all running VMs in parallel (faster than sequential)
-    logger.info(f"Stopping all running VMs for class {class_id}...")
-    from app.services.proxmox_service import get_proxmox_admin_for_cluster
     from app.services.proxmox_service import get_clusters_from_db
     
     # Get cluster connection
-    cluster_id = None
-    for cluster in get_clusters_from_db():
-        if cluster["host"] == (cluster_ip or "10.220.15.249"):
-            cluster_id = cluster["id"]
-            break
-    
-    if not cluster_id:
+    clusters = get_clusters_from_db()
+    cluster = next((c for c in clusters if c["host"] == (cluster_ip or "10.220.15.249")), None)
+    if not cluster:
         # Fallback: use first active cluster if template cluster not found
-        clusters = get_clusters_from_db()
         if clusters:
-            cluster_id = clusters[0]["id"]
-            logger.warning(f"Template cluster not found, using default cluster: {clusters[0]['name']}")
+            cluster = clusters[0]
+            logger.warning(f"Template cluster not found, using default cluster: {cluster['name']}")
         else:
             logger.error("No clusters available for VM deletion!")
             return jsonify({
@@ -498,111 +490,59 @@ def delete_class_route(class_id: int):
                 "failed_vms": [{"vmid": vm["vmid"], "error": "No cluster connection"} for vm in vm_assignments_to_delete]
             }), 500
     
-    # Now proceed with VM deletion
-    try:
-            proxmox = get_proxmox_admin_for_cluster(cluster_id)
-            
-            # FIRST: Query actual nodes for all VMs (they may have been migrated)
-            logger.info(f"Querying actual nodes for {len(vm_assignments_to_delete)} VMs...")
-            nodes_updated = 0
-            try:
-                resources = proxmox.cluster.resources.get(type="vm")
-                logger.info(f"Found {len(resources)} total VMs in cluster")
-                
-                for vm_info in vm_assignments_to_delete:
-                    found = False
-                    for r in resources:
-                        if int(r.get('vmid', -1)) == int(vm_info['vmid']):
-                            actual_node = r.get('node')
-                            if actual_node != vm_info['node']:
-                                logger.warning(f"VM {vm_info['vmid']} found on {actual_node}, NOT {vm_info['node']} (database outdated), correcting...")
-                                vm_info['node'] = actual_node
-                                nodes_updated += 1
-                            else:
-                                logger.info(f"VM {vm_info['vmid']} confirmed on node {actual_node}")
-                            found = True
-                            break
-                    
-                    if not found:
-                        logger.error(f"VM {vm_info['vmid']} not found in cluster resources! Will attempt deletion on stored node {vm_info['node']}")
-                
-                logger.info(f"Node validation complete: {nodes_updated} nodes corrected")
-            except Exception as e:
-                logger.error(f"Failed to query cluster resources for node validation: {e}", exc_info=True)
-                logger.warning("Proceeding with deletion using database node info (may fail if VMs migrated)")
-            
-            # SECOND: Stop all running VMs and wait for them to stop
-            logger.info(f"Stopping and waiting for {len(vm_assignments_to_delete)} VMs...")
-            for vm_info in vm_assignments_to_delete:
-                try:
-                    vmid = vm_info['vmid']
-                    node = vm_info['node']
-                    
-                    # Check if VM is running
-                    try:
-                        status = proxmox.nodes(node).qemu(vmid).status.current.get()
-                        if status.get('status') == 'running':
-                            logger.info(f"Stopping VM {vmid} on node {node}...")
-                            proxmox.nodes(node).qemu(vmid).status.stop.post()
-                            
-                            # Wait for VM to stop (poll until stopped or timeout) using Proxmox API
-                            import time
-                            max_wait = 60
-                            poll_interval = 2
-                            elapsed = 0
-                            
-                            while elapsed < max_wait:
-                                time.sleep(poll_interval)
-                                elapsed += poll_interval
-                                
-                                try:
-                                    current_status = proxmox.nodes(node).qemu(vmid).status.current.get()
-                                    if current_status.get('status') == 'stopped':
-                                        logger.info(f"VM {vmid} stopped successfully")
-                                        break
-                                except Exception as check_error:
-                                    # VM might have been deleted or is stopping
-                                    logger.debug(f"Error checking VM {vmid} status: {check_error}")
-                                    break
-                            else:
-                                logger.warning(f"VM {vmid} did not stop within {max_wait}s, proceeding with deletion anyway")
-                        else:
-                            logger.info(f"VM {vmid} already stopped (status: {status.get('status')})")
-                    except Exception as e:
-                        logger.warning(f"Failed to stop VM {vmid}: {e}")
-                        
-                except Exception as e:
-                    logger.warning(f"Error during VM {vm_info['vmid']} stop: {e}")
-                    
-    except Exception as e:
-        logger.error(f"Error during VM stop/deletion phase: {e}", exc_info=True)
-        # Continue with deletion anyway
-    
-    # Delete VMs from Proxmox (best effort, class already deleted)
-    deleted_vms = []
+    # CRITICAL SAFETY CHECK: Never delete registered template VMs
+    template_vmids = {
+        t.proxmox_vmid for t in Template.query.filter(
+            Template.proxmox_vmid.in_([vm['vmid'] for vm in vm_assignments_to_delete])
+        ).all()
+    } if vm_assignments_to_delete else set()
     failed_vms = []
-    for vm_info in vm_assignments_to_delete:
-        logger.info(f"Deleting VM {vm_info['vmid']} on node {vm_info['node']} (cluster: {cluster_ip}, was in class {vm_info['class_id']}, assignment {vm_info['assignment_id']})")
-        vm_success, vm_msg = delete_vm(vm_info['vmid'], vm_info['node'], cluster_ip)
-        if vm_success:
-            deleted_vms.append(vm_info['vmid'])
-            logger.info(f"Successfully deleted VM {vm_info['vmid']} that belonged to class {class_id}")
-        else:
-            failed_vms.append({'vmid': vm_info['vmid'], 'error': vm_msg})
-            logger.warning(f"Failed to delete VM {vm_info['vmid']} from class {class_id}: {vm_msg}")
+    for vmid in sorted(template_vmids):
+        logger.error(f"REFUSED: VM {vmid} is a registered template and will not be deleted")
+        failed_vms.append({'vmid': vmid, 'error': "VM is a registered template"})
+    to_teardown = [vm for vm in vm_assignments_to_delete if vm['vmid'] not in template_vmids]
     
     # CRITICAL: We ONLY delete VMs that are in VMAssignment for this class
     # - Teacher VM (is_teacher_vm=True)
     # - Class-base VM (is_template_vm=True) - the class-specific overlay base
     # - Student VMs (regular assignments)
     # We NEVER delete the original source template (class_.template) which is shared across classes
-
-    logger.info(f"Class deletion complete: {len(deleted_vms)} VMs deleted, {len(failed_vms)} failed")
-
+    
+    # Stop/destroy runs in the background; progress via /api/classes/clone/progress/<task_id>
+    task_id = str(uuid.uuid4())
+    start_clone_progress(task_id, len(to_teardown))
+    
+    from flask import current_app
+    app = current_app._get_current_object()
+    
+    def _teardown_background():
+        from app.services.class_teardown import TeardownJob
+        from app.services.proxmox_service import get_proxmox_admin_for_cluster
+        from app.services.ssh_executor import get_pooled_ssh_executor
+        
+        with app.app_context():
+            try:
+                proxmox = get_proxmox_admin_for_cluster(cluster["id"])
+                try:
+                    username = cluster['user'].split('@')[0] if '@' in cluster['user'] else cluster['user']
+                    ssh_executor = get_pooled_ssh_executor(cluster['host'], username, cluster['password'])
+                except Exception as e:
+                    logger.warning(f"No SSH connection for overlay cleanup of class {class_id}: {e}")
+                    ssh_executor = None
+                result = TeardownJob(proxmox, to_teardown, ssh_executor=ssh_executor, task_id=task_id).run()
+                logger.info(f"Class {class_id} teardown complete: {len(result['deleted'])} VMs deleted, "
+                            f"{len(result['failed'])} failed")
+            except Exception as e:
+                logger.exception(f"Class {class_id} teardown failed: {e}")
+                update_clone_progress(task_id, status="failed", error=str(e))
+    
+    threading.Thread(target=_teardown_background, daemon=True).start()
+    
     return jsonify({
         "ok": True,
-        "message": msg,
-        "deleted_vms": deleted_vms,
+        "message": f"{msg}. Deleting {len(to_teardown)} VMs in the background.",
+        "task_id": task_id,
+        "queued_vms": [vm['vmid'] for vm in to_teardown],
         "failed_vms": failed_vms,
     })
 
@@ -801,12 +741,15 @@ def trigger_template_replication():
     from app.services.proxmox_operations import replicate_templates_to_all_nodes
     
     task_id = str(uuid.uuid4())
+    from flask import current_app
+    app = current_app._get_current_object()
     
     def run_replication():
         try:
             logger.info(f"[Task {task_id}] Starting template replication")
-            replicate_templates_to_all_nodes(CLASS_CLUSTER_IP)
-            logger.info(f"[Task {task_id}] Template replication completed")
+            with app.app_context():
+                stats = replicate_templates_to_all_nodes(CLASS_CLUSTER_IP)
+            logger.info(f"[Task {task_id}] Template replication completed: {stats}")
         except Exception as e:
             logger.exception(f"[Task {task_id}] Template replication failed: {e}")
     
@@ -1100,6 +1043,26 @@ def auto_assign_vms_route(class_id: int):
     })
 
 
+@api_classes_bp.route("/<int:class_id>/warm-pool", methods=["GET"])
+@login_required
+def warm_pool_status(class_id: int):
+    """Spare/ready VM counts of a class's warm pool (configured via class settings)."""
+    user, error = require_teacher_or_adminer()
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    class_ = get_class_by_id(class_id)
+    if not class_:
+        return jsonify({"ok": False, "error": "Class not found"}), 404
+    
+    if not user.is_adminer and not class_.is_owner(user):
+        return jsonify({"ok": False, "error": "Access denied"}), 403
+    
+    from app.services.warm_pool import pool_status
+    
+    return jsonify({"ok": True, "warm_pool": pool_status(class_)})
+
+
 # ---------------------------------------------------------------------------
 # Student VM Operations
 # ---------------------------------------------------------------------------
@@ -1148,7 +1111,7 @@ def start_my_vm(class_id: int):
     if assignment.is_template_vm:
         return jsonify({"ok": False, "error": "Cannot start a template VM. Templates must be cloned to regular VMs before they can be started."}), 400
     
-    success, msg = start_class_vm(assignment.proxmox_vmid, assignment.node)
+    success, msg = start_class_vm(assignment.proxmox_vmid, assignment.node, owner=user.username)
     
     if not success:
         return jsonify({"ok": False, "error": msg}), 400
@@ -1181,7 +1144,10 @@ def stop_my_vm(class_id: int):
 def revert_my_vm(class_id: int):
     """Revert current user's VM to class baseline snapshot.
     
-    This is a fast operation using Proxmox's snapshot system.
+    This is a fast operation using Proxmox's snapshot system. Classes with a
+    warm pool hand the student a fresh spare VM instead (already booted if
+    the pool keeps spares running) and destroy the old VM in the background.
+    Linked clone classes have no warm pool and always roll back.
     """
     user = get_current_user()
     if not user:
@@ -1191,6 +1157,23 @@ def revert_my_vm(class_id: int):
     if not assignment:
         return jsonify({"ok": False, "error": "You don't have a VM in this class"}), 404
     
+    class_ = get_class_by_id(class_id)
+    from app.services.warm_pool import refill_async, supports_warm_pool, swap_for_spare
+    
+    if class_ and class_.warm_pool_size and supports_warm_pool(class_) and not assignment.is_teacher_vm:
+        spare = swap_for_spare(assignment, user)
+        if spare:
+            db.session.commit()
+            logger.info(f"Swapped {user.username}'s VM {assignment.proxmox_vmid} for spare {spare.proxmox_vmid} "
+                        f"in class {class_id}")
+            refill_async(class_id, retire=assignment.id)
+            return jsonify({
+                "ok": True,
+                "message": f"Your VM was replaced with a fresh VM ({spare.vm_name or spare.proxmox_vmid})",
+                "swapped": True,
+                "vm_assignment": spare.to_dict(),
+            })
+    
     # Revert to the baseline snapshot created when VM was cloned
     success, msg = revert_vm_to_snapshot(
         vmid=assignment.proxmox_vmid,
@@ -1625,105 +1608,32 @@ def load_balance_class_vms(class_id: int):
         if not class_vms:
             return jsonify({"ok": False, "error": "No VMs in class"}), 400
         
-        # Get node stats
-        nodes = proxmox.nodes.get()
-        node_stats = {}
+        # One snapshot of node capacity plus class VM allocations (shared placement engine)
+        from app.services.placement import BALANCED_VARIANCE, NodeSnapshot, plan_rebalance
         
-        for node in nodes:
-            if node.get('status') != 'online':
-                continue
-            
-            node_name = node['node']
-            
-            try:
-                mem_total = float(node.get('maxmem', 1))
-                mem_used = float(node.get('mem', 0))
-                cpu_total = float(node.get('maxcpu', 1))
-                cpu_used = float(node.get('cpu', 0))
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid resource values for node {node_name}, skipping")
-                continue
-            
-            mem_free_pct = (mem_total - mem_used) / mem_total if mem_total > 0 else 0
-            cpu_free_pct = (1 - cpu_used) if cpu_used < 1 else 0
-            
-            # Score: 70% RAM + 30% CPU (higher = more available)
-            score = (mem_free_pct * 0.7) + (cpu_free_pct * 0.3)
-            
-            node_stats[node_name] = {
-                'mem_total': mem_total,
-                'mem_used': mem_used,
-                'mem_free_pct': mem_free_pct,
-                'cpu_total': cpu_total,
-                'cpu_used': cpu_used,
-                'cpu_free_pct': cpu_free_pct,
-                'score': score,
-                'vm_count': 0,
-                'class_vm_count': 0
-            }
-        
-        if not node_stats:
+        snapshot = NodeSnapshot.from_nodes(proxmox.nodes.get())
+        if not len(snapshot):
             return jsonify({"ok": False, "error": "No online nodes found"}), 500
         
-        # Count current VM distribution and add simulated resource usage for stopped VMs
         resources = proxmox.cluster.resources.get(type="vm")
-        
-        # Build VM details map for better resource tracking
-        vm_details = {}
         for r in resources:
+            i = snapshot.index(r.get('node'))
+            if i is None:
+                continue
+            snapshot.vm_count[i] += 1
             vmid = int(r.get('vmid', -1))
-            node_name = r.get('node')
-            
-            if node_name in node_stats:
-                node_stats[node_name]['vm_count'] += 1
-                
-                if vmid in class_vms:
-                    vm_status = r.get('status', 'unknown')
-                    vm_maxmem = r.get('maxmem', 0)  # Allocated RAM
-                    vm_maxcpu = r.get('maxcpu', 0)  # Allocated CPU cores
-                    
-                    node_stats[node_name]['class_vm_count'] += 1
-                    
-                    # For STOPPED VMs: Add their allocated resources to simulated usage
-                    # This accounts for the resources they would consume when started
-                    if vm_status == 'stopped':
-                        try:
-                            simulated_mem = float(vm_maxmem)
-                            simulated_cpu = float(vm_maxcpu)
-                            
-                            # Add to current usage for proper accounting
-                            node_stats[node_name]['mem_used'] += simulated_mem
-                            # CPU is a ratio (0-1), so add as fraction of total cores
-                            if node_stats[node_name]['cpu_total'] > 0:
-                                node_stats[node_name]['cpu_used'] += simulated_cpu / node_stats[node_name]['cpu_total']
-                            
-                            # Recalculate percentages with simulated resources
-                            mem_total = node_stats[node_name]['mem_total']
-                            mem_used = node_stats[node_name]['mem_used']
-                            cpu_used = node_stats[node_name]['cpu_used']
-                            
-                            node_stats[node_name]['mem_free_pct'] = (mem_total - mem_used) / mem_total if mem_total > 0 else 0
-                            node_stats[node_name]['cpu_free_pct'] = (1 - cpu_used) if cpu_used < 1 else 0
-                            node_stats[node_name]['score'] = (node_stats[node_name]['mem_free_pct'] * 0.7) + (node_stats[node_name]['cpu_free_pct'] * 0.3)
-                            
-                            logger.debug(f"Added simulated resources for stopped VM {vmid}: RAM={simulated_mem/1024/1024/1024:.2f}GB, CPU={simulated_cpu} cores")
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Failed to add simulated resources for VM {vmid}: {e}")
-                    
-                    # Store VM details for migration planning
-                    vm_details[vmid] = {
-                        'vmid': vmid,
-                        'name': r.get('name', f'VM-{vmid}'),
-                        'status': vm_status,
-                        'node': node_name,
-                        'maxmem': vm_maxmem,
-                        'maxcpu': vm_maxcpu,
-                        'can_migrate': vm_status in ['running', 'stopped']
-                    }
+            if vmid in class_vms:
+                vm_status = r.get('status', 'unknown')
+                try:
+                    # Stopped VMs are charged their allocated RAM/CPU - what they use once started
+                    snapshot.add_vm(vmid, r['node'], float(r.get('maxmem', 0)), float(r.get('maxcpu', 0)),
+                                    status=vm_status, name=r.get('name', f'VM-{vmid}'),
+                                    reserve=vm_status == 'stopped')
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Invalid resource values for VM {vmid}: {e}")
         
-        # Calculate average score (after simulated resource additions)
-        avg_score = sum(n['score'] for n in node_stats.values()) / len(node_stats)
-        score_variance = sum((n['score'] - avg_score) ** 2 for n in node_stats.values()) / len(node_stats)
+        node_stats = snapshot.node_stats()
+        avg_score, score_variance = snapshot.variance()
         
         logger.info(f"Load balance analysis for class {class_id} (with simulated stopped VM resources):")
         for node_name, stats in node_stats.items():
@@ -1734,111 +1644,31 @@ def load_balance_class_vms(class_id: int):
         logger.info(f"  Average score: {avg_score:.3f}, variance: {score_variance:.6f}")
         
         # Check if balancing is needed
-        if not force and score_variance < 0.01:  # Nodes are already balanced
+        if not force and score_variance < BALANCED_VARIANCE:  # Nodes are already balanced
             return jsonify({
                 "ok": True,
-                "message": "Nodes are already well-balanced (variance < 0.01)",
+                "message": f"Nodes are already well-balanced (variance < {BALANCED_VARIANCE})",
                 "node_stats": node_stats,
                 "avg_score": avg_score,
                 "score_variance": score_variance,
                 "migrations": []
             })
         
-        # Generate migration plan with simulated resource tracking
+        # Migration plan: fewest moves that reduce the score variance
+        # (stopped VMs first-class; running VMs only off critically loaded nodes)
         migrations = []
-        
-        # Create a copy of node_stats for simulation
-        simulated_stats = {node: dict(stats) for node, stats in node_stats.items()}
-        
-        # Sort nodes by score (best to worst)
-        sorted_nodes = sorted(simulated_stats.items(), key=lambda x: x[1]['score'], reverse=True)
-        
-        # Get VMs from overloaded nodes (below average score)
-        for node_name, stats in sorted_nodes:
-            if stats['score'] >= avg_score:
-                continue  # Node is above average, skip
-            
-            # Find VMs on this node that can be migrated
-            # Prefer stopped VMs first (no disruption), but allow running VMs if node is severely overloaded
-            node_vms = [vm for vm in vm_details.values() if vm['node'] == node_name]
-            
-            # Separate stopped vs running VMs
-            stopped_vms = [vm for vm in node_vms if vm['status'] == 'stopped']
-            running_vms = [vm for vm in node_vms if vm['status'] == 'running']
-            
-            # If node is severely overloaded (< 5% RAM free), include running VMs
-            # Otherwise, only migrate stopped VMs to avoid student disruption
-            if stats['mem_free_pct'] < 0.05:  # Less than 5% RAM free = critical
-                node_vms = stopped_vms + running_vms  # Migrate both
-                logger.warning(f"Node {node_name} critically overloaded ({stats['mem_free_pct']*100:.1f}% RAM free), will migrate running VMs")
-            else:
-                node_vms = stopped_vms  # Only migrate stopped VMs
-            
-            # Sort VMs by resource usage (larger VMs first for better balance impact)
-            node_vms.sort(key=lambda x: x['maxmem'], reverse=True)
-            
-            # Try to migrate VMs to better nodes
-            for vm in node_vms:
-                # Find best target node (highest score after accounting for VM resources)
-                best_target = None
-                best_score_after = stats['score']
-                
-                for target_name, target_stats in sorted_nodes:
-                    if target_name == node_name:
-                        continue
-                    
-                    # Calculate target node score AFTER adding this VM's resources
-                    vm_mem = float(vm['maxmem'])
-                    vm_cpu = float(vm['maxcpu'])
-                    
-                    # Simulate adding VM resources to target node
-                    target_mem_total = target_stats['mem_total']
-                    target_mem_used = target_stats['mem_used'] + vm_mem
-                    target_cpu_total = target_stats['cpu_total']
-                    target_cpu_used = target_stats['cpu_used'] + (vm_cpu / target_cpu_total if target_cpu_total > 0 else 0)
-                    
-                    simulated_mem_free_pct = (target_mem_total - target_mem_used) / target_mem_total if target_mem_total > 0 else 0
-                    simulated_cpu_free_pct = (1 - target_cpu_used) if target_cpu_used < 1 else 0
-                    simulated_target_score = (simulated_mem_free_pct * 0.7) + (simulated_cpu_free_pct * 0.3)
-                    
-                    # Target is good if it's still better than source AFTER getting the VM
-                    if simulated_target_score > best_score_after:
-                        best_target = target_name
-                        best_score_after = simulated_target_score
-                
-                if best_target:
-                    migrations.append({
-                        'vmid': vm['vmid'],
-                        'name': vm['name'],
-                        'status': vm['status'],
-                        'from_node': node_name,
-                        'to_node': best_target,
-                        'maxmem_gb': vm['maxmem'] / 1024 / 1024 / 1024,
-                        'maxcpu': vm['maxcpu'],
-                        'reason': f"Balance: {node_name} score={stats['score']:.3f} → {best_target} score={best_score_after:.3f} (after migration)"
-                    })
-                    
-                    # Update simulated stats for next iteration
-                    # Remove resources from source node
-                    simulated_stats[node_name]['mem_used'] -= vm['maxmem']
-                    simulated_stats[node_name]['cpu_used'] -= (vm['maxcpu'] / simulated_stats[node_name]['cpu_total'] if simulated_stats[node_name]['cpu_total'] > 0 else 0)
-                    simulated_stats[node_name]['mem_free_pct'] = (simulated_stats[node_name]['mem_total'] - simulated_stats[node_name]['mem_used']) / simulated_stats[node_name]['mem_total']
-                    simulated_stats[node_name]['cpu_free_pct'] = 1 - simulated_stats[node_name]['cpu_used']
-                    simulated_stats[node_name]['score'] = (simulated_stats[node_name]['mem_free_pct'] * 0.7) + (simulated_stats[node_name]['cpu_free_pct'] * 0.3)
-                    
-                    # Add resources to target node
-                    simulated_stats[best_target]['mem_used'] += vm['maxmem']
-                    simulated_stats[best_target]['cpu_used'] += (vm['maxcpu'] / simulated_stats[best_target]['cpu_total'] if simulated_stats[best_target]['cpu_total'] > 0 else 0)
-                    simulated_stats[best_target]['mem_free_pct'] = (simulated_stats[best_target]['mem_total'] - simulated_stats[best_target]['mem_used']) / simulated_stats[best_target]['mem_total']
-                    simulated_stats[best_target]['cpu_free_pct'] = 1 - simulated_stats[best_target]['cpu_used']
-                    simulated_stats[best_target]['score'] = (simulated_stats[best_target]['mem_free_pct'] * 0.7) + (simulated_stats[best_target]['cpu_free_pct'] * 0.3)
-                    
-                    # Re-sort after update
-                    sorted_nodes = sorted(simulated_stats.items(), key=lambda x: x[1]['score'], reverse=True)
-                    
-                    # Stop if source node is now balanced
-                    if simulated_stats[node_name]['score'] >= avg_score:
-                        break
+        for move in plan_rebalance(snapshot):
+            migrations.append({
+                'vmid': move['vmid'],
+                'name': move['name'],
+                'status': move['status'],
+                'from_node': move['from_node'],
+                'to_node': move['to_node'],
+                'maxmem_gb': move['maxmem'] / 1024 / 1024 / 1024,
+                'maxcpu': move['maxcpu'],
+                'reason': (f"Balance: {move['from_node']} score={move['from_score']:.3f}, "
+                           f"{move['to_node']} score={move['to_score']:.3f} (after migration)")
+            })
         
         if not migrations:
             return jsonify({
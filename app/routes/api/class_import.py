@@ -2,18 +2,18 @@
 """
 Class import API - Import existing classes from Proxmox VM naming patterns.
 
-Scans Proxmox for VMs matching naming conventions (e.g., ABC00-01, ABC-teacher, ABC-base)
-and automatically creates classes with proper VM assignments.
+Finds VM groups following the class VMID pattern ({prefix}00 teacher, {prefix}01-98
+students, {prefix}99 base) via the VMID prefix index and creates classes with proper
+VM assignments.
 """
 
 import logging
-from typing import Dict, List, Tuple
-
 from flask import Blueprint, jsonify, request
 
 from app.models import Class, VMAssignment, db
 from app.services.inventory_service import fetch_vm_inventory
 from app.services.user_manager import is_admin_user, require_user
+from app.services.vmid_index import get_candidate_classes, validate_import_group
 from app.utils.decorators import login_required
 
 logger = logging.getLogger(__name__)
@@ -24,12 +24,12 @@ class_import_bp = Blueprint('class_import', __name__, url_prefix='/api/class-imp
 @class_import_bp.route("/scan", methods=["GET"])
 @login_required
 def api_scan_importable_classes():
-    """Scan Proxmox for VMs matching importable class naming patterns.
+    """Scan the inventory for VM groups matching the class VMID pattern.
     
-    Looks for patterns like:
-    - ABC00-01, ABC00-02, ABC00-03 (student VMs with prefix + 00-XX numbering)
-    - ABC-teacher (teacher VM)
-    - ABC-base (class base VM)
+    VMID pattern (3-digit prefix + 2-digit slot):
+    - {prefix}00: teacher VM (e.g., VMID 12300)
+    - {prefix}01-98: student VMs
+    - {prefix}99: class base VM
     
     Returns:
         Groups of VMs that could be imported as classes
@@ -48,26 +48,24 @@ def api_scan_importable_classes():
         
         cluster_id = request.args.get('cluster_id')
         
-        # Get all VMs from inventory
-        vms = fetch_vm_inventory(cluster_id=cluster_id)
-        
-        logger.info(f"Scanning {len(vms)} VMs for importable classes")
-        if vms:
-            logger.info(f"Sample VMs (VMID: Name): {[(vm.get('vmid'), vm.get('name')) for vm in vms[:5]]}")
+        # Candidate classes straight from the VMID prefix index (no full inventory regroup)
+        potential_classes, unmatched, total_vms = get_candidate_classes(cluster_id)
         
-        # Group VMs by potential class prefix
-        potential_classes, unmatched = _analyze_vm_naming_patterns(vms)
+        logger.info(f"Found {len(potential_classes)} potential class groups in {total_vms} VMs")
         
-        logger.info(f"Found {len(potential_classes)} potential class groups")
+        sample_vms = []
+        for group in potential_classes[:10]:
+            vm = group['teacher_vm'] or group['student_vms'][0]
+            sample_vms.append({"vmid": vm['vmid'], "name": vm['name']})
         
         return jsonify({
             "ok": True,
             "potential_classes": potential_classes,
             "total_groups": len(potential_classes),
-            "total_vms_scanned": len(vms),
-            "sample_vms": [{"vmid": vm.get('vmid'), "name": vm.get('name')} for vm in vms[:10]],
+            "total_vms_scanned": total_vms,
+            "sample_vms": sample_vms,
             "unmatched_count": len(unmatched),
-            "unmatched_samples": [{"vmid": vm['vmid'], "name": vm['name']} for vm in unmatched[:10]]
+            "unmatched_samples": unmatched[:10]
         })
         
     except Exception as e:
@@ -123,6 +121,26 @@ def api_import_class():
         if not teacher_id:
             return jsonify({"ok": False, "error": "Teacher user not found"}), 400
         
+        all_vmids = []
+        if teacher_vmid:
+            all_vmids.append(teacher_vmid)
+        if base_vmid:
+            all_vmids.append(base_vmid)
+        all_vmids.extend(student_vmids)
+        
+        # Validate the whole group in one pass: slots match the prefix, VMs exist,
+        # and none of them already belongs to a class
+        errors = validate_import_group(prefix, teacher_vmid, base_vmid, student_vmids, cluster_id)
+        if all_vmids:
+            taken = db.session.query(VMAssignment.proxmox_vmid, VMAssignment.class_id).filter(
+                VMAssignment.proxmox_vmid.in_(all_vmids),
+                VMAssignment.class_id.isnot(None)
+            ).all()
+            errors.extend(f"VMID {vmid} already belongs to class {cid}" for vmid, cid in taken)
+        if errors:
+            logger.warning(f"Class import rejected for prefix {prefix}: {errors}")
+            return jsonify({"ok": False, "error": "Invalid class group", "errors": errors}), 400
+        
         # Create class
         new_class = Class(
             name=class_name,
@@ -136,13 +154,6 @@ def api_import_class():
         db.session.flush()  # Get class ID
         
         # Get VM details from inventory
-        all_vmids = []
-        if teacher_vmid:
-            all_vmids.append(teacher_vmid)
-        if base_vmid:
-            all_vmids.append(base_vmid)
-        all_vmids.extend(student_vmids)
-        
         vms = fetch_vm_inventory(vmids=all_vmids, cluster_id=cluster_id)
         vm_map = {vm['vmid']: vm for vm in vms}
         
@@ -157,7 +168,7 @@ def api_import_class():
                 proxmox_vmid=teacher_vmid,
                 vm_name=vm.get('name'),
                 node=vm.get('node'),
-                mac_address=vm.get('mac'),
+                mac_address=vm.get('mac_address'),
                 assigned_user_id=teacher_id,
                 status='assigned',
                 is_teacher_vm=True
@@ -173,7 +184,7 @@ def api_import_class():
                 proxmox_vmid=base_vmid,
                 vm_name=vm.get('name'),
                 node=vm.get('node'),
-                mac_address=vm.get('mac'),
+                mac_address=vm.get('mac_address'),
                 assigned_user_id=None,
                 status='available',
                 is_template_vm=True
@@ -190,7 +201,7 @@ def api_import_class():
                     proxmox_vmid=vmid,
                     vm_name=vm.get('name'),
                     node=vm.get('node'),
-                    mac_address=vm.get('mac'),
+                    mac_address=vm.get('mac_address'),
                     assigned_user_id=None,
                     status='available',
                     is_teacher_vm=False,
@@ -215,135 +226,3 @@ def api_import_class():
         logger.exception("Failed to import class")
         return jsonify({"ok": False, "error": str(e)}), 500
 
-
-def _analyze_vm_naming_patterns(vms: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
-    """Analyze VM IDs to find potential class groupings.
-    
-    VMID Pattern (not VM name):
-    - Teacher VM: {3digits}00 (e.g., VMID 12300)
-    - Base VM: {3digits}99 (e.g., VMID 12399)
-    - Student VMs: {3digits}01-98 (e.g., VMID 12301, 12302, etc.)
-    
-    VM names are separate and not used for pattern matching.
-    
-    Args:
-        vms: List of VM dictionaries from inventory
-        
-    Returns:
-        Tuple of (potential_classes, unmatched_vms)
-    """
-    # Group VMs by VMID prefix (first 3 digits)
-    groups = {}
-    unmatched_vms = []  # Track VMs that didn't match any pattern
-    
-    for vm in vms:
-        vm_name = vm.get('name', '')
-        vmid = vm.get('vmid')
-        
-        if not vmid:
-            continue
-        
-        vmid_str = str(vmid)
-        
-        # VMID must be 5 digits (3 random + 2 identifier)
-        if len(vmid_str) != 5 or not vmid_str.isdigit():
-            unmatched_vms.append({'vmid': vmid, 'name': vm_name})
-            continue
-        
-        # Extract prefix (first 3 digits) and suffix (last 2 digits)
-        prefix = vmid_str[:3]
-        suffix = vmid_str[3:5]
-        
-        matched = False
-        
-        # Teacher VM: suffix is "00"
-        if suffix == "00":
-            matched = True
-            group_key = prefix
-            
-            if group_key not in groups:
-                groups[group_key] = {
-                    'prefix': prefix,
-                    'classname': vm_name or f"Class {prefix}",  # Use VM name as class name suggestion
-                    'teacher_vm': None,
-                    'base_vm': None,
-                    'student_vms': []
-                }
-            groups[group_key]['teacher_vm'] = {
-                'vmid': vmid,
-                'name': vm_name,
-                'node': vm.get('node'),
-                'status': vm.get('status')
-            }
-        
-        # Base VM: suffix is "99"
-        elif suffix == "99":
-            matched = True
-            group_key = prefix
-            
-            if group_key not in groups:
-                groups[group_key] = {
-                    'prefix': prefix,
-                    'classname': vm_name or f"Class {prefix}",
-                    'teacher_vm': None,
-                    'base_vm': None,
-                    'student_vms': []
-                }
-            groups[group_key]['base_vm'] = {
-                'vmid': vmid,
-                'name': vm_name,
-                'node': vm.get('node'),
-                'status': vm.get('status')
-            }
-        
-        # Student VM: suffix is "01" through "98"
-        elif suffix.isdigit() and 1 <= int(suffix) <= 98:
-            matched = True
-            group_key = prefix
-            
-            if group_key not in groups:
-                groups[group_key] = {
-                    'prefix': prefix,
-                    'classname': vm_name or f"Class {prefix}",
-                    'teacher_vm': None,
-                    'base_vm': None,
-                    'student_vms': []
-                }
-            groups[group_key]['student_vms'].append({
-                'vmid': vmid,
-                'name': vm_name,
-                'node': vm.get('node'),
-                'status': vm.get('status'),
-                'suffix': suffix  # Track student number
-            })
-        
-        # Track unmatched VMs
-        if not matched:
-            unmatched_vms.append({
-                'vmid': vmid,
-                'name': vm_name
-            })
-    
-    # Convert to list and filter out groups with no student VMs
-    result = []
-    for group_key, group in groups.items():
-        if len(group['student_vms']) > 0:
-            # Sort student VMs by VMID
-            group['student_vms'].sort(key=lambda x: x['vmid'])
-            group['student_count'] = len(group['student_vms'])
-            # Use teacher VM name as suggested class name, or default to "Class {prefix}"
-            if group['teacher_vm']:
-                suggested = group['teacher_vm']['name'] or f"Class {group['prefix']}"
-            else:
-                suggested = f"Class {group['prefix']}"
-            group['suggested_name'] = suggested.replace('-', ' ').replace('_', ' ').title()
-            result.append(group)
-    
-    # Sort by prefix
-    result.sort(key=lambda x: x['prefix'])
-    
-    # Log unmatched VMs for debugging
-    if unmatched_vms:
-        logger.info(f"Found {len(unmatched_vms)} VMs that didn't match VMID pattern (not 5 digits or suffix not 00/01-98/99): {[(vm['vmid'], vm['name']) for vm in unmatched_vms][:10]}")
-    
-    return result, unmatched_vms
@@ -52,7 +52,9 @@ def get_class_settings(class_id: int):
             "hours_end": class_.hours_end or 23,
             "max_usage_hours": class_.max_usage_hours or 0,
             "cpu_cores": class_.cpu_cores or 2,
-            "memory_mb": class_.memory_mb or 4096
+            "memory_mb": class_.memory_mb or 4096,
+            "warm_pool_size": class_.warm_pool_size or 0,
+            "warm_pool_boot": class_.warm_pool_boot or False
         }
     })
 
@@ -116,7 +118,29 @@ def update_class_settings(class_id: int):
         class_.hours_end = hours_end
         class_.max_usage_hours = max_usage_hours
     
-    # VM Hardware specs (optional) - will trigger student VM recreation
+    # Warm pool settings (optional) - spare VMs kept ready for joins/reverts
+    refill_pool = False
+    if 'warm_pool_size' in data or 'warm_pool_boot' in data:
+        warm_pool_size = data.get('warm_pool_size', class_.warm_pool_size or 0)
+        warm_pool_boot = data.get('warm_pool_boot', class_.warm_pool_boot or False)
+        
+        if not isinstance(warm_pool_size, int) or warm_pool_size < 0 or warm_pool_size > 50:
+            return jsonify({"ok": False, "error": "warm_pool_size must be between 0 and 50"}), 400
+        
+        if not isinstance(warm_pool_boot, bool):
+            return jsonify({"ok": False, "error": "warm_pool_boot must be boolean"}), 400
+        
+        from app.services.warm_pool import supports_warm_pool
+        
+        if warm_pool_size and not supports_warm_pool(class_):
+            return jsonify({"ok": False, "error": "Warm pools need a config clone (overlay) class; "
+                                                  "linked clone classes revert to their baseline snapshot"}), 400
+        
+        refill_pool = warm_pool_size > (class_.warm_pool_size or 0) or (warm_pool_boot and not class_.warm_pool_boot)
+        class_.warm_pool_size = warm_pool_size
+        class_.warm_pool_boot = warm_pool_boot
+    
+    # VM Hardware specs (optional) - applied to student VMs in the background
     recreate_vms = False
     if 'cpu_cores' in data or 'memory_mb' in data:
         new_cpu = data.get('cpu_cores', class_.cpu_cores or 2)
@@ -137,7 +161,7 @@ def update_class_settings(class_id: int):
     try:
         db.session.commit()
         
-        # If VM specs changed, trigger recreation of student VMs in background
+        # If VM specs changed, update student VMs in background (in place where possible)
         if recreate_vms:
             import threading
             from app.services.class_vm_service import recreate_student_vms_with_new_specs
@@ -149,10 +173,14 @@ def update_class_settings(class_id: int):
             )
             thread.start()
             
-            message = "Settings updated. Student VMs are being recreated with new specs in the background."
+            message = "Settings updated. New specs are being applied to student VMs in the background."
         else:
             message = "Settings updated successfully"
         
+        if refill_pool and class_.warm_pool_size:
+            from app.services.warm_pool import refill_async
+            refill_async(class_.id)
+        
         return jsonify({
             "ok": True,
             "message": message,
@@ -166,7 +194,9 @@ def update_class_settings(class_id: int):
                 "hours_end": class_.hours_end,
                 "max_usage_hours": class_.max_usage_hours,
                 "cpu_cores": class_.cpu_cores,
-                "memory_mb": class_.memory_mb
+                "memory_mb": class_.memory_mb,
+                "warm_pool_size": class_.warm_pool_size,
+                "warm_pool_boot": class_.warm_pool_boot
             }
         })
     except Exception as e:
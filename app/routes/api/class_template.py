@@ -8,7 +8,7 @@ Handles template operations: reimage, save, push.
 import logging
 from datetime import datetime
 
-from flask import Blueprint, jsonify, session
+from flask import Blueprint, jsonify, request, session
 
 from app.models import db
 from app.services.class_service import get_class_by_id, get_user_by_username
@@ -542,6 +542,9 @@ def save_template(class_id: int):
     
     This updates the class template with changes from the teacher's working VM.
     Student VMs are NOT affected until 'Push' is clicked.
+    
+    Optional JSON body:
+        mode: "incremental" (only the teacher's changes) or "full" (default: TEMPLATE_PUBLISH_MODE)
     """
     class_, error_response, status_code = require_teacher_or_admin(class_id)
     if error_response:
@@ -594,11 +597,15 @@ def save_template(class_id: int):
         time.sleep(5)
         
         # Export teacher VM disk to update class base QCOW2
+        mode = (request.get_json(silent=True) or {}).get('mode')
+        if mode not in (None, 'incremental', 'full'):
+            return jsonify({'ok': False, 'error': "mode must be 'incremental' or 'full'"}), 400
         success, message = save_teacher_vm_to_base(
             class_id=class_id,
             teacher_vmid=vmid,
             teacher_node=node,
-            class_name=class_.name
+            class_name=class_.name,
+            mode=mode
         )
         
         if success:
@@ -622,6 +629,10 @@ def push_template(class_id: int):
     
     This rebases student VM overlays to the new staging template without
     recreating VMs. Much faster than delete/recreate approach.
+    
+    Optional JSON body:
+        rolling: Update students in cohorts, restarting running VMs (default false)
+        cohort_size: Running VMs per cohort in rolling mode (default 10)
     """
     class_, error_response, status_code = require_teacher_or_admin(class_id)
     if error_response:
@@ -630,12 +641,21 @@ def push_template(class_id: int):
     try:
         from app.services.class_vm_service import push_staging_to_students
         
-        logger.info(f"Pushing staging template to students for class {class_id}")
+        data = request.get_json(silent=True) or {}
+        rolling = bool(data.get('rolling', False))
+        try:
+            cohort_size = max(1, int(data.get('cohort_size', 10)))
+        except (TypeError, ValueError):
+            return jsonify({'ok': False, 'error': 'cohort_size must be an integer'}), 400
+        
+        logger.info(f"Pushing staging template to students for class {class_id} (rolling={rolling})")
         
         # Use fast overlay rebase approach
         success, message, updated_count = push_staging_to_students(
             class_id=class_id,
-            class_name=class_.name
+            class_name=class_.name,
+            rolling=rolling,
+            cohort_size=cohort_size
         )
         
         if success:
@@ -33,6 +33,38 @@ def api_health_daemons():
             logger.warning(f"Could not get daemon monitor status: {e}")
             status['daemon_monitor'] = {'error': str(e)}
         
+        # Proxmox read-path coalescing counters (per cluster)
+        try:
+            from app.services.proxmox_cache import get_read_stats
+            status['proxmox_reads'] = get_read_stats()
+        except Exception as e:
+            logger.warning(f"Could not get Proxmox read stats: {e}")
+            status['proxmox_reads'] = {'error': str(e)}
+
+        # In-process cache sizes and hit rates (ThreadSafeCache instances)
+        try:
+            from app.utils.caching import get_cache_stats
+            status['caches'] = get_cache_stats()
+        except Exception as e:
+            logger.warning(f"Could not get cache stats: {e}")
+            status['caches'] = {'error': str(e)}
+
+        # Background sync scheduler jobs (state + runtime histograms)
+        try:
+            from app.services.background_sync import get_sync_job_stats
+            status['sync_jobs'] = get_sync_job_stats()
+        except Exception as e:
+            logger.warning(f"Could not get sync job stats: {e}")
+            status['sync_jobs'] = {'error': str(e)}
+
+        # SQLite single-writer queue (batches, merged intents, backlog)
+        try:
+            from app.services.db_writer import get_db_writer_stats
+            status['db_writer'] = get_db_writer_stats()
+        except Exception as e:
+            logger.warning(f"Could not get DB writer stats: {e}")
+            status['db_writer'] = {'error': str(e)}
+
         return jsonify({
             "ok": True,
             "health": status,
@@ -6,12 +6,25 @@ from flask import Blueprint, jsonify, request
 from app.models import db, VMAssignment, Class
 from app.utils.decorators import admin_required
 from app.services.proxmox_service import get_all_vms
+from app.services.vmid_index import classify_vmid
 
 logger = logging.getLogger(__name__)
 
 recover_vms_bp = Blueprint('recover_vms', __name__, url_prefix='/api/recover-vms')
 
 
+def _assignments_by_vmid(vmids):
+    """First assignment (lowest id) per VMID, fetched in a single query."""
+    vmids = [v for v in vmids if v is not None]
+    if not vmids:
+        return {}
+    assignments = {}
+    for assignment in VMAssignment.query.filter(
+            VMAssignment.proxmox_vmid.in_(vmids)).order_by(VMAssignment.id).all():
+        assignments.setdefault(assignment.proxmox_vmid, assignment)
+    return assignments
+
+
 @recover_vms_bp.route("/vms", methods=["GET"])
 @admin_required
 def get_cached_vms():
@@ -19,11 +32,15 @@ def get_cached_vms():
     try:
         all_vms = get_all_vms()
         
-        # Augment VMs with assignment info from database
+        # Augment VMs with assignment info from database (one query for all VMs)
+        assignments = _assignments_by_vmid([vm.get('vmid') for vm in all_vms])
         for vm in all_vms:
             vmid = vm.get('vmid')
-            # Look up the most recent/relevant assignment for this VM
-            assignment = VMAssignment.query.filter_by(proxmox_vmid=vmid).first()
+            # Candidate class block from the VMID pattern (prefix, teacher/base/student slot)
+            prefix, slot = classify_vmid(vmid)
+            vm['vmid_prefix'] = prefix
+            vm['vmid_slot'] = slot
+            assignment = assignments.get(vmid)
             if assignment:
                 vm['class_id'] = assignment.class_id  # None if direct assignment
                 vm['assigned_user_id'] = assignment.assigned_user_id
@@ -67,6 +84,13 @@ def add_vms_to_class():
         all_vms = get_all_vms()
         vm_map = {vm['vmid']: vm for vm in all_vms}
         
+        # Existing assignments for all requested VMIDs in one query
+        assignments = _assignments_by_vmid(vmids)
+        in_class = {
+            a.proxmox_vmid for a in
+            VMAssignment.query.filter(VMAssignment.proxmox_vmid.in_(vmids), VMAssignment.class_id == class_id).all()
+        }
+        
         added = 0
         skipped = 0
         errors = []
@@ -74,12 +98,7 @@ def add_vms_to_class():
         for vmid in vmids:
             try:
                 # Check if already exists in this class
-                existing = VMAssignment.query.filter_by(
-                    proxmox_vmid=vmid,
-                    class_id=class_id
-                ).first()
-                
-                if existing:
+                if vmid in in_class:
                     skipped += 1
                     continue
                 
@@ -91,7 +110,7 @@ def add_vms_to_class():
                 
                 # FIRST: Check if assignment exists for this VMID (regardless of class)
                 # If so, UPDATE it instead of creating a duplicate
-                any_assignment = VMAssignment.query.filter_by(proxmox_vmid=vmid).first()
+                any_assignment = assignments.get(vmid)
                 
                 if any_assignment:
                     # Update existing assignment
@@ -8,7 +8,8 @@ from flask import Blueprint, jsonify, request
 from app.utils.decorators import admin_required
 from app.services.snapshot_migration import (
     create_baseline_snapshots_for_class,
-    create_baseline_snapshots_for_all_linked_clones
+    create_baseline_snapshots_for_all_linked_clones,
+    revert_class_to_baseline,
 )
 
 logger = logging.getLogger(__name__)
@@ -35,7 +36,8 @@ def migrate_class_snapshots(class_id: int):
             "stats": {
                 "created": int,  # New snapshots created
                 "failed": int,   # Failed attempts
-                "skipped": int   # Already had snapshots
+                "skipped": int,  # Already had snapshots
+                "results": [...]  # Per-VM {"vmid", "node", "action", "error", "seconds"}
             }
         }
     """
@@ -108,6 +110,48 @@ def migrate_all_snapshots():
         }), 500
 
 
+@api_snapshots_bp.route("/api/admin/snapshots/revert-class/<int:class_id>", methods=["POST"])
+@admin_required
+def revert_class_snapshots(class_id: int):
+    """
+    Revert all VMs in a class to their baseline snapshot (in parallel, per node).
+    
+    JSON body (optional):
+        - include_teacher: Also revert the teacher VM (default: false)
+        
+    Returns:
+        {
+            "ok": True/False,
+            "message": "Human-readable status message",
+            "stats": {
+                "reverted": int,  # VMs rolled back
+                "failed": int,    # Failed rollbacks
+                "results": [{"vmid", "node", "action", "error", "seconds"}, ...]
+            }
+        }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        include_teacher = bool(data.get("include_teacher", False))
+        logger.info(f"Reverting class {class_id} to baseline (include_teacher={include_teacher})")
+        
+        success, message, stats = revert_class_to_baseline(class_id, include_teacher=include_teacher)
+        
+        return jsonify({
+            "ok": success,
+            "message": message,
+            "stats": stats
+        }), 200 if success else 400
+        
+    except Exception as e:
+        logger.exception(f"Error in class revert endpoint: {e}")
+        return jsonify({
+            "ok": False,
+            "message": f"Revert failed: {str(e)}",
+            "stats": {}
+        }), 500
+
+
 @api_snapshots_bp.route("/api/admin/snapshots/status", methods=["GET"])
 @admin_required
 def snapshot_migration_status():
@@ -428,33 +428,48 @@ def migrate_template():
     if not source_cluster or not destination_cluster:
         return jsonify({"ok": False, "error": "Invalid cluster ID"}), 400
     
-    # Start migration in background thread
+    # Start migration in background thread (progress via /api/classes/clone/progress/<task_id>)
+    import uuid
+    from flask import current_app
+    from app.services.clone_progress import start_clone_progress, update_clone_progress
+    
+    app = current_app._get_current_object()
+    task_id = str(uuid.uuid4())
+    template_name = source_template.name
+    start_clone_progress(task_id, 1)
+    
     def do_migration():
         try:
-            from app.services.template_migration_service import migrate_template_between_clusters
-            
-            logger.info(f"Starting template copy: {source_template.name} from {source_cluster['name']} to {destination_cluster['name']}")
-            
-            success = migrate_template_between_clusters(
-                source_template=source_template,
-                source_cluster=source_cluster,
-                destination_cluster=destination_cluster,
-                destination_storage=destination_storage,
-                operation=operation
-            )
-            
-            if success:
-                logger.info(f"Template copy completed: {source_template.name} → {destination_cluster['name']}")
-            else:
-                logger.error(f"Template copy failed: {source_template.name} - check logs")
+            with app.app_context():
+                from app.services.template_migration_service import migrate_template_between_clusters
+                
+                logger.info(f"Starting template copy: {template_name} from {source_cluster['name']} to {destination_cluster['name']}")
+                
+                success = migrate_template_between_clusters(
+                    source_template=Template.query.get(source_template_id),
+                    source_cluster=source_cluster,
+                    destination_cluster=destination_cluster,
+                    destination_storage=destination_storage,
+                    operation=operation,
+                    task_id=task_id
+                )
+                
+                if success:
+                    logger.info(f"Template copy completed: {template_name} → {destination_cluster['name']}")
+                    update_clone_progress(task_id, completed=1, status="completed", progress_percent=100)
+                else:
+                    logger.error(f"Template copy failed: {template_name} - check logs")
+                    update_clone_progress(task_id, failed=1, status="failed", error="Template copy failed - retry to resume")
                 
         except Exception as e:
             logger.exception(f"Template copy failed with exception: {e}")
+            update_clone_progress(task_id, failed=1, status="failed", error=str(e))
     
     thread = threading.Thread(target=do_migration, daemon=True)
     thread.start()
     
     return jsonify({
         "ok": True,
+        "task_id": task_id,
         "message": f"Template '{source_template.name}' is being copied from {source_cluster['name']} to {destination_cluster['name']} (TRUENAS storage)"
     })
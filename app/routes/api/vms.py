@@ -310,9 +310,16 @@ def api_vm_start(vmid: int):
     
     Control operations (start/stop) MUST go through Proxmox API.
     Database is updated immediately after for fast UI refresh.
+    
+    Starts are admitted by the cluster's start scheduler (boot-storm
+    protection). If the start is not admitted within START_INTERACTIVE_WAIT
+    seconds, responds 202 with the queue position and ETA; poll
+    /api/vm/start-queue/<ticket> for the outcome.
     """
+    from app.config import START_INTERACTIVE_WAIT
     from app.services.inventory_service import get_vm_from_inventory, update_vm_status
     from app.services.proxmox_service import get_proxmox_admin
+    from app.services.start_scheduler import INTERACTIVE, get_start_scheduler, schedule_start
     from app.services.user_manager import is_admin_user, require_user
     
     user = require_user()
@@ -338,76 +345,43 @@ def api_vm_start(vmid: int):
         node = vm['node']
         vm_type = vm['type']
         
-        # Start the VM - try database node first (fast path)
-        actual_node = node
-        try:
-            if vm_type == 'qemu':
-                proxmox.nodes(actual_node).qemu(vmid).status.start.post()
-            else:  # lxc
-                proxmox.nodes(actual_node).lxc(vmid).status.start.post()
-        except Exception as start_error:
-            # If VM is already running, that's okay
-            if "already running" in str(start_error).lower():
-                logger.info(f"VM {vmid} already running")
-            # If VM not found on expected node, it may have migrated - query cluster
-            elif "does not exist" in str(start_error).lower() or "not found" in str(start_error).lower():
-                logger.warning(f"VM {vmid} not found on {node}, checking for migration...")
-                try:
-                    resources = proxmox.cluster.resources.get(type="vm")
-                    for r in resources:
-                        if int(r.get('vmid', -1)) == int(vmid):
-                            actual_node = r.get('node')
-                            logger.info(f"Found VM {vmid} on {actual_node} (migrated from {node})")
-                            
-                            # Update database with new node location
-                            try:
-                                from app.models import VMInventory, db
-                                vm_record = VMInventory.query.filter_by(cluster_id=cluster_id, vmid=vmid).first()
-                                if vm_record:
-                                    vm_record.node = actual_node
-                                    db.session.commit()
-                                    logger.info(f"Updated VMInventory: VM {vmid} now on node {actual_node}")
-                            except Exception as db_err:
-                                logger.warning(f"Failed to update VMInventory after migration: {db_err}")
-                            
-                            # Retry on correct node
-                            if vm_type == 'qemu':
-                                proxmox.nodes(actual_node).qemu(vmid).status.start.post()
-                            else:
-                                proxmox.nodes(actual_node).lxc(vmid).status.start.post()
-                            break
-                    else:
-                        raise  # VM not found anywhere
-                except Exception as migration_error:
-                    logger.error(f"Failed to start VM after migration check: {migration_error}")
-                    raise
-            else:
-                raise
-        
-        # Immediately update database status
-        update_vm_status(cluster_id, vmid, 'running')
-        
-        # Trigger background IP discovery for this VM after a delay (VM needs time to boot)
-        # Capture app instance before threading
+        # Capture app instance - the start runs on a scheduler worker thread
         from flask import current_app
         app = current_app._get_current_object()
         
-        def _check_vm_ip_after_start():
-            """Background task to check VM IP after it boots."""
-            import time
-            time.sleep(15)  # Wait 15 seconds for VM to boot and get IP
-            try:
-                with app.app_context():
-                    from app.services.background_sync import trigger_immediate_sync
-                    logger.info(f"Triggering IP check for VM {vmid} after start")
-                    trigger_immediate_sync()
-            except Exception as e:
-                logger.error(f"Failed to trigger IP check for VM {vmid}: {e}")
-        
-        import threading
-        threading.Thread(target=_check_vm_ip_after_start, daemon=True).start()
-        
-        logger.info(f"Started VM {vmid} on node {node}")
+        def _start():
+            with app.app_context():
+                _start_vm(proxmox, cluster_id, vmid, node, vm_type)
+                
+                # Immediately update database status
+                update_vm_status(cluster_id, vmid, 'running')
+            
+            # Trigger background IP discovery for this VM after a delay (VM needs time to boot)
+            def _check_vm_ip_after_start():
+                """Background task to check VM IP after it boots."""
+                import time
+                time.sleep(15)  # Wait 15 seconds for VM to boot and get IP
+                try:
+                    with app.app_context():
+                        from app.services.background_sync import trigger_immediate_sync
+                        logger.info(f"Triggering IP check for VM {vmid} after start")
+                        trigger_immediate_sync()
+                except Exception as e:
+                    logger.error(f"Failed to trigger IP check for VM {vmid}: {e}")
+            
+            import threading
+            threading.Thread(target=_check_vm_ip_after_start, daemon=True).start()
+            logger.info(f"Started VM {vmid} on node {node}")
+        
+        ticket = schedule_start(proxmox, cluster_id, vmid, node, _start, priority=INTERACTIVE,
+                                owner=user, storages=None if vm_type == 'qemu' else [])
+        if not ticket.wait(START_INTERACTIVE_WAIT):
+            status = get_start_scheduler(cluster_id).status(ticket.id) or {}
+            logger.info(f"Start of VM {vmid} queued (position {status.get('position')}, ETA {status.get('eta_seconds')}s)")
+            return jsonify(dict(status, ok=True, queued=True)), 202
+        
+        if ticket.state == 'failed':
+            return jsonify({"ok": False, "error": ticket.error}), 500
         return jsonify({"ok": True})
         
     except Exception as e:
@@ -415,6 +389,73 @@ def api_vm_start(vmid: int):
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
+def _start_vm(proxmox, cluster_id: str, vmid: int, node: str, vm_type: str) -> None:
+    """Start a VM via the Proxmox API, following it if it migrated off node."""
+    # Start the VM - try database node first (fast path)
+    actual_node = node
+    try:
+        if vm_type == 'qemu':
+            proxmox.nodes(actual_node).qemu(vmid).status.start.post()
+        else:  # lxc
+            proxmox.nodes(actual_node).lxc(vmid).status.start.post()
+    except Exception as start_error:
+        # If VM is already running, that's okay
+        if "already running" in str(start_error).lower():
+            logger.info(f"VM {vmid} already running")
+        # If VM not found on expected node, it may have migrated - query cluster
+        elif "does not exist" in str(start_error).lower() or "not found" in str(start_error).lower():
+            logger.warning(f"VM {vmid} not found on {node}, checking for migration...")
+            try:
+                resources = proxmox.cluster.resources.get(type="vm")
+                for r in resources:
+                    if int(r.get('vmid', -1)) == int(vmid):
+                        actual_node = r.get('node')
+                        logger.info(f"Found VM {vmid} on {actual_node} (migrated from {node})")
+                        
+                        # Update database with new node location
+                        try:
+                            from app.models import VMInventory, db
+                            vm_record = VMInventory.query.filter_by(cluster_id=cluster_id, vmid=vmid).first()
+                            if vm_record:
+                                vm_record.node = actual_node
+                                db.session.commit()
+                                logger.info(f"Updated VMInventory: VM {vmid} now on node {actual_node}")
+                        except Exception as db_err:
+                            logger.warning(f"Failed to update VMInventory after migration: {db_err}")
+                        
+                        # Retry on correct node
+                        if vm_type == 'qemu':
+                            proxmox.nodes(actual_node).qemu(vmid).status.start.post()
+                        else:
+                            proxmox.nodes(actual_node).lxc(vmid).status.start.post()
+                        break
+                else:
+                    raise  # VM not found anywhere
+            except Exception as migration_error:
+                logger.error(f"Failed to start VM after migration check: {migration_error}")
+                raise
+        else:
+            raise
+
+
+@api_vms_bp.route("/vm/start-queue/<ticket_id>", methods=["GET"])
+@login_required
+def api_vm_start_queue(ticket_id: str):
+    """Status of a queued VM start: state, queue position and ETA in seconds."""
+    from app.services.start_scheduler import get_start_scheduler
+    from app.services.user_manager import is_admin_user, require_user
+    
+    user = require_user()
+    cluster_id = request.args.get('cluster_id') or session.get("cluster_id", get_clusters_from_db()[0]["id"])
+    scheduler = get_start_scheduler(cluster_id)
+    status = scheduler.status(ticket_id)
+    if status is None:
+        return jsonify({"ok": False, "error": "Start request not found"}), 404
+    if not is_admin_user(user) and scheduler.owner_of(ticket_id) != user:
+        return jsonify({"ok": False, "error": "Start request not accessible"}), 403
+    return jsonify(dict(status, ok=True))
+
+
 @api_vms_bp.route("/vm/<int:vmid>/stop", methods=["POST"])
 @login_required
 def api_vm_stop(vmid: int):
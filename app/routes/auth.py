@@ -57,6 +57,9 @@ def login():
         if full_user:
             try:
                 session["user"] = full_user
+                # Resolve roles once at login (re-validated after IDENTITY_REVALIDATE_TTL)
+                from app.services.user_manager import establish_session_identity
+                establish_session_identity(full_user)
                 # Initialize cluster selection (default to first cluster if available)
                 if "cluster_id" not in session:
                     clusters = get_clusters_from_db()
@@ -178,9 +181,11 @@ def setup():
 @auth_bp.route("/logout")
 def logout():
     """Handle user logout."""
+    from app.services.user_manager import clear_session_identity
     
     # Note: We can't use the decorator here since we need to redirect to login
     # But we should still check if logged in
     if session.get("user"):
         session.pop("user", None)
+    clear_session_identity()
     return redirect(url_for("auth.login"))
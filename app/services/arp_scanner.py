@@ -39,17 +39,19 @@ import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional
 
+from app.utils.caching import ThreadSafeCache
+
 # Module-level cache for ARP results
-_arp_cache: Dict[str, str] = {}  # mac -> ip
-_arp_cache_time: float = 0
 _arp_cache_ttl: int = 300  # 5 minutes - refresh more frequently for faster IP updates
+_arp_cache = ThreadSafeCache(ttl=_arp_cache_ttl, max_entries=8192, name="arp")  # mac -> ip
+_arp_cache_time: float = 0
 
 # Scan timeout configuration
 NMAP_SCAN_TIMEOUT_BUFFER: int = 30  # Extra seconds to wait for nmap scan completion
 
 # Background scan state
 _scan_thread: Optional[threading.Thread] = None
-_scan_status: Dict[str, str] = {}  # key (vmid or composite) -> status message
+_scan_status = ThreadSafeCache(ttl=3600, max_entries=8192, name="arp_scan_status")  # key (vmid or composite) -> status message
 _scan_in_progress: bool = False
 _scan_lock = threading.Lock()
 
@@ -559,8 +561,9 @@ def discover_ips_via_arp(vm_mac_map: Dict[str, str], subnets: Optional[List[str]
     vm_ips: Dict[str, str] = {}
     if cache_valid:
         for key, mac in vm_mac_map.items():
-            if mac in _arp_cache:
-                vm_ips[key] = _arp_cache[mac]
+            ip = _arp_cache.get(mac)
+            if ip:
+                vm_ips[key] = ip
     
     # If we found all IPs and cache is valid, no need to scan at all
     if len(vm_ips) == len(vm_mac_map) and cache_valid:
@@ -10,24 +10,35 @@ Continuously polls Proxmox clusters and updates the database with:
 This keeps the database (single source of truth) synchronized with actual Proxmox state.
 
 Architecture:
-- VM Inventory: Full sync every 10min, Quick sync every 2min
+- VM Inventory: Full sync every 10min, Quick status sync every 15s
+  (one cluster/resources call per cluster, only changed rows written)
 - Templates: Full sync every 30min, Quick verification every 5min
 - ISOs: Full sync every 30min, Quick verification every 5min
-- Exponential backoff on errors
+- Storage probe: each node's path to shared VM storage every 30min
+  (STORAGE_PROBE_INTERVAL), feeding storage-aware placement
+- Base flatten: collapse long class base QCOW2 layer chains of idle classes
+  every hour (BASE_FLATTEN_INTERVAL)
+- Warm pool: top up spare student VMs of classes with a warm pool every
+  5min (WARM_POOL_INTERVAL)
+- Each sync kind is an independent sync_scheduler job (own worker slot,
+  +/-10% jitter, exponential retry backoff on errors)
 
 All GUI queries read from database tables, never directly from Proxmox API.
 """
 
+import hashlib
 import logging
-import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
+from app.config import BASE_FLATTEN_INTERVAL, STORAGE_PROBE_INTERVAL, WARM_POOL_INTERVAL
 from app.services.health_service import (
     register_daemon_started,
     update_daemon_sync,
 )
+from app.utils.caching import ThreadSafeCache
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +46,6 @@ logger = logging.getLogger(__name__)
 ARP_SCANNER_AVAILABLE = True  # Module exists and can be imported
 
 # Global sync state
-_sync_thread = None
 _sync_running = False
 _sync_stats = {
     # VM inventory sync stats
@@ -43,6 +53,7 @@ _sync_stats = {
     'last_quick_sync': None,
     'full_sync_count': 0,
     'quick_sync_count': 0,
+    'quick_sync_last': {},  # duration, clusters, vms_checked, vms_changed, ...
     'last_error': None,
     'vms_synced': 0,
     'sync_duration': 0,
@@ -53,6 +64,7 @@ _sync_stats = {
     'template_full_sync_count': 0,
     'template_quick_sync_count': 0,
     'templates_synced': 0,
+    'template_cluster_timings': {},  # cluster_id -> {duration, nodes, templates, configs_fetched}
     
     # ISO sync stats
     'last_iso_full_sync': None,
@@ -60,144 +72,103 @@ _sync_stats = {
     'iso_full_sync_count': 0,
     'iso_quick_sync_count': 0,
     'isos_synced': 0,
+    
+    # Storage probe stats
+    'last_storage_probe': None,
+    'storage_probe_last': {},  # clusters, probes, failed
+    
+    # Base flatten stats
+    'last_base_flatten': None,
+    'base_flatten_last': {},  # candidates, flattened, skipped_running, layers_removed
+    
+    # Warm pool stats
+    'last_warm_pool_refill': None,
+    'warm_pool_last': {},  # classes, created, assigned, booted, failed
 }
 
+# Max parallel Proxmox calls per cluster during template / ISO sync
+SYNC_MAX_WORKERS = 8
+
+# Listing digest of each template at its last config fetch, keyed by
+# (cluster_ip, node, vmid). Expiry forces a periodic refetch of unchanged specs.
+_template_digests = ThreadSafeCache(ttl=24 * 3600, max_entries=10000, name="template_digests")
+
+# Hash of each ISO storage listing at the last committed sync, keyed by
+# (cluster_id, node or None for shared storages, storage)
+_iso_listing_hashes = ThreadSafeCache(ttl=24 * 3600, max_entries=4096, name="iso_listing_hashes")
+
+
+# (job name, function, interval seconds, initial delay seconds)
+# Full syncs run right after startup; quick syncs wait one interval
+SYNC_JOBS = [
+    ('vm_full_sync', '_perform_full_sync', 600, 0),
+    ('vm_quick_sync', '_perform_quick_sync', 15, 15),
+    ('template_full_sync', '_perform_template_full_sync', 1800, 0),
+    ('template_quick_sync', '_perform_template_quick_sync', 300, 300),
+    ('iso_full_sync', '_perform_iso_full_sync', 1800, 0),
+    ('iso_quick_sync', '_perform_iso_quick_sync', 300, 300),
+    ('storage_probe', '_perform_storage_probe', STORAGE_PROBE_INTERVAL, 120),
+    ('base_flatten', '_perform_base_flatten', BASE_FLATTEN_INTERVAL, 600),
+    ('warm_pool', '_perform_warm_pool_refill', WARM_POOL_INTERVAL, 180),
+]
+
+_scheduler = None
+
+
+def _on_job_success(job):
+    """Report a successful sync job to the health service."""
+    update_daemon_sync('background_sync', full_sync=(job.name == 'vm_full_sync'),
+                       items_processed=_sync_stats.get('vms_synced', 0))
+
+
+def _on_job_error(job, error):
+    """Record a failed sync job (other jobs keep running on their own schedule)."""
+    _sync_stats['last_error'] = f"{job.name}: {error}"
+    update_daemon_sync('background_sync', error=_sync_stats['last_error'])
+
 
 def start_background_sync(app):
-    """Start the unified background sync daemon thread.
+    """Start the unified background sync daemon.
     
-    Manages sync for VM inventory, templates, and ISO images.
+    Manages sync for VM inventory, templates, and ISO images. Each sync kind
+    is a separate scheduler job with its own interval and worker slot, so a
+    slow template/ISO sync never delays VM status updates.
     
     Args:
         app: Flask app instance (for context)
     """
-    global _sync_thread, _sync_running
+    global _scheduler, _sync_running
     
-    if _sync_running:
+    if _sync_running and _scheduler is not None and _scheduler.is_alive():
         logger.warning("Background sync already running")
         return
+    if _scheduler is not None:
+        # Restart requested by the daemon monitor - drop the dead scheduler
+        _scheduler.stop()
+    
+    from app.services.sync_scheduler import JobScheduler
     
     _sync_running = True
     
-    def _sync_loop():
-        """Main sync loop with exponential backoff and multiple sync schedules."""
-        # Register daemon as started
-        register_daemon_started('background_sync')
-        
-        error_count = 0
-        max_backoff = 300  # 5 minutes
-
-        def _run_sync_task(task_name: str, task_func) -> bool:
-            """Run one sync task and isolate failures from other tasks.
-
-            Returns:
-                True if task succeeded, False if it failed.
-            """
-            try:
-                task_func()
-                return True
-            except Exception as task_err:
-                logger.warning(f"{task_name} failed (continuing loop): {task_err}", exc_info=True)
-                _sync_stats['last_error'] = f"{task_name}: {task_err}"
-                return False
-        
-        while _sync_running:
-            try:
-                with app.app_context():
-                    now = datetime.utcnow()
-                    had_task_error = False
-                    ran_task = False
-                    
-                    # VM Inventory: Full sync every 10 minutes (600 seconds)
-                    if (_sync_stats['last_full_sync'] is None or 
-                        (now - _sync_stats['last_full_sync']).total_seconds() >= 600):
-                        logger.info("Starting full VM inventory sync...")
-                        ran_task = True
-                        if _run_sync_task('vm_full_sync', _perform_full_sync):
-                            update_daemon_sync('background_sync', full_sync=True,
-                                             items_processed=_sync_stats.get('vms_synced', 0))
-                        else:
-                            had_task_error = True
-                    
-                    # VM Inventory: Quick sync every 2 minutes (120 seconds)
-                    elif (_sync_stats['last_quick_sync'] is None or
-                          (now - _sync_stats['last_quick_sync']).total_seconds() >= 120):
-                        ran_task = True
-                        if _run_sync_task('vm_quick_sync', _perform_quick_sync):
-                            update_daemon_sync('background_sync', full_sync=False,
-                                             items_processed=_sync_stats.get('vms_synced', 0))
-                        else:
-                            had_task_error = True
-                    
-                    # Templates: Full sync every 30 minutes (1800 seconds)
-                    if (_sync_stats['last_template_full_sync'] is None or
-                        (now - _sync_stats['last_template_full_sync']).total_seconds() >= 1800):
-                        logger.info("Starting full template sync...")
-                        ran_task = True
-                        if not _run_sync_task('template_full_sync', _perform_template_full_sync):
-                            had_task_error = True
-                    
-                    # Templates: Quick verification every 5 minutes (300 seconds)
-                    elif (_sync_stats['last_template_quick_sync'] is None or
-                          (now - _sync_stats['last_template_quick_sync']).total_seconds() >= 300):
-                        ran_task = True
-                        if not _run_sync_task('template_quick_sync', _perform_template_quick_sync):
-                            had_task_error = True
-                    
-                    # ISOs: Full sync every 30 minutes (1800 seconds)
-                    if (_sync_stats['last_iso_full_sync'] is None or
-                        (now - _sync_stats['last_iso_full_sync']).total_seconds() >= 1800):
-                        logger.info("Starting full ISO sync...")
-                        ran_task = True
-                        if not _run_sync_task('iso_full_sync', _perform_iso_full_sync):
-                            had_task_error = True
-                    
-                    # ISOs: Quick verification every 5 minutes (300 seconds)
-                    elif (_sync_stats['last_iso_quick_sync'] is None or
-                          (now - _sync_stats['last_iso_quick_sync']).total_seconds() >= 300):
-                        ran_task = True
-                        if not _run_sync_task('iso_quick_sync', _perform_iso_quick_sync):
-                            had_task_error = True
-
-                    if ran_task:
-                        if had_task_error:
-                            error_count += 1
-                            update_daemon_sync('background_sync', error=_sync_stats.get('last_error', 'sync task failed'))
-                        else:
-                            error_count = 0
-                            update_daemon_sync('background_sync', full_sync=False,
-                                             items_processed=_sync_stats.get('vms_synced', 0))
-            
-            except Exception as e:
-                error_count += 1
-                backoff = min(2 ** error_count, max_backoff)
-                error_msg = str(e)
-                logger.exception(f"Background sync error (attempt {error_count}): {e}")
-                _sync_stats['last_error'] = error_msg
-                
-                # Report sync error to health service
-                update_daemon_sync('background_sync', error=error_msg)
-                
-                time.sleep(backoff)
-            
-            finally:
-                # CRITICAL: Clean up DB session to prevent connection pool exhaustion
-                try:
-                    with app.app_context():
-                        from app.models import db
-                        db.session.remove()
-                except Exception as cleanup_err:
-                    logger.warning(f"Failed to cleanup DB session on error: {cleanup_err}")
-            
-            # Sleep 60 seconds between checks
-            time.sleep(60)
-    
-    _sync_thread = threading.Thread(
-        target=_sync_loop,
-        daemon=True,
-        name="UnifiedBackgroundSync"
-    )
-    _sync_thread.start()
+    scheduler = JobScheduler(app, name="background_sync")
+    for name, func_name, interval, initial_delay in SYNC_JOBS:
+        if interval <= 0:
+            logger.info(f"Sync job {name} disabled (interval {interval})")
+            continue
+        scheduler.register(
+            name,
+            globals()[func_name],
+            interval=interval,
+            jitter=0.1,
+            initial_delay=initial_delay,
+            on_success=_on_job_success,
+            on_error=_on_job_error,
+        )
+    _scheduler = scheduler
+    
+    # Register daemon as started
+    register_daemon_started('background_sync')
+    scheduler.start()
     logger.info("Unified background sync daemon started (VM inventory + templates + ISOs)")
 
 
@@ -205,37 +176,49 @@ def stop_background_sync():
     """Stop the background sync service."""
     global _sync_running
     _sync_running = False
+    if _scheduler is not None:
+        _scheduler.stop()
     logger.info("Background sync stopped")
 
 
+def get_sync_job_stats() -> Dict[str, Any]:
+    """Per-job scheduler state and runtime histograms (empty if not started)."""
+    if _scheduler is None:
+        return {}
+    return _scheduler.stats()
+
+
 def _perform_full_sync():
     """Perform complete inventory sync from all Proxmox clusters."""
     start_time = time.time()
     
     try:
+        from app.services.db_writer import queue_update, queue_write
         from app.services.inventory_service import persist_vm_inventory
         from app.services.proxmox_service import get_all_vms
-        from app.models import VMAssignment, db
+        from app.services.vmid_allocator import invalidate_inventory_ranges
+        from app.models import VMAssignment
         
         vms = get_all_vms(skip_ips=False, force_refresh=True)
-        count = persist_vm_inventory(vms)
+        # Runs on the DB writer thread (SQLite); wait so stats reflect the write
+        count = queue_write(lambda: persist_vm_inventory(vms)).result()
+        invalidate_inventory_ranges()  # VMID allocator sees added/removed VMs right away
         
         # Update VMAssignment nodes from VMInventory (sync after migrations)
+        current_nodes = {vm.get('vmid'): vm.get('node') for vm in vms if vm.get('vmid') and vm.get('node')}
         updated_nodes = 0
-        for vm in vms:
-            vmid = vm.get('vmid')
-            current_node = vm.get('node')
-            
-            if vmid and current_node:
-                assignment = VMAssignment.query.filter_by(proxmox_vmid=vmid).first()
-                if assignment and assignment.node != current_node:
-                    logger.info(f"Updating VMAssignment node for {vmid}: {assignment.node} -> {current_node}")
-                    assignment.node = current_node
+        if current_nodes:
+            assignments = VMAssignment.query.with_entities(
+                VMAssignment.id, VMAssignment.proxmox_vmid, VMAssignment.node
+            ).filter(VMAssignment.proxmox_vmid.in_(list(current_nodes))).all()
+            for assignment in assignments:
+                current_node = current_nodes[assignment.proxmox_vmid]
+                if assignment.node != current_node:
+                    logger.info(f"Updating VMAssignment node for {assignment.proxmox_vmid}: {assignment.node} -> {current_node}")
+                    queue_update(VMAssignment, {'id': assignment.id}, {'node': current_node})
                     updated_nodes += 1
         
         if updated_nodes > 0:
-            db.session.commit()
-            db.session.close()  # Release lock immediately
             logger.info(f"Updated {updated_nodes} VMAssignment nodes after migration")
         
         # Update stats
@@ -252,61 +235,116 @@ def _perform_full_sync():
         raise
 
 
+def _fetch_cluster_vm_resources(proxmox):
+    """Fetch every VM/CT of one cluster with a single cluster/resources call.
+    
+    Runs in a worker thread without app context, so the connection is
+    resolved by the caller. Bypasses the read cache, so the result also
+    refreshes it for GUI reads.
+    """
+    from app.services.proxmox_cache import fresh_reads
+
+    with fresh_reads():
+        return proxmox.cluster.resources.get(type='vm') or []
+
+
 def _perform_quick_sync():
-    """Quick sync: Update only running VMs' status.
+    """Quick sync: refresh status/node of every inventoried VM on all clusters.
     
-    This is faster than full sync and catches state changes quickly.
+    One ``cluster/resources`` call per cluster (clusters fetched in parallel)
+    returns the status of the whole fleet. It is diffed against the
+    inventory's current (status, node) and only changed rows are written,
+    so a steady-state run costs a handful of API calls and no DB writes.
+    New or vanished VMs are left to the full sync.
     """
-    try:
-        from app.models import VMInventory, db
-        from app.services.proxmox_service import get_proxmox_admin
-
-        # Get recently active VMs (updated in last hour)
-        cutoff = datetime.utcnow() - timedelta(hours=1)
-        active_vms = VMInventory.query.filter(
-            (VMInventory.status == 'running') |
-            (VMInventory.status == 'running') |
-            (VMInventory.last_status_check > cutoff)
-        ).limit(50).all()  # Limit to prevent overload
-        
-        if not active_vms:
-            _sync_stats['last_quick_sync'] = datetime.utcnow()
-            return
-        
-        # Quick status check via Proxmox API
-        proxmox = get_proxmox_admin()
-        updated = 0
-        
-        for vm in active_vms:
+    from app.models import VMInventory, db
+    from app.services.db_writer import queue_write
+    from app.services.vmid_index import update_index_status
+    from app.services.proxmox_service import get_clusters_from_db, get_proxmox_admin_for_cluster
+
+    started = time.time()
+    clusters = get_clusters_from_db()
+    if not clusters:
+        _sync_stats['last_quick_sync'] = datetime.utcnow()
+        return
+
+    resources_by_cluster: Dict[str, list] = {}
+    errors: Dict[str, Exception] = {}
+    # Connections are resolved here, in the app context (cluster lookups need
+    # the database); the workers only make the API calls
+    connections = {}
+    for cluster in clusters:
+        try:
+            proxmox = get_proxmox_admin_for_cluster(cluster['id'])
+            if not proxmox:
+                raise RuntimeError(f"Could not connect to cluster {cluster['id']}")
+            connections[cluster['id']] = proxmox
+        except Exception as e:
+            errors[cluster['id']] = e
+            logger.warning(f"Quick sync: no connection to cluster {cluster['id']}: {e}")
+    with ThreadPoolExecutor(max_workers=max(1, min(SYNC_MAX_WORKERS, len(connections)))) as pool:
+        futures = {pool.submit(_fetch_cluster_vm_resources, proxmox): cluster_id
+                   for cluster_id, proxmox in connections.items()}
+        for future in as_completed(futures):
+            cluster_id = futures[future]
             try:
-                # Get current status
-                if vm.type == 'qemu':
-                    status_obj = proxmox.nodes(vm.node).qemu(vm.vmid).status.current.get()
-                else:
-                    status_obj = proxmox.nodes(vm.node).lxc(vm.vmid).status.current.get()
-                
-                new_status = status_obj.get('status', 'unknown')
-                
-                if vm.status != new_status:
-                    vm.status = new_status
-                    vm.last_status_check = datetime.utcnow()
-                    updated += 1
-                    
+                resources_by_cluster[cluster_id] = future.result()
             except Exception as e:
-                logger.debug(f"Quick sync failed for VM {vm.vmid}: {e}")
+                errors[cluster_id] = e
+                logger.warning(f"Quick sync: cluster/resources failed for {cluster_id}: {e}")
+
+    if not resources_by_cluster:
+        # Every cluster failed - let the scheduler back off and retry
+        raise RuntimeError(f"Quick sync failed for all clusters: {list(errors)}")
+
+    # Current state of the inventory (narrow query, no ORM objects)
+    current = {
+        (row.cluster_id, row.vmid): row
+        for row in db.session.query(
+            VMInventory.id, VMInventory.cluster_id, VMInventory.vmid,
+            VMInventory.status, VMInventory.node,
+        ).filter(VMInventory.cluster_id.in_(list(resources_by_cluster))).all()
+    }
+
+    now = datetime.utcnow()
+    changes = []
+    index_updates = []
+    seen = 0
+    unknown = 0
+    for cluster_id, resources in resources_by_cluster.items():
+        for resource in resources:
+            vmid = resource.get('vmid')
+            if vmid is None:
                 continue
-        
-        if updated > 0:
-            db.session.commit()
-            db.session.close()  # Release lock immediately
-            logger.info(f"Quick sync: {updated}/{len(active_vms)} VMs updated")
-        
-        _sync_stats['last_quick_sync'] = datetime.utcnow()
-        _sync_stats['quick_sync_count'] += 1
-        
-    except Exception as e:
-        logger.exception(f"Quick sync failed: {e}")
-        raise
+            row = current.get((cluster_id, int(vmid)))
+            if row is None:
+                unknown += 1  # created outside the portal - picked up by the full sync
+                continue
+            seen += 1
+            status = resource.get('status', 'unknown')
+            node = resource.get('node') or row.node
+            if row.status != status or row.node != node:
+                changes.append({'id': row.id, 'status': status, 'node': node, 'last_status_check': now})
+                index_updates.append((cluster_id, int(vmid), status, node))
+
+    if changes:
+        def _write_changes():
+            db.session.bulk_update_mappings(VMInventory, changes)
+        queue_write(_write_changes).result()
+        for cluster_id, vmid, status, node in index_updates:
+            update_index_status(cluster_id, vmid, status, node)
+        logger.info(f"Quick sync: {len(changes)}/{seen} VMs changed status across {len(resources_by_cluster)} cluster(s)")
+
+    _sync_stats['last_quick_sync'] = datetime.utcnow()
+    _sync_stats['quick_sync_count'] += 1
+    _sync_stats['quick_sync_last'] = {
+        'duration': round(time.time() - started, 3),
+        'clusters': len(resources_by_cluster),
+        'failed_clusters': sorted(errors),
+        'vms_checked': seen,
+        'vms_changed': len(changes),
+        'vms_unknown': unknown,
+    }
 
 
 def _perform_template_full_sync():
@@ -377,10 +415,106 @@ def _perform_iso_quick_sync():
         raise
 
 
+def _perform_storage_probe():
+    """Measure each node's latency/throughput to shared VM storage."""
+    from app.services.storage_probe import probe_all_clusters
+
+    stats = probe_all_clusters()
+    _sync_stats['last_storage_probe'] = datetime.utcnow()
+    _sync_stats['storage_probe_last'] = stats
+    logger.info(f"Storage probe completed: {stats}")
+
+
+def _perform_base_flatten():
+    """Flatten long class base layer chains (incremental publishes) of idle classes."""
+    from app.services.base_layers import flatten_idle_class_bases
+
+    stats = flatten_idle_class_bases()
+    _sync_stats['last_base_flatten'] = datetime.utcnow()
+    _sync_stats['base_flatten_last'] = stats
+    logger.info(f"Base flatten completed: {stats}")
+
+
+def _perform_warm_pool_refill():
+    """Top up the spare VMs of classes with a warm pool."""
+    from app.services.warm_pool import refill_warm_pools
+
+    stats = refill_warm_pools()
+    _sync_stats['last_warm_pool_refill'] = datetime.utcnow()
+    _sync_stats['warm_pool_last'] = stats
+    logger.info(f"Warm pool refill completed: {stats}")
+
+
+def _is_expected_node_error(error: Exception) -> bool:
+    """True for connection errors that just mean a node is offline."""
+    message = str(error)
+    return 'hostname lookup' in message or 'No route to host' in message or '595 Errors' in message
+
+
+def _template_listing_digest(vm: Dict[str, Any]) -> Tuple:
+    """Digest of the spec-relevant fields in a node's qemu listing.
+    
+    The qemu list endpoint does not expose the config ``digest``, so the
+    listing fields that change with the template's specs stand in for it.
+    """
+    return (vm.get('name'), vm.get('cpus'), vm.get('maxmem'), vm.get('maxdisk'), vm.get('lock'))
+
+
+def _list_node_templates(proxmox, nodes) -> Tuple[Dict[str, list], Dict[str, Exception]]:
+    """List QEMU templates on every node in parallel.
+    
+    Returns:
+        (templates_by_node, errors_by_node) - nodes that failed are only in errors
+    """
+    templates_by_node: Dict[str, list] = {}
+    errors: Dict[str, Exception] = {}
+    if not nodes:
+        return templates_by_node, errors
+    
+    with ThreadPoolExecutor(max_workers=min(SYNC_MAX_WORKERS, len(nodes))) as pool:
+        futures = {pool.submit(proxmox.nodes(node).qemu.get): node for node in nodes}
+        for future in as_completed(futures):
+            node = futures[future]
+            try:
+                templates_by_node[node] = [vm for vm in (future.result() or []) if vm.get('template', 0)]
+            except Exception as e:
+                errors[node] = e
+    return templates_by_node, errors
+
+
+def _fetch_template_configs(proxmox, targets) -> Dict[Tuple[str, int], Any]:
+    """Fetch configs for (node, vmid) pairs in parallel.
+    
+    Returns:
+        Dict mapping (node, vmid) to the config dict, or to the Exception raised
+    """
+    configs: Dict[Tuple[str, int], Any] = {}
+    if not targets:
+        return configs
+    
+    with ThreadPoolExecutor(max_workers=min(SYNC_MAX_WORKERS, len(targets))) as pool:
+        futures = {
+            pool.submit(proxmox.nodes(node).qemu(vmid).config.get): (node, vmid)
+            for node, vmid in targets
+        }
+        for future in as_completed(futures):
+            try:
+                configs[futures[future]] = future.result()
+            except Exception as e:
+                configs[futures[future]] = e
+    return configs
+
+
 def sync_templates_from_proxmox(full_sync=True):
     """
     Sync templates from all Proxmox clusters to database.
     
+    Per cluster, node template listings and template config fetches run in
+    parallel; existing Template rows are loaded once into a keyed map, and
+    on a full sync configs are only fetched for templates whose listing
+    digest changed since the last fetch (or whose specs are missing).
+    All changes are committed in one transaction.
+    
     Args:
         full_sync: If True, fetch all details including specs. If False, only verify existence.
     
@@ -397,20 +531,31 @@ def sync_templates_from_proxmox(full_sync=True):
         'templates_added': 0,
         'templates_updated': 0,
         'templates_removed': 0,
+        'configs_fetched': 0,
+        'configs_skipped': 0,
         'errors': []
     }
+    cluster_timings: Dict[str, Dict[str, Any]] = {}
     
     # Disable autoflush to prevent premature commits during iteration
     db.session.autoflush = False
     
+    # All existing templates in one query, keyed by (cluster_ip, node, vmid)
+    existing_templates = {
+        (t.cluster_ip, t.node, t.proxmox_vmid): t
+        for t in Template.query.all()
+    }
+    
     # Track all templates found in Proxmox (cluster_ip, node, vmid tuples)
     found_templates = set()
-
+    # Nodes whose listing succeeded - only these may have stale templates removed
+    listed_nodes = set()
     
     # Sync each cluster
     for cluster in get_clusters_from_db():
         cluster_id = cluster['id']
         cluster_ip = cluster['host']
+        started = time.time()
         
         try:
             proxmox = get_proxmox_admin_for_cluster(cluster_id)
@@ -429,88 +574,105 @@ def sync_templates_from_proxmox(full_sync=True):
             
             # Get all nodes in this cluster
             try:
-                nodes = proxmox.nodes.get()
+                nodes = [n['node'] for n in proxmox.nodes.get()]
             except Exception as e:
                 logger.warning(f"Failed to get nodes for cluster {cluster_id}: {e}")
                 stats['errors'].append(f"Failed to get nodes: {cluster_id} - {str(e)}")
                 continue
             
-            for node_data in nodes:
-                node_name = node_data['node']
-                
-                try:
-                    # Get QEMU VMs (templates are QEMU VMs with template=1)
-                    vms = proxmox.nodes(node_name).qemu.get()
+            # Stage 1: list templates on all nodes in parallel
+            templates_by_node, node_errors = _list_node_templates(proxmox, nodes)
+            for node_name, e in node_errors.items():
+                # Use debug level for expected connection issues
+                if _is_expected_node_error(e):
+                    logger.debug(f"Node {cluster_ip}/{node_name} unreachable (expected if node is offline): {e}")
+                    # Don't add expected offline errors to error list - they're normal
+                else:
+                    logger.error(f"Error syncing templates from {cluster_ip}/{node_name}: {e}")
+                    stats['errors'].append(f"{cluster_ip}/{node_name}: {str(e)}")
+            
+            # Stage 2: decide which configs need fetching (digest changed / specs missing)
+            to_fetch = []
+            for node_name, vms in templates_by_node.items():
+                listed_nodes.add((cluster_ip, node_name))
+                for vm in vms:
+                    key = (cluster_ip, node_name, vm['vmid'])
+                    found_templates.add(key)
+                    if not full_sync:
+                        continue
+                    existing = existing_templates.get(key)
+                    digest = _template_listing_digest(vm)
+                    if existing is None or existing.specs_cached_at is None or _template_digests.get(key) != digest:
+                        to_fetch.append((node_name, vm['vmid']))
+                    else:
+                        stats['configs_skipped'] += 1
+            
+            # Stage 3: fetch changed configs in parallel
+            configs = _fetch_template_configs(proxmox, to_fetch)
+            stats['configs_fetched'] += len(configs)
+            
+            # Stage 4: apply to the in-memory row map (single commit below)
+            now = datetime.utcnow()
+            cluster_templates = 0
+            for node_name, vms in templates_by_node.items():
+                for vm in vms:
+                    vmid = vm['vmid']
+                    vm_name = vm.get('name', f'template-{vmid}')
+                    key = (cluster_ip, node_name, vmid)
+                    cluster_templates += 1
+                    stats['templates_found'] += 1
                     
-                    for vm in vms:
-                        # Only process templates
-                        if not vm.get('template', 0):
-                            continue
-                        
-                        vmid = vm['vmid']
-                        vm_name = vm.get('name', f'template-{vmid}')
-                        
-                        stats['templates_found'] += 1
-                        found_templates.add((cluster_ip, node_name, vmid))
-                        
-                        # Check if template exists in database
-                        existing = Template.query.filter_by(
+                    template = existing_templates.get(key)
+                    if template:
+                        # Update existing template
+                        template.name = vm_name
+                        template.last_verified_at = now
+                        stats['templates_updated'] += 1
+                    else:
+                        # Add new template
+                        template = Template(
+                            name=vm_name,
+                            proxmox_vmid=vmid,
                             cluster_ip=cluster_ip,
                             node=node_name,
-                            proxmox_vmid=vmid
-                        ).first()
-                        
-                        if existing:
-                            # Update existing template
-                            existing.name = vm_name
-                            existing.last_verified_at = datetime.utcnow()
-                            
-                            if full_sync:
-                                # Fetch and cache specs
-                                _update_template_specs(existing, proxmox, node_name, vmid)
-                            
-                            stats['templates_updated'] += 1
-                        else:
-                            # Add new template
-                            new_template = Template(
-                                name=vm_name,
-                                proxmox_vmid=vmid,
-                                cluster_ip=cluster_ip,
-                                node=node_name,
-                                is_replica=False,
-                                is_class_template=False,
-                                last_verified_at=datetime.utcnow()
-                            )
-
-                            if full_sync:
-                                # Fetch and cache specs
-                                _update_template_specs(new_template, proxmox, node_name, vmid)
-                            
-                            db.session.add(new_template)
-                            stats['templates_added'] += 1
-                            logger.info(f"Added template {vm_name} (VMID {vmid}) from {cluster_ip}/{node_name}")
-                
-                except Exception as e:
-                    # Use debug level for expected connection issues
-                    if 'hostname lookup' in str(e) or 'No route to host' in str(e) or '595 Errors' in str(e):
-                        logger.debug(f"Node {cluster_ip}/{node_name} unreachable (expected if node is offline): {e}")
-                        # Don't add expected offline errors to error list - they're normal
-                    else:
-                        logger.error(f"Error syncing templates from {cluster_ip}/{node_name}: {e}")
-                        stats['errors'].append(f"{cluster_ip}/{node_name}: {str(e)}")
+                            is_replica=False,
+                            is_class_template=False,
+                            last_verified_at=now
+                        )
+                        db.session.add(template)
+                        existing_templates[key] = template
+                        stats['templates_added'] += 1
+                        logger.info(f"Added template {vm_name} (VMID {vmid}) from {cluster_ip}/{node_name}")
+                    
+                    config = configs.get((node_name, vmid))
+                    if isinstance(config, Exception):
+                        logger.error(f"Failed to fetch specs for template {vmid} on {node_name}: {config}")
+                    elif config is not None:
+                        _apply_template_specs(template, config)
+                        _template_digests.set(key, _template_listing_digest(vm))
+            
+            cluster_timings[cluster_id] = {
+                'duration': round(time.time() - started, 3),
+                'nodes': len(nodes),
+                'nodes_failed': len(node_errors),
+                'templates': cluster_templates,
+                'configs_fetched': len(configs),
+            }
         
         except Exception as e:
             logger.error(f"Error connecting to cluster {cluster_id} ({cluster_ip}): {e}")
             stats['errors'].append(f"Cluster {cluster_id}: {str(e)}")
     
-    # Remove templates that no longer exist in Proxmox (only non-class templates)
+    # Remove templates that no longer exist in Proxmox (only non-class templates,
+    # and only on nodes that were listed successfully - an offline node keeps its rows)
     if full_sync:
-        all_db_templates = Template.query.filter_by(is_class_template=False).all()
-        for template in all_db_templates:
-            key = (template.cluster_ip, template.node, template.proxmox_vmid)
-            if key not in found_templates:
+        for key, template in existing_templates.items():
+            if template.is_class_template or template.id is None:
+                continue
+            if key not in found_templates and (template.cluster_ip, template.node) in listed_nodes:
                 logger.warning(f"Removing stale template {template.name} (VMID {template.proxmox_vmid}) from database")
                 db.session.delete(template)
+                _template_digests.invalidate(key)
                 stats['templates_removed'] += 1
     
     # Commit all changes with retry logic
@@ -534,28 +696,26 @@ def sync_templates_from_proxmox(full_sync=True):
             else:
                 logger.error(f"Failed to commit template sync: {e}")
                 stats['errors'].append(f"Database commit failed: {str(e)}")
+                # Specs were not persisted - refetch them next time
+                _template_digests.invalidate()
                 break
     
     # Re-enable autoflush
     db.session.autoflush = True
     
+    _sync_stats['template_cluster_timings'] = cluster_timings
     return stats
 
 
-def _update_template_specs(template, proxmox, node_name, vmid):
+def _apply_template_specs(template, config):
     """
-    Fetch and cache template specs from Proxmox API.
+    Copy specs from a Proxmox VM config dict onto a Template row.
     
     Args:
         template: Template database object
-        proxmox: ProxmoxAPI connection
-        node_name: Node name
-        vmid: VM ID
+        config: Result of nodes(node).qemu(vmid).config.get()
     """
     try:
-        # Get VM config
-        config = proxmox.nodes(node_name).qemu(vmid).config.get()
-        
         # Extract specs
         template.cpu_cores = config.get('cores', 1)
         template.cpu_sockets = config.get('sockets', 1)
@@ -603,13 +763,91 @@ def _update_template_specs(template, proxmox, node_name, vmid):
         template.specs_cached_at = datetime.utcnow()
         
     except Exception as e:
-        logger.error(f"Failed to fetch specs for template {vmid} on {node_name}: {e}")
+        logger.error(f"Failed to parse specs for template {template.proxmox_vmid} on {template.node}: {e}")
+
+
+def _iso_listing_hash(items) -> str:
+    """Stable hash of a storage's ISO listing (volid + size + ctime)."""
+    entries = sorted((i.get('volid', ''), i.get('size', 0), i.get('ctime', 0)) for i in items)
+    return hashlib.sha1(repr(entries).encode()).hexdigest()
+
+
+def _discover_iso_storages(proxmox, cluster_id, nodes):
+    """List storages on every node in parallel and dedupe shared ones.
+    
+    Shared storages (NFS/CIFS/Ceph...) are keyed by storage ID only, so an
+    ISO share mounted on N nodes is scanned once; local storages are keyed
+    per node.
+    
+    Returns:
+        (storages, node_errors) where storages maps
+        storage key -> (node_to_scan_from, storage_name)
+    """
+    storages: Dict[Tuple, Tuple[str, str]] = {}
+    node_errors: Dict[str, Exception] = {}
+    if not nodes:
+        return storages, node_errors
+    
+    with ThreadPoolExecutor(max_workers=min(SYNC_MAX_WORKERS, len(nodes))) as pool:
+        futures = {pool.submit(proxmox.nodes(node).storage.get): node for node in nodes}
+        for future in as_completed(futures):
+            node = futures[future]
+            try:
+                node_storages = future.result() or []
+            except Exception as e:
+                node_errors[node] = e
+                continue
+            for storage_info in node_storages:
+                content_types = storage_info.get('content', '').split(',')
+                # Skip storages that don't support ISO content
+                if 'iso' not in content_types or not storage_info.get('enabled', True):
+                    continue
+                if 'active' in storage_info and not storage_info['active']:
+                    continue
+                storage_name = storage_info['storage']
+                if storage_info.get('shared'):
+                    key = (cluster_id, None, storage_name)
+                else:
+                    key = (cluster_id, node, storage_name)
+                # Deterministic choice of scanning node for shared storages
+                if key not in storages or node < storages[key][0]:
+                    storages[key] = (node, storage_name)
+    return storages, node_errors
+
+
+def _scan_iso_storages(proxmox, storages):
+    """Fetch ISO content lists for distinct storages in parallel.
+    
+    Returns:
+        Dict mapping storage key to the content list, or to the Exception raised
+    """
+    results: Dict[Tuple, Any] = {}
+    if not storages:
+        return results
+    
+    with ThreadPoolExecutor(max_workers=min(SYNC_MAX_WORKERS, len(storages))) as pool:
+        futures = {
+            pool.submit(proxmox.nodes(node).storage(storage_name).content.get, content='iso'): key
+            for key, (node, storage_name) in storages.items()
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result() or []
+            except Exception as e:
+                results[futures[future]] = e
+    return results
 
 
 def sync_isos_from_proxmox(full_sync=True):
     """
     Sync ISO images from all Proxmox clusters to database.
     
+    Storages are discovered on all nodes in parallel and shared storages are
+    deduplicated, so each distinct storage is listed once. Listings are
+    diffed against an in-memory map of existing volids (one query); storages
+    whose listing hash is unchanged since the last sync skip the diff, and
+    all adds/updates/removes are written in one transaction.
+    
     Args:
         full_sync: If True, scan all storages for ISOs. If False, only verify cached ISOs exist.
     
@@ -626,14 +864,26 @@ def sync_isos_from_proxmox(full_sync=True):
         'isos_added': 0,
         'isos_updated': 0,
         'isos_removed': 0,
+        'storages_scanned': 0,
+        'storages_unchanged': 0,
         'errors': []
     }
     
     # Disable autoflush to avoid mid-operation locks
     db.session.autoflush = False
     
+    # All existing ISOs in one query, keyed by volid
+    existing_isos = {iso.volid: iso for iso in ISOImage.query.all()}
+    
     # Track all ISOs found in Proxmox (volid set)
     found_volids = set()
+    # volids whose rows only need last_seen bumped (bulk UPDATE below)
+    seen_volids = set()
+    # Scope of successful scans - rows outside it are never removed
+    reached_clusters = set()
+    failed_scopes = set()  # ('node', cluster_id, node) and ('storage', cluster_id, storage)
+    pending_hashes: Dict[Tuple, str] = {}
+    now = datetime.utcnow()
     
     # Sync each cluster
     for cluster in get_clusters_from_db():
@@ -656,91 +906,106 @@ def sync_isos_from_proxmox(full_sync=True):
                 continue
             
             # Get all nodes in this cluster
-            nodes = proxmox.nodes.get()
+            nodes = [n['node'] for n in proxmox.nodes.get()]
+            reached_clusters.add(cluster_id)
+            
+            storages, node_errors = _discover_iso_storages(proxmox, cluster_id, nodes)
+            for node_name, e in node_errors.items():
+                failed_scopes.add(('node', cluster_id, node_name))
+                # Use debug level for expected connection issues
+                if _is_expected_node_error(e):
+                    logger.debug(f"Node {node_name} unreachable (expected if node is offline): {e}")
+                else:
+                    logger.warning(f"Failed to scan node {node_name}: {e}")
+                    stats['errors'].append(f"Node scan failed: {node_name} - {str(e)}")
+            
+            listings = _scan_iso_storages(proxmox, storages)
+            stats['storages_scanned'] += len(listings)
             
-            for node_data in nodes:
-                node_name = node_data['node']
+            for key, content in listings.items():
+                node_name, storage_name = storages[key]
+                if isinstance(content, Exception):
+                    failed_scopes.add(('storage', cluster_id, storage_name))
+                    logger.warning(f"Failed to scan storage {storage_name} on {node_name}: {content}")
+                    stats['errors'].append(f"Storage scan failed: {node_name}/{storage_name} - {str(content)}")
+                    continue
                 
-                try:
-                    # Get all storages on this node
-                    storages = proxmox.nodes(node_name).storage.get()
-                    
-                    for storage_info in storages:
-                        storage_name = storage_info['storage']
-                        content_types = storage_info.get('content', '').split(',')
-                        
-                        # Skip storages that don't support ISO content
-                        if 'iso' not in content_types:
-                            continue
-                        
-                        if not storage_info.get('enabled', True):
-                            continue
-                        
-                        try:
-                            # Get ISO files from this storage
-                            content = proxmox.nodes(node_name).storage(storage_name).content.get(content='iso')
-                            
-                            for item in content:
-                                # Only process .iso files
-                                volid = item.get('volid', '')
-                                if not volid.lower().endswith('.iso'):
-                                    continue
-                                
-                                name = item.get('volid', '').split('/')[-1]
-                                size = item.get('size', 0)
-                                
-                                stats['isos_found'] += 1
-                                found_volids.add(volid)
-                                
-                                # Check if ISO exists in database
-                                existing = ISOImage.query.filter_by(volid=volid).first()
-                                
-                                if existing:
-                                    # Update existing ISO
-                                    existing.name = name
-                                    existing.size = size
-                                    existing.node = node_name
-                                    existing.storage = storage_name
-                                    existing.cluster_id = cluster_id
-                                    existing.last_seen = datetime.utcnow()
-                                    stats['isos_updated'] += 1
-                                else:
-                                    # Add new ISO
-                                    new_iso = ISOImage(
-                                        volid=volid,
-                                        name=name,
-                                        size=size,
-                                        node=node_name,
-                                        storage=storage_name,
-                                        cluster_id=cluster_id,
-                                        discovered_at=datetime.utcnow(),
-                                        last_seen=datetime.utcnow()
-                                    )
-                                    db.session.add(new_iso)
-                                    stats['isos_added'] += 1
-                        
-                        except Exception as e:
-                            logger.warning(f"Failed to scan storage {storage_name} on {node_name}: {e}")
-                            stats['errors'].append(f"Storage scan failed: {node_name}/{storage_name} - {str(e)}")
+                # Only process .iso files
+                items = [i for i in content if i.get('volid', '').lower().endswith('.iso')]
+                volids = [i['volid'] for i in items]
+                stats['isos_found'] += len(items)
+                found_volids.update(volids)
+                
+                listing_hash = _iso_listing_hash(items)
+                if (
+                    _iso_listing_hashes.get(key) == listing_hash
+                    and all(v in existing_isos for v in volids)
+                ):
+                    # Unchanged since last sync - just refresh last_seen
+                    seen_volids.update(volids)
+                    stats['storages_unchanged'] += 1
+                    continue
+                pending_hashes[key] = listing_hash
                 
-                except Exception as e:
-                    # Use debug level for expected connection issues
-                    if 'hostname lookup' in str(e) or 'No route to host' in str(e):
-                        logger.debug(f"Node {node_name} unreachable (expected if node is offline): {e}")
+                for item in items:
+                    volid = item['volid']
+                    name = volid.split('/')[-1]
+                    size = item.get('size', 0)
+                    existing = existing_isos.get(volid)
+                    
+                    if existing:
+                        # Update existing ISO only if something changed
+                        if (existing.name, existing.size, existing.node, existing.storage, existing.cluster_id) != \
+                                (name, size, node_name, storage_name, cluster_id):
+                            existing.name = name
+                            existing.size = size
+                            existing.node = node_name
+                            existing.storage = storage_name
+                            existing.cluster_id = cluster_id
+                            stats['isos_updated'] += 1
+                        seen_volids.add(volid)
                     else:
-                        logger.warning(f"Failed to scan node {node_name}: {e}")
-                        stats['errors'].append(f"Node scan failed: {node_name} - {str(e)}")
+                        # Add new ISO
+                        new_iso = ISOImage(
+                            volid=volid,
+                            name=name,
+                            size=size,
+                            node=node_name,
+                            storage=storage_name,
+                            cluster_id=cluster_id,
+                            discovered_at=now,
+                            last_seen=now
+                        )
+                        db.session.add(new_iso)
+                        existing_isos[volid] = new_iso
+                        stats['isos_added'] += 1
         
         except Exception as e:
             logger.error(f"Failed to sync cluster {cluster_id}: {e}")
             stats['errors'].append(f"Cluster sync failed: {cluster_id} - {str(e)}")
     
-    # Remove ISOs that no longer exist in Proxmox
+    # Remove ISOs that no longer exist in Proxmox (only where the scan succeeded)
     if full_sync:
-        stale_isos = ISOImage.query.filter(ISOImage.volid.notin_(found_volids)).all()
-        for iso in stale_isos:
-            db.session.delete(iso)
-            stats['isos_removed'] += 1
+        stale_ids = []
+        for volid, iso in existing_isos.items():
+            if volid in found_volids or iso.id is None:
+                continue
+            if iso.cluster_id not in reached_clusters:
+                continue
+            if (('node', iso.cluster_id, iso.node) in failed_scopes
+                    or ('storage', iso.cluster_id, iso.storage) in failed_scopes):
+                continue
+            stale_ids.append(iso.id)
+        if stale_ids:
+            # 'fetch' also drops the deleted rows from the session's identity map
+            ISOImage.query.filter(ISOImage.id.in_(stale_ids)).delete(synchronize_session='fetch')
+            stats['isos_removed'] = len(stale_ids)
+    
+    # Bump last_seen for every re-seen ISO in one statement
+    if seen_volids:
+        ISOImage.query.filter(ISOImage.volid.in_(seen_volids)).update(
+            {'last_seen': now}, synchronize_session=False
+        )
     
     # Commit all changes with retry logic
     max_retries = 5
@@ -749,6 +1014,8 @@ def sync_isos_from_proxmox(full_sync=True):
         try:
             db.session.commit()
             db.session.close()
+            for key, listing_hash in pending_hashes.items():
+                _iso_listing_hashes.set(key, listing_hash)
             logger.info(f"ISO sync complete: {stats}")
             break
         except Exception as e:
@@ -790,6 +1057,9 @@ def quick_iso_verification():
     # Get all cached ISOs
     cached_isos = ISOImage.query.all()
     
+    # One content listing per (cluster, node, storage), shared by its ISOs
+    listings: Dict[Tuple[str, str, str], set] = {}
+    
     for iso in cached_isos:
         try:
             proxmox = get_proxmox_admin_for_cluster(iso.cluster_id)
@@ -798,14 +1068,13 @@ def quick_iso_verification():
             
             # Quick check: just verify storage exists and is accessible
             try:
-                content = proxmox.nodes(iso.node).storage(iso.storage).content.get(content='iso')
+                key = (iso.cluster_id, iso.node, iso.storage)
+                if key not in listings:
+                    content = proxmox.nodes(iso.node).storage(iso.storage).content.get(content='iso')
+                    listings[key] = {item.get('volid') for item in content}
                 
                 # Check if our ISO still exists
-                found = False
-                for item in content:
-                    if item.get('volid') == iso.volid:
-                        found = True
-                        break
+                found = iso.volid in listings[key]
                 
                 if found:
                     iso.last_seen = datetime.utcnow()
@@ -834,17 +1103,30 @@ def quick_iso_verification():
     return stats
 
 
-def trigger_immediate_sync() -> bool:
-    """Trigger an immediate full sync (for admin/debugging).
+def trigger_immediate_sync(job: str = 'vm_full_sync') -> bool:
+    """Trigger an immediate sync (for admin/debugging and after VM changes).
+    
+    With the daemon running, the job is queued at high priority and this
+    returns immediately; otherwise (CLI/tests) that job runs inline.
+    
+    Args:
+        job: Name of a job in SYNC_JOBS
     
     Returns:
-        True if sync started
+        True if sync was queued or completed (False for an unknown job)
     """
+    if _scheduler is not None and _scheduler.running:
+        return _scheduler.trigger(job)
+    
+    func_name = next((func_name for name, func_name, _, _ in SYNC_JOBS if name == job), None)
+    if func_name is None:
+        logger.warning(f"Immediate sync: unknown job {job}")
+        return False
     try:
-        _perform_full_sync()
+        globals()[func_name]()
         return True
     except Exception as e:
-        logger.exception(f"Immediate sync failed: {e}")
+        logger.exception(f"Immediate {job} failed: {e}")
         return False
 
 
@@ -882,6 +1164,7 @@ def get_sync_stats() -> Dict[str, Any]:
     return {
         **_sync_stats,
         'running': _sync_running,
+        'jobs': get_sync_job_stats(),
         
         # VM stats
         'total_vms': total_vms,
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Base Layers - incremental class base publishing and chain flattening.
+
+A full "Save Template" converts the whole teacher disk into a new flat
+staging image. Incremental publishing instead writes only the clusters the
+teacher overlay allocated since its last publish:
+
+    {prefix}-layer-<A>.qcow2   (hard link of the current base - immutable name)
+            ^
+    {prefix}-layer-<B>.qcow2   (teacher delta; staging is a hard link of it)
+            ^
+    teacher disk               (reset to an empty overlay on layer B)
+
+Layers always reference their parent by an immutable layer name. A push
+publishes staging under a layer name too (publish_staging), rebases the
+students onto that name, and only then makes {prefix}-base.qcow2 a hard
+link of it (promote_base). A student that has not been rebased yet keeps
+reading the unchanged old base.
+
+Every publish adds a layer, so a background job (BASE_FLATTEN_INTERVAL)
+collapses chains longer than BASE_LAYER_MAX_DEPTH into a flat image while
+none of the class's VMs are running, and removes layers nothing references.
+"""
+
+import json
+import logging
+import posixpath
+import shlex
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.config import BASE_LAYER_MAX_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for writing a delta layer or a flattened image
+LAYER_CONVERT_TIMEOUT = 600
+
+
+def layer_path(base_path: str, prefix: str, stamp: Optional[str] = None) -> str:
+    """Path of a new (or given) layer file next to the class base image."""
+    stamp = stamp or datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    return f"{posixpath.dirname(base_path)}/{prefix}-layer-{stamp}.qcow2"
+
+
+def is_layer_of(path: str, base_path: str, prefix: str) -> bool:
+    """True if path is one of this class's layer files."""
+    return (posixpath.dirname(path) == posixpath.dirname(base_path)
+            and posixpath.basename(path).startswith(f"{prefix}-layer-"))
+
+
+def parse_backing_file(info_output: str) -> Optional[str]:
+    """Backing file from `qemu-img info --output=json` (None for flat images)."""
+    info = json.loads(info_output)
+    return info.get('full-backing-filename') or info.get('backing-filename')
+
+
+def parse_chain(info_output: str) -> List[str]:
+    """Image files from `qemu-img info --backing-chain --output=json`, top first."""
+    info = json.loads(info_output)
+    if isinstance(info, dict):
+        info = [info]
+    return [image['filename'] for image in info if image.get('filename')]
+
+
+def _run(ssh_executor, cmd: str, timeout: int = 60) -> Tuple[bool, str]:
+    exit_code, stdout, stderr = ssh_executor.execute(cmd, check=False, timeout=timeout)
+    return exit_code == 0, stdout if exit_code == 0 else (stderr or stdout).strip()
+
+
+def image_chain(ssh_executor, path: str) -> List[str]:
+    """Backing chain of an image (top first); empty if it cannot be read."""
+    ok, out = _run(ssh_executor, f"qemu-img info -U --backing-chain --output=json {shlex.quote(path)}")
+    if not ok:
+        return []
+    try:
+        return parse_chain(out)
+    except ValueError:
+        return []
+
+
+def _layer_name_of(ssh_executor, path: str, base_path: str, prefix: str) -> Optional[str]:
+    """Layer file that is the same inode (hard link) as path, if any."""
+    directory = posixpath.dirname(base_path)
+    ok, out = _run(ssh_executor, (f"find {shlex.quote(directory)} -maxdepth 1 -samefile {shlex.quote(path)} "
+                                  f"-name {shlex.quote(prefix + '-layer-*.qcow2')} | head -n1"))
+    return (out.strip() or None) if ok else None
+
+
+def _list_layers(ssh_executor, directory: str, prefix: str = '*') -> List[str]:
+    """Layer files in directory (every class's by default), NUL-separated so any file name survives."""
+    ok, out = _run(ssh_executor, (f"find {shlex.quote(directory)} -maxdepth 1 -type f "
+                                  f"-name {shlex.quote(prefix + '-layer-*.qcow2')} -print0"))
+    return sorted(path for path in out.split('\0') if path) if ok else []
+
+
+def publish_incremental(ssh_executor, teacher_vmid: int, teacher_disk_path: str, base_path: str,
+                        staging_path: str, prefix: str) -> Tuple[bool, str]:
+    """Publish the teacher overlay's changes as a new layer and point staging at it.
+
+    Only applies when the (stopped) teacher disk is an overlay of the class
+    base or of one of its layers; callers fall back to a full export otherwise.
+
+    Returns:
+        Tuple of (success, message) - on failure nothing visible has changed
+    """
+    ok, status = _run(ssh_executor, f"qm status {int(teacher_vmid)}")
+    if not ok or 'stopped' not in status:
+        return False, f"teacher VM {teacher_vmid} is not stopped"
+
+    ok, out = _run(ssh_executor, f"qemu-img info --output=json {shlex.quote(teacher_disk_path)}")
+    backing = parse_backing_file(out) if ok else None
+    if not backing:
+        return False, "teacher disk is not an overlay"
+
+    # Parent of the new layer must have an immutable name
+    if backing == base_path:
+        parent = _layer_name_of(ssh_executor, base_path, base_path, prefix)
+        if not parent:
+            parent = layer_path(base_path, prefix)
+            ok, err = _run(ssh_executor, f"ln {shlex.quote(base_path)} {shlex.quote(parent)}")
+            if not ok:
+                return False, f"could not link base as layer: {err}"
+    elif is_layer_of(backing, base_path, prefix):
+        parent = backing
+    else:
+        return False, f"teacher disk is backed by {backing}, not the class base"
+
+    new_layer = layer_path(base_path, prefix)
+    ok, err = _run(ssh_executor, (
+        f"qemu-img convert -f qcow2 -O qcow2 -B {shlex.quote(parent)} -F qcow2 "
+        f"{shlex.quote(teacher_disk_path)} {shlex.quote(new_layer)}"
+    ), timeout=LAYER_CONVERT_TIMEOUT)
+    if not ok:
+        _run(ssh_executor, f"rm -f {shlex.quote(new_layer)}")
+        return False, f"failed to write delta layer: {err}"
+
+    ok, err = _run(ssh_executor, f"rm -f {shlex.quote(staging_path)} && ln {shlex.quote(new_layer)} {shlex.quote(staging_path)}")
+    if not ok:
+        return False, f"failed to stage layer: {err}"
+
+    # Restart the teacher from an empty overlay so the next publish only carries new changes
+    teacher_tmp = f"{teacher_disk_path}.publish-tmp"
+    ok, err = _run(ssh_executor, (
+        f"qemu-img create -f qcow2 -F qcow2 -b {shlex.quote(new_layer)} {shlex.quote(teacher_tmp)} "
+        f"&& mv -f {shlex.quote(teacher_tmp)} {shlex.quote(teacher_disk_path)}"
+    ))
+    if not ok:
+        # Teacher still holds all its changes on top of the parent - still correct, just larger next time
+        logger.warning(f"Could not reset teacher overlay {teacher_disk_path}: {err}")
+
+    ok, size = _run(ssh_executor, f"stat -c %s {shlex.quote(new_layer)}")
+    written = int(size.strip()) if ok and size.strip().isdigit() else 0
+    logger.info(f"Published teacher delta layer {new_layer} ({written / 1048576:.1f} MiB) on {parent}")
+    return True, f"{written / 1048576:.1f} MiB delta layer"
+
+
+def publish_staging(ssh_executor, staging_path: str, base_path: str, prefix: str) -> str:
+    """Immutable layer name of the staging image, hard-linking one if it has none yet.
+
+    Raises:
+        RuntimeError: The link could not be created
+    """
+    layer = _layer_name_of(ssh_executor, staging_path, base_path, prefix)
+    if layer:
+        return layer
+    layer = layer_path(base_path, prefix)
+    ok, err = _run(ssh_executor, f"ln {shlex.quote(staging_path)} {shlex.quote(layer)}")
+    if not ok:
+        raise RuntimeError(f"could not publish {staging_path} as a layer: {err}")
+    return layer
+
+
+def promote_base(ssh_executor, layer: str, base_path: str, staging_path: str) -> None:
+    """Make layer the class base once every student overlay is on it.
+
+    The base name is replaced atomically; the old base file goes with it
+    unless a layer name still holds it. Staging is consumed.
+
+    Raises:
+        RuntimeError: The base could not be replaced
+    """
+    base, tmp = shlex.quote(base_path), shlex.quote(f"{base_path}.new")
+    ok, err = _run(ssh_executor, f"ln -f {shlex.quote(layer)} {tmp} && mv -f {tmp} {base}")
+    if not ok:
+        raise RuntimeError(f"could not replace {base_path}: {err}")
+    _run(ssh_executor, f"rm -f {shlex.quote(staging_path)}")
+    logger.info(f"Class base {base_path} is now {layer}")
+
+
+def flatten_base(ssh_executor, base_path: str, staging_path: str, prefix: str,
+                 keep_paths: Iterable[str] = (), max_depth: int = BASE_LAYER_MAX_DEPTH) -> Dict[str, Any]:
+    """Collapse a long base chain into one flat image and drop unreferenced layers.
+
+    Callers must ensure no VM using the chain is running. keep_paths are other
+    images (e.g. the teacher disk) whose backing chains must survive.
+
+    Returns:
+        {'depth': n, 'flattened': bool, 'removed': [layer paths]}
+    """
+    chain = image_chain(ssh_executor, base_path)
+    result = {'depth': len(chain), 'flattened': False, 'removed': []}
+    if len(chain) <= max_depth:
+        return result
+
+    head_layer = _layer_name_of(ssh_executor, base_path, base_path, prefix)
+    flat_tmp = f"{posixpath.dirname(base_path)}/{prefix}-flat.tmp"
+    ok, err = _run(ssh_executor, (
+        f"qemu-img convert -f qcow2 -O qcow2 {shlex.quote(base_path)} {shlex.quote(flat_tmp)}"
+    ), timeout=LAYER_CONVERT_TIMEOUT)
+    if not ok:
+        _run(ssh_executor, f"rm -f {shlex.quote(flat_tmp)}")
+        raise RuntimeError(f"flatten of {base_path} failed: {err}")
+
+    # Same content under the same names: the head layer (parent of staging and
+    # teacher overlays) first, then the base students point at. Renames are atomic.
+    if head_layer:
+        _run(ssh_executor, (f"ln {shlex.quote(flat_tmp)} {shlex.quote(head_layer)}.new "
+                            f"&& mv -f {shlex.quote(head_layer)}.new {shlex.quote(head_layer)}"))
+    ok, err = _run(ssh_executor, f"mv -f {shlex.quote(flat_tmp)} {shlex.quote(base_path)}")
+    if not ok:
+        raise RuntimeError(f"could not replace {base_path}: {err}")
+    result['flattened'] = True
+
+    referenced: Set[str] = set()
+    for path in [base_path, staging_path, *keep_paths]:
+        referenced.update(image_chain(ssh_executor, path))
+    for layer in _list_layers(ssh_executor, posixpath.dirname(base_path), prefix):
+        if layer not in referenced:
+            _run(ssh_executor, f"rm -f {shlex.quote(layer)}")
+            result['removed'].append(layer)
+    logger.info(f"Flattened {base_path} (chain depth {result['depth']}), removed {len(result['removed'])} layers")
+    return result
+
+
+def flatten_idle_class_bases() -> Dict[str, Any]:
+    """Flatten long base chains of classes whose VMs are all stopped. Returns stats."""
+    from app.models import Class, VMAssignment, VMInventory
+    from app.services.class_vm_service import DEFAULT_TEMPLATE_STORAGE_PATH, get_cached_ssh_executor
+    from app.services.vm_utils import sanitize_vm_name
+
+    stats = {'candidates': 0, 'flattened': 0, 'skipped_running': 0, 'layers_removed': 0}
+    ssh_executor = get_cached_ssh_executor()
+    ssh_executor.connect()
+
+    layered = {posixpath.basename(path).rsplit('-layer-', 1)[0]
+               for path in _list_layers(ssh_executor, DEFAULT_TEMPLATE_STORAGE_PATH)}
+    if not layered:
+        return stats
+
+    for class_ in Class.query.all():
+        prefix = sanitize_vm_name(class_.name) or f"class-{class_.id}"
+        if prefix not in layered:
+            continue
+        stats['candidates'] += 1
+
+        assignments = VMAssignment.query.filter_by(class_id=class_.id).all()
+        vmids = [a.proxmox_vmid for a in assignments]
+        if vmids and VMInventory.query.filter(VMInventory.vmid.in_(vmids),
+                                              VMInventory.status == 'running').first():
+            stats['skipped_running'] += 1
+            continue
+
+        keep = []
+        for teacher in (a for a in assignments if a.is_teacher_vm):
+            ok, path = _run(ssh_executor, (
+                f"pvesm path \"$(qm config {int(teacher.proxmox_vmid)} | awk -F'[ ,]' "
+                f"'/^(scsi|virtio|sata|ide)[0-9]+:/ && !/media=cdrom/ {{print $2; exit}}')\""
+            ))
+            if not ok or not path.strip():
+                # Unknown teacher chain - keep every layer rather than risk breaking it
+                keep = None
+                break
+            keep.append(path.strip())
+        if keep is None:
+            continue
+
+        base_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{prefix}-base.qcow2"
+        staging_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{prefix}-staging.qcow2"
+        try:
+            result = flatten_base(ssh_executor, base_path, staging_path, prefix, keep_paths=keep)
+        except Exception as e:
+            logger.warning(f"Base flatten skipped for class {class_.id}: {e}")
+            continue
+        stats['flattened'] += int(result['flattened'])
+        stats['layers_removed'] += len(result['removed'])
+    return stats
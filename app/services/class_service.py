@@ -7,10 +7,12 @@ Handles class CRUD, template management, VM pool operations, and invite links.
 
 import logging
 import time
+import uuid
 from datetime import datetime
 from typing import List, Optional, Tuple
 
 from app.models import Class, Template, User, VMAssignment, db
+from app.services.warm_pool import claim_spares, refill_async
 
 logger = logging.getLogger(__name__)
 
@@ -104,6 +106,8 @@ def update_user_role(user_id: int, new_role: str) -> Tuple[bool, str]:
     
     try:
         db.session.commit()
+        from app.services.user_manager import bump_roles_epoch
+        bump_roles_epoch()
         logger.info("Updated user %s role: %s -> %s", user.username, old_role, new_role)
         return True, f"User {user.username} role updated to {new_role}"
     except Exception as e:
@@ -200,6 +204,19 @@ def create_class(name: str, teacher_id: int, description: str = None,
         if not original_template:
             return None, "Template not found"
     
+    # Allocate VMID prefix BEFORE creating the class row
+    # This ensures every class has a prefix allocated before any VMs are created.
+    # The allocator commits its reservation in its own transaction, so it must
+    # run before this session flushes (SQLite write lock).
+    from app.services.class_vm_service import allocate_vmid_prefix_simple
+    from app.services.vmid_allocator import release_reservations
+    prefix_owner = f"class-prefix-{uuid.uuid4().hex}"
+    vmid_prefix = allocate_vmid_prefix_simple(owner=prefix_owner)
+    if vmid_prefix:
+        logger.info(f"Allocated VMID prefix {vmid_prefix} for class (range: {vmid_prefix}00-{vmid_prefix}99)")
+    else:
+        logger.warning(f"Failed to allocate VMID prefix for class {name}, will retry during VM creation")
+    
     try:
         # NO VM creation during class creation anymore
         # VMs are created later via the "Create VMs" button which calls deploy_class_vms()
@@ -218,7 +235,8 @@ def create_class(name: str, teacher_id: int, description: str = None,
             disk_size_gb=disk_size_gb,
             deployment_node=deployment_node,  # Optional: single-node deployment override
             deployment_cluster=deployment_cluster,  # Optional: target cluster
-            deployment_method=deployment_method  # Store deployment method for later reference
+            deployment_method=deployment_method,  # Store deployment method for later reference
+            vmid_prefix=vmid_prefix,
         )
         db.session.add(class_)
         
@@ -239,16 +257,6 @@ def create_class(name: str, teacher_id: int, description: str = None,
                 else:
                     raise
 
-        # Allocate VMID prefix BEFORE generating token
-        # This ensures every class has a prefix allocated before any VMs are created
-        from app.services.class_vm_service import allocate_vmid_prefix_simple
-        vmid_prefix = allocate_vmid_prefix_simple()
-        if vmid_prefix:
-            class_.vmid_prefix = vmid_prefix
-            logger.info(f"Allocated VMID prefix {vmid_prefix} for class (range: {vmid_prefix}00-{vmid_prefix}99)")
-        else:
-            logger.warning(f"Failed to allocate VMID prefix for class {name}, will retry during VM creation")
-
         # Auto-generate join token (never expires) if none
         # Token format includes the prefix for readability
         class_.generate_join_token(expires_in_days=0)
@@ -268,6 +276,10 @@ def create_class(name: str, teacher_id: int, description: str = None,
         db.session.rollback()
         logger.exception("Failed to create class %s: %s", name, e)
         return None, f"Failed to create class: {str(e)}"
+    finally:
+        # Once committed the class row holds the block; otherwise it is free again
+        if vmid_prefix:
+            release_reservations(prefix_owner)
 
 
 def get_class_by_id(class_id: int) -> Optional[Class]:
@@ -498,16 +510,11 @@ def join_class_via_token(token: str, user_id: int) -> Tuple[bool, str, Optional[
     # Enroll user in class
     class_.students.append(user)
     
-    # Try to find an unassigned VM in the class
-    # CRITICAL: Exclude reserved VMs (class-base VM with index 99) and manually added VMs
-    available_vm = VMAssignment.query.filter_by(
-        class_id=class_.id,
-        assigned_user_id=None,
-        status='available',  # Only 'available' VMs, NOT 'reserved'
-        manually_added=False  # Don't auto-assign manually added VMs
-    ).filter(
-        ~VMAssignment.is_template_vm  # Exclude template VMs
-    ).first()
+    # Try to find an unassigned VM in the class, preferring warm (running, IP known) spares
+    # CRITICAL: Excludes reserved VMs (class-base VM with index 99) and manually added VMs
+    # Row lock skips VMs another worker is claiming (PostgreSQL FOR UPDATE SKIP LOCKED)
+    spares = claim_spares(class_.id, 1)
+    available_vm = spares[0] if spares else None
     
     if available_vm:
         # Assign the VM to the user
@@ -517,6 +524,8 @@ def join_class_via_token(token: str, user_id: int) -> Tuple[bool, str, Optional[
             db.session.commit()
             logger.info("User %s joined class %s, assigned VM %d", 
                         user.username, class_.name, available_vm.proxmox_vmid)
+            if class_.warm_pool_size:
+                refill_async(class_.id)
             return True, f"Successfully joined class {class_.name} with VM assigned", available_vm
         except Exception as e:
             db.session.rollback()
@@ -528,6 +537,9 @@ def join_class_via_token(token: str, user_id: int) -> Tuple[bool, str, Optional[
             db.session.commit()
             logger.info("User %s joined class %s without VM (none available)", 
                         user.username, class_.name)
+            if class_.warm_pool_size:
+                # The refill creates a VM for this student too
+                refill_async(class_.id)
             return True, f"Successfully joined class {class_.name}. You'll be assigned a VM when one becomes available.", None
         except Exception as e:
             db.session.rollback()
@@ -560,14 +572,10 @@ def auto_assign_vms_to_waiting_students(class_id: int) -> int:
         logger.info("No students waiting for VMs in class %s", class_.name)
         return 0
     
-    # Find available VMs (exclude manually added VMs)
-    available_vms = VMAssignment.query.filter_by(
-        class_id=class_id,
-        assigned_user_id=None,
-        status='available',
-        is_template_vm=False,
-        manually_added=False  # Don't auto-assign manually added VMs
-    ).all()
+    # Find available VMs (exclude manually added VMs), warm spares first
+    # Only as many VMs as there are waiting students, skipping rows another
+    # worker has locked (PostgreSQL FOR UPDATE SKIP LOCKED)
+    available_vms = claim_spares(class_id, len(students_without_vms))
     
     if not available_vms:
         logger.info("No VMs available for auto-assignment in class %s", class_.name)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Class Teardown - bulk stop/destroy of a deleted class's VMs.
+
+delete_class_route used to stop and delete every VM in turn inside the HTTP
+request (status poll loops, then delete_vm per VM). Now the route queues a
+TeardownJob on a background thread and returns a task_id at once:
+- One cluster/resources call finds each VM's current node and status
+- VMs are torn down concurrently, each node with its own pool of
+  CLASS_TEARDOWN_PER_NODE workers: stop (if not stopped) and destroy with
+  purge, each waited on through its task UPID instead of status polling
+- Overlay disks attached by absolute path (qm set --scsi0 /path/...) are not
+  owned by a Proxmox storage, so purge leaves them behind; they are removed
+  afterwards with one rm per images directory per node
+- Progress is reported through the clone progress tracker
+"""
+
+import logging
+import posixpath
+import shlex
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import CLASS_TEARDOWN_PER_NODE
+from app.services.node_fanout import disk_entries, run_per_node
+from app.services.ssh_executor import node_command
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for one stop or destroy task
+TEARDOWN_TASK_TIMEOUT = 300
+
+# Seconds between task status polls
+TEARDOWN_TASK_POLL = 1.0
+
+
+@dataclass
+class TeardownVM:
+    """One VM to destroy."""
+    vmid: int
+    node: str
+    status: str = 'unknown'
+    files: List[str] = field(default_factory=list)
+    deleted: bool = False
+    error: Optional[str] = None
+
+
+def unmanaged_disk_files(vmid: int, config: Dict[str, Any]) -> List[str]:
+    """Absolute-path disk files of a VM config that belong to the VM itself.
+
+    Only files named vm-<vmid>-* qualify, so a class base or shared image
+    referenced by path is never picked up.
+    """
+    files = []
+    for _, value in disk_entries(config):
+        path = value.split(',')[0]
+        if 'media=cdrom' in value or not path.startswith('/'):
+            continue
+        if posixpath.basename(path).startswith(f"vm-{int(vmid)}-"):
+            files.append(path)
+    return files
+
+
+def cleanup_commands(vms: List[TeardownVM]) -> List[Tuple[str, str]]:
+    """(node, script) removing destroyed VMs' leftover files, one script per images directory.
+
+    Files under a per-VM directory (<images>/<vmid>/vm-<vmid>-disk-0.qcow2)
+    are grouped by <images>, and the emptied per-VM directories are removed.
+    """
+    groups: Dict[Tuple[str, str], Dict[str, set]] = {}
+    for vm in vms:
+        if not vm.deleted:
+            continue
+        for path in vm.files:
+            directory, name = posixpath.split(path)
+            if posixpath.basename(directory) == str(vm.vmid):
+                root, rel, subdir = posixpath.dirname(directory), f"{vm.vmid}/{name}", str(vm.vmid)
+            else:
+                root, rel, subdir = directory, name, None
+            group = groups.setdefault((vm.node, root), {'files': set(), 'dirs': set()})
+            group['files'].add(rel)
+            if subdir:
+                group['dirs'].add(subdir)
+
+    commands = []
+    for (node, root), group in sorted(groups.items()):
+        script = f"cd {shlex.quote(root)} && rm -f -- {' '.join(shlex.quote(f) for f in sorted(group['files']))}"
+        if group['dirs']:
+            script += f" && rmdir --ignore-fail-on-non-empty -- {' '.join(shlex.quote(d) for d in sorted(group['dirs']))}"
+        commands.append((node, script))
+    return commands
+
+
+class TeardownJob:
+    """Stop and destroy a set of VMs with bounded per-node parallelism."""
+
+    def __init__(self, proxmox, vms: List[Dict[str, Any]], ssh_executor=None, task_id: Optional[str] = None,
+                 per_node: int = CLASS_TEARDOWN_PER_NODE, task_timeout: float = TEARDOWN_TASK_TIMEOUT,
+                 poll_interval: float = TEARDOWN_TASK_POLL):
+        self.proxmox = proxmox
+        self.ssh_executor = ssh_executor
+        self.task_id = task_id
+        self.per_node = max(1, per_node)
+        self.task_timeout = task_timeout
+        self.poll_interval = poll_interval
+        self.vms = [TeardownVM(vmid=int(vm['vmid']), node=vm['node']) for vm in vms]
+        self._lock = threading.Lock()
+        self._finished = 0
+
+    # -- helpers -----------------------------------------------------------------
+
+    def _progress(self, **kwargs) -> None:
+        if not self.task_id:
+            return
+        from app.services.clone_progress import update_clone_progress
+        update_clone_progress(self.task_id, **kwargs)
+
+    def _wait(self, upid, what: str) -> None:
+        from app.services.proxmox_operations import wait_for_task
+
+        if not upid:
+            return
+        ok, status = wait_for_task(self.proxmox, upid, self.task_timeout, self.poll_interval)
+        if not ok:
+            raise RuntimeError(f"{what} failed: {status}")
+
+    # -- steps -------------------------------------------------------------------
+
+    def locate(self) -> None:
+        """Correct nodes and read statuses from one cluster/resources call.
+
+        Read uncached: a VM created or started over SSH moments ago must not
+        be taken for missing or stopped.
+        """
+        from app.services.proxmox_cache import fresh_reads
+
+        try:
+            with fresh_reads():
+                resources = {int(r['vmid']): r for r in self.proxmox.cluster.resources.get(type='vm')}
+        except Exception as e:
+            logger.warning(f"Teardown: cluster resources unavailable, using stored nodes: {e}")
+            return
+        for vm in self.vms:
+            resource = resources.get(vm.vmid)
+            if resource is None:
+                # Not in the cluster any more - nothing to destroy
+                vm.status = 'missing'
+                continue
+            if resource.get('node') and resource['node'] != vm.node:
+                logger.info(f"Teardown: VM {vm.vmid} is on {resource['node']}, not {vm.node}")
+                vm.node = resource['node']
+            vm.status = resource.get('status', 'unknown')
+
+    def _teardown(self, vm: TeardownVM) -> TeardownVM:
+        if vm.status == 'missing':
+            vm.deleted = True
+        else:
+            api = self.proxmox.nodes(vm.node).qemu(vm.vmid)
+            try:
+                try:
+                    vm.files = unmanaged_disk_files(vm.vmid, api.config.get())
+                except Exception as e:
+                    logger.debug(f"Teardown: could not read config of VM {vm.vmid}: {e}")
+                if vm.status != 'stopped':
+                    self._wait(api.status.stop.post(), f"stop of VM {vm.vmid}")
+                self._wait(api.delete(purge=1, **{'destroy-unreferenced-disks': 1}), f"destroy of VM {vm.vmid}")
+                vm.deleted = True
+            except Exception as e:
+                vm.error = str(e)
+                logger.warning(f"Teardown: failed to delete VM {vm.vmid} on {vm.node}: {e}")
+
+        with self._lock:
+            self._finished += 1
+            deleted = sum(1 for v in self.vms if v.deleted)
+            failed = sum(1 for v in self.vms if v.error)
+            finished = self._finished
+        self._progress(completed=deleted, failed=failed, current_vm=str(vm.vmid),
+                       error=f"VM {vm.vmid}: {vm.error}" if vm.error else None,
+                       message=f"Deleting VMs: {finished}/{len(self.vms)}",
+                       progress_percent=finished * 100 / len(self.vms))
+        return vm
+
+    def cleanup_files(self) -> int:
+        """Remove leftover overlay files of destroyed VMs. Returns the number of scripts that failed."""
+        if self.ssh_executor is None:
+            return 0
+        failures = 0
+        for node, script in cleanup_commands(self.vms):
+            exit_code, _, err = self.ssh_executor.execute(node_command(node, script), timeout=300, check=False)
+            if exit_code != 0:
+                failures += 1
+                logger.warning(f"Teardown: overlay cleanup on {node} failed: {err.strip()[:300]}")
+        return failures
+
+    def run(self) -> Dict[str, Any]:
+        """Locate, destroy and clean up. Returns {'deleted', 'failed', 'cleanup_failures'}."""
+        if self.vms:
+            self.locate()
+            run_per_node(self.vms, self._teardown, self.per_node, node_of=lambda vm: vm.node)
+        cleanup_failures = self.cleanup_files()
+
+        deleted = sorted(vm.vmid for vm in self.vms if vm.deleted)
+        failed = [{'vmid': vm.vmid, 'error': vm.error} for vm in self.vms if vm.error]
+        self._progress(status='failed' if failed and not deleted else 'completed', progress_percent=100,
+                       message=f"Deleted {len(deleted)} VM(s)" + (f", {len(failed)} failed" if failed else ""))
+        logger.info(f"Teardown finished: {len(deleted)} deleted, {len(failed)} failed, "
+                    f"{cleanup_failures} cleanup failure(s)")
+        return {'deleted': deleted, 'failed': failed, 'cleanup_failures': cleanup_failures}
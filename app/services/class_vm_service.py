@@ -26,6 +26,7 @@ prefer importing from vm_core.py and vm_template.py.
 import logging
 import os
 import threading
+import uuid
 from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
@@ -59,7 +60,8 @@ logger = logging.getLogger(__name__)
 # Batch processing settings to prevent server overload with large classes
 VM_CREATION_BATCH_SIZE = 5  # Create N VMs before pausing
 VM_CREATION_BATCH_DELAY = 2  # Seconds to wait between batches
-VM_START_BATCH_SIZE = 3  # Start N VMs at a time
+# Seconds a deployment waits for its queued auto-starts (see start_scheduler)
+BULK_START_TIMEOUT = 900
 PROGRESS_UPDATE_INTERVAL = 5  # Update progress every N VMs (reduces database writes)
 DATABASE_COMMIT_INTERVAL = 5  # Commit database every N VMs (frees memory)
 
@@ -72,10 +74,6 @@ LARGE_CLASS_BATCH_DELAY = 3  # Longer delays for large deployments
 # GLOBAL STATE
 # =============================================================================
 
-# Global lock for VMID allocation to prevent race conditions
-# when multiple users create classes simultaneously
-_vmid_allocation_lock = threading.Lock()
-
 # Cache for reusing SSH connections per thread
 _ssh_connection_cache = threading.local()
 
@@ -90,98 +88,63 @@ def get_cached_ssh_executor():
     return _ssh_connection_cache.executor
 
 
-def allocate_vmid_prefix_simple() -> Optional[int]:
+def allocate_vmid_prefix_simple(owner: Optional[str] = None) -> Optional[int]:
     """Allocate a unique 3-digit prefix for a class, without requiring SSH/Proxmox connection.
     
     This is called during class creation to ensure the prefix is allocate BEFORE any VMs.
-    Uses database-only checks, fast and reliable.
+    Uses database-only checks (vmid_allocator interval set + reservations), so
+    it is safe across worker processes.
     
     Returns a prefix like 123, which means the class can use VMIDs 12300-12399.
     Range: 200-999 (100-199 reserved for system/templates)
     
+    Args:
+        owner: Reservation tag of this class creation; release it once the
+            class row holds the prefix (or creation failed)
+    
     Returns:
         3-digit prefix (200-999) or None if allocation fails
     """
-    import random
+    from app.services.vmid_allocator import allocate_vmid_prefix
     
-    with _vmid_allocation_lock:
-        try:
-            # Get all used prefixes from database
-            used_prefixes = {c.vmid_prefix for c in Class.query.all() if c.vmid_prefix}
-            
-            # Try to find an available prefix (200-999)
-            # Avoid 100-199 (reserved for system/templates)
-            max_attempts = 100
-            for _ in range(max_attempts):
-                prefix = random.randint(200, 999)
-                
-                # Check if this prefix is already used by another class
-                if prefix not in used_prefixes:
-                    logger.info(f"Allocated VMID prefix {prefix} (range {prefix}00-{prefix}99, 100 VMs)")
-                    return prefix
-            
-            logger.error(f"Failed to allocate VMID prefix after {max_attempts} attempts")
-            return None
-            
-        except Exception as e:
-            logger.exception(f"Error allocating VMID prefix: {e}")
-            return None
+    try:
+        return allocate_vmid_prefix(owner=owner or f"class-prefix-{uuid.uuid4().hex}")
+    except Exception as e:
+        logger.exception(f"Error allocating VMID prefix: {e}")
+        return None
 
 
-def allocate_vmid_prefix_for_class(ssh_executor: SSHExecutor) -> Optional[int]:
+def allocate_vmid_prefix_for_class(ssh_executor: SSHExecutor, owner: Optional[str] = None) -> Optional[int]:
     """Allocate a unique 3-digit prefix for a class's VMIDs.
     
     Returns a prefix like 123, which means the class can use VMIDs 12300-12399.
-    Ensures the prefix doesn't conflict with existing VMs.
+    Ensures the prefix doesn't conflict with existing VMs (including VMs on
+    the cluster that the inventory has not seen yet).
     
     Args:
         ssh_executor: SSH executor for querying Proxmox
+        owner: Reservation tag of this deployment; release it once the class
+            row holds the prefix (or the deployment failed)
         
     Returns:
-        3-digit prefix (100-999) or None if allocation fails
+        3-digit prefix (200-999) or None if allocation fails
     """
-    import random
-
+    from app.services.proxmox_cache import fresh_reads
     from app.services.proxmox_service import get_proxmox_admin
+    from app.services.vmid_allocator import allocate_vmid_prefix
     
-    with _vmid_allocation_lock:
-        try:
-            # Get all existing VMIDs from cluster
-            proxmox = get_proxmox_admin()
+    try:
+        # Live VMIDs from the cluster, on top of inventory/classes/reservations
+        proxmox = get_proxmox_admin()
+        with fresh_reads():
             resources = proxmox.cluster.resources.get(type="vm")
-            existing_vmids = {int(r.get('vmid', -1)) for r in resources}
-            
-            # Also check database for allocated prefixes
-            from app.models import Class
-            used_prefixes = {c.vmid_prefix for c in Class.query.all() if c.vmid_prefix}
-            
-            # Try to find an available prefix (100-999)
-            # Avoid 100-199 (might be used for system/templates)
-            # Use 200-999 for classes
-            max_attempts = 100
-            for _ in range(max_attempts):
-                prefix = random.randint(200, 999)
-                
-                # Check if this prefix is already used by another class
-                if prefix in used_prefixes:
-                    continue
-                
-                # Check if any VMIDs in this range exist (prefix00 to prefix99)
-                range_start = prefix * 100
-                range_end = range_start + 100
-                range_vmids = set(range(range_start, range_end))
-                
-                # If no overlap with existing VMIDs, this prefix is available
-                if not range_vmids.intersection(existing_vmids):
-                    logger.info(f"Allocated VMID prefix {prefix} (range {range_start}-{range_end-1})")
-                    return prefix
-            
-            logger.error(f"Failed to allocate VMID prefix after {max_attempts} attempts")
-            return None
-            
-        except Exception as e:
-            logger.exception(f"Error allocating VMID prefix: {e}")
-            return None
+        existing_vmids = {int(r['vmid']) for r in resources if r.get('vmid') is not None}
+        
+        return allocate_vmid_prefix(owner=owner or f"class-prefix-{uuid.uuid4().hex}", extra_used=existing_vmids)
+        
+    except Exception as e:
+        logger.exception(f"Error allocating VMID prefix: {e}")
+        return None
 
 
 def get_vmid_for_class_vm(class_id: int, vm_index: int) -> Optional[int]:
@@ -209,6 +172,73 @@ def get_vmid_for_class_vm(class_id: int, vm_index: int) -> Optional[int]:
     return vmid
 
 
+def start_vms_bulk(ssh_executor: SSHExecutor, vmids: List[int], cluster_ip: Optional[str] = None) -> int:
+    """
+    Start VMs through the cluster's start scheduler as bulk (low priority) starts.
+    
+    Interactive starts by users are admitted first, and the per-node and
+    per-storage token buckets spread the boots so a whole class does not
+    hit shared storage at once. Waits for the queued starts to run.
+    
+    Args:
+        ssh_executor: SSH connection to Proxmox cluster
+        vmids: VM IDs to start
+        cluster_ip: Cluster of the VMs (first active cluster if not found)
+    
+    Returns:
+        Number of VMs started
+    """
+    import json
+    import time
+
+    from app.services.proxmox_service import get_clusters_from_db, get_proxmox_admin_for_cluster
+    from app.services.start_scheduler import BULK, schedule_start
+    from app.services.ssh_executor import node_command
+    
+    if not vmids:
+        return 0
+    clusters = get_clusters_from_db()
+    cluster = next((c for c in clusters if c["host"] == cluster_ip), clusters[0] if clusters else None)
+    if not cluster:
+        logger.warning("No cluster for scheduled starts - starting VMs directly")
+        for vmid in vmids:
+            ssh_executor.execute(f"qm start {vmid}", check=False)
+        return len(vmids)
+    
+    # Current node of every VM in one query (students may have been migrated)
+    nodes = {}
+    exit_code, stdout, _ = ssh_executor.execute(
+        "pvesh get /cluster/resources --type vm --output-format json", timeout=30, check=False)
+    if exit_code == 0 and stdout.strip():
+        try:
+            nodes = {int(vm["vmid"]): vm["node"] for vm in json.loads(stdout)}
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Could not parse cluster resources for VM nodes: {e}")
+    
+    # Overlays live on the images storage (/mnt/pve/<storage>/images)
+    parts = DEFAULT_VM_IMAGES_PATH.split("/")
+    storages = [parts[3]] if DEFAULT_VM_IMAGES_PATH.startswith("/mnt/pve/") and len(parts) > 3 else []
+    
+    proxmox = get_proxmox_admin_for_cluster(cluster["id"])
+    tickets = []
+    for vmid in vmids:
+        node = nodes.get(int(vmid))
+        
+        def _start(vmid=vmid, node=node):
+            cmd = node_command(node, f"qm start {int(vmid)}") if node else f"qm start {int(vmid)}"
+            exit_code, _, stderr = ssh_executor.execute(cmd, timeout=120, check=False)
+            if exit_code != 0 and "already running" not in stderr:
+                raise RuntimeError(stderr.strip() or f"qm start exited with {exit_code}")
+        
+        tickets.append(schedule_start(proxmox, cluster["id"], vmid, node or "unknown", _start,
+                                      priority=BULK, owner="deployment", storages=storages))
+    
+    deadline = time.time() + BULK_START_TIMEOUT
+    for ticket in tickets:
+        ticket.wait(max(0, deadline - time.time()))
+    return sum(1 for ticket in tickets if ticket.state == "started")
+
+
 def get_vm_current_node(ssh_executor: SSHExecutor, vmid: int) -> Optional[str]:
     """
     Get the current node where a VM is located.
@@ -335,13 +365,13 @@ class ClassVMDeployResult:
 # New code should import directly from app.services.vm_utils
 # ---------------------------------------------------------------------------
 
-def get_next_available_vmid(ssh_executor: SSHExecutor, start_vmid: int = 100) -> int:
+def get_next_available_vmid(ssh_executor: SSHExecutor, start_vmid: int = 100, owner: Optional[str] = None) -> int:
     """Get the next available VMID in Proxmox.
     
     NOTE: This delegates to vm_utils.get_next_available_vmid_ssh().
     For new code, import directly from app.services.vm_utils.
     """
-    return _get_next_available_vmid_canonical(ssh_executor, start=start_vmid)
+    return _get_next_available_vmid_canonical(ssh_executor, start=start_vmid, owner=owner)
 
 
 def get_vm_mac_address(ssh_executor: SSHExecutor, vmid: int) -> Optional[str]:
@@ -812,13 +842,22 @@ def create_class_vms(
             return result
         
         if not class_.vmid_prefix:
-            vmid_prefix = allocate_vmid_prefix_for_class(ssh_executor)
+            from app.services.vmid_allocator import release_reservations
+            prefix_owner = f"class-prefix-{uuid.uuid4().hex}"
+            vmid_prefix = allocate_vmid_prefix_for_class(ssh_executor, owner=prefix_owner)
             if not vmid_prefix:
                 result.error = "Failed to allocate VMID range for class"
                 return result
             
             class_.vmid_prefix = vmid_prefix
-            db.session.commit()
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                # Once committed the class row holds the block; otherwise it is free again
+                release_reservations(prefix_owner)
             logger.info(f"Allocated VMID prefix {vmid_prefix} for class {class_id} (range: {vmid_prefix}00-{vmid_prefix}99)")
         else:
             logger.info(f"Class {class_id} already has VMID prefix {class_.vmid_prefix}")
@@ -851,6 +890,24 @@ def create_class_vms(
         # Track simulated VM allocations across nodes for load balancing
         simulated_vms_per_node = {}
         
+        # One node resource snapshot for the whole deployment; each placed VM is charged to it
+        placement_snapshot = None
+        if proxmox and not class_.deployment_node:
+            try:
+                from app.services.placement import NodeSnapshot
+                placement_snapshot = NodeSnapshot.from_nodes(proxmox.nodes.get())
+            except Exception as e:
+                logger.warning(f"Could not snapshot node resources for placement: {e}")
+        if placement_snapshot is not None:
+            # Overlays read the class base from shared storage - weigh each node's probed path to it
+            try:
+                from app.services.storage_probe import apply_storage_probes
+                probed = apply_storage_probes(placement_snapshot, PROXMOX_STORAGE_NAME,
+                                              cluster_id=cluster.cluster_id if template_cluster_ip else None)
+                logger.info(f"Storage-aware placement: probe data for {probed}/{len(placement_snapshot)} nodes")
+            except Exception as e:
+                logger.warning(f"Could not load storage probe results: {e}")
+        
         # CRITICAL: When adding to existing class, skip teacher/class-base creation
         # and jump straight to student VM creation
         if adding_to_existing_class:
@@ -1131,7 +1188,7 @@ def create_class_vms(
                     teacher_optimal_node = class_.deployment_node
                     logger.info(f"Using deployment override node for teacher VM: {teacher_optimal_node}")
                 else:
-                    teacher_optimal_node = get_optimal_node(ssh_executor, proxmox, vm_memory_mb=memory, simulated_vms_per_node=simulated_vms_per_node)
+                    teacher_optimal_node = get_optimal_node(ssh_executor, proxmox, vm_memory_mb=memory, simulated_vms_per_node=simulated_vms_per_node, snapshot=placement_snapshot, vm_cores=cores, io=True)
                     logger.info(f"Selected optimal node for teacher VM: {teacher_optimal_node}")
                 
                 logger.info(f"Creating teacher VM with VMID {teacher_vmid}")
@@ -1325,7 +1382,7 @@ def create_class_vms(
                     teacher_optimal_node = class_.deployment_node
                     logger.info(f"Using deployment override node for teacher VM: {teacher_optimal_node}")
                 else:
-                    teacher_optimal_node = get_optimal_node(ssh_executor, proxmox, vm_memory_mb=memory, simulated_vms_per_node=simulated_vms_per_node)
+                    teacher_optimal_node = get_optimal_node(ssh_executor, proxmox, vm_memory_mb=memory, simulated_vms_per_node=simulated_vms_per_node, snapshot=placement_snapshot, vm_cores=cores)
                     logger.info(f"Selected optimal node for teacher VM: {teacher_optimal_node}")
                 
                 # Create empty VM shell with proper hardware settings
@@ -1616,6 +1673,13 @@ def create_class_vms(
                 batch_delay = VM_CREATION_BATCH_DELAY
                 logger.info(f"Using standard batch processing: {batch_size} VMs per batch with {batch_delay}s delay")
             
+            # Place the whole student batch at once against the deployment snapshot
+            student_plan = iter([])
+            if placement_snapshot is not None:
+                from app.services.placement import place_batch
+                student_plan = iter(place_batch(placement_snapshot, [(memory * 1024 * 1024, cores)] * pool_size,
+                                                io=bool(base_qcow2_path)))
+            
             students_created = 0
             current_index = next_student_index
             vms_in_current_batch = 0
@@ -1705,8 +1769,10 @@ def create_class_vms(
                 if class_.deployment_node:
                     student_optimal_node = class_.deployment_node
                 else:
-                    student_optimal_node = get_optimal_node(ssh_executor, proxmox, vm_memory_mb=memory, simulated_vms_per_node=simulated_vms_per_node)
-                    logger.info(f"Selected optimal node for {student_name}: {student_optimal_node} (current allocation: {simulated_vms_per_node})")
+                    student_optimal_node = next(student_plan, None) or get_optimal_node(
+                        ssh_executor, proxmox, vm_memory_mb=memory, simulated_vms_per_node=simulated_vms_per_node,
+                        snapshot=placement_snapshot, vm_cores=cores, io=bool(base_qcow2_path))
+                    logger.info(f"Selected optimal node for {student_name}: {student_optimal_node}")
                 
                 try:
                     # OPTIMIZATION: Reduce logging verbosity for large deployments
@@ -1859,22 +1925,12 @@ def create_class_vms(
                 logger.warning(warning_msg)
                 result.details.append(f"Warning: {warning_msg}")
         
-        # Step 4: Start VMs if requested (with rate limiting)
+        # Step 4: Start VMs if requested (admitted as bulk starts by the start scheduler)
         if auto_start and result.teacher_vmid:
             result.details.append("Starting VMs...")
             ssh_executor.execute(f"qm start {result.teacher_vmid}", check=False)
-            
-            # OPTIMIZATION: Start VMs in batches to avoid overwhelming cluster
-            for i in range(0, len(result.student_vmids), VM_START_BATCH_SIZE):
-                batch = result.student_vmids[i:i + VM_START_BATCH_SIZE]
-                for vmid in batch:
-                    ssh_executor.execute(f"qm start {vmid}", check=False)
-                
-                # Small delay between start batches
-                if i + VM_START_BATCH_SIZE < len(result.student_vmids):
-                    import time
-                    time.sleep(1)
-                    logger.info(f"Started {min(i + VM_START_BATCH_SIZE, len(result.student_vmids))}/{len(result.student_vmids)} VMs")
+            started = start_vms_bulk(ssh_executor, result.student_vmids, template_cluster_ip)
+            logger.info(f"Started {started}/{len(result.student_vmids)} student VMs")
         
         # Commit all VMAssignment records (final commit)
         try:
@@ -2164,7 +2220,9 @@ def recreate_teacher_vm_from_base(class_id: int, class_name: str) -> tuple[bool,
         class_base_vmid = class_.vmid_prefix * 100 + 99
         node = None
         try:
-            resources = proxmox.cluster.resources.get(type="vm")
+            from app.services.proxmox_cache import fresh_reads
+            with fresh_reads():
+                resources = proxmox.cluster.resources.get(type="vm")
             for r in resources:
                 if r.get('vmid') == class_base_vmid:
                     node = r.get('node')
@@ -2278,7 +2336,8 @@ def recreate_teacher_vm_from_base(class_id: int, class_name: str) -> tuple[bool,
         return False, str(e), None
 
 
-def save_teacher_vm_to_base(class_id: int, teacher_vmid: int, teacher_node: str, class_name: str) -> tuple[bool, str]:
+def save_teacher_vm_to_base(class_id: int, teacher_vmid: int, teacher_node: str, class_name: str,
+                            mode: Optional[str] = None) -> tuple[bool, str]:
     """
     Export teacher VM disk to staging QCOW2 file (class-base-staging.qcow2).
     
@@ -2290,16 +2349,23 @@ def save_teacher_vm_to_base(class_id: int, teacher_vmid: int, teacher_node: str,
     2. Students still use class-{prefix}-base.qcow2 (unchanged)
     3. "Push to VMs" will rebase student overlays from old base to staging
     
+    In "incremental" mode step 1 writes only the teacher overlay's changes as
+    a new layer on the current base (see base_layers); it falls back to the
+    full export when the teacher disk is not an overlay of the class base.
+    
     Args:
         class_id: Database ID of the class
         teacher_vmid: VMID of the teacher's working VM
         teacher_node: Node where teacher VM resides
         class_name: Name of the class
+        mode: "incremental" or "full" (default: TEMPLATE_PUBLISH_MODE)
         
     Returns:
         Tuple of (success, message)
     """
+    from app.config import TEMPLATE_PUBLISH_MODE
     from app.models import Class
+    from app.services.base_layers import publish_incremental
     from app.services.vm_utils import sanitize_vm_name
     
     try:
@@ -2338,13 +2404,29 @@ def save_teacher_vm_to_base(class_id: int, teacher_vmid: int, teacher_node: str,
         
         # Convert to path
         if ':' in disk_spec:
-            storage, disk_id = disk_spec.split(':', 1)
-            teacher_disk_path = f"/mnt/pve/{storage}/images/{teacher_vmid}/{disk_id}.qcow2"
+            exit_code, resolved_path, _ = ssh_executor.execute(f"pvesm path {disk_spec}", check=False)
+            if exit_code == 0 and resolved_path.strip():
+                teacher_disk_path = resolved_path.strip()
+            else:
+                storage, disk_id = disk_spec.split(':', 1)
+                teacher_disk_path = f"/mnt/pve/{storage}/images/{teacher_vmid}/{disk_id}.qcow2"
         else:
             teacher_disk_path = disk_spec
         
         logger.info(f"Teacher VM disk: {teacher_disk_path}")
         
+        # Incremental publish: only the teacher's changes become a new base layer
+        if (mode or TEMPLATE_PUBLISH_MODE) == 'incremental':
+            base_qcow2_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{class_prefix}-base.qcow2"
+            published, detail = publish_incremental(
+                ssh_executor, teacher_vmid, teacher_disk_path, base_qcow2_path, staging_qcow2_path, class_prefix)
+            if published:
+                ssh_executor.disconnect()
+                logger.info(f"Published teacher VM {teacher_vmid} changes to staging ({detail})")
+                return True, (f"Template changes saved to staging ({detail}). Students not affected. "
+                              "Click 'Push to VMs' to update students.")
+            logger.info(f"Incremental publish not possible ({detail}), exporting full disk")
+        
         # Step 2: Remove old staging file if exists
         ssh_executor.execute(f"rm -f {staging_qcow2_path}", check=False)
         
@@ -2367,26 +2449,41 @@ def save_teacher_vm_to_base(class_id: int, teacher_vmid: int, teacher_node: str,
         return False, str(e)
 
 
-def push_staging_to_students(class_id: int, class_name: str) -> tuple[bool, str, int]:
+def push_staging_to_students(class_id: int, class_name: str, rolling: bool = False,
+                             cohort_size: int = 10) -> tuple[bool, str, int]:
     """
     Push staging template to all student VMs by rebasing their overlays.
     
     This is FAST because it only changes overlay backing files, no data copying.
+    Stops, starts and rebases run concurrently (see FleetUpdater); rebases are
+    batched into one remote command per node.
     
-    Workflow:
-    1. Stop all student VMs
-    2. Swap: class-base.qcow2 ← class-staging.qcow2 (staging becomes new base)
-    3. Rebase all student overlays to point to new base
-    4. Student VMs now use teacher's updated template
+    Workflow (default):
+    1. Publish staging under an immutable layer name (the base stays untouched)
+    2. Stop all running student VMs (confirmed via task status, no fixed sleep);
+       if any stop fails, restart the stopped ones and abort
+    3. Rebase all student overlays onto the published layer
+    4. Once every student is on it, class-base.qcow2 becomes a hard link of
+       the layer and staging is removed
+    
+    Rolling workflow (rolling=True): stop -> rebase -> restart students in
+    cohorts of cohort_size. Students not rebased yet keep reading the old base,
+    which is only replaced after the last cohort. If any student could not be
+    updated, the old base stays and staging is kept, so a second push finishes.
     
     Args:
         class_id: Database ID of the class
         class_name: Name of the class
+        rolling: Update students cohort by cohort and restart the ones that were running
+        cohort_size: Running VMs per cohort in rolling mode
         
     Returns:
         Tuple of (success, message, updated_count)
     """
     from app.models import Class, VMAssignment
+    from app.services.base_layers import promote_base, publish_staging
+    from app.services.fleet_update import FleetUpdater
+    from app.services.proxmox_service import get_proxmox_admin
     from app.services.vm_utils import sanitize_vm_name
     
     try:
@@ -2401,7 +2498,6 @@ def push_staging_to_students(class_id: int, class_name: str) -> tuple[bool, str,
         
         base_qcow2_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{class_prefix}-base.qcow2"
         staging_qcow2_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{class_prefix}-staging.qcow2"
-        old_base_backup = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{class_prefix}-base.old"
         
         # Check if staging exists
         ssh_executor = get_cached_ssh_executor()
@@ -2425,75 +2521,45 @@ def push_staging_to_students(class_id: int, class_name: str) -> tuple[bool, str,
             ssh_executor.disconnect()
             return True, "No student VMs to update", 0
         
-        logger.info(f"Pushing staging template to {len(student_vms)} student VMs")
+        logger.info(f"Pushing staging template to {len(student_vms)} student VMs (rolling={rolling})")
         
-        # Step 1: Stop all student VMs
-        logger.info("Stopping all student VMs")
-        for vm in student_vms:
-            ssh_executor.execute(f"qm stop {vm.proxmox_vmid}", check=False, timeout=60)
+        # Students are rebased onto a name whose content never changes
+        new_base = publish_staging(ssh_executor, staging_qcow2_path, base_qcow2_path, class_prefix)
         
-        # Wait for all to stop
-        import time
-        time.sleep(10)
-        
-        # Step 2: Backup old base and swap staging → base
-        logger.info(f"Swapping staging → base: {staging_qcow2_path} → {base_qcow2_path}")
-        ssh_executor.execute(f"mv {base_qcow2_path} {old_base_backup}", check=False)
-        ssh_executor.execute(f"mv {staging_qcow2_path} {base_qcow2_path}", check=True)
+        updater = FleetUpdater(get_proxmox_admin(), ssh_executor)
+        result = updater.update(
+            [vm.proxmox_vmid for vm in student_vms],
+            new_base,
+            rolling=rolling,
+            cohort_size=cohort_size,
+        )
+        for vmid, error in sorted(result['failed'].items()):
+            logger.error(f"Failed to update VM {vmid}: {error}")
         
-        # Step 3: Rebase all student overlays to new base (FAST - no data copy!)
-        updated_count = 0
-        for vm in student_vms:
-            try:
-                # Find student VM disk
-                find_cmd = f"qm config {vm.proxmox_vmid} | grep -E '^(scsi|virtio|sata|ide)[0-9]+:' | head -1"
-                exit_code, disk_line, _ = ssh_executor.execute(find_cmd, check=False)
-                
-                if exit_code != 0 or not disk_line:
-                    logger.warning(f"Could not find disk for VM {vm.proxmox_vmid}")
-                    continue
-                
-                # Parse disk spec
-                parts = disk_line.split(':', 1)
-                if len(parts) < 2:
-                    continue
-                
-                disk_spec = parts[1].strip().split(',')[0]
-                
-                # Convert to path
-                if ':' in disk_spec:
-                    storage, disk_id = disk_spec.split(':', 1)
-                    student_disk_path = f"/mnt/pve/{storage}/images/{vm.proxmox_vmid}/{disk_id}.qcow2"
-                else:
-                    student_disk_path = disk_spec
-                
-                # Rebase overlay to new base (FAST!)
-                logger.info(f"Rebasing VM {vm.proxmox_vmid} overlay to new base")
-                rebase_cmd = f"qemu-img rebase -u -f qcow2 -b {base_qcow2_path} {student_disk_path}"
-                exit_code, _, stderr = ssh_executor.execute(rebase_cmd, check=False, timeout=30)
-                
-                if exit_code == 0:
-                    updated_count += 1
-                else:
-                    logger.error(f"Failed to rebase VM {vm.proxmox_vmid}: {stderr}")
-                    
-            except Exception as e:
-                logger.error(f"Error processing VM {vm.proxmox_vmid}: {e}")
+        if result['aborted']:
+            ssh_executor.disconnect()
+            return False, (f"Push aborted, no student VM was changed: "
+                           f"{', '.join(str(v) for v in sorted(result['failed']))} could not be stopped"), 0
         
-        # Clean up old base backup
-        ssh_executor.execute(f"rm -f {old_base_backup}", check=False)
+        # The old base is only replaced when no student reads it any more
+        if not result['failed']:
+            promote_base(ssh_executor, new_base, base_qcow2_path, staging_qcow2_path)
         
         ssh_executor.disconnect()
         
-        logger.info(f"Successfully pushed staging to {updated_count}/{len(student_vms)} student VMs")
-        return True, f"Updated {updated_count} student VMs with new template", updated_count
+        updated_count = len(result['updated'])
+        logger.info(f"Successfully pushed staging to {updated_count}/{len(student_vms)} student VMs "
+                    f"in {result['duration']}s ({result['cohorts']} cohort(s))")
+        message = f"Updated {updated_count} student VMs with new template"
+        if result['failed']:
+            message += (f" ({len(result['failed'])} failed: {', '.join(str(v) for v in sorted(result['failed']))};"
+                        f" the previous base is kept until a push updates every student)")
+        return True, message, updated_count
         
     except Exception as e:
         logger.exception(f"Failed to push staging to students: {e}")
-        # Try to restore old base
         try:
             if 'ssh_executor' in locals() and ssh_executor:
-                ssh_executor.execute(f"mv {old_base_backup} {base_qcow2_path}", check=False)
                 ssh_executor.disconnect()
         except Exception:
             pass
@@ -2502,11 +2568,12 @@ def push_staging_to_students(class_id: int, class_name: str) -> tuple[bool, str,
 
 def recreate_student_vms_with_new_specs(class_id: int, cpu_cores: int, memory_mb: int) -> None:
     """
-    Recreate all student VMs in a class with new hardware specifications.
+    Bring all student VMs in a class to new hardware specifications.
     
-    This function deletes existing student VMs (excluding teacher VM) and recreates
-    them with updated CPU and RAM specs. The recreation maintains the same VM IDs
-    and overlay structure from the class base template.
+    Each VM is planned by SpecPlanner: CPU/RAM changes are applied in place
+    with qm set (running VMs pick them up on their next boot) and only VMs
+    without a disk get a fresh overlay from the class base template. Changes
+    run as one batch per node, with the nodes in parallel.
     
     Args:
         class_id: Database ID of the class
@@ -2514,13 +2581,13 @@ def recreate_student_vms_with_new_specs(class_id: int, cpu_cores: int, memory_mb
         memory_mb: New memory in MB for VMs
     """
     from app import create_app
-    from app.services.proxmox_service import get_proxmox_admin_for_cluster
+    from app.services.spec_planner import SpecPlanner
     
     app = create_app()
     
     with app.app_context():
         try:
-            logger.info(f"Starting VM recreation for class {class_id} with {cpu_cores} cores and {memory_mb}MB RAM")
+            logger.info(f"Applying new specs to class {class_id}: {cpu_cores} cores and {memory_mb}MB RAM")
             
             # Get class details
             class_obj = Class.query.get(class_id)
@@ -2528,133 +2595,50 @@ def recreate_student_vms_with_new_specs(class_id: int, cpu_cores: int, memory_mb
                 logger.error(f"Class {class_id} not found")
                 return
             
-            # Get student VMs (exclude teacher VM which is index 0)
+            # Student VMs, assigned or spare (teacher VM and class base keep their specs)
             student_vms = VMAssignment.query.filter_by(
                 class_id=class_id,
-                status='assigned'
+                is_teacher_vm=False,
+                is_template_vm=False,
             ).filter(
-                VMAssignment.vm_name.notlike('%teacher%')
+                VMAssignment.status != 'deleting'
             ).all()
             
-            if not student_vms:
+            vms = []
+            for vm in student_vms:
+                if not vm.node:
+                    logger.warning(f"VM {vm.proxmox_vmid} has no node assignment, skipping")
+                    continue
+                vms.append({'vmid': vm.proxmox_vmid, 'node': vm.node})
+            
+            if not vms:
                 logger.info(f"No student VMs found for class {class_id}")
                 return
             
-            logger.info(f"Found {len(student_vms)} student VMs to recreate")
-            
             # Get SSH connection
             ssh_executor = get_pooled_ssh_executor_from_config()
+            planner = SpecPlanner(ssh_executor)
+            changes = planner.plan(vms, {'cores': cpu_cores, 'memory': memory_mb})
             
-            # Get Proxmox connection
-            cluster_id = class_obj.deployment_cluster
-            if not cluster_id:
-                logger.error(f"No deployment cluster configured for class {class_id}")
-                return
-            
-            proxmox = get_proxmox_admin_for_cluster(int(cluster_id))
-            
-            # Get class base QCOW2 path
-            class_prefix = sanitize_vm_name(class_obj.name)
-            if not class_prefix:
-                class_prefix = f"class-{class_id}"
-            
-            base_qcow2_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{class_prefix}-base.qcow2"
-            
-            # Verify base template exists
-            exit_code, _, _ = ssh_executor.execute(f"test -f {base_qcow2_path}", check=False)
-            if exit_code != 0:
-                logger.error(f"Base template not found at {base_qcow2_path}")
-                return
+            # Class base QCOW2 is only needed for VMs whose disk must be recreated
+            base_qcow2_path = None
+            if any(c.action == 'recreate_disk' for c in changes):
+                class_prefix = sanitize_vm_name(class_obj.name) or f"class-{class_id}"
+                base_qcow2_path = f"{DEFAULT_TEMPLATE_STORAGE_PATH}/{class_prefix}-base.qcow2"
+                exit_code, _, _ = ssh_executor.execute(f"test -f {base_qcow2_path}", check=False)
+                if exit_code != 0:
+                    logger.error(f"Base template not found at {base_qcow2_path}")
+                    base_qcow2_path = None
             
-            # Process each student VM
-            recreated_count = 0
-            for vm in student_vms:
-                try:
-                    vmid = vm.proxmox_vmid
-                    node = vm.node
-                    
-                    if not node:
-                        logger.warning(f"VM {vmid} has no node assignment, skipping")
-                        continue
-                    
-                    logger.info(f"Recreating VM {vmid} on node {node}")
-                    
-                    # Stop VM if running
-                    try:
-                        status = proxmox.nodes(node).qemu(vmid).status.current.get()
-                        if status.get('status') == 'running':
-                            logger.info(f"Stopping VM {vmid}")
-                            proxmox.nodes(node).qemu(vmid).status.shutdown.post()
-                            wait_for_vm_stopped(ssh_executor, vmid, node, timeout=120)
-                    except Exception as e:
-                        logger.warning(f"Could not check/stop VM {vmid}: {e}")
-                    
-                    # Delete existing VM
-                    logger.info(f"Deleting VM {vmid}")
-                    try:
-                        proxmox.nodes(node).qemu(vmid).delete()
-                    except Exception as e:
-                        logger.error(f"Failed to delete VM {vmid}: {e}")
-                        continue
-                    
-                    # Wait a moment for deletion to complete
-                    import time
-                    time.sleep(2)
-                    
-                    # Recreate VM with new specs
-                    student_name = vm.vm_name or f"{class_prefix}-student-{vmid}"
-                    
-                    # Create VM shell with new specs
-                    logger.info(f"Creating new VM {vmid} with {cpu_cores} cores and {memory_mb}MB RAM")
-                    exit_code, stdout, stderr = ssh_executor.execute(
-                        f"qm create {vmid} --name {student_name} --memory {memory_mb} --cores {cpu_cores} "
-                        f"--net0 virtio,bridge=vmbr0",
-                        timeout=60
-                    )
-                    
-                    if exit_code != 0:
-                        logger.error(f"Failed to create VM shell {vmid}: {stderr}")
-                        continue
-                    
-                    # Remove the default disk that qm create might add
-                    ssh_executor.execute(f"rm -rf {DEFAULT_VM_IMAGES_PATH}/{vmid}", check=False)
-                    
-                    # Create overlay disk pointing to class base
-                    overlay_path = f"{DEFAULT_VM_IMAGES_PATH}/{vmid}/vm-{vmid}-disk-0.qcow2"
-                    ssh_executor.execute(f"mkdir -p {DEFAULT_VM_IMAGES_PATH}/{vmid}", check=False)
-                    
-                    logger.info(f"Creating overlay disk for VM {vmid}")
-                    exit_code, stdout, stderr = ssh_executor.execute(
-                        f"qemu-img create -f qcow2 -F qcow2 -b {base_qcow2_path} {overlay_path}",
-                        timeout=120
-                    )
-                    
-                    if exit_code != 0:
-                        logger.error(f"Failed to create overlay for VM {vmid}: {stderr}")
-                        continue
-                    
-                    # Attach disk to VM
-                    exit_code, stdout, stderr = ssh_executor.execute(
-                        f"qm set {vmid} --scsi0 {overlay_path}",
-                        timeout=60
-                    )
-                    
-                    if exit_code != 0:
-                        logger.error(f"Failed to attach disk to VM {vmid}: {stderr}")
-                        continue
-                    
-                    # Set boot order
-                    ssh_executor.execute(f"qm set {vmid} --boot order=scsi0", check=False)
-                    
-                    recreated_count += 1
-                    logger.info(f"Successfully recreated VM {vmid}")
-                    
-                except Exception as e:
-                    logger.error(f"Error recreating VM {vmid}: {e}", exc_info=True)
-                    continue
+            changes = planner.apply(changes, base_path=base_qcow2_path, images_path=DEFAULT_VM_IMAGES_PATH)
             
-            logger.info(f"VM recreation complete: {recreated_count}/{len(student_vms)} VMs successfully recreated")
+            pending = sum(1 for c in changes if c.action == 'in_place' and c.running)
+            failed = [c for c in changes if not c.ok]
+            logger.info(f"Spec change complete for class {class_id}: {len(changes) - len(failed)}/{len(changes)} VMs "
+                        f"at new specs ({pending} running VMs apply them on next boot)")
+            for change in failed:
+                logger.error(f"VM {change.vmid} on {change.node} not updated: {change.error}")
             
         except Exception as e:
-            logger.error(f"Fatal error during VM recreation: {e}", exc_info=True)
+            logger.error(f"Fatal error during VM spec change: {e}", exc_info=True)
 
@@ -35,7 +35,8 @@ def start_clone_progress(task_id: str, total_count: int) -> None:
 
 def update_clone_progress(task_id: str, completed: int = None, failed: int = None, 
                          current_vm: str = None, status: str = None, error: str = None,
-                         message: str = None, progress_percent: float = None) -> None:
+                         message: str = None, progress_percent: float = None,
+                         throughput_mbps: float = None) -> None:
     """Update progress for a clone task."""
     with _progress_lock:
         if task_id not in _clone_progress:
@@ -57,6 +58,8 @@ def update_clone_progress(task_id: str, completed: int = None, failed: int = Non
             progress["message"] = message
         if progress_percent is not None:
             progress["progress_percent"] = min(100, max(0, progress_percent))
+        if throughput_mbps is not None:
+            progress["throughput_mbps"] = throughput_mbps
         
         progress["updated_at"] = datetime.utcnow()
 
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+DB Writer - single-writer queue for SQLite deployments.
+
+SQLite allows one writer at a time. When the sync daemons, the IP scanner
+and request threads all commit on their own, they queue behind each other's
+write lock and retry on "database is locked". With the write queue enabled,
+those writes become intents handed to one writer thread, which:
+- Drains the queue in batches (up to DB_WRITE_BATCH intents)
+- Merges row updates last-write-wins per (model, row key)
+- Applies each batch's row updates in one transaction (per-row fallback
+  if it fails); queued callables run alone in a transaction of their own
+- Resolves a Future per intent for callers that need confirmation
+
+Writers never contend with each other, and WAL readers never wait behind a
+daemon's long write transaction. PostgreSQL deployments (and SQLite with
+DB_WRITE_QUEUE=false) skip the queue: queue_update()/queue_write() apply
+the write inline, in a session of its own as the writer thread would, and
+return an already-completed Future.
+
+Usage:
+    queue_update(VMInventory, {'cluster_id': cid, 'vmid': 101}, {'status': 'running'})
+    queue_write(lambda: persist_vm_inventory(vms)).result(timeout=300)
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import DB_WRITE_BATCH, DB_WRITE_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# How long the writer waits for more intents after the first one of a batch
+WRITE_LINGER_SECONDS = 0.02
+
+# Retries for "database is locked" (other processes / unconverted writers)
+WRITE_LOCK_RETRIES = 3
+
+
+class _RowUpdate:
+    """UPDATE (or upsert) of one row identified by its key columns."""
+
+    __slots__ = ('model', 'key', 'values', 'upsert', 'future')
+
+    def __init__(self, model, key: Dict[str, Any], values: Dict[str, Any], upsert: bool, future: Future):
+        self.model = model
+        self.key = key
+        self.values = values
+        self.upsert = upsert
+        self.future = future
+
+    @property
+    def row_key(self) -> Tuple:
+        return (self.model, tuple(sorted(self.key.items())))
+
+
+class _Callable:
+    """Opaque unit of work run with the writer's session (acts as a merge barrier).
+
+    Run exactly once, in its own transaction: it may commit or roll back
+    itself without touching other intents of the batch.
+    """
+
+    __slots__ = ('func', 'future')
+
+    def __init__(self, func: Callable[[], Any], future: Future):
+        self.func = func
+        self.future = future
+
+
+def _apply_update(update: _RowUpdate, session) -> int:
+    """Apply one (merged) row update; returns rows affected."""
+    if update.upsert:
+        from app.utils.db_dialect import upsert
+        upsert(update.model, [dict(update.key, **update.values)],
+               conflict_columns=list(update.key), session=session)
+        return 1
+    return session.query(update.model).filter_by(**update.key).update(
+        update.values, synchronize_session=False)
+
+
+def _merge_updates(updates: List[_RowUpdate]) -> List[Tuple[_RowUpdate, List[Future]]]:
+    """Collapse updates to the same row (later values win), keeping first-seen order."""
+    merged: Dict[Tuple, Tuple[_RowUpdate, List[Future]]] = {}
+    for update in updates:
+        existing = merged.get(update.row_key)
+        if existing is None:
+            merged[update.row_key] = (
+                _RowUpdate(update.model, update.key, dict(update.values), update.upsert, update.future),
+                [update.future],
+            )
+        else:
+            combined, futures = existing
+            combined.values.update(update.values)
+            combined.upsert = combined.upsert or update.upsert
+            futures.append(update.future)
+    return list(merged.values())
+
+
+class DBWriter:
+    """One thread applying queued write intents in grouped transactions."""
+
+    def __init__(self, app=None, max_batch: int = 500, linger: float = WRITE_LINGER_SECONDS):
+        self._app = app
+        self._max_batch = max(1, max_batch)
+        self._linger = linger
+        self._queue: "queue.Queue" = queue.Queue()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._pending = 0  # submitted but not yet applied
+        self._pending_cond = threading.Condition()
+        self._stats = {
+            'intents': 0,
+            'merged': 0,
+            'batches': 0,
+            'failed': 0,
+            'lock_retries': 0,
+            'last_batch_size': 0,
+            'last_batch_duration': None,
+        }
+
+    # -- lifecycle ---------------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="db-writer")
+        self._thread.start()
+        logger.info("DB writer started (batch=%d)", self._max_batch)
+
+    def stop(self, wait: bool = True, timeout: float = 30.0) -> None:
+        """Stop after draining queued intents (if wait=True)."""
+        if wait:
+            self.flush(timeout=timeout)
+        self._running = False
+        self._queue.put(None)  # wake the thread
+        if wait and self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    # -- submission --------------------------------------------------------------
+
+    def submit_update(self, model, key: Dict[str, Any], values: Dict[str, Any],
+                      upsert: bool = False) -> Future:
+        """Queue an UPDATE of the row matching key (or an upsert). Future -> rows affected."""
+        future: Future = Future()
+        self._put(_RowUpdate(model, dict(key), dict(values), upsert, future))
+        return future
+
+    def submit(self, func: Callable[[], Any]) -> Future:
+        """Queue a callable run on the writer thread (uses db.session). Future -> its result."""
+        future: Future = Future()
+        self._put(_Callable(func, future))
+        return future
+
+    def _put(self, item) -> None:
+        with self._pending_cond:
+            self._pending += 1
+            self._stats['intents'] += 1
+        self._queue.put(item)
+
+    def _done(self, count: int) -> None:
+        with self._pending_cond:
+            self._pending -= count
+            if self._pending <= 0:
+                self._pending_cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued intent has been applied."""
+        with self._pending_cond:
+            if not self.running:
+                return self._pending == 0
+            return self._pending_cond.wait_for(lambda: self._pending <= 0, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, pending=self._pending, running=self.running)
+
+    # -- writer thread -----------------------------------------------------------
+
+    def _run(self) -> None:
+        if self._app is not None:
+            with self._app.app_context():
+                self._loop()
+        else:
+            self._loop()
+
+    def _loop(self) -> None:
+        while self._running or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if first is None:
+                continue
+
+            batch = [first]
+            deadline = time.time() + self._linger
+            while len(batch) < self._max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+
+            started = time.time()
+            try:
+                self._apply_batch(batch)
+            except Exception as e:  # never let the writer thread die
+                logger.exception("DB writer batch failed: %s", e)
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+            finally:
+                if self._app is not None:
+                    # Fresh session per batch (no identity map growth)
+                    from app.models import db
+                    db.session.remove()
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_batch_duration'] = round(time.time() - started, 4)
+            self._done(len(batch))
+
+    def _segments(self, batch) -> List[Any]:
+        """Split a batch into merged update groups separated by callables."""
+        segments: List[Any] = []
+        pending: List[_RowUpdate] = []
+        for item in batch:
+            if isinstance(item, _RowUpdate):
+                pending.append(item)
+            else:
+                if pending:
+                    segments.append(_merge_updates(pending))
+                    pending = []
+                segments.append(item)
+        if pending:
+            segments.append(_merge_updates(pending))
+        return segments
+
+    def _apply_batch(self, batch) -> None:
+        segments = self._segments(batch)
+        merged = sum(len(s) for s in segments if isinstance(s, list))
+        self._stats['merged'] += sum(1 for i in batch if isinstance(i, _RowUpdate)) - merged
+
+        # Callables own their transaction (they may commit or roll back
+        # themselves), so each runs alone and never shares one with updates
+        for segment in segments:
+            if isinstance(segment, _Callable):
+                self._run_callable(segment)
+            else:
+                self._apply_updates(segment)
+
+    def _run_callable(self, item: _Callable) -> None:
+        """Run a callable exactly once in a transaction of its own."""
+        from app.models import db
+
+        try:
+            result = item.func()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self._stats['failed'] += 1
+            item.future.set_exception(e)
+            return
+        item.future.set_result(result)
+
+    def _apply_updates(self, updates: List[Tuple[_RowUpdate, List[Future]]]) -> None:
+        """Apply merged row updates in one transaction; futures resolve only after its commit."""
+        from app.models import db
+        from app.utils.db_dialect import is_retryable_error
+
+        for attempt in range(WRITE_LOCK_RETRIES + 1):
+            results: List[Tuple[List[Future], Any]] = []
+            try:
+                for update, futures in updates:
+                    results.append((futures, _apply_update(update, db.session)))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                if is_retryable_error(e) and attempt < WRITE_LOCK_RETRIES:
+                    self._stats['lock_retries'] += 1
+                    time.sleep(0.1 * (2 ** attempt))
+                    continue
+                if len(updates) > 1:
+                    # Isolate the failing update: apply each on its own
+                    logger.warning("DB writer: %d updates failed (%s), applying individually", len(updates), e)
+                    for update in updates:
+                        self._apply_updates([update])
+                    return
+                self._stats['failed'] += 1
+                for future in updates[0][1]:
+                    future.set_exception(e)
+                return
+            for futures, result in results:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+
+# ---------------------------------------------------------------------------
+# Module-level writer
+# ---------------------------------------------------------------------------
+
+_writer: Optional[DBWriter] = None
+_writer_lock = threading.Lock()
+
+
+def start_db_writer(app) -> Optional[DBWriter]:
+    """Start the writer thread for SQLite deployments (no-op for other backends)."""
+    global _writer
+
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    if not DB_WRITE_QUEUE or not uri.startswith('sqlite'):
+        logger.info("DB write queue disabled (%s)", "DB_WRITE_QUEUE=false" if not DB_WRITE_QUEUE else "not SQLite")
+        return None
+    with _writer_lock:
+        if _writer is not None and _writer.running:
+            return _writer
+        _writer = DBWriter(app, max_batch=DB_WRITE_BATCH)
+        _writer.start()
+        return _writer
+
+
+def stop_db_writer(wait: bool = True) -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop(wait=wait)
+            _writer = None
+
+
+def get_db_writer() -> Optional[DBWriter]:
+    """The running writer for the current app, or None when writes are applied inline."""
+    from flask import current_app, has_app_context
+
+    writer = _writer
+    if writer is None or not writer.running:
+        return None
+    if has_app_context() and current_app._get_current_object() is not writer._app:
+        return None  # another app instance (e.g. tests) owns a different database
+    return writer
+
+
+def _inline(func: Callable[[], Any]) -> Future:
+    """Run a write now in its own session and commit; returns a completed Future.
+
+    The write gets a fresh app context (and with it a fresh db.session), so
+    it never commits or rolls back changes the caller has pending.
+    """
+    from flask import current_app
+
+    from app.models import db
+
+    future: Future = Future()
+    with current_app._get_current_object().app_context():
+        try:
+            result = func()
+            db.session.commit()
+            future.set_result(result)
+        except Exception as e:
+            db.session.rollback()
+            future.set_exception(e)
+    return future
+
+
+def queue_update(model, key: Dict[str, Any], values: Dict[str, Any], upsert: bool = False) -> Future:
+    """Update (or upsert) one row through the writer; inline when no writer runs."""
+    writer = get_db_writer()
+    if writer is not None:
+        return writer.submit_update(model, key, values, upsert=upsert)
+
+    from app.models import db
+    return _inline(lambda: _apply_update(_RowUpdate(model, key, values, upsert, None), db.session))
+
+
+def queue_write(func: Callable[[], Any]) -> Future:
+    """Run a write callable on the writer thread; inline when no writer runs."""
+    writer = get_db_writer()
+    if writer is not None:
+        return writer.submit(func)
+    return _inline(func)
+
+
+def get_db_writer_stats() -> Dict[str, Any]:
+    """Writer counters for health endpoints (empty when no writer runs)."""
+    writer = get_db_writer()
+    return writer.stats() if writer is not None else {}
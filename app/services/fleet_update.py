@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Fleet Update - stop, rebase and restart many overlay VMs at once.
+
+Used by push_staging_to_students() to move every student overlay onto a new
+class base image. Instead of one `qm stop` + fixed sleep + `qm config` +
+`qemu-img rebase` round trip per VM over a single SSH channel:
+- VM state comes from one cluster/resources call (already-stopped VMs are
+  not touched)
+- Stops/starts are issued through the Proxmox API with bounded parallelism
+  and confirmed by their task status, then by one more cluster/resources call
+- Rebases are grouped by node: one remote script per node resolves each
+  VM's disk (qm config + pvesm path) and rebases it; node batches run
+  concurrently
+- Rolling mode updates one cohort at a time (stop -> rebase -> restart the
+  VMs that were running), so most of the class stays usable during a push
+- base_path must be a new, immutable file: VMs not rebased yet keep their old
+  base, which the caller removes only once every VM is on the new one
+
+Usage:
+    updater = FleetUpdater(proxmox, ssh_executor)
+    result = updater.update(vmids, new_layer_path, rolling=True, cohort_size=10)
+"""
+
+import logging
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.config import FLEET_PARALLELISM
+from app.services.ssh_executor import node_command
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for one stop/start task
+FLEET_TASK_TIMEOUT = 60
+
+# Seconds between task status polls
+FLEET_TASK_POLL = 0.5
+
+# Seconds allowed for one node's rebase batch
+FLEET_REBASE_TIMEOUT = 300
+
+# Default VMs per cohort in rolling mode
+DEFAULT_COHORT_SIZE = 10
+
+
+def build_rebase_script(vmids: Iterable[int], base_path: str) -> str:
+    """Shell script rebasing each VM's first (non-CD-ROM) disk onto base_path.
+
+    Prints one line per VM: "OK <vmid>" or "FAIL <vmid> <reason>".
+    """
+    base = shlex.quote(base_path)
+    vmid_list = ' '.join(str(int(v)) for v in vmids)
+    return (
+        f"for vmid in {vmid_list}; do "
+        "vol=$(qm config $vmid 2>/dev/null | "
+        "awk -F'[ ,]' '/^(scsi|virtio|sata|ide)[0-9]+:/ && !/media=cdrom/ {print $2; exit}'); "
+        "if [ -z \"$vol\" ]; then echo \"FAIL $vmid no disk found\"; continue; fi; "
+        "path=$(pvesm path \"$vol\" 2>/dev/null); "
+        "if [ -z \"$path\" ]; then echo \"FAIL $vmid cannot resolve $vol\"; continue; fi; "
+        f"if err=$(qemu-img rebase -u -f qcow2 -F qcow2 -b {base} \"$path\" 2>&1); "
+        "then echo \"OK $vmid\"; else echo \"FAIL $vmid $(echo $err | tr '\\n' ' ')\"; fi; "
+        "done"
+    )
+
+
+def parse_rebase_output(output: str) -> Tuple[List[int], Dict[int, str]]:
+    """(rebased vmids, {vmid: error}) from a rebase script's output."""
+    ok: List[int] = []
+    failed: Dict[int, str] = {}
+    for line in output.splitlines():
+        parts = line.strip().split(' ', 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            continue
+        if parts[0] == 'OK':
+            ok.append(int(parts[1]))
+        elif parts[0] == 'FAIL':
+            failed[int(parts[1])] = parts[2] if len(parts) > 2 else 'rebase failed'
+    return ok, failed
+
+
+def make_cohorts(vmids: List[int], states: Dict[int, Dict[str, Any]], cohort_size: int) -> List[List[int]]:
+    """Split VMs into rolling cohorts; VMs that are not running go first (no disruption)."""
+    idle = [v for v in vmids if states.get(v, {}).get('status') != 'running']
+    running = [v for v in vmids if states.get(v, {}).get('status') == 'running']
+    size = max(1, cohort_size)
+    cohorts = [idle] if idle else []
+    cohorts.extend(running[i:i + size] for i in range(0, len(running), size))
+    return cohorts
+
+
+class FleetUpdater:
+    """Concurrent stop/rebase/start of a set of VMs in one cluster."""
+
+    def __init__(self, proxmox, ssh_executor, parallelism: int = FLEET_PARALLELISM,
+                 task_timeout: float = FLEET_TASK_TIMEOUT, poll_interval: float = FLEET_TASK_POLL):
+        self.proxmox = proxmox
+        self.ssh_executor = ssh_executor
+        self.parallelism = max(1, parallelism)
+        self.task_timeout = task_timeout
+        self.poll_interval = poll_interval
+
+    # -- state -------------------------------------------------------------------
+
+    def vm_states(self, vmids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """{vmid: {'node', 'status'}} for the given VMs from one cluster/resources call."""
+        wanted = {int(v) for v in vmids}
+        states = {}
+        for r in self.proxmox.cluster.resources.get(type='vm'):
+            vmid = r.get('vmid')
+            if vmid is not None and int(vmid) in wanted:
+                states[int(vmid)] = {'node': r.get('node'), 'status': r.get('status')}
+        return states
+
+    # -- power actions -----------------------------------------------------------
+
+    def _wait_task(self, upid: str) -> Tuple[bool, str]:
+        from app.services.proxmox_operations import wait_for_task
+        return wait_for_task(self.proxmox, upid, self.task_timeout, self.poll_interval)
+
+    def _power(self, action: str, vmid: int, node: str) -> Tuple[int, bool, str]:
+        try:
+            endpoint = self.proxmox.nodes(node).qemu(vmid).status
+            upid = (endpoint.stop if action == 'stop' else endpoint.start).post()
+            ok, detail = self._wait_task(upid) if upid else (True, '')
+            return vmid, ok, detail
+        except Exception as e:
+            message = str(e)
+            if action == 'stop' and 'not running' in message.lower():
+                return vmid, True, ''
+            return vmid, False, message
+
+    def _power_all(self, action: str, targets: Dict[int, str]) -> Dict[int, str]:
+        """Run action on {vmid: node} concurrently; returns {vmid: error} for failures."""
+        if not targets:
+            return {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=min(self.parallelism, len(targets))) as pool:
+            for vmid, ok, detail in pool.map(lambda item: self._power(action, *item), sorted(targets.items())):
+                if not ok:
+                    failed[vmid] = detail or f"{action} failed"
+        return failed
+
+    def stop(self, states: Dict[int, Dict[str, Any]], vmids: Iterable[int]) -> Dict[int, str]:
+        """Stop the running VMs among vmids and confirm; returns {vmid: error}."""
+        targets = {v: states[v]['node'] for v in vmids if states.get(v, {}).get('status') == 'running'}
+        failed = self._power_all('stop', targets)
+        if targets:
+            # Task OK should mean stopped - confirm with one status read
+            confirmed = self.vm_states(targets)
+            for vmid in targets:
+                if vmid not in failed and confirmed.get(vmid, {}).get('status') not in ('stopped', None):
+                    failed[vmid] = f"still {confirmed[vmid]['status']} after stop"
+        return failed
+
+    def start(self, states: Dict[int, Dict[str, Any]], vmids: Iterable[int]) -> Dict[int, str]:
+        """Start vmids on their nodes; returns {vmid: error}."""
+        return self._power_all('start', {v: states[v]['node'] for v in vmids if v in states})
+
+    # -- rebase ------------------------------------------------------------------
+
+    def _rebase_node(self, node: str, vmids: List[int], base_path: str) -> Tuple[List[int], Dict[int, str]]:
+        cmd = node_command(node, build_rebase_script(vmids, base_path))
+        try:
+            exit_code, stdout, stderr = self.ssh_executor.execute(cmd, timeout=FLEET_REBASE_TIMEOUT, check=False)
+        except Exception as e:
+            return [], {v: str(e) for v in vmids}
+        ok, failed = parse_rebase_output(stdout)
+        for vmid in vmids:
+            if vmid not in failed and vmid not in ok:
+                failed[vmid] = (stderr.strip() or 'no result')[:300]
+        return ok, failed
+
+    def rebase(self, states: Dict[int, Dict[str, Any]], vmids: Iterable[int],
+               base_path: str) -> Tuple[List[int], Dict[int, str]]:
+        """Rebase overlays onto base_path, one remote batch per node (concurrent)."""
+        by_node: Dict[str, List[int]] = {}
+        failed: Dict[int, str] = {}
+        for vmid in vmids:
+            node = states.get(vmid, {}).get('node')
+            if node:
+                by_node.setdefault(node, []).append(vmid)
+            else:
+                failed[vmid] = 'VM not found in cluster'
+        ok: List[int] = []
+        if by_node:
+            with ThreadPoolExecutor(max_workers=min(self.parallelism, len(by_node))) as pool:
+                for node_ok, node_failed in pool.map(
+                        lambda item: self._rebase_node(item[0], item[1], base_path), sorted(by_node.items())):
+                    ok.extend(node_ok)
+                    failed.update(node_failed)
+        return sorted(ok), failed
+
+    # -- workflow ----------------------------------------------------------------
+
+    def update(self, vmids: Iterable[int], base_path: str, rolling: bool = False,
+               cohort_size: int = DEFAULT_COHORT_SIZE, restart: bool = False) -> Dict[str, Any]:
+        """Move vmids' overlays onto base_path (a new file, never the image they use now).
+
+        All-at-once mode stops every VM first and rebases nothing if any stop
+        fails: the VMs it did stop are restarted and the update is aborted.
+
+        Args:
+            rolling: Update one cohort at a time, restarting the VMs that were running
+                (a VM whose stop fails stays on its old base)
+            restart: All-at-once mode only - restart VMs that were running
+
+        Returns:
+            {'updated': [vmids], 'failed': {vmid: error}, 'cohorts': n, 'aborted': bool, 'duration': s}
+        """
+        started = time.time()
+        vmids = sorted(int(v) for v in vmids)
+        states = self.vm_states(vmids)
+        was_running = {v for v in vmids if states.get(v, {}).get('status') == 'running'}
+        updated: List[int] = []
+        failed: Dict[int, str] = {}
+        aborted = False
+
+        cohorts = make_cohorts(vmids, states, cohort_size) if rolling else [vmids]
+        for number, cohort in enumerate(cohorts, 1):
+            stop_failed = self.stop(states, cohort)
+            failed.update(stop_failed)
+            if stop_failed and not rolling:
+                # Nothing is rebased while some VM may still be running: put the fleet back as it was
+                aborted = True
+                self.start(states, [v for v in cohort if v in was_running and v not in stop_failed])
+                for vmid in cohort:
+                    failed.setdefault(vmid, f"aborted: {len(stop_failed)} VM(s) could not be stopped")
+                logger.warning(f"Fleet update aborted: {len(stop_failed)} VM(s) could not be stopped")
+                break
+            ready = [v for v in cohort if v not in stop_failed]
+            ok, rebase_failed = self.rebase(states, ready, base_path)
+            updated.extend(ok)
+            failed.update(rebase_failed)
+            if rolling or restart:
+                failed.update(self.start(states, [v for v in ok if v in was_running]))
+            logger.info(f"Fleet update cohort {number}/{len(cohorts)}: {len(ok)}/{len(cohort)} rebased")
+
+        return {
+            'updated': sorted(updated),
+            'failed': failed,
+            'cohorts': len(cohorts),
+            'aborted': aborted,
+            'duration': round(time.time() - started, 2),
+        }
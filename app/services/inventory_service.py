@@ -56,23 +56,23 @@ def update_vm_status_immediate(cluster_id: str, vmid: int, status: str, ip: Opti
     Returns:
         True if updated successfully
     """
-    from app.models import VMInventory, db
+    from app.models import VMInventory
+    from app.services.db_writer import queue_update
     
     try:
-        inventory = VMInventory.query.filter_by(
+        exists = VMInventory.query.filter_by(
             cluster_id=cluster_id,
             vmid=vmid
-        ).first()
+        ).with_entities(VMInventory.id).first()
         
-        if inventory:
-            inventory.status = status
-            inventory.last_status_check = datetime.utcnow()
-            
+        if exists:
+            now = datetime.utcnow()
+            values = {'status': status, 'last_status_check': now}
             if ip and ip not in ('N/A', 'Fetching...', ''):
-                inventory.ip = ip
-                inventory.ip_updated_at = datetime.utcnow()
+                values['ip'] = ip
             
-            db.session.commit()
+            # Write-behind (SQLite writer thread) - the request never waits on the write lock
+            queue_update(VMInventory, {'cluster_id': cluster_id, 'vmid': vmid}, values)
             # logger.debug(f"Immediate status update: VM {cluster_id}/{vmid} -> {status}")
             return True
         else:
@@ -81,7 +81,6 @@ def update_vm_status_immediate(cluster_id: str, vmid: int, status: str, ip: Opti
             
     except Exception as e:
         logger.error(f"Failed to update VM {cluster_id}/{vmid} status: {e}")
-        db.session.rollback()
         return False
 
 
@@ -100,9 +99,10 @@ def persist_vm_inventory(vms: List[Dict], cleanup_missing: bool = True) -> int:
     """
     import time
 
-    from sqlalchemy.exc import IntegrityError, OperationalError
+    from sqlalchemy.exc import OperationalError
 
     from app.models import VMInventory, db
+    from app.utils.db_dialect import upsert
     
     updated_count = 0
     
@@ -131,33 +131,24 @@ def persist_vm_inventory(vms: List[Dict], cleanup_missing: bool = True) -> int:
                 ).first()
                 
                 if not inventory:
-                    # Record doesn't exist - try to create it
-                    inventory = VMInventory(
+                    # Record doesn't exist - insert it, letting the database resolve a
+                    # concurrent insert of the same (cluster_id, vmid) (ON CONFLICT DO NOTHING)
+                    upsert(VMInventory, [{
+                        'cluster_id': cluster_id,
+                        'vmid': vmid,
+                        'name': vm.get('name', 'Unknown'),
+                        'node': vm.get('node', 'Unknown'),
+                        'status': vm.get('status', 'unknown'),
+                        'type': vm.get('type', 'qemu'),
+                    }], conflict_columns=['cluster_id', 'vmid'], update_columns=[])
+                    inventory = VMInventory.query.filter_by(
                         cluster_id=cluster_id,
-                        vmid=vmid,
-                        name=vm.get('name', 'Unknown'),
-                        node=vm.get('node', 'Unknown'),
-                        status=vm.get('status', 'unknown'),
-                        type=vm.get('type', 'qemu')
-                    )
-                    db.session.add(inventory)
+                        vmid=vmid
+                    ).first()
                     
-                    try:
-                        # Commit immediately to avoid holding locks
-                        db.session.flush()
-                    except IntegrityError:
-                        # Another thread created it between our query and commit
-                        db.session.rollback()
-                        
-                        # Fetch the record that was created by the other thread
-                        inventory = VMInventory.query.filter_by(
-                            cluster_id=cluster_id,
-                            vmid=vmid
-                        ).first()
-                        
-                        if not inventory:
-                            # Extremely rare - skip this VM
-                            continue
+                    if not inventory:
+                        # Extremely rare - skip this VM
+                        continue
                 
                 # Update all fields
                 inventory.name = vm.get('name')
@@ -203,6 +194,7 @@ def persist_vm_inventory(vms: List[Dict], cleanup_missing: bool = True) -> int:
                 updated_count += 1
             
             # Remove VMs not touched in this sync for seen clusters (only after a successful pass)
+            removed = []
             if cleanup_missing and vms:
                 from app.models import VMInventory
                 for cluster_id in seen_clusters:
@@ -212,10 +204,16 @@ def persist_vm_inventory(vms: List[Dict], cleanup_missing: bool = True) -> int:
                     ).all()
                     if missing:
                         for rec in missing:
+                            removed.append((rec.cluster_id, rec.vmid))
                             db.session.delete(rec)
             
             # Commit all changes
             db.session.commit()
+            
+            # Keep the VMID prefix index in step with the inventory
+            from app.services.vmid_index import index_vms, unindex_vms
+            index_vms(vms)
+            unindex_vms(removed)
             return updated_count
             
         except OperationalError:
@@ -134,58 +134,46 @@ def get_available_vmid(cluster_config: dict, start_vmid: int = 100) -> int:
         return start_vmid
 
 
-def get_nodes_for_load_balancing(cluster_config: dict, count: int = 1) -> List[str]:
+def get_nodes_for_load_balancing(cluster_config: dict, count: int = 1, vm_memory_mb: int = 2048,
+                                 vm_cores: int = 0, storage: Optional[str] = None) -> List[str]:
     """
-    Get list of nodes for load balancing VM placement.
+    Plan node placement for a batch of VMs.
     
-    Distributes VMs across nodes based on current VM count.
+    Takes one cluster/resources snapshot and places all `count` VMs with the
+    shared placement engine (app.services.placement).
     
     Args:
         cluster_config: Cluster configuration dict
-        count: Number of nodes to return (for distributing VMs)
+        count: Number of VMs to place
+        vm_memory_mb: Memory per VM in MB
+        vm_cores: CPU cores per VM
+        storage: Shared storage holding the VMs' base image; when set, placement
+            weighs each node's probed path to it (linked clones read the base)
     
     Returns:
-        List of node names for VM placement
+        One node name per VM, in order (empty list on failure)
     """
+    from app.services.placement import NodeSnapshot, place_batch
+
     try:
         proxmox = get_proxmox_admin_for_cluster(cluster_config["id"])
-        nodes = proxmox.nodes.get()
+        snapshot = NodeSnapshot.from_resources(proxmox.cluster.resources.get())
         
-        if not nodes:
+        if not len(snapshot):
             logger.error("No nodes available in cluster")
             return []
         
-        # Get VM count per node
-        node_vm_counts = {}
-        for node in nodes:
-            node_name = node['node']
-            vm_count = 0
-            
-            try:
-                qemu_vms = proxmox.nodes(node_name).qemu.get()
-                vm_count += len(qemu_vms)
-            except Exception:
-                pass
-            
-            try:
-                lxc_vms = proxmox.nodes(node_name).lxc.get()
-                vm_count += len(lxc_vms)
-            except Exception:
-                pass
-            
-            node_vm_counts[node_name] = vm_count
+        if storage:
+            from app.services.storage_probe import apply_storage_probes
+            apply_storage_probes(snapshot, storage, cluster_id=cluster_config["id"])
         
-        # Sort by VM count (least loaded first) and return top 'count' nodes
-        sorted_nodes = sorted(node_vm_counts.items(), key=lambda x: x[1])
-        return [node[0] for node in sorted_nodes[:count]]
+        return place_batch(snapshot, [(vm_memory_mb * 1024 * 1024, vm_cores)] * count, io=bool(storage))
         
     except Exception as e:
         logger.error(f"Failed to get load balanced nodes: {e}")
         return []
 
 
-
-
 def get_node_ip_via_gateway(gateway_host: str, gateway_user: str, gateway_password: str, target_node: str, cluster_id: str) -> Optional[str]:
     """
     Resolve a target node's IP address by SSH-ing to the gateway and running a hostname lookup.
@@ -316,16 +304,17 @@ def deploy_linked_clones(
         template_storage = get_template_storage(proxmox, template_node, template_vmid)
         logger.info(f"Template uses storage: {template_storage}")
         
-        # Get list of deployment nodes
+        # Plan nodes for the teacher VM plus every student VM in one pass
         if deployment_node:
-            target_nodes = [deployment_node]
+            placement = [deployment_node] * (num_students + 1)
         else:
-            target_nodes = get_nodes_for_load_balancing(cluster_config, count=num_students)
-            if not target_nodes:
-                target_nodes = [template_node]  # Fallback to template node
+            placement = get_nodes_for_load_balancing(cluster_config, count=num_students + 1,
+                                                     storage=template_storage)
+            if not placement:
+                placement = [template_node] * (num_students + 1)  # Fallback to template node
         
         # Validate storage is available on all target nodes
-        for target_node in target_nodes:
+        for target_node in sorted(set(placement)):
             is_available, msg = check_storage_available(proxmox, target_node, template_storage)
             logger.info(msg)
             if not is_available:
@@ -382,11 +371,7 @@ def deploy_linked_clones(
         teacher_vmid = start_vmid
         teacher_name = f"{class_.name.replace(' ', '-').lower()}-teacher"
         
-        if deployment_node:
-            teacher_node = deployment_node
-        else:
-            nodes = get_nodes_for_load_balancing(cluster_config)
-            teacher_node = nodes[0] if nodes else template_node
+        teacher_node = placement[0]
         
         try:
             logger.info(f"Creating teacher VM: {teacher_vmid} ({teacher_name}) on {teacher_node}")
@@ -417,12 +402,8 @@ def deploy_linked_clones(
         for i in range(num_students):
             new_vmid = start_vmid + 1 + i  # Start from prefix*100 + 1 (index 1)
             
-            # Pick node for this VM (load balance if not single node deployment)
-            if deployment_node:
-                target_node = deployment_node
-            else:
-                nodes = get_nodes_for_load_balancing(cluster_config)
-                target_node = nodes[i % len(nodes)] if nodes else template_node
+            # Node from the batch placement plan
+            target_node = placement[i + 1]
             
             vm_name = f"{class_.name.replace(' ', '-').lower()}-student-{i+1}"
             
@@ -473,30 +454,19 @@ def deploy_linked_clones(
             time.sleep(2)
             
             logger.info(f"Creating baseline snapshots for {len(created_vms)} VMs...")
-            from app.services.vm_core import create_snapshot_ssh
+            from app.services.snapshot_orchestrator import SnapshotOrchestrator
             
-            for vm_info in created_vms:
-                vmid = vm_info["vmid"]
-                vm_name = vm_info["name"]
-                
-                try:
-                    snap_success, snap_error = create_snapshot_ssh(
-                        ssh_executor=ssh_executor,
-                        vmid=vmid,
-                        snapname="baseline",
-                        description="Baseline snapshot from initial clone - use for reimage",
-                        include_ram=False
-                    )
-                    
-                    if snap_success:
-                        logger.info(f"Created baseline snapshot for VM {vmid} ({vm_name})")
-                    else:
-                        logger.warning(f"Failed to create baseline snapshot for VM {vmid} ({vm_name}): {snap_error}")
-                        # Snapshot failure is non-critical, VM still works
-                
-                except Exception as e:
-                    logger.error(f"Error creating baseline snapshot for VM {vmid} ({vm_name}): {e}")
-                    # Continue to next VM - snapshot failure is non-critical
+            # New VMs have no snapshots yet - skip listing; snapshots run in parallel per node
+            results = SnapshotOrchestrator(ssh_executor).ensure(
+                created_vms,
+                snapname="baseline",
+                description="Baseline snapshot from initial clone - use for reimage",
+                assume_missing=True,
+            )
+            for result in results:
+                if not result.ok:
+                    # Snapshot failure is non-critical, VM still works
+                    logger.warning(f"Failed to create baseline snapshot for VM {result.vmid}: {result.error}")
         
         # Step 4: Create database records for created VMs
         try:
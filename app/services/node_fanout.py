@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Node Fan-out - run bulk VM work across cluster nodes.
+
+Snapshots, class teardown, spec changes and template replication all work
+on many VMs spread over several nodes:
+- run_per_node() gives every node its own bounded worker pool, so a slow or
+  busy node never holds workers another node could use
+- run_on_each_node() makes one call per node (batch scripts, listings), with
+  the nodes running concurrently
+- disk_entries() picks the disk keys out of a VM config
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Config keys holding disks
+DISK_PREFIXES = ('scsi', 'virtio', 'sata', 'ide', 'efidisk', 'tpmstate')
+
+
+def _vm_node(item) -> str:
+    return item['node']
+
+
+def disk_entries(config: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
+    """(key, value) of every disk slot in a VM config, in key order."""
+    for key, value in sorted(config.items()):
+        if key.startswith(DISK_PREFIXES) and key[-1].isdigit() and isinstance(value, str):
+            yield key, value
+
+
+def group_by_node(items, node_of: Callable[[Any], str] = _vm_node) -> Dict[str, list]:
+    """{node: items on it}, keeping the input order within each node."""
+    grouped: Dict[str, list] = {}
+    for item in items:
+        grouped.setdefault(node_of(item), []).append(item)
+    return grouped
+
+
+def run_per_node(items: Sequence, func: Callable, per_node: int,
+                 node_of: Callable[[Any], str] = _vm_node) -> List[Any]:
+    """func(item) for every item, at most per_node at a time on one node.
+
+    Each node gets its own pool, so every node starts at once and its
+    workers only ever take that node's items. Results are in input order.
+    """
+    if not items:
+        return []
+    grouped = group_by_node(range(len(items)), lambda index: node_of(items[index]))
+    results: List[Any] = [None] * len(items)
+    with ExitStack() as stack:
+        futures = []
+        for node, indexes in sorted(grouped.items()):
+            pool = stack.enter_context(ThreadPoolExecutor(
+                max_workers=max(1, min(per_node, len(indexes))), thread_name_prefix=f"node-{node}"))
+            futures.extend((index, pool.submit(func, items[index])) for index in indexes)
+        for index, future in futures:
+            results[index] = future.result()
+    return results
+
+
+def run_on_each_node(grouped: Dict[str, list], func: Callable[[str, list], Any]) -> List[Any]:
+    """func(node, items) once per node, nodes concurrently. Results in node order."""
+    if not grouped:
+        return []
+    with ThreadPoolExecutor(max_workers=len(grouped)) as pool:
+        return list(pool.map(lambda item: func(*item), sorted(grouped.items())))
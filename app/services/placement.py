@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Placement Engine - shared node placement for deployment, load balancing and the VM builder.
+
+Takes one snapshot of node capacity and VM allocations (parallel arrays, one
+Proxmox call to build) and answers placement questions against it:
+- place() / place_batch(): choose nodes for new VMs. A batch is packed
+  largest-first, each VM going to the node with the best score after
+  placement among nodes where it fits in RAM (falls back to the best score
+  when nothing fits, since Proxmox allows overcommit)
+- Overlay-backed VMs (io=True) also weigh each node's measured path to the
+  shared storage holding their base image (latency/throughput from
+  storage_probe), discounted by the overlay VMs already placed there -
+  lab boot storms are bounded by storage, not RAM
+- plan_rebalance(): migration plan that lowers the score variance with as
+  few moves as possible - every move is the single best improvement left,
+  a VM moves at most once, and moves that barely help are not made
+
+Score (higher = more headroom) = 70% free RAM fraction + 30% free CPU fraction.
+Everything here is pure and deterministic (ties break on node name / VMID),
+so it can be tested against synthetic snapshots.
+
+Usage:
+    snapshot = NodeSnapshot.from_nodes(proxmox.nodes.get())
+    nodes = place_batch(snapshot, [(2 * GIB, 2)] * 60)   # one node per student VM
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.config import PLACEMENT_STORAGE_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+MEM_WEIGHT = 0.7
+CPU_WEIGHT = 0.3
+
+# Below this free-RAM fraction a node is critical: running VMs may be moved off it
+CRITICAL_MEM_FREE = 0.05
+
+# Score variance under which a cluster counts as balanced
+BALANCED_VARIANCE = 0.01
+
+# Smallest variance reduction worth a migration
+MIN_MOVE_GAIN = 1e-4
+
+# Share of its storage path each overlay VM already on a node takes away
+STORAGE_CONTENTION = 0.1
+
+GIB = 1024 ** 3
+
+
+def _score(mem_total: float, mem_used: float, cpu_used: float) -> float:
+    mem_free = (mem_total - mem_used) / mem_total if mem_total > 0 else 0
+    cpu_free = (1 - cpu_used) if cpu_used < 1 else 0
+    return mem_free * MEM_WEIGHT + cpu_free * CPU_WEIGHT
+
+
+class NodeSnapshot:
+    """Node capacity/usage and VM allocations as parallel arrays.
+
+    Memory is in bytes, node CPU usage is a 0-1 fraction of its cores, VM CPU
+    is in cores.
+    """
+
+    def __init__(self):
+        # Nodes (index i)
+        self.names: List[str] = []
+        self.mem_total: List[float] = []
+        self.mem_used: List[float] = []
+        self.cpu_total: List[float] = []
+        self.cpu_used: List[float] = []
+        self.vm_count: List[int] = []
+        self.storage_latency: List[Optional[float]] = []  # ms, from storage probes
+        self.storage_throughput: List[Optional[float]] = []  # MB/s
+        self.io_vms: List[int] = []  # overlay-backed VMs placed per node
+        # VMs (index j) that plan_rebalance may move
+        self.vmids: List[int] = []
+        self.vm_names: List[str] = []
+        self.vm_node: List[int] = []
+        self.vm_mem: List[float] = []
+        self.vm_cpu: List[float] = []
+        self.vm_status: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    # -- construction ------------------------------------------------------------
+
+    def add_node(self, name: str, mem_total: float, mem_used: float, cpu_total: float = 1,
+                 cpu_used: float = 0, vm_count: int = 0) -> int:
+        self._index[name] = len(self.names)
+        self.names.append(name)
+        self.mem_total.append(float(mem_total))
+        self.mem_used.append(float(mem_used))
+        self.cpu_total.append(float(cpu_total))
+        self.cpu_used.append(float(cpu_used))
+        self.vm_count.append(int(vm_count))
+        self.storage_latency.append(None)
+        self.storage_throughput.append(None)
+        self.io_vms.append(0)
+        return self._index[name]
+
+    def set_storage(self, node: str, latency_ms: Optional[float], throughput_mbps: Optional[float]) -> bool:
+        """Record a node's measured path to the shared storage. False if node unknown."""
+        i = self._index.get(node)
+        if i is None:
+            return False
+        self.storage_latency[i] = latency_ms
+        self.storage_throughput[i] = throughput_mbps
+        return True
+
+    def add_vm(self, vmid: int, node: str, mem: float, cpu: float = 0, status: str = 'stopped',
+               name: Optional[str] = None, reserve: bool = False) -> None:
+        """Track a movable VM on node. reserve=True also charges its resources to the
+        node (for stopped VMs, whose RAM the node usage does not include yet)."""
+        i = self._index.get(node)
+        if i is None:
+            return  # offline/unknown node
+        self.vmids.append(int(vmid))
+        self.vm_names.append(name or f"VM-{vmid}")
+        self.vm_node.append(i)
+        self.vm_mem.append(float(mem or 0))
+        self.vm_cpu.append(float(cpu or 0))
+        self.vm_status.append(status)
+        if reserve:
+            self.reserve(i, float(mem or 0), float(cpu or 0))
+
+    @classmethod
+    def from_nodes(cls, nodes: Iterable[Dict[str, Any]]) -> "NodeSnapshot":
+        """Snapshot from proxmox.nodes.get() (online nodes with valid numbers)."""
+        snapshot = cls()
+        for node in sorted(nodes, key=lambda n: n.get('node') or ''):
+            if node.get('status') != 'online' or not node.get('node'):
+                continue
+            try:
+                snapshot.add_node(node['node'], float(node.get('maxmem', 1)), float(node.get('mem', 0)),
+                                  float(node.get('maxcpu', 1)), float(node.get('cpu', 0)))
+            except (ValueError, TypeError):
+                logger.debug(f"Node {node.get('node')}: invalid resource values, skipping")
+        return snapshot
+
+    @classmethod
+    def from_resources(cls, resources: Iterable[Dict[str, Any]]) -> "NodeSnapshot":
+        """Snapshot from one proxmox.cluster.resources.get() call (nodes + VM counts)."""
+        resources = list(resources)
+        snapshot = cls.from_nodes(
+            dict(r, node=r.get('node')) for r in resources if r.get('type') == 'node'
+        )
+        for r in resources:
+            if r.get('type') in ('qemu', 'lxc') and r.get('node') in snapshot._index:
+                snapshot.vm_count[snapshot._index[r['node']]] += 1
+        return snapshot
+
+    # -- queries -----------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def index(self, name: str) -> Optional[int]:
+        return self._index.get(name)
+
+    def cpu_fraction(self, i: int, cores: float) -> float:
+        return cores / self.cpu_total[i] if self.cpu_total[i] > 0 else 0
+
+    def score(self, i: int) -> float:
+        return _score(self.mem_total[i], self.mem_used[i], self.cpu_used[i])
+
+    def scores(self) -> List[float]:
+        return [self.score(i) for i in range(len(self.names))]
+
+    def storage_quality(self) -> Optional[List[float]]:
+        """Per-node storage path quality in (0, 1] relative to the best node
+        (half latency, half throughput). Unprobed nodes get the mean of the
+        probed ones; None when no node has measurements."""
+        latencies = [v for v in self.storage_latency if v and v > 0]
+        throughputs = [v for v in self.storage_throughput if v and v > 0]
+        if not latencies and not throughputs:
+            return None
+        best_latency = min(latencies) if latencies else None
+        best_throughput = max(throughputs) if throughputs else None
+        quality: List[Optional[float]] = []
+        for latency, throughput in zip(self.storage_latency, self.storage_throughput):
+            parts = []
+            if best_latency and latency and latency > 0:
+                parts.append(best_latency / latency)
+            if best_throughput and throughput and throughput > 0:
+                parts.append(throughput / best_throughput)
+            quality.append(sum(parts) / len(parts) if parts else None)
+        known = [q for q in quality if q is not None]
+        default = sum(known) / len(known)
+        return [default if q is None else q for q in quality]
+
+    def mem_free_pct(self, i: int) -> float:
+        return (self.mem_total[i] - self.mem_used[i]) / self.mem_total[i] if self.mem_total[i] > 0 else 0
+
+    def fits(self, i: int, mem: float) -> bool:
+        return self.mem_used[i] + mem <= self.mem_total[i]
+
+    def reserve(self, i: int, mem: float, cpu: float = 0) -> None:
+        self.mem_used[i] += mem
+        self.cpu_used[i] += self.cpu_fraction(i, cpu)
+
+    def release(self, i: int, mem: float, cpu: float = 0) -> None:
+        self.mem_used[i] -= mem
+        self.cpu_used[i] -= self.cpu_fraction(i, cpu)
+
+    def variance(self) -> Tuple[float, float]:
+        """(average score, score variance)."""
+        scores = self.scores()
+        if not scores:
+            return 0.0, 0.0
+        avg = sum(scores) / len(scores)
+        return avg, sum((s - avg) ** 2 for s in scores) / len(scores)
+
+    def copy(self) -> "NodeSnapshot":
+        clone = NodeSnapshot()
+        for attr, value in self.__dict__.items():
+            setattr(clone, attr, dict(value) if isinstance(value, dict) else list(value))
+        return clone
+
+    def node_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-node stats for API responses."""
+        class_counts = [0] * len(self.names)
+        for i in self.vm_node:
+            class_counts[i] += 1
+        return {
+            name: {
+                'mem_total': self.mem_total[i],
+                'mem_used': self.mem_used[i],
+                'mem_free_pct': self.mem_free_pct(i),
+                'cpu_total': self.cpu_total[i],
+                'cpu_used': self.cpu_used[i],
+                'cpu_free_pct': (1 - self.cpu_used[i]) if self.cpu_used[i] < 1 else 0,
+                'score': self.score(i),
+                'vm_count': self.vm_count[i],
+                'class_vm_count': class_counts[i],
+                'storage_latency_ms': self.storage_latency[i],
+                'storage_throughput_mbps': self.storage_throughput[i],
+            }
+            for i, name in enumerate(self.names)
+        }
+
+
+# ---------------------------------------------------------------------------
+# Placement of new VMs
+# ---------------------------------------------------------------------------
+
+def _best_node(snapshot: NodeSnapshot, mem: float, cpu: float, io: bool = False) -> Optional[int]:
+    """Node with the best score after taking (mem, cpu); fitting nodes first.
+
+    With io=True and storage measurements available, the score blends in the
+    node's storage quality shared among the overlay VMs it would then run.
+    """
+    quality = snapshot.storage_quality() if io and PLACEMENT_STORAGE_WEIGHT > 0 else None
+    best = None
+    best_key = None
+    for i in range(len(snapshot)):
+        after = _score(snapshot.mem_total[i], snapshot.mem_used[i] + mem,
+                       snapshot.cpu_used[i] + snapshot.cpu_fraction(i, cpu))
+        if quality is not None:
+            storage = quality[i] / (1 + snapshot.io_vms[i] * STORAGE_CONTENTION)
+            after = (1 - PLACEMENT_STORAGE_WEIGHT) * after + PLACEMENT_STORAGE_WEIGHT * storage
+        key = (snapshot.fits(i, mem), after, snapshot.vm_count[i] * -1)
+        if best_key is None or key > best_key:  # strict: earlier (lower) name wins ties
+            best, best_key = i, key
+    return best
+
+
+def place(snapshot: NodeSnapshot, mem: float, cpu: float = 0, io: bool = False) -> Optional[str]:
+    """Choose a node for one VM and charge it to the snapshot. None if no nodes.
+
+    io=True marks an overlay-backed VM (storage-aware placement).
+    """
+    i = _best_node(snapshot, mem, cpu, io)
+    if i is None:
+        return None
+    if not snapshot.fits(i, mem):
+        logger.warning(f"No node has {mem / GIB:.1f}GB RAM free; overcommitting {snapshot.names[i]}")
+    snapshot.reserve(i, mem, cpu)
+    snapshot.vm_count[i] += 1
+    if io:
+        snapshot.io_vms[i] += 1
+    return snapshot.names[i]
+
+
+def place_batch(snapshot: NodeSnapshot, demands: Sequence[Tuple[float, float]],
+                io: bool = False) -> List[Optional[str]]:
+    """Place a batch of (mem_bytes, cores) demands; returns nodes in demand order.
+
+    Largest demands are placed first (first-fit-decreasing order), each onto
+    the best-scoring node after placement, so the batch ends up balanced.
+    """
+    order = sorted(range(len(demands)), key=lambda k: (-demands[k][0], -demands[k][1], k))
+    result: List[Optional[str]] = [None] * len(demands)
+    for k in order:
+        mem, cpu = demands[k]
+        result[k] = place(snapshot, mem, cpu, io)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Rebalancing
+# ---------------------------------------------------------------------------
+
+def plan_rebalance(snapshot: NodeSnapshot, max_moves: Optional[int] = None,
+                   min_gain: float = MIN_MOVE_GAIN) -> List[Dict[str, Any]]:
+    """Plan migrations of the snapshot's VMs that reduce score variance.
+
+    Stopped VMs can always move; running VMs only off critical nodes (less
+    than 5% RAM free). Targets must have RAM for the VM. The snapshot is not
+    modified.
+
+    Returns:
+        Moves in execution order: vmid, name, status, from_node, to_node,
+        maxmem, maxcpu, from_score, to_score (scores after the move)
+    """
+    sim = snapshot.copy()
+    n = len(sim)
+    if n < 2:
+        return []
+    scores = sim.scores()
+    total = sum(scores)
+    total_sq = sum(s * s for s in scores)
+    moved = set()
+    plan: List[Dict[str, Any]] = []
+    candidates = sorted(range(len(sim.vmids)), key=lambda j: sim.vmids[j])
+    limit = len(candidates) if max_moves is None else max_moves
+
+    def variance(t: float, t_sq: float) -> float:
+        avg = t / n
+        return t_sq / n - avg * avg
+
+    while len(plan) < limit:
+        current = variance(total, total_sq)
+        best = None  # (gain, j, target, src_score, dst_score)
+        for j in candidates:
+            if j in moved:
+                continue
+            src = sim.vm_node[j]
+            status = sim.vm_status[j]
+            if status != 'stopped' and not (status == 'running' and sim.mem_free_pct(src) < CRITICAL_MEM_FREE):
+                continue
+            mem, cpu = sim.vm_mem[j], sim.vm_cpu[j]
+            src_after = _score(sim.mem_total[src], sim.mem_used[src] - mem,
+                               sim.cpu_used[src] - sim.cpu_fraction(src, cpu))
+            for dst in range(n):
+                if dst == src or not sim.fits(dst, mem):
+                    continue
+                dst_after = _score(sim.mem_total[dst], sim.mem_used[dst] + mem,
+                                   sim.cpu_used[dst] + sim.cpu_fraction(dst, cpu))
+                t = total - scores[src] - scores[dst] + src_after + dst_after
+                t_sq = (total_sq - scores[src] ** 2 - scores[dst] ** 2
+                        + src_after ** 2 + dst_after ** 2)
+                gain = current - variance(t, t_sq)
+                if best is None or gain > best[0] + 1e-12:
+                    best = (gain, j, dst, src_after, dst_after)
+        if best is None or best[0] < min_gain:
+            break
+
+        _, j, dst, src_after, dst_after = best
+        src = sim.vm_node[j]
+        sim.release(src, sim.vm_mem[j], sim.vm_cpu[j])
+        sim.reserve(dst, sim.vm_mem[j], sim.vm_cpu[j])
+        sim.vm_node[j] = dst
+        moved.add(j)
+        total += src_after + dst_after - scores[src] - scores[dst]
+        total_sq += src_after ** 2 + dst_after ** 2 - scores[src] ** 2 - scores[dst] ** 2
+        scores[src], scores[dst] = src_after, dst_after
+        plan.append({
+            'vmid': sim.vmids[j],
+            'name': sim.vm_names[j],
+            'status': sim.vm_status[j],
+            'from_node': sim.names[src],
+            'to_node': sim.names[dst],
+            'maxmem': sim.vm_mem[j],
+            'maxcpu': sim.vm_cpu[j],
+            'from_score': src_after,
+            'to_score': dst_after,
+        })
+    return plan
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Async Proxmox API client - native asyncio access to the Proxmox VE REST API.
+
+This module provides:
+- AsyncProxmoxClient: aiohttp-based client with a bounded, per-cluster
+  connection pool and HTTP/1.1 keep-alive
+- Ticket authentication with proactive refresh (well before the 2-hour expiry)
+- proxmoxer-style resource paths: ``client.nodes(n).qemu(v).status.current.get()``
+- SyncProxmoxAPI: drop-in synchronous facade for existing callers, backed by
+  one shared event loop thread so fan-out runs concurrently on one thread
+
+Errors are raised as proxmoxer ``ResourceException`` so existing error
+handling (status codes, "595 Errors" string checks) keeps working.
+
+aiohttp is an optional dependency - check ``ASYNC_CLIENT_AVAILABLE`` before use.
+"""
+
+import asyncio
+import logging
+import posixpath
+import ssl
+import threading
+import time
+from http import client as httplib
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Tuple
+
+from proxmoxer.core import ANYEVENT_HTTP_STATUS_CODES, AuthenticationError, ResourceException
+
+try:
+    import aiohttp
+    ASYNC_CLIENT_AVAILABLE = True
+except ImportError:  # pragma: no cover - depends on deployment
+    aiohttp = None
+    ASYNC_CLIENT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Proxmox tickets are valid for 2 hours - refresh well before that
+TICKET_LIFETIME = 7200
+TICKET_REFRESH_AGE = 3600
+
+# Connection pool defaults (per cluster)
+DEFAULT_POOL_SIZE = 32
+KEEPALIVE_TIMEOUT = 60
+
+
+# =============================================================================
+# SHARED EVENT LOOP
+# =============================================================================
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background event loop, starting it on first use.
+
+    All async clients live on this loop so the sync facade can be called from
+    any Flask request thread or background daemon.
+    """
+    global _loop, _loop_thread
+
+    if _loop is not None and _loop.is_running():
+        return _loop
+
+    with _loop_lock:
+        if _loop is None or not _loop.is_running():
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            _loop_thread = threading.Thread(target=_run, daemon=True, name="ProxmoxAsyncLoop")
+            _loop_thread.start()
+            started.wait(timeout=5)
+            _loop = loop
+            logger.info("Started shared Proxmox async event loop")
+
+    return _loop
+
+
+def run_sync(coro: Awaitable, timeout: Optional[float] = None) -> Any:
+    """Run a coroutine on the shared loop and block until it completes.
+
+    Raises:
+        RuntimeError: If called from the loop thread itself (would deadlock)
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("run_sync() called from the Proxmox event loop thread - await instead")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    return future.result(timeout)
+
+
+def _encode_values(values: Optional[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """Encode request parameters the same way proxmoxer/requests does.
+
+    None values are dropped, lists become repeated keys and everything else
+    is stringified (aiohttp rejects bools/ints in form data).
+    """
+    encoded: List[Tuple[str, str]] = []
+    for key, value in (values or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            encoded.extend((key, str(v)) for v in value)
+        else:
+            encoded.append((key, str(value)))
+    return encoded
+
+
+# =============================================================================
+# RESOURCE PATHS
+# =============================================================================
+
+class AsyncProxmoxResource:
+    """Lazily built API path with awaitable HTTP verbs (proxmoxer ergonomics)."""
+
+    def __init__(self, client: "AsyncProxmoxClient", path: str = ""):
+        self._client = client
+        self._path = path
+
+    def __repr__(self):
+        return f"AsyncProxmoxResource ({self._path or '/'})"
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return AsyncProxmoxResource(self._client, posixpath.join(self._path, item))
+
+    def __call__(self, resource_id=None):
+        if resource_id in (None, ""):
+            return self
+        if isinstance(resource_id, (bytes, str)):
+            parts = resource_id.decode() if isinstance(resource_id, bytes) else resource_id
+            parts = parts.split("/")
+        elif isinstance(resource_id, (tuple, list)):
+            parts = [str(p) for p in resource_id]
+        else:
+            parts = [str(resource_id)]
+        if not parts:
+            return self
+        return AsyncProxmoxResource(self._client, posixpath.join(self._path, *parts))
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    async def get(self, *args, **params):
+        return await self._client.request("GET", self(args).path, params=params)
+
+    async def post(self, *args, **data):
+        return await self._client.request("POST", self(args).path, data=data)
+
+    async def put(self, *args, **data):
+        return await self._client.request("PUT", self(args).path, data=data)
+
+    async def delete(self, *args, **params):
+        return await self._client.request("DELETE", self(args).path, params=params)
+
+    async def create(self, *args, **data):
+        return await self.post(*args, **data)
+
+    async def set(self, *args, **data):
+        return await self.put(*args, **data)
+
+
+# =============================================================================
+# ASYNC CLIENT
+# =============================================================================
+
+class AsyncProxmoxClient:
+    """Native asyncio Proxmox VE API client for one cluster.
+
+    One aiohttp session per client: bounded TCPConnector (``pool_size``
+    sockets to the cluster) with keep-alive, so concurrent callers reuse warm
+    TLS connections instead of each holding their own.
+    """
+
+    def __init__(self, host: str, user: str, password: str, port: int = 8006,
+                 verify_ssl: bool = False, timeout: int = 120,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        if not ASYNC_CLIENT_AVAILABLE:
+            raise RuntimeError("aiohttp is not installed - async Proxmox client unavailable")
+
+        self.host = host
+        self.port = port
+        self.user = user
+        self._password = password
+        self._verify_ssl = verify_ssl
+        self._timeout = timeout
+        self._pool_size = pool_size
+        self._base_url = f"https://{host}:{port}/api2/json"
+
+        self._session = None
+        self._auth_lock: Optional[asyncio.Lock] = None
+        self._ticket: Optional[str] = None
+        self._csrf_token: Optional[str] = None
+        self._ticket_ts: float = 0.0
+
+        # Simple counters for diagnostics
+        self.stats = {"requests": 0, "errors": 0, "ticket_refreshes": 0}
+
+    def __repr__(self):
+        return f"AsyncProxmoxClient ({self.user}@{self.host}:{self.port})"
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return AsyncProxmoxResource(self, item)
+
+    def _get_session(self):
+        """Create the aiohttp session lazily (must run inside the event loop)."""
+        if self._session is None or self._session.closed:
+            if self._verify_ssl:
+                ssl_context = ssl.create_default_context()
+            else:
+                ssl_context = False
+            connector = aiohttp.TCPConnector(
+                limit=self._pool_size,
+                limit_per_host=self._pool_size,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ssl=ssl_context,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+            )
+        return self._session
+
+    def _ticket_needs_refresh(self) -> bool:
+        return self._ticket is None or (time.time() - self._ticket_ts) >= TICKET_REFRESH_AGE
+
+    async def authenticate(self, force: bool = False) -> None:
+        """Obtain (or proactively renew) a PVE auth ticket.
+
+        A still-valid ticket is used as the password for renewal, matching
+        the Proxmox ticket refresh protocol.
+
+        Raises:
+            AuthenticationError: If Proxmox rejects the credentials
+        """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+
+        async with self._auth_lock:
+            # Another coroutine may have refreshed while we waited
+            if not force and not self._ticket_needs_refresh():
+                return
+
+            password = self._password
+            if self._ticket and (time.time() - self._ticket_ts) < TICKET_LIFETIME - 60:
+                password = self._ticket
+
+            session = self._get_session()
+            async with session.post(
+                f"{self._base_url}/access/ticket",
+                data={"username": self.user, "password": password},
+            ) as resp:
+                if resp.status >= 400:
+                    # Renewal with an old ticket failed - fall back to password once
+                    if password != self._password:
+                        self._ticket = None
+                        async with session.post(
+                            f"{self._base_url}/access/ticket",
+                            data={"username": self.user, "password": self._password},
+                        ) as retry:
+                            if retry.status >= 400:
+                                raise AuthenticationError(f"Couldn't authenticate user: {self.user} to {self._base_url}/access/ticket")
+                            payload = await retry.json(content_type=None)
+                    else:
+                        raise AuthenticationError(f"Couldn't authenticate user: {self.user} to {self._base_url}/access/ticket")
+                else:
+                    payload = await resp.json(content_type=None)
+
+            data = (payload or {}).get("data") or {}
+            if "ticket" not in data:
+                raise AuthenticationError(f"Couldn't authenticate user: {self.user} to {self._base_url}/access/ticket")
+
+            self._ticket = data["ticket"]
+            self._csrf_token = data.get("CSRFPreventionToken")
+            self._ticket_ts = time.time()
+            self.stats["ticket_refreshes"] += 1
+            logger.debug("Refreshed Proxmox ticket for %s on %s", self.user, self.host)
+
+    async def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                      data: Optional[Dict[str, Any]] = None, _retry: bool = True) -> Any:
+        """Perform one API request and return the ``data`` payload.
+
+        Raises:
+            ResourceException: On any HTTP status >= 400 (same as proxmoxer)
+        """
+        if self._ticket_needs_refresh():
+            await self.authenticate()
+
+        session = self._get_session()
+        headers = {"Cookie": f"PVEAuthCookie={self._ticket}"}
+        if method != "GET" and self._csrf_token:
+            headers["CSRFPreventionToken"] = self._csrf_token
+
+        url = f"{self._base_url}/{path.lstrip('/')}"
+        self.stats["requests"] += 1
+        async with session.request(
+            method,
+            url,
+            params=_encode_values(params) or None,
+            data=_encode_values(data) or None,
+            headers=headers,
+        ) as resp:
+            if resp.status == 401 and _retry:
+                # Ticket revoked or expired server-side - re-authenticate once
+                await self.authenticate(force=True)
+                return await self.request(method, path, params=params, data=data, _retry=False)
+
+            if resp.status >= 400:
+                self.stats["errors"] += 1
+                errors = None
+                try:
+                    body = await resp.json(content_type=None)
+                    errors = (body or {}).get("errors")
+                except Exception:
+                    pass
+                raise ResourceException(
+                    resp.status,
+                    httplib.responses.get(resp.status, ANYEVENT_HTTP_STATUS_CODES.get(resp.status)),
+                    resp.reason or "",
+                    errors=errors,
+                )
+
+            body = await resp.json(content_type=None)
+            return (body or {}).get("data")
+
+    async def gather(self, coros: Iterable[Awaitable], return_exceptions: bool = True) -> List[Any]:
+        """Run many requests concurrently over this client's connection pool."""
+        return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+
+    async def close(self) -> None:
+        """Close the underlying session and its pooled connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# =============================================================================
+# SYNC FACADE
+# =============================================================================
+
+class SyncProxmoxResource:
+    """Blocking mirror of AsyncProxmoxResource for existing synchronous callers."""
+
+    def __init__(self, api: "SyncProxmoxAPI", resource: AsyncProxmoxResource):
+        self._api = api
+        self._resource = resource
+
+    def __repr__(self):
+        return f"SyncProxmoxResource ({self._resource.path or '/'})"
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return SyncProxmoxResource(self._api, getattr(self._resource, item))
+
+    def __call__(self, resource_id=None):
+        return SyncProxmoxResource(self._api, self._resource(resource_id))
+
+    def get(self, *args, **params):
+        return self._api._run(self._resource.get(*args, **params))
+
+    def post(self, *args, **data):
+        return self._api._run(self._resource.post(*args, **data))
+
+    def put(self, *args, **data):
+        return self._api._run(self._resource.put(*args, **data))
+
+    def delete(self, *args, **params):
+        return self._api._run(self._resource.delete(*args, **params))
+
+    def create(self, *args, **data):
+        return self.post(*args, **data)
+
+    def set(self, *args, **data):
+        return self.put(*args, **data)
+
+
+class SyncProxmoxAPI:
+    """Drop-in replacement for ``proxmoxer.ProxmoxAPI`` backed by AsyncProxmoxClient.
+
+    Thread-safe: every call is scheduled on the shared event loop, so one
+    instance can be shared by all request threads and daemons.
+
+    Fan-out example (one thread, bounded by the cluster pool)::
+
+        results = proxmox.gather(
+            proxmox.aio.nodes(vm["node"]).qemu(vm["vmid"]).status.current.get()
+            for vm in vms
+        )
+    """
+
+    def __init__(self, client: AsyncProxmoxClient):
+        self._client = client
+        # Authenticate eagerly like proxmoxer does, so bad credentials fail here
+        self._run(client.authenticate())
+
+    def __repr__(self):
+        return f"SyncProxmoxAPI ({self._client!r})"
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return SyncProxmoxResource(self, AsyncProxmoxResource(self._client, item))
+
+    def __call__(self, resource_id=None):
+        return SyncProxmoxResource(self, AsyncProxmoxResource(self._client)(resource_id))
+
+    def _run(self, coro: Awaitable) -> Any:
+        # Allow a little slack over the HTTP timeout for auth retries
+        return run_sync(coro, timeout=self._client._timeout + 30)
+
+    @property
+    def aio(self) -> AsyncProxmoxClient:
+        """The underlying async client (for building coroutines to gather)."""
+        return self._client
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self._client.stats)
+
+    def gather(self, coros: Iterable[Awaitable], return_exceptions: bool = True) -> List[Any]:
+        """Run coroutines from ``self.aio`` concurrently and return their results in order.
+
+        With ``return_exceptions=True`` (default) failed calls appear as
+        exception instances in the result list instead of aborting the batch.
+        """
+        coros = list(coros)
+        if not coros:
+            return []
+        timeout = self._client._timeout + 30
+        return run_sync(self._client.gather(coros, return_exceptions=return_exceptions), timeout=timeout)
+
+    def get_tokens(self) -> Tuple[Optional[str], Optional[str]]:
+        """Return (ticket, CSRF token) - mirrors proxmoxer's ProxmoxAPI.get_tokens()."""
+        return self._client._ticket, self._client._csrf_token
+
+    def close(self) -> None:
+        run_sync(self._client.close(), timeout=10)
+
+
+# =============================================================================
+# PER-CLUSTER REGISTRY
+# =============================================================================
+
+_clients: Dict[Tuple[str, int, str, str], SyncProxmoxAPI] = {}
+_clients_lock = threading.Lock()
+
+
+def get_sync_client(cluster: Dict[str, Any], timeout: int = 120,
+                    pool_size: int = DEFAULT_POOL_SIZE) -> SyncProxmoxAPI:
+    """Get (or create) the shared sync facade for a cluster + credentials.
+
+    Clients are keyed by host/port/user/password so every caller using the
+    same credentials shares one connection pool. Failed authentication is
+    never cached.
+    """
+    key = (cluster["host"], int(cluster.get("port", 8006)), cluster["user"], cluster["password"])
+
+    existing = _clients.get(key)
+    if existing is not None:
+        return existing
+
+    client = AsyncProxmoxClient(
+        cluster["host"],
+        user=cluster["user"],
+        password=cluster["password"],
+        port=int(cluster.get("port", 8006)),
+        verify_ssl=cluster.get("verify_ssl", False),
+        timeout=timeout,
+        pool_size=pool_size,
+    )
+    try:
+        api = SyncProxmoxAPI(client)
+    except Exception:
+        try:
+            run_sync(client.close(), timeout=10)
+        except Exception:
+            pass
+        raise
+
+    with _clients_lock:
+        # Another thread may have won the race - keep the first one
+        if key in _clients:
+            try:
+                api.close()
+            except Exception:
+                pass
+            return _clients[key]
+        _clients[key] = api
+        logger.info("Created async Proxmox client for %s@%s (pool_size=%d)", cluster["user"], cluster["host"], pool_size)
+
+    return api
+
+
+def close_all_clients() -> None:
+    """Close every pooled client (call on shutdown or cluster reconfiguration)."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for api in clients:
+        try:
+            api.close()
+        except Exception as e:
+            logger.debug("Failed to close async Proxmox client: %s", e)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Proxmox read path - unified read-through cache in front of the Proxmox API client.
+
+Wraps a ProxmoxAPI connection (proxmoxer or the async facade) so that:
+- GETs are served from a per-cluster read-through cache with per-path TTL
+  policies (READ_CACHE_POLICIES)
+- Entries past their TTL but inside the policy's stale window are returned
+  immediately while ONE background refresh runs (stale-while-revalidate),
+  so cache expiry never blocks a user request
+- Concurrent identical GETs (same cluster, path and params) share ONE
+  in-flight request and its result (single-flight)
+- The cache is LRU-bounded per cluster by entry count and estimated bytes,
+  with hit / miss / stale counters for diagnostics
+- Any write (POST/PUT/DELETE) through the wrapper drops that cluster's cache
+
+The wrapper keeps proxmoxer's resource-path ergonomics, so callers are
+unchanged: ``proxmox.nodes(n).qemu(v).status.current.get()``.
+
+Background daemons that must see current state wrap their reads in
+``with fresh_reads():`` - results still refresh the cache for everyone else.
+"""
+
+import logging
+import posixpath
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from app.config import PROXMOX_CACHE_TTL
+from app.utils.caching import SingleFlight, ThreadSafeCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachePolicy:
+    """TTL rule for one endpoint class.
+
+    Args:
+        pattern: Regex matched against the API path (no leading slash)
+        ttl: Seconds an entry is served as fresh
+        stale: Extra seconds an expired entry may still be served while a
+            background refresh runs (0 = no stale-while-revalidate)
+    """
+
+    __slots__ = ("pattern", "ttl", "stale")
+
+    def __init__(self, pattern: str, ttl: float, stale: float = 0.0):
+        self.pattern: Pattern = re.compile(pattern)
+        self.ttl = float(ttl)
+        self.stale = float(stale)
+
+    def __repr__(self):
+        return f"CachePolicy({self.pattern.pattern!r}, ttl={self.ttl}, stale={self.stale})"
+
+
+# Per-endpoint TTL policies - first match wins.
+# Paths not listed are coalesced while in flight but never cached.
+# VM status/current and cluster/resources have no stale window: clone/create/
+# destroy/start issued over SSH bypass the wrapper, so VMID allocation,
+# teardown and callers polling for a state change must see real state (those
+# paths also read under fresh_reads()). Group membership backs admin checks,
+# so a revoked member may only be served a stale list for a few seconds.
+READ_CACHE_POLICIES: List[CachePolicy] = [
+    CachePolicy(r"^cluster/resources$", ttl=PROXMOX_CACHE_TTL),
+    CachePolicy(r"^nodes$", ttl=10, stale=120),
+    CachePolicy(r"^nodes/[^/]+/status$", ttl=10, stale=60),
+    CachePolicy(r"^nodes/[^/]+/storage$", ttl=60, stale=600),
+    CachePolicy(r"^nodes/[^/]+/(qemu|lxc)/\d+/status/current$", ttl=1),
+    CachePolicy(r"^access/groups/[^/]+$", ttl=60, stale=5),
+    CachePolicy(r"^version$", ttl=60, stale=600),
+]
+
+# LRU bounds per cluster
+MAX_CACHE_ENTRIES = 2048
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Background refresh workers (shared by all clusters)
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="proxmox-swr")
+
+_thread_local = threading.local()
+
+
+@contextmanager
+def fresh_reads():
+    """Bypass cached values for GETs in this thread (results still refresh the cache)."""
+    previous = getattr(_thread_local, "fresh", False)
+    _thread_local.fresh = True
+    try:
+        yield
+    finally:
+        _thread_local.fresh = previous
+
+
+def _wants_fresh() -> bool:
+    return getattr(_thread_local, "fresh", False)
+
+
+def _policy_for(path: str) -> Optional[CachePolicy]:
+    for policy in READ_CACHE_POLICIES:
+        if policy.pattern.match(path):
+            return policy
+    return None
+
+
+def _copy_result(value: Any) -> Any:
+    """Cheap structural copy so callers can't mutate each other's shared result."""
+    if isinstance(value, list):
+        return [dict(v) if isinstance(v, dict) else v for v in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def _join_path(path: str, resource_id: Any) -> str:
+    """Append a resource id to a path the same way proxmoxer's __call__ does."""
+    if resource_id in (None, ""):
+        return path
+    if isinstance(resource_id, bytes):
+        resource_id = resource_id.decode()
+    if isinstance(resource_id, str):
+        parts = resource_id.split("/")
+    elif isinstance(resource_id, (tuple, list)):
+        parts = [str(p) for p in resource_id]
+    else:
+        parts = [str(resource_id)]
+    if not parts:
+        return path
+    return posixpath.join(path, *parts)
+
+
+class _ClusterReadState:
+    """Per-cluster single-flight group + LRU read cache, shared by all connections."""
+
+    def __init__(self, cluster_id: str):
+        self.cluster_id = cluster_id
+        self.flight = SingleFlight()
+        # Entries are kept for ttl + stale; freshness is decided per policy on lookup
+        self.cache = ThreadSafeCache(
+            ttl=PROXMOX_CACHE_TTL,
+            max_entries=MAX_CACHE_ENTRIES,
+            max_bytes=MAX_CACHE_BYTES,
+            sweep_interval=30,
+            name=f"proxmox_reads:{cluster_id}",
+        )
+        self.refreshing: set = set()
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale_hits": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "invalidations": 0,
+        }
+
+    def lookup(self, key: Tuple, policy: CachePolicy) -> Tuple[str, Any]:
+        """Return ("fresh"|"stale"|"miss", value) and update LRU order + counters."""
+        found = self.cache.peek(key, touch=True)
+        with self.lock:
+            if found is not None:
+                value, age = found
+                if age < policy.ttl:
+                    self.stats["hits"] += 1
+                    return "fresh", value
+                if age < policy.ttl + policy.stale:
+                    self.stats["stale_hits"] += 1
+                    return "stale", value
+            self.stats["misses"] += 1
+        return "miss", None
+
+    def store(self, key: Tuple, value: Any, policy: CachePolicy) -> None:
+        self.cache.set(key, value, ttl=policy.ttl + policy.stale)
+
+    def clear(self) -> None:
+        self.cache.invalidate()
+        with self.lock:
+            self.stats["invalidations"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cache_stats = self.cache.stats()
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": cache_stats["entries"],
+                "bytes": cache_stats["bytes"],
+                "evictions": cache_stats["evictions"],
+                "hit_rate": round((self.stats["hits"] + self.stats["stale_hits"]) / lookups, 3) if lookups else None,
+                "refreshing": len(self.refreshing),
+            }
+
+
+_read_states: Dict[str, _ClusterReadState] = {}
+_read_states_lock = threading.Lock()
+
+
+def _get_read_state(cluster_id: str) -> _ClusterReadState:
+    state = _read_states.get(cluster_id)
+    if state is None:
+        with _read_states_lock:
+            state = _read_states.get(cluster_id)
+            if state is None:
+                state = _ClusterReadState(cluster_id)
+                _read_states[cluster_id] = state
+    return state
+
+
+class CoalescingResource:
+    """Resource path wrapper that routes GETs through the cluster read cache."""
+
+    def __init__(self, state: _ClusterReadState, resource: Any, path: str):
+        self._state = state
+        self._resource = resource
+        self._path = path
+
+    def __repr__(self):
+        return f"CoalescingResource ({self._state.cluster_id}:{self._path or '/'})"
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return CoalescingResource(self._state, getattr(self._resource, item), posixpath.join(self._path, item))
+
+    def __call__(self, resource_id=None):
+        if resource_id in (None, ""):
+            return self
+        return CoalescingResource(self._state, self._resource(resource_id), _join_path(self._path, resource_id))
+
+    def get(self, *args, **params):
+        target = self(args) if args else self
+        path = target._path.strip("/")
+        key = (path, tuple(sorted((k, str(v)) for k, v in params.items() if v is not None)))
+        state = self._state
+        policy = _policy_for(path)
+
+        def _fetch():
+            result = target._resource.get(**params)
+            if policy is not None:
+                state.store(key, result, policy)
+            return result
+
+        if policy is not None and not _wants_fresh():
+            status, value = state.lookup(key, policy)
+            if status == "fresh":
+                return _copy_result(value)
+            if status == "stale":
+                self._schedule_refresh(key, _fetch)
+                return _copy_result(value)
+
+        result, _shared = state.flight.do(key, _fetch)
+        return _copy_result(result)
+
+    def _schedule_refresh(self, key: Tuple, fetch) -> None:
+        """Refresh one stale key in the background (at most one refresh per key)."""
+        state = self._state
+        with state.lock:
+            if key in state.refreshing:
+                return
+            state.refreshing.add(key)
+            state.stats["refreshes"] += 1
+
+        def _refresh():
+            try:
+                state.flight.do(key, fetch)
+            except Exception as e:
+                # Keep serving the stale value until its window closes
+                with state.lock:
+                    state.stats["refresh_errors"] += 1
+                logger.debug("Background refresh of %s:%s failed: %s", state.cluster_id, key[0], e)
+            finally:
+                with state.lock:
+                    state.refreshing.discard(key)
+
+        try:
+            _refresh_executor.submit(_refresh)
+        except RuntimeError:
+            # Executor shut down (interpreter exit) - nothing to refresh
+            with state.lock:
+                state.refreshing.discard(key)
+
+    def _write(self, method: str, args, data):
+        try:
+            return getattr(self._resource, method)(*args, **data)
+        finally:
+            # Any state change may invalidate cached status/resources
+            self._state.clear()
+
+    def post(self, *args, **data):
+        return self._write("post", args, data)
+
+    def put(self, *args, **data):
+        return self._write("put", args, data)
+
+    def delete(self, *args, **params):
+        return self._write("delete", args, params)
+
+    def create(self, *args, **data):
+        return self.post(*args, **data)
+
+    def set(self, *args, **data):
+        return self.put(*args, **data)
+
+
+class CoalescingProxmoxAPI(CoalescingResource):
+    """Drop-in wrapper for a ProxmoxAPI connection (see module docstring)."""
+
+    def __init__(self, connection: Any, cluster_id: str):
+        super().__init__(_get_read_state(str(cluster_id)), connection, "")
+        self._connection = connection
+
+    def __repr__(self):
+        return f"CoalescingProxmoxAPI ({self._state.cluster_id}: {self._connection!r})"
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        # Backend helpers (gather, aio, get_tokens, close) pass straight through
+        if item in ("aio", "gather", "get_tokens", "close", "stats"):
+            return getattr(self._connection, item)
+        return super().__getattr__(item)
+
+    @property
+    def unwrapped(self) -> Any:
+        """The underlying client (bypasses coalescing and caching)."""
+        return self._connection
+
+
+def wrap_connection(connection: Any, cluster_id: str) -> CoalescingProxmoxAPI:
+    """Wrap a Proxmox connection with the per-cluster read cache."""
+    if isinstance(connection, CoalescingProxmoxAPI):
+        return connection
+    return CoalescingProxmoxAPI(connection, cluster_id)
+
+
+def invalidate_reads(cluster_id: Optional[str] = None) -> None:
+    """Drop cached reads for one cluster (or all clusters)."""
+    with _read_states_lock:
+        states = list(_read_states.values()) if cluster_id is None else [
+            s for s in _read_states.values() if s.cluster_id == str(cluster_id)
+        ]
+    for state in states:
+        state.clear()
+
+
+def get_read_stats() -> Dict[str, Any]:
+    """Cache and coalescing counters per cluster (for health diagnostics)."""
+    with _read_states_lock:
+        states = list(_read_states.values())
+    return {
+        state.cluster_id: {**state.snapshot(), "flight": state.flight.stats()}
+        for state in states
+    }
@@ -79,6 +79,28 @@ def _find_boot_disk(config: dict):
     return None, None
 
 
+def wait_for_task(proxmox, upid: str, timeout: float = 600, poll_interval: float = 1.0) -> Tuple[bool, str]:
+    """Wait for a Proxmox task (UPID) to finish.
+
+    The task's node is read from the UPID ("UPID:<node>:..."), so callers do
+    not need to know which node ran it (e.g. clones with a target node).
+
+    Returns:
+        (ok, exitstatus) - ok is True when the task ended with "OK"
+    """
+    import time
+
+    node = upid.split(':')[1]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = proxmox.nodes(node).tasks(upid).status.get()
+        if status.get('status') == 'stopped':
+            exit_status = status.get('exitstatus', '')
+            return exit_status == 'OK', exit_status
+        time.sleep(poll_interval)
+    return False, f"task timed out after {timeout}s"
+
+
 def _get_vm_actual_node(proxmox, vmid: int, fallback_node: str) -> str:
     """Resolve the node a VM currently lives on via cluster resources.
 
@@ -227,161 +249,33 @@ def wait_for_clone_completion(proxmox, node: str, vmid: int, timeout: int = 300)
     raise TimeoutError(f"Clone of VM {vmid} did not complete within {timeout} seconds")
 
 
-def replicate_templates_to_all_nodes(cluster_ip: str = None) -> None:
+def replicate_templates_to_all_nodes(cluster_ip: str = None) -> Dict[str, Any]:
     """Ensure every QEMU template exists on every node. Missing replicas are cloned and converted.
 
-    Runs best as a background task. Adds a 60s delay per replica to avoid locks.
-    Stores all template information in the database.
+    Runs best as a background task. Missing (template, node) pairs are planned
+    in one pass and cloned concurrently with per-storage limits, waiting on
+    task completion (see template_replication). Nodes that reach the template
+    through shared storage are skipped. Templates are stored in the database.
+
+    Returns:
+        Replication stats (empty if the cluster is unavailable)
     """
     try:
-        from datetime import datetime
+        from app.services.template_replication import replicate_cluster_templates
 
-        from app.models import Template, db
-        
         target_ip = cluster_ip or CLASS_CLUSTER_IP
         proxmox, err = _get_proxmox_for_cluster(cluster_ip)
         if err:
             logger.warning(f"replicate_templates_to_all_nodes: {err}")
-            return
-
-        nodes = [n.get('node') for n in proxmox.nodes.get()]
-        logger.info(f"Template replication startup: nodes={nodes}")
-
-        # Collect all templates across nodes
-        templates = []
-        for node in nodes:
-            try:
-                vms = proxmox.nodes(node).qemu.get()
-                for vm in vms:
-                    if vm.get('template') == 1:
-                        vmid = vm.get('vmid')
-                        name = vm.get('name') or f"tpl-{vmid}"
-                        templates.append({
-                            'vmid': vmid,
-                            'name': name,
-                            'node': node
-                        })
-                        # Register/update in database
-                        try:
-                            existing = Template.query.filter_by(
-                                cluster_ip=target_ip,
-                                node=node,
-                                proxmox_vmid=vmid
-                            ).first()
-                            if existing:
-                                existing.name = name
-                                existing.last_verified_at = datetime.utcnow()
-                                db.session.commit()
-                            else:
-                                # Use safe create_template to avoid race conditions
-                                from app.services.class_service import create_template
-                                new_tpl, tpl_msg = create_template(
-                                    name=name,
-                                    proxmox_vmid=vmid,
-                                    cluster_ip=target_ip,
-                                    node=node,
-                                    is_class_template=False
-                                )
-                                if new_tpl:
-                                    new_tpl.last_verified_at = datetime.utcnow()
-                                    db.session.commit()
-                        except Exception as db_err:
-                            logger.warning(f"Failed to register template {vmid} in DB: {db_err}")
-                            db.session.rollback()
-            except Exception as e:
-                logger.warning(f"Failed to query templates on {node}: {e}")
-
-        # Build a map of template name -> nodes where present
-        tpl_by_name = {}
-        for t in templates:
-            tpl_by_name.setdefault(t['name'], []).append(t)
-
-        # Get used VMIDs
-        used_vmids = set()
-        try:
-            resources = proxmox.cluster.resources.get(type="vm")
-            for r in resources:
-                used_vmids.add(r.get('vmid'))
-        except Exception:
-            for node in nodes:
-                try:
-                    for vm in proxmox.nodes(node).qemu.get():
-                        used_vmids.add(vm.get('vmid'))
-                except Exception:
-                    pass
-        next_vmid = max(used_vmids) + 1 if used_vmids else 200
-
-        import time
+            return {}
 
-        # For each template, ensure a replica exists on each node
-        for tpl_name, instances in tpl_by_name.items():
-            present_nodes = {i['node'] for i in instances}
-            source = instances[0]
-            missing_nodes = [n for n in nodes if n not in present_nodes]
-            if not missing_nodes:
-                continue
-            logger.info(f"Replicating template '{tpl_name}' from {source['node']} to nodes: {missing_nodes}")
-            for target in missing_nodes:
-                # Allocate VMID
-                while next_vmid in used_vmids:
-                    next_vmid += 1
-                replica_vmid = next_vmid
-                used_vmids.add(replica_vmid)
-                next_vmid += 1
-                replica_name = sanitize_vm_name(f"{tpl_name}-replica-{target}", fallback="tpl-replica")
-                try:
-                    proxmox.nodes(source['node']).qemu(source['vmid']).clone.post(
-                        newid=replica_vmid,
-                        name=replica_name,
-                        target=target,
-                        full=1
-                    )
-                    logger.info(f"Clone started for '{tpl_name}' -> {target} as {replica_name} ({replica_vmid})")
-                    time.sleep(60)
-                    # Ensure VM is stopped before conversion
-                    try:
-                        vm_status = proxmox.nodes(target).qemu(replica_vmid).status.current.get()
-                        if vm_status.get('status') == 'running':
-                            logger.info(f"Stopping replica {replica_vmid} on {target} before conversion")
-                            proxmox.nodes(target).qemu(replica_vmid).status.shutdown.post()
-                            time.sleep(10)
-                    except Exception:
-                        pass
-                    ok, msg = convert_vm_to_template(replica_vmid, target, target_ip)
-                    if ok:
-                        logger.info(f"Replica template ready on {target}: {replica_vmid}")
-                        # Register replica in database
-                        try:
-                            from datetime import datetime
-
-                            from app.models import Template, db
-
-                            # Use safe create_template to avoid race conditions
-                            from app.services.class_service import create_template
-                            replica_tpl, tpl_msg = create_template(
-                                name=replica_name,
-                                proxmox_vmid=replica_vmid,
-                                cluster_ip=target_ip,
-                                node=target,
-                                is_class_template=False
-                            )
-                            if replica_tpl:
-                                # Update replica-specific fields if needed
-                                replica_tpl.is_replica = True
-                                # Note: source template tracking removed due to undefined source_template variable
-                                replica_tpl.last_verified_at = datetime.utcnow()
-                                db.session.commit()
-                                logger.info(f"Registered replica template {replica_vmid} in database")
-                        except Exception as db_err:
-                            logger.warning(f"Failed to register replica in DB: {db_err}")
-                            db.session.rollback()
-                    else:
-                        logger.warning(f"Replica conversion failed on {target}: {msg}")
-                except Exception as e:
-                    logger.warning(f"Failed to replicate '{tpl_name}' to {target}: {e}")
+        cluster_id = next((c["id"] for c in get_clusters_from_db() if c["host"] == target_ip), None)
+        stats = replicate_cluster_templates(proxmox, target_ip, cluster_id)
+        logger.info(f"Template replication finished: {stats}")
+        return stats
     except Exception as e:
         logger.exception(f"replicate_templates_to_all_nodes failed: {e}")
-
+        return {}
 
 
 def _clone_vm_via_disk_api(proxmox, node: str, template_vmid: int, new_vmid: int, 
@@ -706,22 +600,44 @@ def clone_vm_from_template(template_vmid: int, new_vmid: int, name: str, node: s
 # Use deploy_class_vms() instead for new VM creation
 
 
-def start_class_vm(vmid: int, node: str, cluster_ip: str = None) -> Tuple[bool, str]:
+def start_class_vm(vmid: int, node: str, cluster_ip: str = None, owner: str = None) -> Tuple[bool, str]:
     """Start a class VM.
     
+    The start is admitted by the cluster's start scheduler (boot-storm
+    protection). If it is not admitted within START_INTERACTIVE_WAIT seconds
+    it stays queued and the message gives the expected start time.
+    
     Args:
         vmid: VM ID
         node: Node name
         cluster_ip: IP of the Proxmox cluster
+        owner: Username requesting the start (shown in the start queue)
     
     Returns:
         Tuple of (success, message)
     """
+    from app.config import START_INTERACTIVE_WAIT
+    from app.services.start_scheduler import INTERACTIVE, get_start_scheduler, schedule_start
+
     try:
-        proxmox, err = _get_proxmox_for_cluster(cluster_ip)
-        if err:
-            return False, err
-        return _execute_vm_power_action(proxmox, vmid, node, 'start')
+        target_ip = cluster_ip or CLASS_CLUSTER_IP
+        cluster = next((c for c in get_clusters_from_db() if c["host"] == target_ip), None)
+        if not cluster:
+            return False, f"Cluster not found for IP: {target_ip}"
+        proxmox = get_proxmox_admin_for_cluster(cluster["id"])
+        
+        result = {}
+        
+        def _start():
+            result['outcome'] = _execute_vm_power_action(proxmox, vmid, node, 'start')
+        
+        ticket = schedule_start(proxmox, cluster["id"], vmid, node, _start, priority=INTERACTIVE, owner=owner)
+        if not ticket.wait(START_INTERACTIVE_WAIT):
+            eta = get_start_scheduler(cluster["id"]).eta(ticket)
+            return True, f"VM start queued (expected to start in about {int(eta) + 1}s)"
+        if ticket.state == 'failed':
+            return False, f"Start failed: {ticket.error}"
+        return result['outcome']
     except Exception as e:
         logger.exception(f"Failed to start VM {vmid}: {e}")
         return False, f"Start failed: {str(e)}"
@@ -25,8 +25,20 @@ from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
 import urllib3
 
-from app.config import PROXMOX_CACHE_TTL, DB_IP_CACHE_TTL
-from app.services.user_manager import is_admin_user
+from app.config import (
+    DB_IP_CACHE_TTL,
+    PROXMOX_CACHE_TTL,
+    PROXMOX_CLIENT_BACKEND,
+    PROXMOX_POOL_SIZE,
+)
+from app.services.proxmox_cache import fresh_reads, invalidate_reads, wrap_connection
+from app.utils.caching import ThreadSafeCache
+from app.services.user_manager import (
+    ADMIN_GROUP_CACHE_TTL,
+    _get_admin_group_members_cached,
+    _invalidate_admin_group_cache,
+    is_admin_user,
+)
 from app.services.arp_scanner import has_rdp_port_open, invalidate_arp_cache
 from app.services.health_service import (
     register_daemon_started,
@@ -79,7 +91,22 @@ def create_proxmox_connection(cluster: Dict[str, Any], timeout: int = 120) -> Pr
                - Python client abandons the request after timeout
                - pveproxy keeps processing the abandoned request
                - Multiple orphaned requests accumulate and cause pveproxy failures
+    
+    When PROXMOX_CLIENT_BACKEND=async (and aiohttp is installed) this returns the
+    shared SyncProxmoxAPI facade from proxmox_async instead: same resource-path
+    API, but one keep-alive connection pool per cluster that is safe to share
+    across threads.
     """
+    if PROXMOX_CLIENT_BACKEND == "async":
+        from app.services.proxmox_async import ASYNC_CLIENT_AVAILABLE, get_sync_client
+        if ASYNC_CLIENT_AVAILABLE:
+            try:
+                return get_sync_client(cluster, timeout=timeout, pool_size=PROXMOX_POOL_SIZE)
+            except Exception as e:
+                logger.error(f"Failed to create async Proxmox connection to {cluster['host']}: {e}")
+                raise
+        logger.warning("PROXMOX_CLIENT_BACKEND=async but aiohttp is not installed - using proxmoxer")
+    
     try:
         connection = ProxmoxAPI(
             cluster["host"],
@@ -120,6 +147,20 @@ def get_clusters_from_db():
     return []
 
 
+# Cluster dropdown entries rendered on every page (cleared by _invalidate_vm_cache)
+_cluster_choices_cache = ThreadSafeCache(ttl=60, max_entries=1, name="cluster_choices")
+
+
+def get_cluster_choices() -> List[Dict[str, Any]]:
+    """Return [{id, name}] for active clusters, cached for template rendering."""
+    choices = _cluster_choices_cache.get("all")
+    if choices is None:
+        choices = [{"id": c["id"], "name": c["name"]} for c in get_clusters_from_db()]
+        if choices:
+            _cluster_choices_cache.set("all", choices)
+    return [dict(c) for c in choices]
+
+
 def get_current_cluster_id() -> str:
     """Get current cluster ID from Flask session or default to first cluster."""
     clusters = get_clusters_from_db()
@@ -191,7 +232,8 @@ def get_proxmox_admin_for_cluster(cluster_id: str) -> ProxmoxAPI:
         return _proxmox_connections[cluster_id]
     
     # Create connection OUTSIDE lock (slow network operation)
-    new_connection = create_proxmox_connection(cluster)
+    # Wrapped so concurrent identical GETs share one in-flight request
+    new_connection = wrap_connection(create_proxmox_connection(cluster), cluster_id)
     
     # Now acquire lock ONLY for dictionary write (fast)
     with _proxmox_lock:
@@ -227,7 +269,7 @@ def get_proxmox_admin() -> ProxmoxAPI:
             session.mount('http://', _http_adapter)
             session.mount('https://', _http_adapter)
             
-            _proxmox_connections[cluster_id] = create_proxmox_connection(cluster)
+            _proxmox_connections[cluster_id] = wrap_connection(create_proxmox_connection(cluster), cluster_id)
             
             logger.info("Connected to Proxmox cluster '%s' at %s (pool_size=100)", cluster["name"], cluster["host"])
     
@@ -259,9 +301,10 @@ def create_proxmox_client() -> ProxmoxAPI:
     
     Used by ThreadPoolExecutor workers to avoid sharing the main client
     across threads, since ProxmoxAPI may not be fully thread-safe.
+    Reads still coalesce with other connections to the same cluster.
     """
     cluster = get_current_cluster()
-    return create_proxmox_connection(cluster)
+    return wrap_connection(create_proxmox_connection(cluster), cluster["id"])
 
 
 def probe_proxmox() -> Dict[str, Any]:
@@ -312,19 +355,14 @@ def probe_proxmox() -> Dict[str, Any]:
 # VM CACHING & RESOURCE QUERIES
 # =============================================================================
 
-# Thread-safe locks for caches
-_vm_cache_lock = threading.Lock()
+# Combined VM list cache (key "all_clusters"). Entries are retained well past
+# VM_LIST_CACHE_TTL so the previous list can seed IPs while a rescan runs;
+# freshness is checked against the entry age (see get_all_vms).
+VM_LIST_CACHE_TTL = 300
+_vm_cache = ThreadSafeCache(ttl=3600, max_entries=4, name="vm_list")
 
-# Per-cluster VM cache - dict mapping cluster_id to cache data
-_vm_cache_data: Dict[str, Optional[List[Dict[str, Any]]]] = {}
-_vm_cache_ts: Dict[str, float] = {}
-_vm_cache_loaded: Dict[str, bool] = {}
-
-# Short-lived cluster resources cache (PROXMOX_CACHE_TTL seconds, default 10)
-# Per-cluster cache
-_cluster_cache_data: Dict[str, Optional[List[Dict[str, Any]]]] = {}
-_cluster_cache_ts: Dict[str, float] = {}
-_cluster_cache_lock = threading.Lock()
+# Short-lived cluster resources caching (PROXMOX_CACHE_TTL seconds) is handled
+# by the unified read-through cache in proxmox_cache (per-path TTL policies)
 
 # Auto-tuned ThreadPoolExecutor for parallel IP lookups
 # Uses CPU count - 1 for workers, bounded between 2 and 8
@@ -333,12 +371,7 @@ _cluster_cache_lock = threading.Lock()
 DEFAULT_IP_LOOKUP_WORKERS = max(2, min(8, (os.cpu_count() or 4) - 1))
 _ip_lookup_executor = ThreadPoolExecutor(max_workers=DEFAULT_IP_LOOKUP_WORKERS)
 
-# Admin group membership cache (avoids repeated Proxmox API calls)
-# Thread-safe with lock for concurrent access
-_admin_group_cache: Optional[List[str]] = None
-_admin_group_ts: float = 0.0
-_admin_group_lock = threading.Lock()
-ADMIN_GROUP_CACHE_TTL = 120  # 2 minutes
+# Admin group membership cache lives in user_manager (re-exported for callers)
 
 
 def shutdown_executor() -> None:
@@ -351,21 +384,20 @@ def shutdown_executor() -> None:
     _ip_lookup_executor.shutdown(wait=True)
 
 
+_vm_cache_loaded = False
+
+
 def _load_vm_cache() -> None:
     """Load VM cache from JSON file on startup for all clusters."""
-    global _vm_cache_data, _vm_cache_ts, _vm_cache_loaded
-    cache_key = "all_clusters"
+    global _vm_cache_loaded
     
-    if _vm_cache_loaded.get(cache_key, False):
+    if _vm_cache_loaded:
         return
     
     # DISABLED: JSON cache replaced by database (VMInventory table)
     # Database is loaded on-demand via fetch_vm_inventory() in API routes
-    _vm_cache_data[cache_key] = None
-    _vm_cache_ts[cache_key] = 0.0
-    _vm_cache_loaded[cache_key] = True
+    _vm_cache_loaded = True
     logger.info("VM cache file disabled - using database (VMInventory) instead")
-    _vm_cache_loaded[cache_key] = True
     return
 
 def _save_vm_cache() -> None:
@@ -374,8 +406,7 @@ def _save_vm_cache() -> None:
     Skips writing if the on-disk cache timestamp matches the in-memory timestamp,
     indicating no changes since last save.
     """
-    cache_key = "all_clusters"
-    if _vm_cache_data.get(cache_key) is None:
+    if "all_clusters" not in _vm_cache:
         return
     
     # VM cache file persistence disabled (database-first architecture)
@@ -385,20 +416,21 @@ def _save_vm_cache() -> None:
 
 def _invalidate_vm_cache() -> None:
     """Invalidate VM cache for all clusters."""
-    global _vm_cache_data, _vm_cache_ts, _cluster_cache_data, _cluster_cache_ts
-    cache_key = "all_clusters"
-    with _vm_cache_lock:
-        _vm_cache_data[cache_key] = None
-        _vm_cache_ts[cache_key] = 0.0
-    # Also invalidate cluster-specific caches
-    cluster_id = get_current_cluster_id()
-    with _cluster_cache_lock:
-        _cluster_cache_data[cluster_id] = None
-        _cluster_cache_ts[cluster_id] = 0.0
-    # Note: Don't reset _vm_cache_loaded - we want to keep trying disk cache
+    _vm_cache.invalidate("all_clusters")
+    _cluster_choices_cache.invalidate()
+    # Also invalidate cached Proxmox reads (cluster resources, node lists)
+    invalidate_cluster_cache()
     logger.debug("Invalidated VM cache for all clusters")
 
 
+def invalidate_cluster_cache(cluster_id: Optional[str] = None) -> None:
+    """Invalidate cached Proxmox reads for one cluster (default: all clusters).
+    
+    Safe to call from any thread, with or without an app context.
+    """
+    invalidate_reads(cluster_id)
+
+
 # ---------------------------------------------------------------------------
 # Cluster-wide resource queries (single API call for all VMs/containers)
 # ---------------------------------------------------------------------------
@@ -412,28 +444,7 @@ def get_all_qemu_vms() -> List[Dict[str, Any]]:
     
     Returns raw VM data from Proxmox API (not processed).
     """
-    global _cluster_cache_data, _cluster_cache_ts
-    cluster_id = get_current_cluster_id()
-    
-    now = time.time()
-    with _cluster_cache_lock:
-        cached_data = _cluster_cache_data.get(cluster_id)
-        cached_ts = _cluster_cache_ts.get(cluster_id, 0)
-        if cached_data is not None and (now - cached_ts) < PROXMOX_CACHE_TTL:
-            # Return cached QEMU VMs
-            return [r for r in cached_data if r.get("type") == "qemu"]
-    
-    # Fetch fresh data from Proxmox
-    try:
-        resources = get_proxmox_admin().cluster.resources.get(type="vm") or []
-        with _cluster_cache_lock:
-            _cluster_cache_data[cluster_id] = resources
-            _cluster_cache_ts[cluster_id] = now
-        logger.debug("get_all_qemu_vms: fetched %d resources from cluster %s API", len(resources), cluster_id)
-        return [r for r in resources if r.get("type") == "qemu"]
-    except Exception as e:
-        logger.warning("Failed to fetch cluster resources: %s", e)
-        return []
+    return [r for r in _get_cluster_resources_cached() if r.get("type") == "qemu"]
 
 
 def get_all_lxc_containers() -> List[Dict[str, Any]]:
@@ -445,63 +456,28 @@ def get_all_lxc_containers() -> List[Dict[str, Any]]:
     
     Returns raw container data from Proxmox API (not processed).
     """
-    global _cluster_cache_data, _cluster_cache_ts
-    cluster_id = get_current_cluster_id()
-    
-    now = time.time()
-    with _cluster_cache_lock:
-        cached_data = _cluster_cache_data.get(cluster_id)
-        cached_ts = _cluster_cache_ts.get(cluster_id, 0)
-        if cached_data is not None and (now - cached_ts) < PROXMOX_CACHE_TTL:
-            # Return cached LXC containers
-            return [r for r in cached_data if r.get("type") == "lxc"]
-    
-    # Fetch fresh data from Proxmox
-    try:
-        resources = get_proxmox_admin().cluster.resources.get(type="vm") or []
-        with _cluster_cache_lock:
-            _cluster_cache_data[cluster_id] = resources
-            _cluster_cache_ts[cluster_id] = now
-        logger.debug("get_all_lxc_containers: fetched %d resources from cluster %s API", len(resources), cluster_id)
-        return [r for r in resources if r.get("type") == "lxc"]
-    except Exception as e:
-        logger.warning("Failed to fetch cluster resources: %s", e)
-        return []
+    return [r for r in _get_cluster_resources_cached() if r.get("type") == "lxc"]
 
 
 def _get_cluster_resources_cached() -> List[Dict[str, Any]]:
     """
     Get all VM/container resources from cluster API with caching.
     
-    Uses PROXMOX_CACHE_TTL (default 10 seconds) for short-lived caching.
-    Thread-safe.
+    Served by the unified read-through cache for PROXMOX_CACHE_TTL seconds;
+    concurrent misses share one in-flight cluster.resources request. There
+    is no stale window: once the TTL passes the caller waits for a fresh
+    listing, since VMID allocation and teardown read this too. Thread-safe.
     """
-    global _cluster_cache_data, _cluster_cache_ts
     cluster_id = get_current_cluster_id()
-    
-    now = time.time()
-    with _cluster_cache_lock:
-        cached_data = _cluster_cache_data.get(cluster_id)
-        cached_ts = _cluster_cache_ts.get(cluster_id, 0)
-        if cached_data is not None and (now - cached_ts) < PROXMOX_CACHE_TTL:
-            return list(cached_data)
-    
-    # Fetch fresh data from Proxmox
     try:
         resources = get_proxmox_admin().cluster.resources.get(type="vm") or []
-        with _cluster_cache_lock:
-            _cluster_cache_data[cluster_id] = resources
-            _cluster_cache_ts[cluster_id] = now
-        logger.debug("_get_cluster_resources_cached: fetched %d resources from cluster %s", len(resources), cluster_id)
+        logger.debug("_get_cluster_resources_cached: %d resources from cluster %s", len(resources), cluster_id)
         return resources
     except Exception as e:
         logger.warning("Failed to fetch cluster resources: %s", e)
         return []
 
 
-# DELETED: invalidate_cluster_cache() duplicate - use version from proxmox_service.py
-
-
 def _get_cached_ip_from_db(cluster_id: str, vmid: int) -> Optional[str]:
     """Get IP from database cache if not expired (1 hour TTL)."""
     from datetime import datetime
@@ -1527,7 +1503,8 @@ def _save_ips_to_db(vms: List[Dict[str, Any]], vm_mac_map: Dict[int, str]) -> No
 
     from flask import has_app_context
 
-    from app.models import VMAssignment, VMInventory, db
+    from app.models import VMAssignment, VMInventory
+    from app.services.db_writer import queue_update
     
     if not has_app_context():
         logger.warning("_save_ips_to_db: skipping (no app context)")
@@ -1538,70 +1515,66 @@ def _save_ips_to_db(vms: List[Dict[str, Any]], vm_mac_map: Dict[int, str]) -> No
     inventory_updates = 0
     
     try:
-        # Get all class VMs in one query (use correct column proxmox_vmid)
-        class_vmids = {vm["vmid"] for vm in vms if vm.get("ip") and vm["ip"] not in ("N/A", "Fetching...", "")}
-        if class_vmids:
-            assignments_query = VMAssignment.query.filter(VMAssignment.proxmox_vmid.in_(class_vmids)).all()
-            assignments = {a.proxmox_vmid: a for a in assignments_query}
-        else:
-            assignments = {}
+        valid = [vm for vm in vms if vm.get("ip") and vm["ip"] not in ("N/A", "Fetching...", "")]
+        if not valid:
+            return
         
-        for vm in vms:
+        # Current IPs in two queries (class VMs by proxmox_vmid, inventory by (cluster_id, vmid))
+        vmids = {vm["vmid"] for vm in valid}
+        assignments = {
+            a.proxmox_vmid: a
+            for a in VMAssignment.query.with_entities(
+                VMAssignment.id, VMAssignment.proxmox_vmid, VMAssignment.cached_ip
+            ).filter(VMAssignment.proxmox_vmid.in_(vmids)).all()
+        }
+        inventory_ips = {
+            (row.cluster_id, row.vmid): row.ip
+            for row in VMInventory.query.with_entities(
+                VMInventory.cluster_id, VMInventory.vmid, VMInventory.ip
+            ).filter(VMInventory.vmid.in_(vmids)).all()
+        }
+        
+        # Writes go through the DB writer (one grouped transaction on SQLite)
+        for vm in valid:
             vmid = vm["vmid"]
-            ip = vm.get("ip")
-            
-            # Skip if no valid IP
-            if not ip or ip in ("N/A", "Fetching...", ""):
-                continue
+            ip = vm["ip"]
             
             # Check if this is a class VM
-            if vmid in assignments:
-                assignment = assignments[vmid]
-                # Only update if IP changed or no cached IP
-                if assignment.cached_ip != ip:
-                    assignment.cached_ip = ip
-                    assignment.ip_updated_at = now
-                    class_updates += 1
-                    logger.debug("Updated VMAssignment %d: cached_ip=%s", vmid, ip)
+            assignment = assignments.get(vmid)
+            if assignment is not None and assignment.cached_ip != ip:
+                queue_update(VMAssignment, {'id': assignment.id}, {'cached_ip': ip, 'ip_updated_at': now})
+                class_updates += 1
+                logger.debug("Updated VMAssignment %d: cached_ip=%s", vmid, ip)
             
             # Update VMInventory for all VMs (primary source of truth)
             cluster_id = vm.get("cluster_id", "default")
+            key = (cluster_id, vmid)
+            if key in inventory_ips and inventory_ips[key] == ip:
+                continue
+            
             mac = vm_mac_map.get(vmid)
             if not mac:
                 # Try to get MAC from VM config
                 mac = _get_vm_mac(vm["node"], vmid, vm["type"], cluster_id=cluster_id)
             
-            # Find or create VMInventory entry
-            inventory = VMInventory.query.filter_by(cluster_id=cluster_id, vmid=vmid).first()
-            if inventory:
-                # Update existing
-                if inventory.ip != ip:
-                    inventory.ip = ip
-                    inventory.last_updated = now
-                    if mac:
-                        inventory.mac_address = mac
-                    inventory_updates += 1
-                    logger.debug("Updated VMInventory %d: ip=%s", vmid, ip)
+            values = {'ip': ip, 'last_updated': now}
+            if mac:
+                values['mac_address'] = mac
+            if key in inventory_ips:
+                queue_update(VMInventory, {'cluster_id': cluster_id, 'vmid': vmid}, values)
+                logger.debug("Updated VMInventory %d: ip=%s", vmid, ip)
             else:
-                # Create new entry
-                inventory = VMInventory(
-                    vmid=vmid,
-                    cluster_id=cluster_id,
-                    ip=ip,
-                    mac_address=mac,
-                    last_updated=now
-                )
-                db.session.add(inventory)
-                inventory_updates += 1
+                # Not inventoried yet - create (the full sync fills in the rest)
+                values.update(name=vm.get("name") or f"vm-{vmid}", node=vm.get("node") or "Unknown",
+                              status=vm.get("status") or "unknown", type=vm.get("type") or "qemu")
+                queue_update(VMInventory, {'cluster_id': cluster_id, 'vmid': vmid}, values, upsert=True)
                 logger.debug("Created VMInventory %d: ip=%s", vmid, ip)
+            inventory_updates += 1
         
-        # Commit all updates in one transaction
-        db.session.commit()
         logger.info("Saved IPs to database: %d class VMs, %d VMInventory updates", class_updates, inventory_updates)
         
     except Exception as e:
         logger.error("Failed to save IPs to database: %s", e)
-        db.session.rollback()
 
 
 # ---------------------------------------------------------------------------
@@ -1726,21 +1699,19 @@ def get_all_vms(skip_ips: bool = False, force_refresh: bool = False) -> List[Dic
     Set skip_ips=True to skip ARP scan for fast initial page load.
     Set force_refresh=True to bypass cache and fetch fresh data from Proxmox.
     """
-    global _vm_cache_data, _vm_cache_ts
     cache_key = "all_clusters"  # Single cache for all clusters combined
 
     # Load VM cache from disk on first call
     _load_vm_cache()
 
-    now = time.time()
-    # Check if we have valid cached data
-    cached_vms = _vm_cache_data.get(cache_key)
-    cached_ts = _vm_cache_ts.get(cache_key, 0)
+    # Check if we have valid cached data (expired entries are kept for prev_ips)
+    cached = _vm_cache.peek(cache_key)
+    cached_vms, cached_age = cached if cached is not None else (None, 0.0)
     
     # Get VM cache TTL from settings (use default 300 for multi-cluster queries)
     # Note: For per-cluster queries, use cluster-specific vm_cache_ttl from database
-    vm_cache_ttl = 300  # Default 5 minutes for backward compatibility
-    cache_valid = cached_vms is not None and (now - cached_ts) < vm_cache_ttl
+    vm_cache_ttl = VM_LIST_CACHE_TTL  # Default 5 minutes for backward compatibility
+    cache_valid = cached_vms is not None and cached_age < vm_cache_ttl
     
     # Force IP enrichment always now (ignore caller skip_ips request)
     skip_ips = False
@@ -1748,7 +1719,7 @@ def get_all_vms(skip_ips: bool = False, force_refresh: bool = False) -> List[Dic
     # If cache is valid and not forcing refresh, return cached data (still includes IPs)
     if not force_refresh and cache_valid and cached_vms is not None:
         logger.info("get_all_vms: returning cached data for all clusters (age=%.1fs, ttl=%ds)", 
-                   now - cached_ts, vm_cache_ttl)
+                   cached_age, vm_cache_ttl)
         result = []
         for vm in cached_vms:
             result.append({**vm})
@@ -1783,7 +1754,12 @@ def get_all_vms(skip_ips: bool = False, force_refresh: bool = False) -> List[Dic
         try:
             # Get Proxmox API client for this cluster
             proxmox = get_proxmox_admin_for_cluster(cluster_id)
-            resources = proxmox.cluster.resources.get(type="vm") or []
+            if force_refresh:
+                # Background sync must see current state, not a cached read
+                with fresh_reads():
+                    resources = proxmox.cluster.resources.get(type="vm") or []
+            else:
+                resources = proxmox.cluster.resources.get(type="vm") or []
             logger.info("get_all_vms: fetched %d resources from cluster %s", len(resources), cluster_name)
         
             for vm in resources:
@@ -1889,16 +1865,19 @@ def get_all_vms(skip_ips: bool = False, force_refresh: bool = False) -> List[Dic
         logger.warning("get_all_vms: SKIPPING ARP scan (scanner not available)")
 
     # Cache the VM structure for all clusters using consistent key
-    _vm_cache_data[cache_key] = out
-    _vm_cache_ts[cache_key] = now
+    _vm_cache.set(cache_key, out)
     # _save_vm_cache()  # DISABLED: Now using database persistence via persist_vm_inventory()
 
     # Persist to database inventory (best-effort; avoid hard failure)
     try:
         from flask import has_app_context
         if has_app_context():
+            from app.services.db_writer import queue_write
             from app.services.inventory_service import persist_vm_inventory
-            persist_vm_inventory(out)
+            # Write-behind on SQLite: the caller does not wait for the commit
+            queue_write(lambda: persist_vm_inventory(out)).add_done_callback(
+                lambda f: f.exception() and logger.warning(
+                    f"get_all_vms: failed to persist VM inventory: {f.exception()}"))
         else:
             logger.debug("get_all_vms: skipping inventory persistence (no app context)")
     except Exception as inv_err:
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Snapshot Orchestrator - batched snapshot listing, creation and rollback.
+
+Baseline snapshots used to be handled one VM at a time (qm listsnapshot, then
+qm snapshot, each a separate SSH round trip, serially). Now:
+- Snapshots of all VMs on a node are listed in one remote call per node,
+  and the nodes are listed concurrently
+- Missing snapshots are created concurrently, each node with its own pool of
+  SNAPSHOT_PER_NODE snapshot/rollback workers (each one writes to the
+  VM's disk storage, so unbounded fan-out would stall shared storage)
+- Rollbacks for class-wide resets use the same per-node limits
+- Every VM gets a structured SnapshotResult
+"""
+
+import logging
+import re
+import shlex
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Set
+
+from app.config import SNAPSHOT_PER_NODE
+from app.services.node_fanout import group_by_node, run_on_each_node, run_per_node
+from app.services.ssh_executor import node_command
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for one snapshot or rollback
+SNAPSHOT_TIMEOUT = 300
+
+# Seconds allowed for listing all snapshots of a node
+LIST_TIMEOUT = 120
+
+
+@dataclass
+class SnapshotResult:
+    """Outcome of one VM's snapshot operation."""
+    vmid: int
+    node: str
+    action: str  # created | skipped | reverted | failed
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.action != 'failed'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def snapshot_name(snapname: str) -> str:
+    from app.services.vm_utils import sanitize_vm_name
+    return sanitize_vm_name(snapname, fallback="snapshot")
+
+
+def list_snapshots_script(vmids: List[int]) -> str:
+    """Shell loop listing snapshots of several VMs, each block headed by '@@vm <vmid>'."""
+    ids = ' '.join(str(int(v)) for v in vmids)
+    return f'for v in {ids}; do echo "@@vm $v"; qm listsnapshot "$v" 2>/dev/null || echo "@@error $v"; done'
+
+
+def parse_snapshot_listing(output: str) -> Dict[int, Optional[Set[str]]]:
+    """{vmid: snapshot names} from list_snapshots_script output (None if the listing failed).
+
+    qm listsnapshot prints a tree ("`-> baseline  2024-01-01 ...  desc") ending
+    in the "current" pseudo-snapshot, which is not a snapshot.
+    """
+    snapshots: Dict[int, Optional[Set[str]]] = {}
+    vmid = None
+    for line in output.splitlines():
+        if line.startswith('@@vm '):
+            vmid = int(line.split()[1])
+            snapshots[vmid] = set()
+        elif line.startswith('@@error '):
+            snapshots[int(line.split()[1])] = None
+        elif vmid is not None and snapshots.get(vmid) is not None:
+            name = re.sub(r'^[\s|`\->]+', '', line).split(' ', 1)[0]
+            if name and name != 'current':
+                snapshots[vmid].add(name)
+    return snapshots
+
+
+class SnapshotOrchestrator:
+    """Run snapshot operations for many VMs with per-node concurrency limits."""
+
+    def __init__(self, ssh_executor, per_node: int = SNAPSHOT_PER_NODE):
+        self.ssh_executor = ssh_executor
+        self.per_node = max(1, per_node)
+
+    def _on_node(self, node: str, script: str, timeout: int):
+        return self.ssh_executor.execute(node_command(node, script), timeout=timeout, check=False)
+
+    def list_snapshots(self, vms: List[Dict[str, Any]]) -> Dict[int, Optional[Set[str]]]:
+        """{vmid: snapshot names or None} with one remote call per node."""
+        def list_node(node, node_vms):
+            vmids = [int(vm['vmid']) for vm in node_vms]
+            exit_code, out, err = self._on_node(node, list_snapshots_script(vmids), LIST_TIMEOUT)
+            if exit_code != 0 and not out:
+                logger.warning(f"Listing snapshots on {node} failed: {err.strip()[:200]}")
+                return {vmid: None for vmid in vmids}
+            return parse_snapshot_listing(out)
+
+        snapshots: Dict[int, Optional[Set[str]]] = {}
+        for listing in run_on_each_node(group_by_node(vms), list_node):
+            snapshots.update(listing)
+        return snapshots
+
+    def _run(self, vm: Dict[str, Any], script: str, action: str) -> SnapshotResult:
+        vmid, node = int(vm['vmid']), vm['node']
+        started = time.time()
+        try:
+            exit_code, out, err = self._on_node(node, script, SNAPSHOT_TIMEOUT)
+            error = None if exit_code == 0 else (err.strip() or out.strip() or 'Unknown error')
+        except Exception as e:
+            error = str(e)
+        if error:
+            logger.warning(f"Snapshot {action} failed for VM {vmid} on {node}: {error[:300]}")
+        return SnapshotResult(vmid=vmid, node=node, action='failed' if error else action,
+                              error=error, seconds=round(time.time() - started, 1))
+
+    def ensure(self, vms: List[Dict[str, Any]], snapname: str = 'baseline', description: str = '',
+               assume_missing: bool = False) -> List[SnapshotResult]:
+        """Create snapname on every VM that lacks it.
+
+        Args:
+            vms: [{'vmid', 'node'}]
+            assume_missing: Skip listing (e.g. VMs that were just created)
+        """
+        name = snapshot_name(snapname)
+        existing = {} if assume_missing else self.list_snapshots(vms)
+        results, to_create = [], []
+        for vm in vms:
+            if name in (existing.get(int(vm['vmid'])) or set()):
+                results.append(SnapshotResult(vmid=int(vm['vmid']), node=vm['node'], action='skipped'))
+            else:
+                to_create.append(vm)
+
+        desc = f" --description {shlex.quote(description)}" if description else ""
+        results.extend(run_per_node(
+            to_create, lambda vm: self._run(vm, f"qm snapshot {int(vm['vmid'])} {name}{desc}", 'created'),
+            self.per_node))
+        logger.info(f"Snapshot '{name}': {sum(r.action == 'created' for r in results)} created, "
+                    f"{sum(r.action == 'skipped' for r in results)} skipped, "
+                    f"{sum(r.action == 'failed' for r in results)} failed")
+        return results
+
+    def revert(self, vms: List[Dict[str, Any]], snapname: str = 'baseline') -> List[SnapshotResult]:
+        """Roll every VM back to snapname."""
+        name = snapshot_name(snapname)
+        results = run_per_node(
+            vms, lambda vm: self._run(vm, f"qm rollback {int(vm['vmid'])} {name}", 'reverted'), self.per_node)
+        logger.info(f"Rollback to '{name}': {sum(r.ok for r in results)} reverted, "
+                    f"{sum(not r.ok for r in results)} failed")
+        return results
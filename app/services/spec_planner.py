@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Spec Planner - apply class hardware spec changes with the least work.
+
+Changing a class's RAM or cores used to destroy and rebuild every student
+VM one at a time (qm destroy, sleep, qm create, fresh overlay, qm set).
+Most spec changes only touch the VM config, so each VM is planned first:
+- cores / sockets / memory: `qm set` in place. Running VMs keep running;
+  Proxmox keeps the change as pending config until their next boot
+- disk growth: `qm disk resize` in place
+- only a VM without a boot disk gets a fresh overlay on the class base
+  (overlays cannot shrink - a smaller disk_gb is reported as failed)
+
+Current configs are read with one remote call per node. Every node's changes
+run as one batch script on that node, and the nodes run concurrently.
+"""
+
+import logging
+import re
+import shlex
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.node_fanout import group_by_node, run_on_each_node
+from app.services.ssh_executor import node_command
+from app.services.vm_utils import parse_disk_config
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for reading all configs of a node
+LIST_TIMEOUT = 120
+
+# Seconds allowed for one node's batch, plus per VM in it
+BATCH_TIMEOUT = 120
+BATCH_TIMEOUT_PER_VM = 60
+
+# Config keys changed in place, in `qm set` order
+IN_PLACE_KEYS = ('cores', 'sockets', 'memory')
+
+DISK_SLOTS = ('scsi0', 'virtio0', 'sata0', 'ide0')
+
+
+@dataclass
+class SpecChange:
+    """Planned (and, after apply, executed) spec change of one VM."""
+    vmid: int
+    node: str
+    action: str  # unchanged | in_place | recreate_disk | failed
+    set_args: Dict[str, Any] = field(default_factory=dict)
+    resize_gb: Optional[int] = None
+    disk_slot: Optional[str] = None
+    running: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.action != 'failed'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def config_listing_script(vmids: List[int]) -> str:
+    """Shell loop printing status and config of several VMs, each block headed by '@@vm <vmid>'."""
+    ids = ' '.join(str(int(v)) for v in vmids)
+    return (f'for v in {ids}; do echo "@@vm $v"; qm status "$v" 2>/dev/null; '
+            f'qm config "$v" 2>/dev/null || echo "@@error $v"; done')
+
+
+def parse_config_listing(output: str) -> Dict[int, Optional[Dict[str, str]]]:
+    """{vmid: config (plus 'status')} from config_listing_script output (None if unreadable)."""
+    configs: Dict[int, Optional[Dict[str, str]]] = {}
+    vmid = None
+    for line in output.splitlines():
+        if line.startswith('@@vm '):
+            vmid = int(line.split()[1])
+            configs[vmid] = {}
+        elif line.startswith('@@error '):
+            configs[int(line.split()[1])] = None
+        elif vmid is not None and configs.get(vmid) is not None and ': ' in line:
+            key, value = line.split(': ', 1)
+            configs[vmid][key.strip()] = value.strip()
+    return configs
+
+
+def boot_disk(config: Dict[str, str]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """(slot, parsed disk) of the VM's first non-CD-ROM disk."""
+    for slot in DISK_SLOTS:
+        value = config.get(slot)
+        if value and 'media=cdrom' not in value:
+            return slot, parse_disk_config(value)
+    return None, None
+
+
+def plan_vm(vmid: int, node: str, config: Optional[Dict[str, str]], spec: Dict[str, Any]) -> SpecChange:
+    """Decide the cheapest way to bring one VM to spec (keys: cores, sockets, memory, disk_gb)."""
+    if config is None:
+        return SpecChange(vmid=vmid, node=node, action='failed', error="Could not read VM config")
+
+    change = SpecChange(vmid=vmid, node=node, action='unchanged', running=config.get('status') == 'running')
+    defaults = {'cores': '1', 'sockets': '1', 'memory': '512'}
+    for key in IN_PLACE_KEYS:
+        wanted = spec.get(key)
+        if wanted is not None and str(config.get(key, defaults[key])) != str(int(wanted)):
+            change.set_args[key] = int(wanted)
+
+    slot, disk = boot_disk(config)
+    if slot is None:
+        change.action = 'recreate_disk'
+        change.disk_slot = 'scsi0'
+        return change
+
+    wanted_gb = spec.get('disk_gb')
+    current_gb = disk.get('size_gb')
+    if wanted_gb and current_gb:
+        if wanted_gb < current_gb:
+            change.action = 'failed'
+            change.error = f"Cannot shrink disk from {current_gb:g}G to {wanted_gb}G"
+            return change
+        if wanted_gb > current_gb:
+            change.resize_gb = int(wanted_gb)
+            change.disk_slot = slot
+
+    if change.set_args or change.resize_gb:
+        change.action = 'in_place'
+    return change
+
+
+def vm_commands(change: SpecChange, base_path: Optional[str], images_path: str) -> str:
+    """Shell commands applying one planned change."""
+    vmid = int(change.vmid)
+    set_opts = ''.join(f" --{key} {value}" for key, value in change.set_args.items())
+    if change.action == 'recreate_disk':
+        disk = shlex.quote(f"{images_path}/{vmid}/vm-{vmid}-disk-0.qcow2")
+        slot = change.disk_slot
+        return (f"mkdir -p {shlex.quote(f'{images_path}/{vmid}')} && rm -f -- {disk} && "
+                f"qemu-img create -f qcow2 -F qcow2 -b {shlex.quote(base_path)} {disk} >/dev/null && "
+                f"qm set {vmid} --{slot} {disk} --boot order={slot}{set_opts}")
+    commands = []
+    if set_opts:
+        commands.append(f"qm set {vmid}{set_opts}")
+    if change.resize_gb:
+        commands.append(f"qm disk resize {vmid} {change.disk_slot} {change.resize_gb}G")
+    return ' && '.join(commands)
+
+
+def node_batch_script(changes: List[SpecChange], base_path: Optional[str], images_path: str) -> str:
+    """One script applying every change on a node, reporting '@@ok <vmid>' or '@@error <vmid> <reason>'."""
+    lines = []
+    for change in changes:
+        commands = vm_commands(change, base_path, images_path)
+        lines.append(f'if out=$( {{ {commands}; }} 2>&1 ); then echo "@@ok {int(change.vmid)}"; '
+                     f'else echo "@@error {int(change.vmid)} $(echo "$out" | tail -n 1)"; fi')
+    return '\n'.join(lines)
+
+
+def parse_batch_results(output: str) -> Dict[int, Optional[str]]:
+    """{vmid: None on success or the error line} from node_batch_script output."""
+    results: Dict[int, Optional[str]] = {}
+    for line in output.splitlines():
+        match = re.match(r'^@@(ok|error) (\d+) ?(.*)$', line)
+        if match:
+            results[int(match.group(2))] = None if match.group(1) == 'ok' else (match.group(3) or 'Unknown error')
+    return results
+
+
+class SpecPlanner:
+    """Plan and apply spec changes for many VMs, one batch per node."""
+
+    def __init__(self, ssh_executor):
+        self.ssh_executor = ssh_executor
+
+    def _on_node(self, node: str, script: str, timeout: int):
+        return self.ssh_executor.execute(node_command(node, script), timeout=timeout, check=False)
+
+    def read_configs(self, vms: List[Dict[str, Any]]) -> Dict[int, Optional[Dict[str, str]]]:
+        """{vmid: config or None} with one remote call per node."""
+        def read_node(node, node_vms):
+            vmids = [int(vm['vmid']) for vm in node_vms]
+            exit_code, out, err = self._on_node(node, config_listing_script(vmids), LIST_TIMEOUT)
+            if exit_code != 0 and not out:
+                logger.warning(f"Reading VM configs on {node} failed: {err.strip()[:200]}")
+                return {vmid: None for vmid in vmids}
+            return parse_config_listing(out)
+
+        configs: Dict[int, Optional[Dict[str, str]]] = {}
+        for listing in run_on_each_node(group_by_node(vms), read_node):
+            configs.update(listing)
+        return configs
+
+    def plan(self, vms: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[SpecChange]:
+        """Plan the change of every VM ([{'vmid', 'node'}]) to spec."""
+        configs = self.read_configs(vms)
+        changes = [plan_vm(int(vm['vmid']), vm['node'], configs.get(int(vm['vmid'])), spec) for vm in vms]
+        counts = {}
+        for change in changes:
+            counts[change.action] = counts.get(change.action, 0) + 1
+        logger.info(f"Spec change plan for {len(changes)} VMs: {counts}")
+        return changes
+
+    def apply(self, changes: List[SpecChange], base_path: Optional[str] = None,
+              images_path: Optional[str] = None) -> List[SpecChange]:
+        """Run the planned changes (per-node batches, nodes concurrently); updates and returns them.
+
+        Args:
+            base_path: Class base QCOW2 for 'recreate_disk' changes
+            images_path: Directory of VM disk folders (DEFAULT_VM_IMAGES_PATH)
+        """
+        if images_path is None:
+            from app.services.class_vm_service import DEFAULT_VM_IMAGES_PATH
+            images_path = DEFAULT_VM_IMAGES_PATH
+
+        pending = [c for c in changes if c.action in ('in_place', 'recreate_disk')]
+        if not base_path:
+            for change in pending:
+                if change.action == 'recreate_disk':
+                    change.action, change.error = 'failed', "VM has no disk and no class base to recreate it from"
+            pending = [c for c in pending if c.action != 'failed']
+
+        def apply_node(node, node_changes):
+            script = node_batch_script(node_changes, base_path, images_path)
+            try:
+                exit_code, out, err = self._on_node(
+                    node, script, BATCH_TIMEOUT + BATCH_TIMEOUT_PER_VM * len(node_changes))
+                results = parse_batch_results(out)
+                fallback = err.strip() or f"Batch on {node} exited with {exit_code}"
+            except Exception as e:
+                results, fallback = {}, str(e)
+            for change in node_changes:
+                # No report at all means the batch stopped before this VM
+                error = results[change.vmid] if change.vmid in results else fallback
+                if error:
+                    change.action, change.error = 'failed', error
+                    logger.warning(f"Spec change failed for VM {change.vmid} on {node}: {error[:300]}")
+
+        run_on_each_node(group_by_node(pending, lambda c: c.node), apply_node)
+        logger.info(f"Spec change applied: {sum(c.action == 'in_place' for c in changes)} in place, "
+                    f"{sum(c.action == 'recreate_disk' for c in changes)} disks recreated, "
+                    f"{sum(c.action == 'unchanged' for c in changes)} unchanged, "
+                    f"{sum(not c.ok for c in changes)} failed")
+        return changes
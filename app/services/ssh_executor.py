@@ -7,6 +7,7 @@ Used by class VM service for direct qm and qemu-img operations.
 """
 
 import logging
+import shlex
 import threading
 import time
 from typing import Dict, Optional, Tuple
@@ -190,6 +191,30 @@ def get_pooled_ssh_executor(host: str, username: str, password: str, port: int =
     return _connection_pool.get_executor(host, username, password, port)
 
 
+def node_command(node: str, script: str, user: str = '', connect_timeout: Optional[int] = None) -> str:
+    """
+    Wrap script so it runs on another node of the cluster.
+    
+    A pooled executor is connected to one host per cluster, but qm and
+    pvesm only manage VMs and volumes of the node they run on. Proxmox
+    cluster nodes trust each other's root key, so the connected host reaches
+    any node with a plain `ssh <node> '...'` and no extra credentials.
+    
+    Args:
+        node: Target node name (or host)
+        script: Shell script to run there
+        user: Remote user (default: the connected user)
+        connect_timeout: Seconds to wait for the hop to connect
+        
+    Returns:
+        Shell command to pass to SSHExecutor.execute()
+    """
+    target = f"{user}@{node}" if user else node
+    timeout = f"-o ConnectTimeout={int(connect_timeout)} " if connect_timeout else ""
+    return (f"ssh -o BatchMode=yes {timeout}-o StrictHostKeyChecking=no "
+            f"{shlex.quote(target)} {shlex.quote(script)}")
+
+
 class SSHExecutor:
     """
     Execute commands on a remote Proxmox node via SSH.
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Start Scheduler - boot-storm aware admission of VM starts.
+
+When a class starts at 9:00 every student clicks Start at once, and after a
+deployment every student VM is started in a loop; all of them boot from the
+same shared NFS base. Starts now go through a per-cluster StartScheduler:
+- Every start takes one token from its node's bucket and one from each of
+  its disk storages' buckets (shared storages are one bucket cluster-wide)
+- Buckets start full, so on an idle cluster starts are admitted at once;
+  under a storm they are spread at the bucket refill rate
+- Bucket sizes follow the cluster: storage buckets shrink when the storage
+  probe reports latency above START_TARGET_LATENCY_MS, node buckets shrink
+  when free memory falls below START_LOW_MEMORY_FRACTION
+- Interactive starts (a user clicking Start) are admitted before bulk starts
+  (deployments); a blocked request holds back later requests for the same
+  node/storage, so bulk starts cannot overtake it
+- Each queued request has a position and an expected start ETA
+"""
+
+import itertools
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import (
+    START_LOW_MEMORY_FRACTION,
+    START_NODE_BURST,
+    START_NODE_RATE,
+    START_STORAGE_BURST,
+    START_STORAGE_RATE,
+    START_TARGET_LATENCY_MS,
+    START_WORKERS,
+)
+from app.utils.caching import ThreadSafeCache
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+# Seconds between bucket sizing refreshes (node memory, storage latency)
+SIZING_REFRESH = 30
+
+# Smallest bucket scale factor - starts slow down but never stop
+MIN_FACTOR = 0.2
+
+# Finished tickets are kept this long for status polling
+TICKET_RETENTION = 600
+
+# Disk storages of VMs, for bucket keys (disks rarely move)
+_vm_storage_cache = ThreadSafeCache(ttl=3600, max_entries=20000, name="start_vm_storages")
+
+
+def latency_factor(latency_ms: Optional[float], target_ms: float = START_TARGET_LATENCY_MS) -> float:
+    """Storage bucket scale: 1.0 up to the target latency, then proportionally smaller."""
+    if not latency_ms or latency_ms <= target_ms:
+        return 1.0
+    return max(MIN_FACTOR, target_ms / latency_ms)
+
+
+def memory_factor(mem: Optional[int], maxmem: Optional[int], low_fraction: float = START_LOW_MEMORY_FRACTION) -> float:
+    """Node bucket scale: 1.0 while free memory is above low_fraction, then proportionally smaller."""
+    if not maxmem or mem is None:
+        return 1.0
+    free = max(0.0, 1 - mem / maxmem)
+    if free >= low_fraction:
+        return 1.0
+    return max(MIN_FACTOR, free / low_fraction)
+
+
+def vm_storages(config: Dict[str, Any]) -> List[str]:
+    """Storages of a VM's disks, including disks attached by /mnt/pve/<storage>/ path."""
+    from app.services.template_replication import disk_storages
+
+    storages = disk_storages(config)
+    for key, value in config.items():
+        if key[-1:].isdigit() and isinstance(value, str) and value.startswith('/mnt/pve/'):
+            storages.add(value.split('/')[3])
+    return sorted(storages)
+
+
+class TokenBucket:
+    """Token bucket; tokens refill continuously at rate per second up to capacity."""
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = max(1.0, capacity)
+        self.rate = max(0.01, rate)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait_time(self, now: float, count: int = 1) -> float:
+        """Seconds until count tokens are available."""
+        self._refill(now)
+        return max(0.0, (count - self.tokens) / self.rate)
+
+    def resize(self, capacity: float, rate: float, now: float) -> None:
+        self._refill(now)
+        self.capacity = max(1.0, capacity)
+        self.rate = max(0.01, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+
+@dataclass
+class StartTicket:
+    """One queued start."""
+    vmid: int
+    node: str
+    keys: List[str]
+    priority: int
+    seq: int
+    start_func: Callable[[], Any]
+    owner: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    state: str = 'queued'  # queued | starting | started | failed
+    submitted_at: float = 0.0
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the start ran. Returns True if it ran within timeout."""
+        return self.done.wait(timeout)
+
+
+class StartScheduler:
+    """Admits VM starts through per-node and per-storage token buckets."""
+
+    def __init__(self, workers: int = START_WORKERS, node_burst: float = START_NODE_BURST,
+                 node_rate: float = START_NODE_RATE, storage_burst: float = START_STORAGE_BURST,
+                 storage_rate: float = START_STORAGE_RATE, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.limits = {'node': (node_burst, node_rate), 'storage': (storage_burst, storage_rate)}
+        self.factors: Dict[str, float] = {}
+        self.shared_storages: Dict[str, bool] = {}
+        self.sized_at: Optional[float] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queue: List[StartTicket] = []
+        self._tickets: Dict[str, StartTicket] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="vm-start")
+        self._dispatcher: Optional[threading.Thread] = None
+
+    # -- buckets -------------------------------------------------------------------
+
+    def storage_key(self, node: str, storage: str) -> str:
+        return f"storage:{storage}" if self.shared_storages.get(storage, True) else f"storage:{node}/{storage}"
+
+    def _bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            burst, rate = self.limits[key.split(':', 1)[0]]
+            factor = self.factors.get(key, 1.0)
+            bucket = self._buckets[key] = TokenBucket(burst * factor, rate * factor, now)
+        return bucket
+
+    def set_factors(self, factors: Dict[str, float], shared_storages: Optional[Dict[str, bool]] = None) -> None:
+        """Rescale buckets ({key: 0..1}); keys not listed go back to full size."""
+        with self._cond:
+            now = self.clock()
+            self.factors = dict(factors)
+            if shared_storages is not None:
+                self.shared_storages = dict(shared_storages)
+            for key, bucket in self._buckets.items():
+                burst, rate = self.limits[key.split(':', 1)[0]]
+                factor = self.factors.get(key, 1.0)
+                bucket.resize(burst * factor, rate * factor, now)
+            self.sized_at = now
+            self._cond.notify_all()
+
+    def needs_sizing(self) -> bool:
+        return self.sized_at is None or self.clock() - self.sized_at > SIZING_REFRESH
+
+    # -- queue ---------------------------------------------------------------------
+
+    def submit(self, vmid: int, node: str, storages: List[str], start_func: Callable[[], Any],
+               priority: int = INTERACTIVE, owner: Optional[str] = None) -> StartTicket:
+        """Queue a start; start_func runs on a worker thread once admitted."""
+        with self._cond:
+            keys = [f"node:{node}"] + sorted({self.storage_key(node, s) for s in storages})
+            ticket = StartTicket(vmid=int(vmid), node=node, keys=keys, priority=priority, seq=next(self._seq),
+                                 start_func=start_func, owner=owner, submitted_at=self.clock())
+            self._queue.append(ticket)
+            self._queue.sort(key=lambda t: (t.priority, t.seq))
+            self._tickets[ticket.id] = ticket
+            self._prune()
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True, name="vm-start-dispatch")
+                self._dispatcher.start()
+            self._cond.notify_all()
+        return ticket
+
+    def _admit(self, now: float) -> List[StartTicket]:
+        """Pop every ticket whose buckets all have a token (call with lock held)."""
+        admitted, blocked = [], set()
+        for ticket in list(self._queue):
+            if blocked.intersection(ticket.keys):
+                continue
+            buckets = [self._bucket(key, now) for key in ticket.keys]
+            if all(b.available(now) for b in buckets):
+                for bucket in buckets:
+                    bucket.take(now)
+                self._queue.remove(ticket)
+                ticket.state = 'starting'
+                admitted.append(ticket)
+            else:
+                blocked.update(ticket.keys)
+        return admitted
+
+    def _next_wake(self, now: float) -> Optional[float]:
+        """Seconds until a queued ticket could be admitted (call with lock held)."""
+        if not self._queue:
+            return None
+        waits = [max(self._bucket(k, now).wait_time(now) for k in t.keys) for t in self._queue]
+        return max(0.01, min(waits))
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                admitted = self._admit(self.clock())
+                if not admitted:
+                    self._cond.wait(self._next_wake(self.clock()) or 60)
+                    continue
+            for ticket in admitted:
+                self._pool.submit(self._run, ticket)
+
+    def _run(self, ticket: StartTicket) -> None:
+        try:
+            ticket.start_func()
+            ticket.state = 'started'
+        except Exception as e:
+            ticket.state = 'failed'
+            ticket.error = str(e)
+            logger.warning(f"Scheduled start of VM {ticket.vmid} on {ticket.node} failed: {e}")
+        ticket.finished_at = self.clock()
+        ticket.done.set()
+
+    def _prune(self) -> None:
+        now = self.clock()
+        for ticket_id, ticket in list(self._tickets.items()):
+            if ticket.finished_at is not None and now - ticket.finished_at > TICKET_RETENTION:
+                del self._tickets[ticket_id]
+
+    # -- status --------------------------------------------------------------------
+
+    def eta(self, ticket: StartTicket) -> float:
+        """Expected seconds until the ticket is admitted (0 once it has been)."""
+        with self._cond:
+            if ticket not in self._queue:
+                return 0.0
+            now = self.clock()
+            ahead = self._queue[:self._queue.index(ticket)]
+            return max(self._bucket(key, now).wait_time(now, 1 + sum(1 for t in ahead if key in t.keys))
+                       for key in ticket.keys)
+
+    def status(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        ticket = self._tickets.get(ticket_id)
+        if ticket is None:
+            return None
+        with self._cond:
+            position = self._queue.index(ticket) + 1 if ticket in self._queue else 0
+        return {
+            'ticket': ticket.id,
+            'vmid': ticket.vmid,
+            'node': ticket.node,
+            'state': ticket.state,
+            'position': position,
+            'eta_seconds': round(self.eta(ticket), 1),
+            'error': ticket.error,
+        }
+
+    def owner_of(self, ticket_id: str) -> Optional[str]:
+        ticket = self._tickets.get(ticket_id)
+        return ticket.owner if ticket else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = self.clock()
+            buckets = {}
+            for key, bucket in sorted(self._buckets.items()):
+                bucket.available(now)  # refill before reporting
+                buckets[key] = {'tokens': round(bucket.tokens, 2), 'capacity': round(bucket.capacity, 2),
+                                'rate': round(bucket.rate, 3)}
+            return {
+                'queued': len(self._queue),
+                'queued_interactive': sum(1 for t in self._queue if t.priority == INTERACTIVE),
+                'buckets': buckets,
+            }
+
+
+# ---------------------------------------------------------------------------
+# Per-cluster schedulers
+# ---------------------------------------------------------------------------
+
+_schedulers: Dict[str, StartScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_start_scheduler(cluster_id: str) -> StartScheduler:
+    with _schedulers_lock:
+        if cluster_id not in _schedulers:
+            _schedulers[cluster_id] = StartScheduler()
+        return _schedulers[cluster_id]
+
+
+def refresh_sizing(scheduler: StartScheduler, proxmox, cluster_id: str) -> None:
+    """Size buckets from node memory (cluster resources) and storage probe latency."""
+    from datetime import datetime
+
+    from app.models import NodeStorageProbe
+    from app.services.storage_probe import PROBE_MAX_AGE
+
+    factors: Dict[str, float] = {}
+    shared: Dict[str, bool] = {}
+    try:
+        for r in proxmox.cluster.resources.get(type='node'):
+            factors[f"node:{r['node']}"] = memory_factor(r.get('mem'), r.get('maxmem'))
+        for r in proxmox.cluster.resources.get(type='storage'):
+            shared[r['storage']] = bool(r.get('shared'))
+    except Exception as e:
+        logger.debug(f"Start scheduler sizing: cluster resources unavailable: {e}")
+
+    latencies: Dict[str, List[float]] = {}
+    probes = NodeStorageProbe.query.filter(
+        NodeStorageProbe.cluster_id == cluster_id,
+        NodeStorageProbe.latency_ms.isnot(None),
+        NodeStorageProbe.probed_at >= datetime.utcnow() - PROBE_MAX_AGE,
+    ).all()
+    for probe in probes:
+        latencies.setdefault(probe.storage, []).append(probe.latency_ms)
+    for storage, values in latencies.items():
+        factors[f"storage:{storage}"] = latency_factor(sum(values) / len(values))
+
+    scheduler.set_factors(factors, shared_storages=shared or None)
+
+
+def storages_for_vm(proxmox, cluster_id: str, node: str, vmid: int) -> List[str]:
+    """Disk storages of a VM (cached; [] if the config cannot be read)."""
+    key = (cluster_id, int(vmid))
+    storages = _vm_storage_cache.get(key)
+    if storages is None:
+        try:
+            storages = vm_storages(proxmox.nodes(node).qemu(vmid).config.get())
+        except Exception as e:
+            logger.debug(f"Could not read config of VM {vmid} for start scheduling: {e}")
+            return []
+        _vm_storage_cache.set(key, storages)
+    return storages
+
+
+def schedule_start(proxmox, cluster_id: str, vmid: int, node: str, start_func: Callable[[], Any],
+                   priority: int = INTERACTIVE, owner: Optional[str] = None,
+                   storages: Optional[List[str]] = None) -> StartTicket:
+    """Queue a VM start on the cluster's scheduler (refreshing bucket sizes when stale)."""
+    scheduler = get_start_scheduler(cluster_id)
+    if scheduler.needs_sizing():
+        try:
+            refresh_sizing(scheduler, proxmox, cluster_id)
+        except Exception as e:
+            logger.warning(f"Start scheduler sizing failed for cluster {cluster_id}: {e}")
+            scheduler.sized_at = scheduler.clock()  # keep current sizes, retry after SIZING_REFRESH
+    if storages is None:
+        storages = storages_for_vm(proxmox, cluster_id, node, vmid)
+    return scheduler.submit(vmid, node, storages, start_func, priority=priority, owner=owner)
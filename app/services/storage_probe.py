@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Storage Probe - per-node latency and throughput to shared VM storage.
+
+Student overlays read their class base QCOW2 from shared storage (usually an
+NFS export), so how fast a lab boots depends on each node's path to that
+storage more than on its free RAM. The background sync runs
+probe_all_clusters() periodically:
+- One pooled SSH session per cluster; each node is probed through it with
+  node_command()
+- Per online node and shared image storage: a small direct-I/O sequential
+  write (throughput) and 4K direct reads of the same file (latency), then
+  the probe file is removed
+- Results are upserted into NodeStorageProbe (one row per cluster/node/storage)
+
+apply_storage_probes() loads recent results into a placement NodeSnapshot,
+where they weigh on overlay-backed VM placement.
+"""
+
+import logging
+import re
+import shlex
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import STORAGE_PROBE_SIZE_MB
+from app.services.ssh_executor import node_command
+
+logger = logging.getLogger(__name__)
+
+# 4K direct reads per probe (latency = mean read time)
+PROBE_READS = 64
+
+# Seconds allowed per node probe
+PROBE_TIMEOUT = 60
+
+# Results older than this are ignored by placement
+PROBE_MAX_AGE = timedelta(hours=24)
+
+# Storage types with a mounted path we can write a probe file to
+PROBE_STORAGE_TYPES = ('nfs', 'cifs', 'dir', 'glusterfs', 'cephfs')
+
+# "16777216 bytes (17 MB, 16 MiB) copied, 0.123 s, 136 MB/s" (comma decimals in some locales)
+_DD_SECONDS = re.compile(r'copied,\s*([\d.,]+)\s*s')
+
+
+def build_probe_command(node: str, path: str, size_mb: int = STORAGE_PROBE_SIZE_MB) -> str:
+    """Shell command (run on any cluster node) probing node's path to a storage mount."""
+    probe_file = shlex.quote(f"{path.rstrip('/')}/.lab-portal-probe-{node}")
+    script = (
+        f"dd if=/dev/zero of={probe_file} bs=1M count={size_mb} oflag=direct conv=fsync 2>&1 | tail -n1; "
+        f"dd if={probe_file} of=/dev/null bs=4k count={PROBE_READS} iflag=direct 2>&1 | tail -n1; "
+        f"rm -f {probe_file}"
+    )
+    return node_command(node, script, connect_timeout=5)
+
+
+def parse_probe_output(output: str, size_mb: int = STORAGE_PROBE_SIZE_MB) -> Tuple[float, float]:
+    """(latency_ms, throughput_mbps) from the two dd summary lines.
+
+    Raises:
+        ValueError: Output does not contain both dd summaries
+    """
+    seconds = [float(value.replace(',', '.')) for value in _DD_SECONDS.findall(output)]
+    if len(seconds) < 2:
+        raise ValueError(f"unexpected probe output: {output.strip()[:200]}")
+    write_s, read_s = seconds[0], seconds[1]
+    throughput = size_mb / write_s if write_s > 0 else float(size_mb)
+    latency = read_s / PROBE_READS * 1000
+    return round(latency, 3), round(throughput, 1)
+
+
+def probe_targets(proxmox) -> List[Tuple[str, str, str]]:
+    """(node, storage, mount path) for every online node and shared image storage."""
+    online = sorted(n['node'] for n in proxmox.nodes.get() if n.get('status') == 'online')
+    targets = []
+    for storage in proxmox.storage.get():
+        if (not storage.get('shared') or storage.get('disable')
+                or storage.get('type') not in PROBE_STORAGE_TYPES
+                or 'images' not in (storage.get('content') or '')):
+            continue
+        name = storage['storage']
+        path = storage.get('path') or f"/mnt/pve/{name}"
+        allowed = set(filter(None, (storage.get('nodes') or '').split(',')))
+        for node in online:
+            if not allowed or node in allowed:
+                targets.append((node, name, path))
+    return targets
+
+
+def probe_cluster(cluster: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Probe every node/shared-storage pair of one cluster (sequentially, so
+    probes do not measure each other)."""
+    from app.services.proxmox_service import get_proxmox_admin_for_cluster
+    from app.services.ssh_executor import get_pooled_ssh_executor
+
+    proxmox = get_proxmox_admin_for_cluster(cluster['id'])
+    targets = probe_targets(proxmox)
+    if not targets:
+        return []
+
+    username = cluster['user'].split('@')[0] if '@' in cluster['user'] else cluster['user']
+    ssh_executor = get_pooled_ssh_executor(cluster['host'], username, cluster['password'])
+
+    results = []
+    for node, storage, path in targets:
+        result = {'cluster_id': cluster['id'], 'node': node, 'storage': storage}
+        try:
+            exit_code, stdout, stderr = ssh_executor.execute(
+                build_probe_command(node, path), timeout=PROBE_TIMEOUT, check=False)
+            result['latency_ms'], result['throughput_mbps'] = parse_probe_output(stdout + stderr)
+        except Exception as e:
+            result['error'] = str(e)[:500]
+            logger.warning(f"Storage probe {cluster['id']}/{node} -> {storage} failed: {e}")
+        results.append(result)
+    return results
+
+
+def save_probe_results(results: List[Dict[str, Any]]) -> None:
+    """Upsert results.
+
+    Failed probes record the error and error_at but keep the last
+    measurement and its probed_at, so placement still ages it out on time.
+    """
+    from app.models import NodeStorageProbe
+    from app.utils.db_dialect import upsert
+
+    now = datetime.utcnow()
+    keys = ('cluster_id', 'node', 'storage')
+    measured = [dict({k: r[k] for k in keys}, latency_ms=r['latency_ms'], throughput_mbps=r['throughput_mbps'],
+                     error=None, error_at=None, probed_at=now) for r in results if 'error' not in r]
+    failed = [dict({k: r[k] for k in keys}, error=r['error'], error_at=now, probed_at=None)
+              for r in results if 'error' in r]
+    upsert(NodeStorageProbe, measured, conflict_columns=keys)
+    upsert(NodeStorageProbe, failed, conflict_columns=keys, update_columns=('error', 'error_at'))
+
+
+def probe_all_clusters() -> Dict[str, Any]:
+    """Probe all active clusters and store the results. Returns stats."""
+    from app.services.db_writer import queue_write
+    from app.services.proxmox_service import get_clusters_from_db
+
+    stats = {'clusters': 0, 'probes': 0, 'failed': 0}
+    for cluster in get_clusters_from_db():
+        try:
+            results = probe_cluster(cluster)
+        except Exception as e:
+            logger.warning(f"Storage probe skipped for cluster {cluster.get('id')}: {e}")
+            continue
+        if results:
+            queue_write(lambda results=results: save_probe_results(results)).result()
+        stats['clusters'] += 1
+        stats['probes'] += len(results)
+        stats['failed'] += sum(1 for r in results if 'error' in r)
+    return stats
+
+
+def apply_storage_probes(snapshot, storage: str, cluster_id: Optional[str] = None) -> int:
+    """Load recent probe results for storage into a placement NodeSnapshot.
+
+    Returns:
+        Number of nodes that received storage measurements
+    """
+    from app.models import NodeStorageProbe
+
+    query = NodeStorageProbe.query.filter(
+        NodeStorageProbe.storage == storage,
+        NodeStorageProbe.latency_ms.isnot(None),
+        NodeStorageProbe.probed_at >= datetime.utcnow() - PROBE_MAX_AGE,
+    )
+    if cluster_id:
+        query = query.filter(NodeStorageProbe.cluster_id == cluster_id)
+    applied = 0
+    for probe in query.all():
+        if snapshot.set_storage(probe.node, probe.latency_ms, probe.throughput_mbps):
+            applied += 1
+    return applied
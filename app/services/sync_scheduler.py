@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Sync Scheduler - deadline-ordered job scheduler for background sync daemons.
+
+Replaces a single "run everything, then sleep" loop with:
+- A priority queue of jobs ordered by (priority, next-due time)
+- Per-job interval and jitter (so jobs registered together drift apart)
+- Max concurrency of 1 per job kind; each job gets its own worker slot, so
+  a 20-minute template sync never delays a 2-minute VM quick sync
+- Manual triggers that enqueue a job at high priority (coalesced if the
+  job is already running - it re-runs once as soon as it finishes)
+- Exponential retry backoff (capped at the job interval) after failures
+- Per-job runtime histograms for /api/sync/status and health endpoints
+
+Usage:
+    scheduler = JobScheduler(app, name="background_sync")
+    scheduler.register("vm_quick_sync", _perform_quick_sync, interval=15)
+    scheduler.start()
+    scheduler.trigger("vm_full_sync")
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+
+# Upper bounds (seconds) of runtime histogram buckets; the last bucket is open
+HISTOGRAM_BUCKETS: Tuple[float, ...] = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# First retry after a failure waits this long, doubling up to the job interval
+RETRY_BACKOFF_BASE = 5.0
+
+
+class RuntimeHistogram:
+    """Fixed-bucket histogram of job runtimes (seconds)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = HISTOGRAM_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self._buckets):
+                if seconds <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._count += 1
+            self._sum += seconds
+            self._max = max(self._max, seconds)
+
+    def _quantile(self, q: float) -> Optional[float]:
+        """Upper bucket bound containing the q-quantile (call with lock held)."""
+        if not self._count:
+            return None
+        target = q * self._count
+        running = 0
+        for i, count in enumerate(self._counts):
+            running += count
+            if running >= target:
+                return self._buckets[i] if i < len(self._buckets) else self._max
+        return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [f"le_{b:g}" for b in self._buckets] + ["inf"]
+            return {
+                "count": self._count,
+                "sum": round(self._sum, 3),
+                "avg": round(self._sum / self._count, 3) if self._count else None,
+                "max": round(self._max, 3),
+                "p50": self._quantile(0.5),
+                "p95": self._quantile(0.95),
+                "buckets": dict(zip(labels, self._counts)),
+            }
+
+
+class SyncJob:
+    """One recurring job and its run state."""
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: float,
+                 jitter: float = 0.1, initial_delay: float = 0.0,
+                 on_success: Optional[Callable[["SyncJob"], None]] = None,
+                 on_error: Optional[Callable[["SyncJob", Exception], None]] = None):
+        """
+        Args:
+            name: Unique job kind
+            func: Callable run inside the Flask app context
+            interval: Seconds between the end of one run and the next
+            jitter: Fraction of interval added/subtracted at random (0.1 = +/-10%)
+            initial_delay: Seconds after start() before the first run
+            on_success / on_error: Hooks called after each run (health reporting)
+        """
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.jitter = float(jitter)
+        self.initial_delay = float(initial_delay)
+        self.on_success = on_success
+        self.on_error = on_error
+
+        self.running = False
+        self.rerun_requested = False
+        self.next_due: Optional[float] = None
+        self.schedule_token = 0
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_started: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.histogram = RuntimeHistogram()
+
+    def next_delay(self) -> float:
+        """Delay before the next regular run (jittered, backed off after failures)."""
+        if self.consecutive_failures:
+            base = min(self.interval, RETRY_BACKOFF_BASE * (2 ** (self.consecutive_failures - 1)))
+        else:
+            base = self.interval
+        if self.jitter:
+            base += random.uniform(-self.jitter, self.jitter) * base
+        return max(0.0, base)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "running": self.running,
+            "next_due_in": round(self.next_due - now, 1) if self.next_due is not None else None,
+            "runs": self.runs,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_duration": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_started_ago": round(now - self.last_started, 1) if self.last_started else None,
+            "last_error": self.last_error,
+            "runtime": self.histogram.snapshot(),
+        }
+
+
+class JobScheduler:
+    """Deadline scheduler running each registered job on its own worker slot."""
+
+    def __init__(self, app=None, name: str = "scheduler"):
+        self._app = app
+        self.name = name
+        self._jobs: Dict[str, SyncJob] = {}
+        self._queue: List[Tuple[int, float, int, str, Optional[int]]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._dispatcher: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # -- registration / lifecycle ----------------------------------------------
+
+    def register(self, name: str, func: Callable[[], Any], interval: float, **kwargs) -> SyncJob:
+        """Register a recurring job (see SyncJob for kwargs)."""
+        if name in self._jobs:
+            raise ValueError(f"Job {name} already registered")
+        job = SyncJob(name, func, interval, **kwargs)
+        self._jobs[name] = job
+        return job
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def is_alive(self) -> bool:
+        """True while started and the dispatcher thread is alive."""
+        return self._running and self._dispatcher is not None and self._dispatcher.is_alive()
+
+    def start(self) -> None:
+        """Schedule every job's first run and start the dispatcher thread."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            now = time.time()
+            for job in self._jobs.values():
+                self._schedule(job, now + job.initial_delay)
+
+        # One worker slot per job kind: concurrency is capped at 1 per job,
+        # so no job can ever wait for a free worker
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self._jobs)),
+            thread_name_prefix=f"{self.name}-job",
+        )
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True, name=f"{self.name}-dispatcher")
+        self._dispatcher.start()
+        logger.info("%s scheduler started with jobs: %s", self.name, ", ".join(self._jobs))
+
+    def stop(self, wait: bool = False) -> None:
+        """Stop dispatching; running jobs finish in the background unless wait=True."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+        logger.info("%s scheduler stopped", self.name)
+
+    def trigger(self, name: str, priority: int = PRIORITY_HIGH) -> bool:
+        """Enqueue a job to run as soon as possible.
+
+        If the job is running, it re-runs once when the current run finishes.
+
+        Returns:
+            False if the job is unknown or the scheduler is not running
+        """
+        job = self._jobs.get(name)
+        if job is None:
+            return False
+        with self._cond:
+            if not self._running:
+                return False
+            if job.running:
+                job.rerun_requested = True
+            else:
+                heapq.heappush(self._queue, (priority, time.time(), next(self._seq), name, None))
+                self._cond.notify_all()
+        logger.info("%s: manual trigger queued for %s", self.name, name)
+        return True
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-job state and runtime histograms."""
+        now = time.time()
+        with self._cond:
+            return {name: job.snapshot(now) for name, job in self._jobs.items()}
+
+    # -- internals ---------------------------------------------------------------
+
+    def _schedule(self, job: SyncJob, due: float) -> None:
+        """Queue the job's next regular run (call with condition held).
+
+        Older regular entries for the job are invalidated via schedule_token.
+        """
+        job.schedule_token += 1
+        job.next_due = due
+        heapq.heappush(self._queue, (PRIORITY_NORMAL, due, next(self._seq), job.name, job.schedule_token))
+        self._cond.notify_all()
+
+    def _next_ready(self) -> Optional[SyncJob]:
+        """Pop the next runnable job, or wait until one is due (condition held)."""
+        while self._running:
+            now = time.time()
+            ready: Optional[SyncJob] = None
+            wait_for: Optional[float] = None
+
+            # Highest priority first; within a priority, earliest due first
+            while self._queue:
+                priority, due, _, name, token = self._queue[0]
+                job = self._jobs[name]
+                if token is not None and token != job.schedule_token:
+                    heapq.heappop(self._queue)  # superseded regular entry
+                    continue
+                if due > now:
+                    wait_for = due - now
+                    break
+                heapq.heappop(self._queue)
+                if job.running:
+                    # Never run the same job kind twice at once
+                    job.rerun_requested = True
+                    continue
+                ready = job
+                break
+
+            if ready is not None:
+                return ready
+            self._cond.wait(timeout=wait_for)
+        return None
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                job = self._next_ready()
+                if job is None:
+                    return
+                job.running = True
+                job.next_due = None
+            try:
+                self._executor.submit(self._run_job, job)
+            except RuntimeError:
+                # Executor shut down between stop() and here
+                with self._cond:
+                    job.running = False
+                return
+
+    def _run_job(self, job: SyncJob) -> None:
+        started = time.time()
+        job.last_started = started
+        error: Optional[Exception] = None
+        try:
+            if self._app is not None:
+                with self._app.app_context():
+                    try:
+                        job.func()
+                    finally:
+                        # Release this worker's DB session (connection pool / SQLite lock)
+                        from app.models import db
+                        db.session.remove()
+            else:
+                job.func()
+        except Exception as e:
+            error = e
+            logger.warning("%s: job %s failed: %s", self.name, job.name, e, exc_info=True)
+
+        duration = time.time() - started
+        job.histogram.observe(duration)
+
+        with self._cond:
+            job.running = False
+            job.runs += 1
+            job.last_duration = duration
+            if error is None:
+                job.consecutive_failures = 0
+                job.last_error = None
+            else:
+                job.failures += 1
+                job.consecutive_failures += 1
+                job.last_error = str(error)
+            if self._running:
+                if job.rerun_requested:
+                    job.rerun_requested = False
+                    heapq.heappush(self._queue, (PRIORITY_HIGH, time.time(), next(self._seq), job.name, None))
+                self._schedule(job, time.time() + job.next_delay())
+
+        hook = job.on_success if error is None else job.on_error
+        if hook is not None:
+            try:
+                hook(job) if error is None else hook(job, error)
+            except Exception as hook_err:
+                logger.debug("%s: hook for %s failed: %s", self.name, job.name, hook_err)
@@ -2,12 +2,17 @@
 """
 Template Migration Service - Migrate templates between Proxmox clusters.
 
-Handles the actual disk copying and VM creation across clusters.
+Handles VM creation across clusters; disk copies go through
+template_transfer (sparse, compressed, resumable).
 """
 
+import json
 import logging
+import shlex
+from typing import Optional
 
 from app.models import Template, db
+from app.services.proxmox_cache import fresh_reads
 from app.services.proxmox_service import get_proxmox_admin_for_cluster
 
 logger = logging.getLogger(__name__)
@@ -38,19 +43,22 @@ def migrate_template_between_clusters(
     source_cluster: dict,
     destination_cluster: dict,
     destination_storage: str,
-    operation: str = 'copy'
+    operation: str = 'copy',
+    task_id: Optional[str] = None
 ) -> bool:
     """Migrate/copy a template from one cluster to another.
     
     Workflow:
     1. Get source template config and disk info
     2. Find destination node with specified storage
-    3. Export source disk to QCOW2
-    4. Copy QCOW2 to destination via SCP
-    5. Create VM shell on destination with same specs
-    6. Attach copied disk
-    7. Convert to template
-    8. If operation='move', delete source template
+    3. Transfer each disk (sparse export, compressed chunked stream, resumable -
+       see template_transfer.DiskTransfer)
+    4. Create VM shell on destination with same specs
+    5. Import and attach the copied disks
+    6. Convert to template
+    7. If operation='move', delete source template
+    
+    Re-running a failed migration resumes interrupted disk transfers.
     
     Args:
         source_template: Source Template database object
@@ -58,96 +66,105 @@ def migrate_template_between_clusters(
         destination_cluster: Destination cluster config dict
         destination_storage: Storage name on destination (default: "TRUENAS")
         operation: 'copy' (keep source) or 'move' (delete source after success)
+        task_id: Clone progress task to report transfer progress/throughput to
         
     Returns:
         True if successful, False otherwise
     """
+    from app.services.ssh_executor import get_pooled_ssh_executor, node_command
+    from app.services.template_transfer import DiskTransfer, parse_imported_volume, template_disks
+    from app.services.vmid_allocator import allocate_vmid, release_reservations
+    
     logger.info(f"Starting template migration: {source_template.name} (VMID {source_template.proxmox_vmid}) "
                 f"from {source_cluster['name']} to {destination_cluster['name']}")
     
+    def ssh_for(cluster):
+        username = cluster['user'].split('@')[0] if '@' in cluster['user'] else cluster['user']
+        return get_pooled_ssh_executor(cluster['host'], username, cluster['password'])
+    
+    reservation_owner = f"template-migration:{source_cluster['id']}:{source_template.proxmox_vmid}"
+    dest_vmid = None
+    migrated = False
     try:
         source_proxmox = get_proxmox_admin_for_cluster(source_cluster["id"])
         dest_proxmox = get_proxmox_admin_for_cluster(destination_cluster["id"])
         
         source_node = source_template.node
         source_vmid = source_template.proxmox_vmid
-        # Note: source_name not used in current implementation
         
         # Step 1: Get template config from source
         logger.info(f"Step 1: Getting template config from {source_node}/{source_vmid}")
         source_config = source_proxmox.nodes(source_node).qemu(source_vmid).config.get()
         
-        # Note: CPU/memory specs extracted for reference but not used in current implementation
-        # They are preserved in the VM shell creation from hardware config
-        
-        # Get network config (not currently used in migration)
-        # Get primary disk (scsi0)
-        scsi0 = source_config.get("scsi0", "")
-        if not scsi0:
-            return {"ok": False, "error": "Template has no scsi0 disk"}
-        
-        # Parse disk config: "STORAGE:DISK_ID,size=10G"
-        disk_parts = scsi0.split(",")
-        disk_location = disk_parts[0]
-        disk_size_str = next((p.split("=")[1] for p in disk_parts if p.startswith("size=")), "10G")
-        
-        if ":" not in disk_location:
-            return {"ok": False, "error": f"Invalid disk location: {disk_location}"}
-        
-        source_storage, disk_id = disk_location.split(":", 1)
-        logger.info(f"Source disk: {source_storage}:{disk_id}, size: {disk_size_str}")
+        disks = template_disks(source_config)
+        if not disks:
+            logger.error("No disks found in source template")
+            return False
+        logger.info(f"Found {len(disks)} disk(s) to migrate: {[key for key, _ in disks]}")
         
-        # Step 2: Find destination node with TRUENAS storage
-        logger.info("Step 2: Finding destination node with TRUENAS storage...")
-        dest_nodes = dest_proxmox.nodes.get()
+        # Step 2: Find destination node with the destination storage
+        logger.info(f"Step 2: Finding destination node with {destination_storage} storage...")
         dest_node = None
-        
-        for node in dest_nodes:
+        for node in sorted(dest_proxmox.nodes.get(), key=lambda n: n["node"]):
+            if node.get("status") != "online":
+                continue
             node_name = node["node"]
             try:
                 storages = dest_proxmox.nodes(node_name).storage.get()
-                for storage in storages:
-                    if storage["storage"] == destination_storage and "images" in storage.get("content", ""):
-                        dest_node = node_name
-                        break
-                if dest_node:
+                if any(storage["storage"] == destination_storage and "images" in storage.get("content", "")
+                       for storage in storages):
+                    dest_node = node_name
                     break
             except Exception as e:
                 logger.warning(f"Failed to check storage on {node_name}: {e}")
         
         if not dest_node:
-            return {"ok": False, "error": f"No node with {destination_storage} storage found"}
+            logger.error(f"No node with {destination_storage} storage found")
+            return False
         
         logger.info(f"Selected destination node: {dest_node}")
         
-        # Get next available VMID
-        dest_vmids = [vm["vmid"] for vm in dest_proxmox.cluster.resources.get(type="vm")]
-        dest_vmid = max(dest_vmids) + 1 if dest_vmids else 100
+        # Reserve a free VMID (interval set + reservations, not max()+1)
+        with fresh_reads():
+            dest_vmids = [vm["vmid"] for vm in dest_proxmox.cluster.resources.get(type="vm")]
+        dest_vmid = allocate_vmid(start=100, cluster_id=destination_cluster["id"], owner=reservation_owner,
+                                  extra_used=dest_vmids)
+        if dest_vmid is None:
+            logger.error("No free VMID on destination cluster")
+            return False
         logger.info(f"Assigned VMID: {dest_vmid}")
         
-        # Get SSH connections
-        from app.services.ssh_executor import get_ssh_executor_from_config
-        
-        source_ssh = get_ssh_executor_from_config(source_cluster)
-        source_ssh.connect(source_node)
-        
-        dest_ssh = get_ssh_executor_from_config(destination_cluster)
-        dest_ssh.connect(dest_node)
+        source_ssh = ssh_for(source_cluster)
+        dest_ssh = ssh_for(destination_cluster)
         
-        # Extract disk info from source config
-        disk_configs = {}
-        for key, value in source_config.items():
-            if key.startswith(('scsi', 'sata', 'virtio', 'ide')) and isinstance(value, str):
-                if ':' in value and 'cdrom' not in value.lower():
-                    disk_configs[key] = value
+        def on_dest(script, timeout=60):
+            return dest_ssh.execute(node_command(dest_node, script), timeout=timeout, check=False)
         
-        if not disk_configs:
-            logger.error("No disks found in source template")
-            return False
-        
-        logger.info(f"Found {len(disk_configs)} disk(s) to migrate: {list(disk_configs.keys())}")
+        # Step 3: Transfer disks (before creating anything on the destination,
+        # so a failed transfer leaves nothing to clean up and can be resumed)
+        received = []
+        for disk_key, volume in disks:
+            exit_code, source_path, stderr = source_ssh.execute(
+                node_command(source_node, f"pvesm path {shlex.quote(volume)}"), timeout=30, check=False)
+            if exit_code != 0 or not source_path.strip():
+                logger.error(f"Could not resolve source disk {volume}: {stderr}")
+                return False
+            source_path = source_path.strip()
+            exit_code, info, _ = source_ssh.execute(
+                node_command(source_node, f"qemu-img info --output=json {shlex.quote(source_path)}"),
+                timeout=30, check=False)
+            disk_format = json.loads(info).get('format', 'raw') if exit_code == 0 else 'raw'
+            
+            transfer = DiskTransfer(
+                source_ssh, source_node, dest_ssh, dest_node, destination_cluster['host'],
+                transfer_id=f"template-{source_cluster['id']}-{source_vmid}-{disk_key}-to-{destination_cluster['id']}",
+                task_id=task_id,
+                label=f"{source_template.name} {disk_key}",
+            )
+            logger.info(f"Transferring disk {disk_key} ({volume}, {disk_format}) from {source_node} to {dest_node}")
+            received.append((disk_key, transfer, transfer.run(source_path, disk_format)))
         
-        # Create destination VM shell
+        # Step 4: Create destination VM shell
         logger.info(f"Creating VM shell on destination: {dest_node}/{dest_vmid}")
         
         vm_name = source_template.name
@@ -155,116 +172,59 @@ def migrate_template_between_clusters(
         cores = source_config.get('cores', 2)
         sockets = source_config.get('sockets', 1)
         
-        # Build VM creation command
         create_cmd = (
             f"qm create {dest_vmid} "
-            f"--name {vm_name} "
+            f"--name {shlex.quote(str(vm_name))} "
             f"--memory {memory} "
             f"--cores {cores} "
             f"--sockets {sockets}"
         )
+        for option in ('ostype', 'cpu', 'machine', 'bios', 'scsihw'):
+            if option in source_config:
+                create_cmd += f" --{option} {shlex.quote(str(source_config[option]))}"
         
-        # Add optional parameters
-        if 'ostype' in source_config:
-            create_cmd += f" --ostype {source_config['ostype']}"
-        if 'cpu' in source_config:
-            create_cmd += f" --cpu {source_config['cpu']}"
-        if 'machine' in source_config:
-            create_cmd += f" --machine {source_config['machine']}"
-        if 'bios' in source_config:
-            create_cmd += f" --bios {source_config['bios']}"
-        if 'scsihw' in source_config:
-            create_cmd += f" --scsihw {source_config['scsihw']}"
-        
-        exit_code, stdout, stderr = dest_ssh.execute(create_cmd, timeout=60)
+        exit_code, stdout, stderr = on_dest(create_cmd)
         if exit_code != 0:
             logger.error(f"Failed to create VM shell: {stderr}")
             return False
         
         logger.info("VM shell created successfully")
         
-        # Migrate each disk
-        for disk_key, disk_config in disk_configs.items():
-            logger.info(f"Migrating disk {disk_key}: {disk_config}")
-            
-            # Parse disk config (format: storage:size or storage:vmid/disk-name)
-            parts = disk_config.split(',')[0]  # Get just the storage part
-            storage_parts = parts.split(':')
-            
-            if len(storage_parts) < 2:
-                logger.warning(f"Could not parse disk config: {disk_config}")
-                continue
-            
-            source_storage = storage_parts[0]
-            # Note: disk_identifier not used in current implementation
-            
-            # Build source disk path
-            source_path = f"/dev/zvol/{source_storage}/vm-{source_vmid}-{disk_key}-0"
-            
-            # Check if it's a raw disk or qcow2
-            check_cmd = f"file {source_path} || qemu-img info {source_path}"
-            exit_code, stdout, stderr = source_ssh.execute(check_cmd, timeout=30, check=False)
-            
-            is_qcow2 = 'QCOW2' in stdout or 'qcow2' in stdout.lower()
-            disk_format = 'qcow2' if is_qcow2 else 'raw'
-            
-            logger.info(f"Source disk format: {disk_format}")
-            
-            # Note: dest_path constructed but not directly used (passed inline to commands)
-            
-            # Copy disk using qemu-img convert over SSH
-            logger.info(f"Copying disk {disk_key} from {source_node} to {dest_node}...")
-            
-            # Use qemu-img convert piped through SSH
-            copy_cmd = (
-                f"qemu-img convert -O {disk_format} -p {source_path} - | "
-                f"ssh -o StrictHostKeyChecking=no root@{destination_cluster['host']} "
-                f"\"cat > /tmp/temp-disk-{dest_vmid}-{disk_key}.img && "
-                f"qm importdisk {dest_vmid} /tmp/temp-disk-{dest_vmid}-{disk_key}.img {destination_storage} && "
-                f"rm /tmp/temp-disk-{dest_vmid}-{disk_key}.img\""
-            )
-            
-            logger.info("Starting disk copy (this may take several minutes)...")
-            exit_code, stdout, stderr = source_ssh.execute(copy_cmd, timeout=3600, check=False)
-            
+        # Step 5: Import and attach disks
+        for disk_key, transfer, path in received:
+            exit_code, stdout, stderr = on_dest(
+                f"qm importdisk {dest_vmid} {shlex.quote(path)} {shlex.quote(destination_storage)} --format qcow2",
+                timeout=3600)
             if exit_code != 0:
-                logger.error(f"Disk copy failed: {stderr}")
-                # Clean up and return
-                dest_ssh.execute(f"qm destroy {dest_vmid}", timeout=60, check=False)
+                logger.error(f"Failed to import disk {disk_key}: {stderr}")
+                on_dest(f"qm destroy {dest_vmid}")
                 return False
+            transfer.cleanup_destination()
             
-            logger.info(f"Disk {disk_key} copied successfully")
-            
-            # Attach disk to VM
-            attach_cmd = f"qm set {dest_vmid} --{disk_key} {destination_storage}:vm-{dest_vmid}-disk-0"
-            exit_code, stdout, stderr = dest_ssh.execute(attach_cmd, timeout=60, check=False)
-            
+            volume = parse_imported_volume(stdout) or f"{destination_storage}:vm-{dest_vmid}-disk-0"
+            exit_code, stdout, stderr = on_dest(f"qm set {dest_vmid} --{disk_key} {shlex.quote(volume)}")
             if exit_code != 0:
                 logger.warning(f"Failed to attach disk: {stderr}")
         
         # Copy EFI disk if exists
         if 'efidisk0' in source_config:
             logger.info("Copying EFI disk...")
-            efi_cmd = f"qm set {dest_vmid} --efidisk0 {destination_storage}:1,efitype=4m,pre-enrolled-keys=1"
-            dest_ssh.execute(efi_cmd, timeout=60, check=False)
+            on_dest(f"qm set {dest_vmid} --efidisk0 {destination_storage}:1,efitype=4m,pre-enrolled-keys=1")
         
         # Copy TPM if exists
         if 'tpmstate0' in source_config:
             logger.info("Copying TPM state...")
-            tpm_cmd = f"qm set {dest_vmid} --tpmstate0 {destination_storage}:1,version=v2.0"
-            dest_ssh.execute(tpm_cmd, timeout=60, check=False)
+            on_dest(f"qm set {dest_vmid} --tpmstate0 {destination_storage}:1,version=v2.0")
         
-        # Copy network config
+        # Copy network config and boot order
         for key in source_config:
-            if key.startswith('net'):
-                logger.info(f"Copying network config {key}")
-                net_cmd = f"qm set {dest_vmid} --{key} {source_config[key]}"
-                dest_ssh.execute(net_cmd, timeout=30, check=False)
+            if key.startswith('net') or key == 'boot':
+                logger.info(f"Copying {key} config")
+                on_dest(f"qm set {dest_vmid} --{key} {shlex.quote(str(source_config[key]))}", timeout=30)
         
-        # Convert to template
+        # Step 6: Convert to template
         logger.info("Converting destination VM to template...")
-        template_cmd = f"qm template {dest_vmid}"
-        exit_code, stdout, stderr = dest_ssh.execute(template_cmd, timeout=60)
+        exit_code, stdout, stderr = on_dest(f"qm template {dest_vmid}")
         
         if exit_code != 0:
             logger.error(f"Failed to convert to template: {stderr}")
@@ -289,13 +249,13 @@ def migrate_template_between_clusters(
         db.session.commit()
         
         logger.info(f"Template migrated successfully: {vm_name} (VMID {dest_vmid})")
+        migrated = True
         
-        # If operation is 'move', delete source template
+        # Step 7: If operation is 'move', delete source template
         if operation == 'move':
             logger.info("Move operation - deleting source template...")
             try:
-                delete_cmd = f"qm destroy {source_vmid}"
-                source_ssh.execute(delete_cmd, timeout=60, check=False)
+                source_ssh.execute(node_command(source_node, f"qm destroy {source_vmid}"), timeout=60, check=False)
                 
                 # Delete from database
                 db.session.delete(source_template)
@@ -310,3 +270,7 @@ def migrate_template_between_clusters(
     except Exception as e:
         logger.exception(f"Template migration failed: {e}")
         return False
+    finally:
+        # On success the reservation covers the VMID until inventory sync sees it
+        if dest_vmid is not None and not migrated:
+            release_reservations(reservation_owner)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Template Replication - keep a copy of every QEMU template on every node.
+
+replicate_templates_to_all_nodes() used to scan nodes one by one, commit
+each template on its own and sleep 60s after every clone. Now:
+- One cluster/resources call lists all templates and VMIDs, one more lists
+  storages per node; template configs (for disk storages) are fetched in
+  parallel
+- plan_replication() computes every missing (template, node) pair in one
+  pass and skips nodes that already see all of a template's disks on shared
+  storage (a replica there would only duplicate the same disks)
+- Clones run concurrently, limited per storage (TEMPLATE_REPLICATION_PER_STORAGE
+  tasks writing to one storage at a time), and wait on their task UPIDs
+  instead of fixed sleeps: full clone on the source node -> offline migrate
+  to the target node -> convert to template
+- A clone whose migrate or template step fails is destroyed again; if that
+  fails too, it is reported as orphaned and keeps its VMID reservation
+- Discovered templates and new replicas are registered in one DB write
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.config import TEMPLATE_REPLICATION_PER_STORAGE, TEMPLATE_REPLICATION_WORKERS
+from app.services.node_fanout import disk_entries
+from app.services.proxmox_cache import fresh_reads
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for one clone or migrate task
+REPLICA_TASK_TIMEOUT = 3600
+
+# Seconds between task status polls
+REPLICA_TASK_POLL = 2.0
+
+
+@dataclass
+class ReplicaTask:
+    """One missing (template, node) pair."""
+    name: str
+    source_node: str
+    source_vmid: int
+    target_node: str
+    storages: Tuple[str, ...] = ()
+    vmid: Optional[int] = None
+    error: Optional[str] = None
+    done: bool = False
+    orphan_node: Optional[str] = None  # node still holding a clone that could not be destroyed
+
+    @property
+    def replica_name(self) -> str:
+        from app.services.vm_utils import sanitize_vm_name
+        return sanitize_vm_name(f"{self.name}-replica-{self.target_node}", fallback="tpl-replica")
+
+
+@dataclass
+class ReplicationPlan:
+    tasks: List[ReplicaTask] = field(default_factory=list)
+    skipped_shared: List[Tuple[str, str]] = field(default_factory=list)  # (template name, node)
+
+
+def disk_storages(config: Dict[str, Any]) -> Set[str]:
+    """Storage IDs of a VM config's disks (CD-ROMs excluded)."""
+    storages = set()
+    for _, value in disk_entries(config):
+        if 'media=cdrom' in value or ':' not in value:
+            continue
+        storages.add(value.split(':', 1)[0])
+    return storages
+
+
+def plan_replication(templates: List[Dict[str, Any]], nodes: List[str],
+                     template_storages: Dict[Tuple[str, int], Set[str]],
+                     node_storages: Dict[str, Dict[str, bool]]) -> ReplicationPlan:
+    """Missing (template, node) pairs for templates grouped by name.
+
+    Args:
+        templates: [{'vmid', 'name', 'node'}] - every template instance in the cluster
+        nodes: Online nodes that should hold each template
+        template_storages: {(node, vmid): storages of its disks}
+        node_storages: {node: {storage: shared}} for storages available on each node
+    """
+    by_name: Dict[str, List[Dict[str, Any]]] = {}
+    for tpl in sorted(templates, key=lambda t: (t['node'], t['vmid'])):
+        by_name.setdefault(tpl['name'], []).append(tpl)
+
+    plan = ReplicationPlan()
+    for name, instances in sorted(by_name.items()):
+        present = {i['node'] for i in instances}
+        missing = [n for n in sorted(nodes) if n not in present]
+        for index, target in enumerate(missing):
+            # Spread clone reads over the existing instances
+            source = instances[index % len(instances)]
+            storages = template_storages.get((source['node'], source['vmid']), set())
+            available = node_storages.get(target, {})
+            if storages and all(available.get(s) for s in storages):
+                plan.skipped_shared.append((name, target))
+                continue
+            plan.tasks.append(ReplicaTask(name=name, source_node=source['node'], source_vmid=source['vmid'],
+                                          target_node=target, storages=tuple(sorted(storages))))
+    return plan
+
+
+def storage_keys(node: str, storages, node_storages: Dict[str, Dict[str, bool]]) -> List[str]:
+    """Limiter keys: shared storages are one resource cluster-wide, local ones per node."""
+    shared = node_storages.get(node, {})
+    return [s if shared.get(s) else f"{node}/{s}" for s in storages]
+
+
+class StorageLimiter:
+    """Per-storage concurrency limits (keys acquired in sorted order, so no deadlock)."""
+
+    def __init__(self, per_storage: int):
+        self.per_storage = max(1, per_storage)
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+
+    def _semaphore(self, key: str) -> threading.Semaphore:
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(self.per_storage)
+            return self._semaphores[key]
+
+    def hold(self, keys) -> ExitStack:
+        stack = ExitStack()
+        for key in sorted(set(keys)):
+            stack.enter_context(self._semaphore(key))
+        return stack
+
+
+def _run_task(proxmox, task: ReplicaTask, limiter: StorageLimiter,
+              node_storages: Dict[str, Dict[str, bool]]) -> ReplicaTask:
+    from app.services.proxmox_operations import wait_for_task
+
+    def wait(upid, what):
+        ok, status = wait_for_task(proxmox, upid, REPLICA_TASK_TIMEOUT, REPLICA_TASK_POLL)
+        if not ok:
+            raise RuntimeError(f"{what} failed: {status}")
+
+    keys = (storage_keys(task.source_node, task.storages, node_storages)
+            + storage_keys(task.target_node, task.storages, node_storages))
+    cloned_on = None
+    try:
+        with limiter.hold(keys):
+            upid = proxmox.nodes(task.source_node).qemu(task.source_vmid).clone.post(
+                newid=task.vmid, name=task.replica_name, full=1)
+            wait(upid, f"clone of {task.source_vmid}")
+            cloned_on = task.source_node
+            if task.target_node != task.source_node:
+                upid = proxmox.nodes(task.source_node).qemu(task.vmid).migrate.post(
+                    target=task.target_node, **{'with-local-disks': 1})
+                wait(upid, f"migrate of {task.vmid} to {task.target_node}")
+                cloned_on = task.target_node
+        proxmox.nodes(task.target_node).qemu(task.vmid).template.post()
+        task.done = True
+        logger.info(f"Replica template ready on {task.target_node}: {task.vmid} ({task.name})")
+    except Exception as e:
+        task.error = str(e)
+        logger.warning(f"Failed to replicate '{task.name}' to {task.target_node}: {e}")
+        if cloned_on:
+            _destroy_clone(proxmox, task, cloned_on, wait)
+    return task
+
+
+def _destroy_clone(proxmox, task: ReplicaTask, node: str, wait) -> None:
+    """Remove the full clone of a failed task; record it as an orphan if that fails too."""
+    try:
+        wait(proxmox.nodes(node).qemu(task.vmid).delete(purge=1), f"destroy of {task.vmid}")
+        logger.info(f"Removed unfinished replica {task.vmid} from {node}")
+    except Exception as e:
+        task.orphan_node = node
+        logger.error(f"Unfinished replica {task.vmid} of '{task.name}' left on {node}: {e}")
+
+
+def run_replication(proxmox, tasks: List[ReplicaTask], node_storages: Dict[str, Dict[str, bool]],
+                    per_storage: int = TEMPLATE_REPLICATION_PER_STORAGE,
+                    workers: int = TEMPLATE_REPLICATION_WORKERS) -> List[ReplicaTask]:
+    """Run replica tasks concurrently (VMIDs must be assigned). Returns the tasks."""
+    if not tasks:
+        return tasks
+    limiter = StorageLimiter(per_storage)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+        return list(pool.map(lambda task: _run_task(proxmox, task, limiter, node_storages), tasks))
+
+
+def _discover(proxmox) -> Tuple[List[str], List[Dict[str, Any]], Set[int], Dict[str, Dict[str, bool]]]:
+    """(online nodes, template instances, used VMIDs, {node: {storage: shared}})."""
+    nodes = sorted(n['node'] for n in proxmox.nodes.get() if n.get('status') == 'online')
+    templates, used = [], set()
+    # Uncached: the used VMIDs feed allocation
+    with fresh_reads():
+        vm_resources = proxmox.cluster.resources.get(type='vm')
+    for r in vm_resources:
+        used.add(int(r['vmid']))
+        if r.get('type') == 'qemu' and r.get('template') == 1:
+            templates.append({'vmid': int(r['vmid']), 'name': r.get('name') or f"tpl-{r['vmid']}", 'node': r['node']})
+    node_storages: Dict[str, Dict[str, bool]] = {}
+    for r in proxmox.cluster.resources.get(type='storage'):
+        if r.get('status', 'available') == 'available':
+            node_storages.setdefault(r['node'], {})[r['storage']] = bool(r.get('shared'))
+    return nodes, templates, used, node_storages
+
+
+def replicate_cluster_templates(proxmox, cluster_ip: str, cluster_id: Optional[str] = None) -> Dict[str, Any]:
+    """Plan and run template replication for one cluster. Returns stats."""
+    from app.services.db_writer import queue_write
+    from app.services.vmid_allocator import allocate_vmid, release_reservations
+
+    nodes, templates, used, node_storages = _discover(proxmox)
+    logger.info(f"Template replication: {len(templates)} template instance(s) on nodes {nodes}")
+
+    # Disk storages of every instance (any of them may be picked as a clone source)
+    to_read = sorted(templates, key=lambda t: (t['node'], t['vmid']))
+
+    def read_storages(tpl):
+        try:
+            return (tpl['node'], tpl['vmid']), disk_storages(proxmox.nodes(tpl['node']).qemu(tpl['vmid']).config.get())
+        except Exception as e:
+            logger.warning(f"Could not read config of template {tpl['vmid']} on {tpl['node']}: {e}")
+            return (tpl['node'], tpl['vmid']), set()
+
+    template_storages = {}
+    if to_read:
+        with ThreadPoolExecutor(max_workers=min(TEMPLATE_REPLICATION_WORKERS, len(to_read))) as pool:
+            template_storages = dict(pool.map(read_storages, to_read))
+
+    plan = plan_replication(templates, nodes, template_storages, node_storages)
+    if plan.skipped_shared:
+        logger.info(f"Skipping {len(plan.skipped_shared)} replica(s) on nodes that share the template's storage")
+
+    def owner(task):
+        return f"template-replication:{cluster_ip}:{task.name}:{task.target_node}"
+
+    for task in plan.tasks:
+        task.vmid = allocate_vmid(start=200, cluster_id=cluster_id, owner=owner(task), extra_used=used)
+        if task.vmid is None:
+            task.error = "no free VMID"
+        else:
+            used.add(task.vmid)
+    runnable = [t for t in plan.tasks if t.vmid is not None]
+    logger.info(f"Replicating {len(runnable)} (template, node) pair(s)")
+    run_replication(proxmox, runnable, node_storages)
+
+    now = datetime.utcnow()
+    known = [{'name': t['name'], 'proxmox_vmid': t['vmid'], 'cluster_ip': cluster_ip, 'node': t['node'],
+              'is_replica': False, 'last_verified_at': now} for t in templates]
+    replicas = [{'name': t.replica_name, 'proxmox_vmid': t.vmid, 'cluster_ip': cluster_ip, 'node': t.target_node,
+                 'is_replica': True, 'last_verified_at': now} for t in plan.tasks if t.done]
+    queue_write(lambda: _register_templates(known, replicas)).result()
+    # Failed replicas were destroyed; successful ones and orphaned clones keep their VMID reserved
+    # (replicas until inventory sync sees them, orphans until someone removes them)
+    for task in plan.tasks:
+        if task.error and task.vmid is not None and not task.orphan_node:
+            release_reservations(owner(task))
+
+    return {
+        'templates': len(templates),
+        'planned': len(plan.tasks),
+        'replicated': sum(1 for t in plan.tasks if t.done),
+        'failed': sum(1 for t in plan.tasks if t.error),
+        'orphaned': [{'vmid': t.vmid, 'node': t.orphan_node} for t in plan.tasks if t.orphan_node],
+        'skipped_shared': len(plan.skipped_shared),
+    }
+
+
+def _register_templates(known: List[Dict[str, Any]], replicas: List[Dict[str, Any]]) -> None:
+    from app.models import Template
+    from app.utils.db_dialect import upsert
+
+    keys = ('cluster_ip', 'node', 'proxmox_vmid')
+    # Existing rows keep their flags; only name and verification time refresh
+    upsert(Template, known, conflict_columns=keys, update_columns=['name', 'last_verified_at'])
+    upsert(Template, replicas, conflict_columns=keys)
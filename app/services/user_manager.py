@@ -7,18 +7,31 @@ This module handles user authentication, admin checking, and user management.
 
 import logging
 import re
-import threading
+import time
+import uuid
 from typing import Any, Dict, List, Optional
 
-from flask import abort, session
+from flask import abort, has_request_context, session
+
+from app.config import IDENTITY_REVALIDATE_TTL
+from app.utils.caching import ThreadSafeCache
 
 logger = logging.getLogger(__name__)
 
-# Admin group membership cache (per-group caching)
-_admin_group_cache: Dict[str, List[str]] = {}  # groupid -> members
-_admin_group_ts: Dict[str, float] = {}  # groupid -> timestamp
-_admin_group_lock = threading.Lock()
+# Admin group membership cache (groupid -> members). Entries are fresh for
+# ADMIN_GROUP_CACHE_TTL but retained longer so a Proxmox outage can fall back
+# to the last known membership.
 ADMIN_GROUP_CACHE_TTL = 120  # 2 minutes
+_admin_group_cache = ThreadSafeCache(ttl=3600, max_entries=256, name="admin_groups")
+
+# Roles epoch: changes whenever roles change (admin group edits, local role
+# updates) so session identity claims are re-resolved on the next request.
+# It lives in system_settings so a bump reaches every worker process; each
+# worker re-reads it at most every ROLES_EPOCH_CHECK_SECONDS.
+ROLES_EPOCH_SETTING = 'roles_epoch'
+ROLES_EPOCH_CHECK_SECONDS = 5
+_roles_epoch_cache = ThreadSafeCache(ttl=ROLES_EPOCH_CHECK_SECONDS, max_entries=1, name="roles_epoch")
+_last_roles_epoch: Optional[str] = None  # last value seen by this process
 
 
 def require_user() -> str:
@@ -93,22 +106,17 @@ def _get_admin_group_members_cached(admin_group: str) -> List[str]:
     Returns:
         List of userids in the group
     """
-    global _admin_group_cache, _admin_group_ts
-    
     if not admin_group:
         return []
     
-    import time
-    now = time.time()
-    
     # Cache key based on group name
     cache_key = admin_group
     
-    # Check cache first (thread-safe read)
-    with _admin_group_lock:
-        if cache_key in _admin_group_cache and (now - _admin_group_ts.get(cache_key, 0)) < ADMIN_GROUP_CACHE_TTL:
-            logger.debug("Using cached admin group members for %s (age=%.1fs)", admin_group, now - _admin_group_ts.get(cache_key, 0))
-            return list(_admin_group_cache[cache_key])
+    # Check cache first
+    cached = _admin_group_cache.peek(cache_key)
+    if cached is not None and cached[1] < ADMIN_GROUP_CACHE_TTL:
+        logger.debug("Using cached admin group members for %s (age=%.1fs)", admin_group, cached[1])
+        return list(cached[0])
     
     # Cache miss or expired - fetch from Proxmox
     try:
@@ -122,20 +130,16 @@ def _get_admin_group_members_cached(admin_group: str) -> List[str]:
             elif isinstance(m, dict) and "userid" in m:
                 members.append(m["userid"])
         
-        # Update cache (thread-safe write)
-        with _admin_group_lock:
-            _admin_group_cache[cache_key] = members
-            _admin_group_ts[cache_key] = now
+        _admin_group_cache.set(cache_key, members)
         logger.debug("Refreshed admin group cache for %s: %d members", admin_group, len(members))
         return members
         
     except Exception as e:
         logger.warning("Failed to get admin group members for %s: %s", admin_group, e)
         # On error, return cached value if we have one (even if expired)
-        with _admin_group_lock:
-            if cache_key in _admin_group_cache:
-                logger.debug("Using stale admin group cache for %s due to error", admin_group)
-                return list(_admin_group_cache[cache_key])
+        if cached is not None:
+            logger.debug("Using stale admin group cache for %s due to error", admin_group)
+            return list(cached[0])
         return []
 
 
@@ -171,8 +175,23 @@ def is_admin_user(user: str) -> bool:
     if not user:
         return False
     
+    # The logged-in user's roles come from the session claim (no Proxmox call)
+    if has_request_context() and session.get("user") == user:
+        identity = get_session_identity()
+        return bool(identity and identity.get("is_admin"))
+    
+    return _resolve_is_admin(user)
+
+
+def _is_proxmox_realm_user(user: str) -> bool:
+    """True for users authenticated via Proxmox (user@pve / user@pam)."""
+    return '@' in user and (user.endswith('@pve') or user.endswith('@pam'))
+
+
+def _resolve_is_admin(user: str) -> bool:
+    """Check admin status against Proxmox admin groups / local roles (uncached)."""
     # Check if user has Proxmox realm suffix (authenticated via Proxmox)
-    if '@' in user and (user.endswith('@pve') or user.endswith('@pam')):
+    if _is_proxmox_realm_user(user):
         # Check if user is in any configured admin group
         from app.services.settings_service import get_all_admin_groups
         admin_groups = get_all_admin_groups()
@@ -204,6 +223,114 @@ def is_admin_user(user: str) -> bool:
     return False
 
 
+def resolve_identity(user: str) -> Dict[str, Any]:
+    """Compute a user's effective roles (one admin check, one local user lookup).
+    
+    Returns a JSON-serialisable claim stored in the (signed) Flask session:
+    {"user", "is_admin", "local_user": {"id", "username", "role"} | None,
+     "resolved_at", "epoch"}
+    """
+    local_user = None
+    try:
+        from app.services.class_service import get_user_by_username
+        username = user.split('@')[0] if '@' in user else user
+        db_user = get_user_by_username(username)
+        if db_user:
+            local_user = {"id": db_user.id, "username": db_user.username, "role": db_user.role}
+    except Exception as e:
+        logger.debug("resolve_identity(%s): local user lookup failed: %s", user, e)
+    
+    if _is_proxmox_realm_user(user):
+        is_admin = _resolve_is_admin(user)
+    else:
+        is_admin = bool(local_user and local_user["role"] == 'adminer')
+    
+    return {
+        "user": user,
+        "is_admin": is_admin,
+        "local_user": local_user,
+        "resolved_at": time.time(),
+        "epoch": current_roles_epoch(),
+    }
+
+
+def establish_session_identity(user: str) -> Dict[str, Any]:
+    """Resolve roles at login and store them as the session identity claim."""
+    identity = resolve_identity(user)
+    session["identity"] = identity
+    return identity
+
+
+def get_session_identity() -> Optional[Dict[str, Any]]:
+    """Return the logged-in user's identity claim, re-validating it when stale.
+    
+    The claim is re-resolved when it belongs to another user, is older than
+    IDENTITY_REVALIDATE_TTL, or roles changed in any worker since it was
+    issued (see bump_roles_epoch()).
+    """
+    user = session.get("user")
+    if not user:
+        return None
+    
+    identity = session.get("identity")
+    if (
+        not isinstance(identity, dict)
+        or identity.get("user") != user
+        or identity.get("epoch") != current_roles_epoch()
+        or time.time() - identity.get("resolved_at", 0) >= IDENTITY_REVALIDATE_TTL
+    ):
+        identity = establish_session_identity(user)
+        logger.debug("Re-validated session identity for %s (is_admin=%s)", user, identity["is_admin"])
+    return identity
+
+
+def clear_session_identity() -> None:
+    """Drop the identity claim (logout)."""
+    session.pop("identity", None)
+
+
+def current_roles_epoch() -> str:
+    """Roles epoch identity claims are checked against (shared by all workers)."""
+    global _last_roles_epoch
+    
+    epoch = _roles_epoch_cache.get('epoch')
+    if epoch is None:
+        try:
+            from app.models import SystemSettings
+            epoch = SystemSettings.get(ROLES_EPOCH_SETTING, '0') or '0'
+        except Exception as e:
+            # No database (or it is unavailable): keep the last known value
+            logger.debug("Could not read roles epoch: %s", e)
+            epoch = _last_roles_epoch or '0'
+        _roles_epoch_cache.set('epoch', epoch)
+    if _last_roles_epoch is not None and epoch != _last_roles_epoch:
+        # Roles changed (possibly in another worker): our admin group cache may be stale too
+        _admin_group_cache.invalidate()
+    _last_roles_epoch = epoch
+    return epoch
+
+
+def bump_roles_epoch() -> None:
+    """Invalidate all session identity claims in every worker (role change).
+    
+    Immediate in this process; other workers notice within
+    ROLES_EPOCH_CHECK_SECONDS.
+    """
+    from app.services.db_writer import queue_write
+    
+    epoch = uuid.uuid4().hex
+    
+    def _store():
+        from app.models import SystemSettings
+        SystemSettings.set(ROLES_EPOCH_SETTING, epoch, description="Changes whenever user roles change")
+    
+    try:
+        queue_write(_store)
+    except Exception as e:
+        logger.warning("Could not share roles epoch with other workers: %s", e)
+    _roles_epoch_cache.set('epoch', epoch)
+
+
 def get_admin_group_members() -> List[str]:
     """Get list of users in all configured admin groups (aggregated across clusters)."""
     from app.services.settings_service import get_all_admin_groups
@@ -223,10 +350,8 @@ def get_admin_group_members() -> List[str]:
 
 def _invalidate_admin_group_cache() -> None:
     """Invalidate the admin group cache to force a refresh on next access."""
-    global _admin_group_cache, _admin_group_ts
-    with _admin_group_lock:
-        _admin_group_cache.clear()
-        _admin_group_ts.clear()
+    _admin_group_cache.invalidate()
+    bump_roles_epoch()
     logger.debug("Invalidated admin group cache")
 
 
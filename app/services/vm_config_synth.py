@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+VM Config Synthesis - build a VM's complete config in memory, write it once.
+
+Student VMs used to be assembled with a chain of remote calls, each a separate
+SSH exec and a separate cluster config-lock acquisition:
+- config clone: hostname, cat template config, write, cat to verify,
+  qm showcmd, plus mkdir/qemu-img/chmod/chown/ls for each EFI/TPM disk
+- VM shell: qm create, then agent, EFI disk, boot order and the remaining
+  template settings one qm set (or API call) at a time, and a qm config check
+
+Now the full config (template config plus overrides) is computed here and
+written with one remote call:
+- config clone: one script creates the EFI/TPM state files, writes the .conf
+  and reads it back through pvesh; the digest Proxmox returns (SHA-1 of the
+  config file) must match the digest of the config we rendered
+- VM shell: one `qm create` carrying every option, followed in the same call
+  by the pvesh read-back used to check the settings landed
+"""
+
+import base64
+import hashlib
+import json
+import re
+import shlex
+from typing import Any, Dict, List, Optional, Tuple
+
+# Settings never passed to qm create
+CREATE_SKIP_KEYS = ('vmid', 'digest', 'meta', 'template')
+
+# Standard sizes of the EFI vars and TPM state files
+EFI_DISK_SIZE = '528K'
+TPM_STATE_SIZE = '4M'
+
+DISK_LINE = re.compile(r'^(scsi|virtio|sata|ide)(\d+)$')
+
+
+def parse_vm_config(text: str) -> Tuple[List[str], Dict[str, str]]:
+    """(description comment lines, settings) of a qemu-server .conf file.
+
+    Snapshot sections ('[name]') are not part of the VM's current config and
+    are dropped.
+    """
+    comments: List[str] = []
+    settings: Dict[str, str] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            break
+        if not line:
+            continue
+        if line.startswith('#'):
+            comments.append(line)
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            settings[key.strip()] = value.strip()
+    return comments, settings
+
+
+def render_vm_config(settings: Dict[str, str], comments: List[str] = ()) -> str:
+    """qemu-server .conf text for settings (description comments first)."""
+    lines = list(comments) + [f"{key}: {value}" for key, value in settings.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def config_digest(text: str) -> str:
+    """Digest Proxmox reports for a config file (SHA-1 of its content)."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _with_path(value: str, volume: str, force_qcow2: bool = False) -> str:
+    """Disk value with its volume replaced and every option kept."""
+    parts = value.split(',', 1)
+    options = [opt.strip() for opt in parts[1].split(',')] if len(parts) > 1 else []
+    if force_qcow2:
+        # Overlay disks are QCOW2 whatever the template's format was
+        options = ['format=qcow2'] + [opt for opt in options if not opt.startswith('format=')]
+    return ','.join([volume] + options)
+
+
+def synthesize_clone_config(template: Dict[str, str], dest_vmid: int, dest_name: str,
+                            overlay_disk_path: str, storage: str, mac: str) -> Dict[str, str]:
+    """Config of a student VM cloned from a template config.
+
+    Args:
+        template: Template settings (parse_vm_config)
+        overlay_disk_path: Overlay volume relative to storage ("58000/vm-58000-disk-0.qcow2")
+        storage: Storage of the overlay and EFI/TPM state files
+        mac: MAC address for net0
+    """
+    config: Dict[str, str] = {}
+    for key, value in template.items():
+        # 'parent' names a template snapshot the clone does not have
+        if key in ('template', 'parent'):
+            continue
+        if key == 'name':
+            value = dest_name
+        elif DISK_LINE.match(key) and 'media=cdrom' not in value:
+            value = _with_path(value, f"{storage}:{overlay_disk_path}",
+                               force_qcow2=overlay_disk_path.endswith('.qcow2'))
+        elif key == 'efidisk0':
+            value = _with_path(value, f"{storage}:{dest_vmid}/vm-{dest_vmid}-disk-1.raw")
+        elif key == 'tpmstate0':
+            value = _with_path(value, f"{storage}:{dest_vmid}/vm-{dest_vmid}-disk-2.raw")
+        elif key == 'net0':
+            # "virtio=XX:XX:XX:XX:XX:XX,bridge=vmbr0,..." - replace the MAC only
+            value = re.sub(r'([^=,]+)=([0-9A-Fa-f:]+)', f'\\1={mac}', value, count=1)
+        config[key] = value
+    if 'name' not in config:
+        config = {'name': dest_name, **config}
+    return config
+
+
+def write_config_script(vmid: int, text: str, disk_dir: Optional[str] = None,
+                        efi: bool = False, tpm: bool = False) -> str:
+    """Script creating EFI/TPM state files, writing /etc/pve/qemu-server/<vmid>.conf
+    and printing the config (with digest) as JSON.
+
+    Refuses to overwrite an existing VM. A failed TPM state file is reported
+    with an '@@warn' line instead of failing the VM.
+    """
+    vmid = int(vmid)
+    conf = f"/etc/pve/qemu-server/{vmid}.conf"
+    lines = ['set -e', f'test ! -e {conf} || {{ echo "VM {vmid} already exists" >&2; exit 1; }}']
+    if disk_dir and (efi or tpm):
+        lines.append(f"mkdir -p {shlex.quote(disk_dir)}")
+    if disk_dir and efi:
+        efi_path = shlex.quote(f"{disk_dir}/vm-{vmid}-disk-1.raw")
+        lines.append(f"qemu-img create -f raw {efi_path} {EFI_DISK_SIZE} >/dev/null && chmod 600 {efi_path}")
+    if disk_dir and tpm:
+        tpm_path = shlex.quote(f"{disk_dir}/vm-{vmid}-disk-2.raw")
+        lines.append(f"{{ qemu-img create -f raw {tpm_path} {TPM_STATE_SIZE} >/dev/null && chmod 600 {tpm_path}; }} "
+                     f"|| echo '@@warn TPM state file could not be created'")
+    encoded = base64.b64encode(text.encode('utf-8')).decode('ascii')
+    lines.append(f"echo {encoded} | base64 -d > {conf}")
+    lines.append(f'pvesh get "/nodes/$(hostname)/qemu/{vmid}/config" --output-format json')
+    return '\n'.join(lines)
+
+
+def qm_create_command(vmid: int, options: Dict[str, Any]) -> str:
+    """One `qm create` carrying every option, then the created config as JSON."""
+    args = ''.join(f" --{key} {shlex.quote(str(value))}" for key, value in options.items()
+                   if value is not None and key not in CREATE_SKIP_KEYS)
+    return (f"qm create {int(vmid)}{args} && "
+            f'pvesh get "/nodes/$(hostname)/qemu/{int(vmid)}/config" --output-format json')
+
+
+def parse_written_config(output: str) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """(config JSON printed by the read-back, '@@warn' messages) from a write's stdout."""
+    warnings = [line[len('@@warn '):] for line in output.splitlines() if line.startswith('@@warn ')]
+    start = output.find('{')
+    if start < 0:
+        return None, warnings
+    try:
+        return json.loads(output[start:output.rfind('}') + 1]), warnings
+    except ValueError:
+        return None, warnings
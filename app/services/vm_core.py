@@ -18,10 +18,16 @@ in inventory_service.py and background_sync.py.
 
 import logging
 import os
+import shlex
 import time
 from typing import Dict, Optional, Tuple
 
 from app.services.ssh_executor import SSHExecutor
+from app.services.vm_config_synth import (
+    CREATE_SKIP_KEYS,
+    parse_written_config,
+    qm_create_command,
+)
 from app.services.vm_utils import (
     sanitize_vm_name,
 )
@@ -64,7 +70,9 @@ def get_vm_node(ssh_executor: SSHExecutor, vmid: int, proxmox=None) -> Optional[
         
         if proxmox:
             try:
-                resources = proxmox.cluster.resources.get(type='vm')
+                from app.services.proxmox_cache import fresh_reads
+                with fresh_reads():
+                    resources = proxmox.cluster.resources.get(type='vm')
                 for resource in resources:
                     if resource.get('vmid') == vmid:
                         node = resource.get('node')
@@ -165,163 +173,68 @@ def create_vm_shell(
     if scsihw is not None:
         other_settings.pop('scsihw', None)
     
-    # Agent is always removed since we apply it separately later
+    # Agent is always removed since it is set explicitly below
     other_settings.pop('agent', None)
     
     logger.info(f"Creating VM {vmid} with: ostype={ostype}, scsihw={scsihw}, bios={bios}, cpu={cpu}, machine={machine}, memory={memory}, cores={cores}")
     logger.info(f"Remaining other_settings to apply: {len(other_settings)} items")
     
-    # Base command
-    cmd = (
-        f"qm create {vmid} --name {safe_name} "
-        f"--memory {memory} --cores {cores} "
-        f"--net0 {net_model},bridge={network_bridge}{net_options} "
-        f"--ostype {ostype}"
-    )
-    
-    # Add hardware settings (use explicit values if provided, otherwise use defaults)
-    if cpu:
-        cmd += f" --cpu {cpu}"
-    if machine:
-        cmd += f" --machine {machine}"
-    if bios:
-        cmd += f" --bios {bios}"
-    if scsihw:
-        cmd += f" --scsihw {scsihw}"
-        logger.info(f"Setting SCSI controller for VM {vmid}: {scsihw}")
+    # Every option goes into one qm create: a single remote call and a single
+    # config write instead of qm create followed by a qm set/API call per setting
+    options = {
+        'name': safe_name,
+        'memory': memory,
+        'cores': cores,
+        'net0': f"{net_model},bridge={network_bridge}{net_options}",
+        'ostype': ostype,
+        'cpu': cpu or None,
+        'machine': machine or None,
+        'bios': bios or None,
+        'scsihw': scsihw or None,
+    }
+    # For UEFI VMs (ovmf), add EFI disk automatically
+    if bios and bios.lower() == 'ovmf':
+        options['efidisk0'] = f"{storage}:1,efitype=4m,pre-enrolled-keys=1"
+    # Enable QEMU guest agent by default
+    options['agent'] = "enabled=1,fstrim_cloned_disks=1"
+    # Boot order is CRITICAL for Windows boot
+    if boot_order:
+        options['boot'] = boot_order
+    extra = {key: value for key, value in other_settings.items()
+             if value is not None and key not in CREATE_SKIP_KEYS and key != 'name'}
     
     try:
-        exit_code, stdout, stderr = ssh_executor.execute(cmd, timeout=60, check=False)
+        exit_code, stdout, stderr = ssh_executor.execute(
+            qm_create_command(vmid, {**options, **extra}), timeout=120, check=False)
+        
+        if exit_code != 0 and extra:
+            # One template setting qm create rejects would fail the whole VM;
+            # fall back to the base options and apply the extras one by one
+            logger.warning(f"qm create {vmid} with {len(extra)} template settings failed "
+                           f"({stderr.strip()[:300]}), retrying without them")
+            exit_code, stdout, stderr = ssh_executor.execute(
+                qm_create_command(vmid, options), timeout=120, check=False)
+            if exit_code == 0:
+                _apply_settings_individually(ssh_executor, vmid, extra)
+                extra = {}
         
         if exit_code != 0:
             error_msg = stderr.strip() or stdout.strip() or "Unknown error"
             logger.error(f"Failed to create VM shell {vmid}: {error_msg}")
             return False, error_msg
         
-        logger.info(f"Created VM shell: {vmid} ({safe_name})")
+        logger.info(f"Created VM shell: {vmid} ({safe_name}) with {len(options) + len(extra)} settings")
         
-        # Get Proxmox API connection for post-creation config (API auto-routes to correct node)
-        try:
-            from app.services.proxmox_service import get_proxmox_admin
-            proxmox = get_proxmox_admin()
-        except Exception as e:
-            logger.warning(f"Could not get Proxmox API, falling back to SSH commands: {e}")
-            proxmox = None
-        
-        # Verify which node the VM is on (may have auto-migrated)
-        vm_node = get_vm_node(ssh_executor, vmid, proxmox)
-        if not vm_node:
-            logger.warning(f"Could not determine node for VM {vmid}, assuming current node")
-            # Try to get current node from SSH
-            exit_code, stdout, _ = ssh_executor.execute("hostname", timeout=5, check=False)
-            vm_node = stdout.strip() if exit_code == 0 else "localhost"
-        
-        logger.info(f"VM {vmid} is on node: {vm_node}")
-        
-        # For UEFI VMs (ovmf), add EFI disk automatically
-        if bios and bios.lower() == 'ovmf':
-            logger.info(f"UEFI VM detected, adding EFI disk to VM {vmid}")
-            if proxmox:
-                try:
-                    proxmox.nodes(vm_node).qemu(vmid).config.set(efidisk0=f"{storage}:1,efitype=4m,pre-enrolled-keys=1")
-                    logger.info(f"Added EFI disk to VM {vmid} via API")
-                except Exception as e:
-                    logger.error(f"Failed to add EFI disk via API: {e}")
-            else:
-                # Fallback to SSH qm command
-                efi_cmd = f"qm set {vmid} --efidisk0 {storage}:1,efitype=4m,pre-enrolled-keys=1"
-                exit_code, stdout, stderr = ssh_executor.execute(efi_cmd, timeout=30, check=False)
-                if exit_code != 0:
-                    logger.error(f"Failed to add EFI disk via SSH: {stderr}")
-        
-        # Enable QEMU guest agent by default
-        agent_enabled = False
-        if proxmox:
-            try:
-                # Note: agent parameter must be passed as plain value, not key=value format
-                proxmox.nodes(vm_node).qemu(vmid).config.set(agent='1')
-                logger.info(f"Enabled QEMU guest agent for VM {vmid} via API")
-                agent_enabled = True
-            except Exception as e:
-                logger.warning(f"Failed to enable guest agent via API: {e}, trying SSH fallback")
-        
-        if not agent_enabled:
-            # Fallback to SSH qm command
-            agent_cmd = f"qm set {vmid} --agent enabled=1,fstrim_cloned_disks=1"
-            exit_code, stdout, stderr = ssh_executor.execute(agent_cmd, timeout=30, check=False)
-            if exit_code == 0:
-                logger.info(f"Enabled QEMU guest agent for VM {vmid} via SSH")
-                agent_enabled = True
-            else:
-                logger.error(f"Failed to enable QEMU guest agent for VM {vmid}: {stderr}")
-                # Don't fail the VM creation, but log prominently
-        
-        # Verify guest agent was actually enabled by reading config
-        verify_cmd = f"qm config {vmid} | grep agent"
-        exit_code, stdout, stderr = ssh_executor.execute(verify_cmd, timeout=10, check=False)
-        if exit_code == 0 and 'enabled=1' in stdout:
-            logger.info(f"Verified QEMU guest agent is enabled for VM {vmid}")
+        # Verify the settings landed from the config read back in the same call
+        written, _ = parse_written_config(stdout)
+        if written is None:
+            logger.warning(f"Could not read back config of VM {vmid}")
         else:
-            logger.warning(f"Could not verify guest agent for VM {vmid}, output: {stdout}")
-        
-        # Apply boot order if provided (CRITICAL for Windows boot - must come before other settings)
-        if boot_order:
-            logger.info(f"Applying boot order to VM {vmid}: {boot_order}")
-            if proxmox:
-                try:
-                    # boot_order comes as 'order=scsi0;ide2;net0' from template
-                    proxmox.nodes(vm_node).qemu(vmid).config.set(boot=boot_order)
-                    logger.info(f"✓ Boot order applied to VM {vmid} via API: {boot_order}")
-                except Exception as e:
-                    logger.error(f"✗ Failed to apply boot order via API: {e}")
-            else:
-                boot_cmd = f"qm set {vmid} --boot {boot_order}"
-                exit_code, stdout, stderr = ssh_executor.execute(boot_cmd, timeout=30, check=False)
-                if exit_code == 0:
-                    logger.info(f"✓ Boot order applied to VM {vmid}: {boot_order}")
-                else:
-                    logger.error(f"✗ Failed to apply boot order to VM {vmid}: {stderr}")
-        else:
-            logger.debug(f"No boot order specified for VM {vmid}, using Proxmox default")
-        
-        # Apply all other settings from template (if provided)
-        if other_settings:
-            logger.info(f"Applying {len(other_settings)} additional settings to VM {vmid}")
-            settings_applied = 0
-            settings_failed = 0
-            
-            # Apply all settings at once via API (more efficient and reliable)
-            if proxmox:
-                try:
-                    proxmox.nodes(vm_node).qemu(vmid).config.set(**other_settings)
-                    settings_applied = len(other_settings)
-                    logger.info(f"✓ Applied {settings_applied} settings to VM {vmid} via API")
-                except Exception as e:
-                    logger.error(f"Failed to apply settings via API: {e}")
-                    settings_failed = len(other_settings)
-            else:
-                # Fallback to SSH qm commands
-                skip_keys = ['name', 'vmid', 'digest', 'meta', 'template']
-                
-                for key, value in other_settings.items():
-                    if key in skip_keys or value is None:
-                        continue
-                    
-                    # Apply setting via qm command
-                    try:
-                        set_cmd = f"qm set {vmid} --{key} {value}"
-                        exit_code, stdout, stderr = ssh_executor.execute(set_cmd, timeout=30, check=False)
-                        if exit_code == 0:
-                            settings_applied += 1
-                            logger.debug(f"Applied setting {key}={value} to VM {vmid}")
-                        else:
-                            settings_failed += 1
-                            logger.warning(f"Failed to apply setting {key}={value} to VM {vmid}: {stderr}")
-                    except Exception as ex:
-                        settings_failed += 1
-                        logger.warning(f"Error applying setting {key} to VM {vmid}: {ex}")
-            
-            logger.info(f"Applied {settings_applied} settings to VM {vmid}, {settings_failed} failed")
+            if 'enabled=1' not in str(written.get('agent', '')):
+                logger.warning(f"Could not verify guest agent for VM {vmid}: {written.get('agent')}")
+            if boot_order and written.get('boot') != boot_order:
+                logger.error(f"✗ Boot order of VM {vmid} is {written.get('boot')}, expected {boot_order}")
+            logger.info(f"Verified config of VM {vmid} (digest {str(written.get('digest', ''))[:12]})")
         
         return True, ""
         
@@ -330,6 +243,26 @@ def create_vm_shell(
         return False, str(e)
 
 
+def _apply_settings_individually(ssh_executor: SSHExecutor, vmid: int, settings: dict) -> None:
+    """Apply settings with one qm set each, skipping (and logging) the ones that fail."""
+    settings_applied = 0
+    settings_failed = 0
+    for key, value in settings.items():
+        try:
+            set_cmd = f"qm set {vmid} --{key} {shlex.quote(str(value))}"
+            exit_code, stdout, stderr = ssh_executor.execute(set_cmd, timeout=30, check=False)
+            if exit_code == 0:
+                settings_applied += 1
+                logger.debug(f"Applied setting {key}={value} to VM {vmid}")
+            else:
+                settings_failed += 1
+                logger.warning(f"Failed to apply setting {key}={value} to VM {vmid}: {stderr}")
+        except Exception as ex:
+            settings_failed += 1
+            logger.warning(f"Error applying setting {key} to VM {vmid}: {ex}")
+    logger.info(f"Applied {settings_applied} settings to VM {vmid}, {settings_failed} failed")
+
+
 def create_vm_with_disk(
     ssh_executor: SSHExecutor,
     vmid: int,
@@ -91,6 +91,9 @@ def build_vm_from_scratch(
                 node = _find_node_with_iso(proxmox, iso_file)
                 if not node:
                     return False, None, f"Could not find ISO {iso_file} on any node"
+            
+            # ISO on shared storage is reachable from every node - place by load instead
+            node = _place_on_shared_iso_storage(proxmox, iso_file, node, memory_mb, cpu_cores * cpu_sockets)
         
         logger.info(f"Building VM on node {node}")
         
@@ -153,6 +156,23 @@ def build_vm_from_scratch(
         return False, None, str(e)
 
 
+def _place_on_shared_iso_storage(proxmox, iso_file: str, iso_node: str, memory_mb: int, cores: int) -> str:
+    """Pick the least loaded node when the ISO's storage is shared, else keep iso_node."""
+    try:
+        storage_config = proxmox.storage(iso_file.split(':')[0]).get()
+        if not storage_config.get('shared'):
+            return iso_node
+        
+        from app.services.placement import NodeSnapshot, place
+        node = place(NodeSnapshot.from_nodes(proxmox.nodes.get()), memory_mb * 1024 * 1024, cores)
+        if node and node != iso_node:
+            logger.info(f"ISO storage is shared - placing VM on {node} instead of {iso_node}")
+        return node or iso_node
+    except Exception as e:
+        logger.debug(f"Shared-storage placement skipped: {e}")
+        return iso_node
+
+
 def _find_node_with_iso(proxmox, iso_file: str) -> Optional[str]:
     """Find which node has the specified ISO."""
     try:
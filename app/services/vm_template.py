@@ -16,6 +16,7 @@ in inventory_service.py and background_sync.py.
 """
 
 import logging
+import uuid
 from typing import List, Optional, Tuple
 
 from app.services.ssh_executor import SSHExecutor
@@ -33,7 +34,7 @@ from app.services.vm_core import (
 )
 from app.services.vm_utils import (
     build_vm_name,
-    get_next_available_vmid_ssh,
+    get_cluster_vmids_ssh,
     get_vm_mac_address_ssh,
     parse_disk_config,
     sanitize_vm_name,
@@ -41,12 +42,6 @@ from app.services.vm_utils import (
 
 logger = logging.getLogger(__name__)
 
-# Module-level cache for template EFI/TPM status
-# Prevents re-checking template config for every VM (reduces SSH commands)
-# Key: template_vmid, Value: (has_efi, has_tpm)
-_template_efi_tpm_cache = {}
-
-
 # ---------------------------------------------------------------------------
 # Template Export Operations
 # ---------------------------------------------------------------------------
@@ -398,7 +393,7 @@ def create_overlay_vm(
         # Step 2: Clone VM config from template (if template_vmid provided)
         if template_vmid:
             logger.info(f"Cloning VM config from template {template_vmid} to VM {vmid}")
-            from app.services.vm_config_clone import clone_vm_config, check_template_has_efi_tpm
+            from app.services.vm_config_clone import clone_vm_config
             
             # Get template node - prefer passed 'node' parameter, fallback to database lookup
             template_node = node  # Use the node parameter passed to this function
@@ -410,66 +405,6 @@ def create_overlay_vm(
             
             logger.info(f"Template {template_vmid} is on node: {template_node}")
             
-            # Check if template has EFI/TPM disks that need to be created
-            # Use cache to avoid re-checking for every VM
-            if template_vmid in _template_efi_tpm_cache:
-                has_efi, has_tpm = _template_efi_tpm_cache[template_vmid]
-                logger.debug(f"Template {template_vmid} EFI/TPM status from cache: has_efi={has_efi}, has_tpm={has_tpm}")
-            else:
-                has_efi, has_tpm = check_template_has_efi_tpm(ssh_executor, template_vmid, template_node)
-                _template_efi_tpm_cache[template_vmid] = (has_efi, has_tpm)
-                logger.info(f"Template {template_vmid} EFI/TPM check (cached): has_efi={has_efi}, has_tpm={has_tpm}")
-            
-            # Ensure overlay directory exists (should already exist from overlay disk creation)
-            ssh_executor.execute(f"mkdir -p {overlay_dir}", check=False)
-            
-            # Create EFI disk if template has one (required for UEFI boot)
-            if has_efi:
-                logger.info(f"Template has EFI disk, creating for VM {vmid}")
-                efi_path = f"{overlay_dir}/vm-{vmid}-disk-1.raw"
-                # Create 528K EFI disk (standard size) - use qemu-img for proper format
-                efi_cmd = f"qemu-img create -f raw {efi_path} 528K"
-                exit_code, stdout, stderr = ssh_executor.execute(efi_cmd, timeout=30, check=False)
-                if exit_code != 0:
-                    logger.error(f"Failed to create EFI disk: {stderr}")
-                    ssh_executor.execute(f"rm -rf {overlay_dir}", check=False)
-                    return False, f"Failed to create EFI disk: {stderr}", None
-                
-                # Set proper permissions on EFI disk
-                ssh_executor.execute(f"chmod 600 {efi_path}", timeout=10, check=False)
-                ssh_executor.execute(f"chown root:root {efi_path}", timeout=10, check=False)
-                
-                # Verify EFI disk was created
-                verify_cmd = f"ls -lh {efi_path}"
-                exit_code, ls_output, _ = ssh_executor.execute(verify_cmd, timeout=10, check=False)
-                if exit_code == 0:
-                    logger.info(f"Created EFI disk at {efi_path}: {ls_output.strip()}")
-                else:
-                    logger.error(f"EFI disk verification failed - file not found: {efi_path}")
-            
-            # Create TPM state disk if template has one (required for Windows 11)
-            if has_tpm:
-                logger.info(f"Template has TPM, creating for VM {vmid}")
-                tpm_path = f"{overlay_dir}/vm-{vmid}-disk-2.raw"
-                # Create 4M TPM state disk (standard size) - use qemu-img for proper format
-                tpm_cmd = f"qemu-img create -f raw {tpm_path} 4M"
-                exit_code, stdout, stderr = ssh_executor.execute(tpm_cmd, timeout=30, check=False)
-                if exit_code != 0:
-                    logger.warning(f"Failed to create TPM disk: {stderr}")
-                    # Don't fail the whole operation for TPM
-                else:
-                    # Set proper permissions on TPM disk
-                    ssh_executor.execute(f"chmod 600 {tpm_path}", timeout=10, check=False)
-                    ssh_executor.execute(f"chown root:root {tpm_path}", timeout=10, check=False)
-                    
-                    # Verify TPM disk was created
-                    verify_cmd = f"ls -lh {tpm_path}"
-                    exit_code, ls_output, _ = ssh_executor.execute(verify_cmd, timeout=10, check=False)
-                    if exit_code == 0:
-                        logger.info(f"Created TPM disk at {tpm_path}: {ls_output.strip()}")
-                    else:
-                        logger.warning(f"TPM disk verification failed - file not found: {tpm_path}")
-            
             # Disk path relative to storage mount: "58000/vm-58000-disk-0.qcow2"
             overlay_disk_rel = f"{vmid}/vm-{vmid}-disk-0.qcow2"
             
@@ -480,7 +415,8 @@ def create_overlay_vm(
                 dest_name=name,
                 overlay_disk_path=overlay_disk_rel,
                 storage=storage,
-                source_node=template_node,  # Pass node for SSH hop
+                source_node=template_node,
+                disk_dir=overlay_dir,  # EFI/TPM state files are created with the config
             )
             
             if not success:
@@ -489,26 +425,6 @@ def create_overlay_vm(
                 return False, f"Failed to clone VM config: {error}", None
             
             logger.info(f"VM {vmid} created with config from template {template_vmid}, MAC: {mac}")
-            
-            # Verify the config was written correctly (especially EFI/TPM paths)
-            verify_config_cmd = f"cat /etc/pve/qemu-server/{vmid}.conf"
-            exit_code, config_content, _ = ssh_executor.execute(verify_config_cmd, timeout=10, check=False)
-            if exit_code == 0:
-                if has_efi and 'efidisk0:' in config_content:
-                    for line in config_content.split('\n'):
-                        if line.startswith('efidisk0:'):
-                            logger.info(f"VM {vmid} EFI config: {line}")
-                elif has_efi:
-                    logger.error(f"VM {vmid} config missing efidisk0 line!")
-                    
-                if has_tpm and 'tpmstate0:' in config_content:
-                    for line in config_content.split('\n'):
-                        if line.startswith('tpmstate0:'):
-                            logger.info(f"VM {vmid} TPM config: {line}")
-                elif has_tpm:
-                    logger.warning(f"VM {vmid} config missing tpmstate0 line!")
-            else:
-                logger.warning(f"Could not verify VM {vmid} config")
             return True, "", mac
         
         # Step 3: Fallback to old approach if no template_vmid (shouldn't happen in normal usage)
@@ -646,7 +562,7 @@ def create_student_overlays(
         class_prefix: Prefix for VM names
         count: Number of student VMs to create
         node: Proxmox node name
-        start_vmid: Starting VMID (default: auto-detect)
+        start_vmid: Starting VMID (default: reserve a free block of count IDs)
         memory: Memory per VM in MB (default: 2048)
         cores: CPU cores per VM (default: 2)
         
@@ -657,64 +573,78 @@ def create_student_overlays(
     created_vms = []
     successful = 0
     failed = 0
+    if count <= 0:
+        return created_vms, successful, failed
     
-    # Get starting VMID if not specified
+    # Without a start VMID, reserve one block for the whole deployment so a
+    # concurrent deployment can never take any of its IDs
+    owner = None
     if start_vmid is None:
-        start_vmid = get_next_available_vmid_ssh(ssh_executor)
+        from app.services.vmid_allocator import VMID_MAX, allocate_vmid_block
+        owner = f"deploy-{uuid.uuid4().hex}"
+        start_vmid = allocate_vmid_block(size=count, lo=200, hi=VMID_MAX, align=1, owner=owner,
+                                         extra_used=get_cluster_vmids_ssh(ssh_executor))
+        if start_vmid is None:
+            logger.error(f"No free block of {count} VMIDs for {class_prefix}")
+            return created_vms, successful, count
     
     current_vmid = start_vmid
     
-    for i in range(count):
-        student_name = build_vm_name(class_prefix, "student", i + 1)
-        
-        # Find next available VMID with safeguard against infinite loops
-        max_search_iterations = 1000  # Prevent infinite loop if VMID space exhausted
-        search_iterations = 0
-        while search_iterations < max_search_iterations:
-            search_iterations += 1
-            exit_code, _, _ = ssh_executor.execute(
-                f"qm status {current_vmid}",
-                check=False,
-                timeout=10
+    try:
+        for i in range(count):
+            student_name = build_vm_name(class_prefix, "student", i + 1)
+            
+            if owner:
+                vmid = start_vmid + i
+            else:
+                vmid = _next_unused_vmid(ssh_executor, current_vmid)
+                if vmid is None:
+                    failed += 1
+                    continue  # Skip this VM and try next one
+                current_vmid = vmid + 1
+            
+            success, error, mac = create_overlay_vm(
+                ssh_executor=ssh_executor,
+                vmid=vmid,
+                name=student_name,
+                base_qcow2_path=base_qcow2_path,
+                node=node,
+                memory=memory,
+                cores=cores,
             )
-            if exit_code != 0:
-                break  # VMID is available
-            current_vmid += 1
-        
-        if search_iterations >= max_search_iterations:
-            logger.error(f"Failed to find available VMID after {max_search_iterations} iterations (starting from {current_vmid - max_search_iterations})")
-            failed += 1
-            continue  # Skip this VM and try next one
-        
-        vmid = current_vmid
-        current_vmid += 1
-        
-        success, error, mac = create_overlay_vm(
-            ssh_executor=ssh_executor,
-            vmid=vmid,
-            name=student_name,
-            base_qcow2_path=base_qcow2_path,
-            node=node,
-            memory=memory,
-            cores=cores,
-        )
-        
-        if success:
-            created_vms.append({
-                'vmid': vmid,
-                'name': student_name,
-                'mac': mac,
-                'node': node,
-            })
-            successful += 1
-            logger.info(f"Created student VM {vmid} ({student_name})")
-        else:
-            failed += 1
-            logger.error(f"Failed to create student VM: {error}")
+            
+            if success:
+                created_vms.append({
+                    'vmid': vmid,
+                    'name': student_name,
+                    'mac': mac,
+                    'node': node,
+                })
+                successful += 1
+                logger.info(f"Created student VM {vmid} ({student_name})")
+            else:
+                failed += 1
+                logger.error(f"Failed to create student VM: {error}")
+    finally:
+        # Unused IDs of the block go back to the pool; created VMs keep
+        # theirs until inventory sync sees them
+        if owner:
+            from app.services.vmid_allocator import release_reservations
+            release_reservations(owner, keep=[vm['vmid'] for vm in created_vms])
     
     return created_vms, successful, failed
 
 
+def _next_unused_vmid(ssh_executor: SSHExecutor, vmid: int, max_search: int = 1000) -> Optional[int]:
+    """First VMID from vmid on that `qm status` does not know (caller-chosen ranges)."""
+    for candidate in range(vmid, vmid + max_search):
+        exit_code, _, _ = ssh_executor.execute(f"qm status {candidate}", check=False, timeout=10)
+        if exit_code != 0:
+            return candidate
+    logger.error(f"Failed to find available VMID after {max_search} iterations (starting from {vmid})")
+    return None
+
+
 # ---------------------------------------------------------------------------
 # Full Clone Operations (via SSH qm clone)
 # ---------------------------------------------------------------------------
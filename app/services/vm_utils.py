@@ -17,86 +17,56 @@ in inventory_service.py and background_sync.py.
 
 import logging
 import re
+import uuid
 from typing import Optional, Set
 
 logger = logging.getLogger(__name__)
 
-# Import VMInventory model for VMID lookup
-from app.models import VMInventory  # noqa: E402 - import after logger setup
 
-
-def get_optimal_node(ssh_executor, proxmox=None, vm_memory_mb=2048, simulated_vms_per_node=None) -> str:
+def get_optimal_node(ssh_executor, proxmox=None, vm_memory_mb=2048, simulated_vms_per_node=None,
+                     snapshot=None, vm_cores=0, io=False) -> str:
     """
     Find the optimal Proxmox node for VM creation based on resource availability.
     
-    Selects node with most available RAM and CPU capacity, accounting for
-    VMs that will be created in the same batch (simulated weighting).
+    Scoring and batch accounting live in app.services.placement. Pass a
+    NodeSnapshot to place successive VMs of a batch against one node scan;
+    otherwise nodes are queried and VMs counted in simulated_vms_per_node are
+    charged before choosing.
     
     Args:
         ssh_executor: SSH executor for running commands
         proxmox: Optional ProxmoxAPI connection (if None, uses SSH to query)
         vm_memory_mb: Memory per VM in MB (for simulated weighting)
         simulated_vms_per_node: Dict of {node_name: count} for VMs being created
+        snapshot: Optional placement.NodeSnapshot shared across a batch (updated in place)
+        vm_cores: CPU cores per VM (charged against node CPU)
+        io: True for overlay-backed VMs (weigh probed storage path quality)
         
     Returns:
         Node name with most available resources
     """
+    from app.services.placement import NodeSnapshot, place
+
+    vm_mem = vm_memory_mb * 1024 * 1024
     try:
         # Track simulated VM allocations if not provided
         if simulated_vms_per_node is None:
             simulated_vms_per_node = {}
-            
-        # Try to use Proxmox API if available
-        if proxmox:
+        
+        nodes = None
+        if snapshot is None and proxmox:
             nodes = proxmox.nodes.get()
-            best_node = None
-            best_score = -1
-            
-            for node in nodes:
-                if node.get('status') != 'online':
-                    continue
-                
-                node_name = node['node']
-                    
-                # Calculate availability score (higher is better)
-                # Weight RAM more heavily than CPU (RAM is usually the bottleneck)
-                try:
-                    mem_total = float(node.get('maxmem', 1))
-                    mem_used = float(node.get('mem', 0))
-                    
-                    # Add simulated memory usage from VMs being created
-                    simulated_count = simulated_vms_per_node.get(node_name, 0)
-                    simulated_mem = simulated_count * vm_memory_mb * 1024 * 1024  # Convert MB to bytes
-                    mem_used += simulated_mem
-                except (ValueError, TypeError) as e:
-                    logger.debug(f"Node {node_name}: Invalid memory values ({e}), skipping")
-                    continue
-                
-                mem_free_pct = (mem_total - mem_used) / mem_total if mem_total > 0 else 0
-                
-                try:
-                    # Get max CPU cores (this is informational, not used in calculation)
-                    # cpu_total = float(node.get('maxcpu', 1))
-                    cpu_used = float(node.get('cpu', 0))
-                except (ValueError, TypeError):
-                    logger.debug(f"Node {node_name}: Invalid CPU values, using defaults")
-                    # Use defaults in case of error
-                    cpu_used = 0
-                    
-                cpu_free_pct = (1 - cpu_used) if cpu_used < 1 else 0
-                
-                # Score: 70% RAM + 30% CPU
-                score = (mem_free_pct * 0.7) + (cpu_free_pct * 0.3)
-                
-                simulated_note = f" (+{simulated_count} simulated VMs)" if simulated_count > 0 else ""
-                logger.debug(f"Node {node_name}: {mem_free_pct*100:.1f}% RAM free, {cpu_free_pct*100:.1f}% CPU free, score={score:.3f}{simulated_note}")
-                
-                if score > best_score:
-                    best_score = score
-                    best_node = node_name
-            
+            snapshot = NodeSnapshot.from_nodes(nodes)
+            for node_name, count in simulated_vms_per_node.items():
+                i = snapshot.index(node_name)
+                if i is not None:
+                    snapshot.reserve(i, count * vm_mem, count * vm_cores)
+        
+        if snapshot is not None:
+            best_node = place(snapshot, vm_mem, vm_cores, io=io)
             if best_node:
-                logger.info(f"Selected optimal node: {best_node} (score={best_score:.3f})")
+                logger.info(f"Selected optimal node: {best_node} "
+                            f"(score={snapshot.score(snapshot.index(best_node)):.3f} after placement)")
                 # Increment simulated count for next VM
                 simulated_vms_per_node[best_node] = simulated_vms_per_node.get(best_node, 0) + 1
                 return best_node
@@ -181,15 +151,49 @@ def sanitize_vm_name(name: str, fallback: str = "vm") -> str:
     return name
 
 
-def get_next_available_vmid_ssh(ssh_executor, start: int = 200) -> int:
+def get_cluster_vmids_ssh(ssh_executor) -> Set[int]:
     """
-    Find the next available VMID on the Proxmox cluster.
+    VMIDs of every VM on the cluster, from one pvesh call.
     
-    Queries VMInventory database first (fastest), then falls back to cluster query.
+    Args:
+        ssh_executor: SSH executor for running commands (from ssh_executor.py)
+        
+    Returns:
+        Set of used VMIDs (empty if the query fails)
+    """
+    exit_code, stdout, stderr = ssh_executor.execute(
+        "pvesh get /cluster/resources --type vm --output-format json",
+        check=False,
+        timeout=30
+    )
+    
+    used_vmids = set()
+    if exit_code == 0 and stdout.strip():
+        try:
+            import json
+            resources = json.loads(stdout)
+            used_vmids = {int(r['vmid']) for r in resources if 'vmid' in r}
+            logger.debug(f"Found {len(used_vmids)} VMIDs in use from cluster query")
+        except (json.JSONDecodeError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to parse cluster resources: {e}")
+            used_vmids = set()
+    return used_vmids
+
+
+def get_next_available_vmid_ssh(ssh_executor, start: int = 200, owner: Optional[str] = None) -> int:
+    """
+    Find (and reserve) the next available VMID on the Proxmox cluster.
+    
+    Uses the vmid_allocator interval set (VMInventory + class prefixes +
+    live reservations); the returned ID stays reserved for in-flight
+    deployments in every worker process. Falls back to a cluster query if
+    the database is unavailable.
     
     Args:
         ssh_executor: SSH executor for running commands (from ssh_executor.py)
         start: Starting VMID to search from (default: 200)
+        owner: Reservation tag of this deployment, for release_reservations()
+            on failure (default: a new unique tag)
         
     Returns:
         Next available VMID
@@ -197,30 +201,19 @@ def get_next_available_vmid_ssh(ssh_executor, start: int = 200) -> int:
     Raises:
         RuntimeError: If unable to find available VMID after max attempts
     """
-    # Query VMInventory database for all used VMIDs (fastest method)
     try:
-        used_vmids = {vm.vmid for vm in VMInventory.query.with_entities(VMInventory.vmid).all()}
-        logger.debug(f"Found {len(used_vmids)} VMIDs in use from VMInventory database")
+        from app.services.vmid_allocator import allocate_vmid
+        vmid = allocate_vmid(start=start, owner=owner or f"deploy-{uuid.uuid4().hex}")
+        if vmid is not None:
+            return vmid
+        raise RuntimeError(f"No free VMID at or above {start}")
+    except RuntimeError:
+        raise
     except Exception as e:
-        logger.warning(f"Failed to query VMInventory: {e}, falling back to cluster query")
-        
-        # Fallback: Query cluster directly via pvesh
-        exit_code, stdout, stderr = ssh_executor.execute(
-            "pvesh get /cluster/resources --type vm --output-format json",
-            check=False,
-            timeout=30
-        )
-        
-        used_vmids = set()
-        if exit_code == 0 and stdout.strip():
-            try:
-                import json
-                resources = json.loads(stdout)
-                used_vmids = {int(r['vmid']) for r in resources if 'vmid' in r}
-                logger.debug(f"Found {len(used_vmids)} VMIDs in use from cluster query")
-            except (json.JSONDecodeError, ValueError, KeyError) as e:
-                logger.warning(f"Failed to parse cluster resources: {e}")
-                used_vmids = set()
+        logger.warning(f"VMID allocator unavailable: {e}, falling back to cluster query")
+    
+    # Fallback: Query cluster directly via pvesh
+    used_vmids = get_cluster_vmids_ssh(ssh_executor)
     
     # Find next available VMID starting from 'start'
     vmid = start
@@ -254,7 +247,9 @@ def get_next_available_vmid_api(proxmox, start: int = 200, used_vmids: Set[int]
         # Query cluster resources to get all used VMIDs
         used_vmids = set()
         try:
-            resources = proxmox.cluster.resources.get(type="vm")
+            from app.services.proxmox_cache import fresh_reads
+            with fresh_reads():
+                resources = proxmox.cluster.resources.get(type="vm")
             for r in resources:
                 vmid = r.get("vmid")
                 if vmid is not None:
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+VMID Allocator - interval-set VMID allocation with DB-backed reservations.
+
+Replaces random prefix guessing and linear VMID scans with:
+- IntervalSet: sorted disjoint [start, end] ranges; lowest free ID and
+  lowest free aligned block found by bisection over the gaps
+- Used ranges = VMInventory VMIDs (cached per cluster, compressed to ranges)
+  + Class.vmid_prefix blocks + live VMIDReservation rows
+- Reservations with a TTL, so in-flight deployments hold their IDs until
+  the VMs appear in the inventory (or the reservation expires)
+- Cross-process safety: allocation runs in its own short transaction that
+  takes the database write lock first (PostgreSQL advisory lock / SQLite
+  write lock via the expired-reservation purge), then reads and inserts
+
+Usage:
+    vmid = allocate_vmid(start=200, cluster_id="cluster1", owner="deploy:42")
+    prefix = allocate_vmid_prefix(owner="class:new")   # block prefix*100 .. prefix*100+99
+    release_reservations("deploy:42")
+"""
+
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from app.utils.caching import ThreadSafeCache
+
+logger = logging.getLogger(__name__)
+
+# Class VMID prefixes: prefix 200-999 -> VMIDs 20000-99999 (100-199 reserved for system/templates)
+PREFIX_MIN = 200
+PREFIX_MAX = 999
+BLOCK_SIZE = 100
+
+# Proxmox VMID limits
+VMID_MIN = 100
+VMID_MAX = 999999999
+
+# Seconds an allocation is held before the VM/class must exist
+DEFAULT_RESERVATION_TTL = 900
+
+# Inventory VMIDs compressed to ranges, per cluster ('*' = all clusters)
+_inventory_ranges = ThreadSafeCache(ttl=30, max_entries=64, name="vmid_inventory_ranges")
+
+# Serializes allocations within this process (the DB lock covers other processes)
+_local_lock = threading.Lock()
+
+ALLOCATION_RETRIES = 5
+
+
+class IntervalSet:
+    """Sorted set of disjoint, non-adjacent inclusive integer ranges."""
+
+    def __init__(self, ranges: Iterable[Tuple[int, int]] = ()):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        for start, end in ranges:
+            self.add(start, end)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def intervals(self) -> List[Tuple[int, int]]:
+        return list(zip(self._starts, self._ends))
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect.bisect_right(self._starts, value) - 1
+        return i >= 0 and self._ends[i] >= value
+
+    def add(self, start: int, end: Optional[int] = None) -> None:
+        """Add [start, end], merging with overlapping or adjacent ranges."""
+        end = start if end is None else end
+        if end < start:
+            return
+        # First range that could merge: ends at or after start - 1
+        lo = bisect.bisect_left(self._ends, start - 1)
+        # Ranges starting at or before end + 1 merge too
+        hi = bisect.bisect_right(self._starts, end + 1)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def discard(self, start: int, end: Optional[int] = None) -> None:
+        """Remove [start, end], splitting ranges as needed."""
+        end = start if end is None else end
+        lo = bisect.bisect_left(self._ends, start)
+        hi = bisect.bisect_right(self._starts, end)
+        if lo >= hi:
+            return
+        keep: List[Tuple[int, int]] = []
+        if self._starts[lo] < start:
+            keep.append((self._starts[lo], start - 1))
+        if self._ends[hi - 1] > end:
+            keep.append((end + 1, self._ends[hi - 1]))
+        self._starts[lo:hi] = [s for s, _ in keep]
+        self._ends[lo:hi] = [e for _, e in keep]
+
+    def first_free(self, lo: int, hi: int) -> Optional[int]:
+        """Lowest value in [lo, hi] not in the set."""
+        i = bisect.bisect_right(self._starts, lo) - 1
+        candidate = lo
+        if i >= 0 and self._ends[i] >= lo:
+            candidate = self._ends[i] + 1  # ranges never touch, so this is free
+        return candidate if candidate <= hi else None
+
+    def first_free_block(self, size: int, lo: int, hi: int, align: int = 1) -> Optional[int]:
+        """Lowest aligned start s in [lo, hi] with [s, s+size-1] free and within hi."""
+        def aligned(value: int) -> int:
+            return -(-value // align) * align
+
+        candidate = aligned(lo)
+        i = bisect.bisect_right(self._starts, candidate) - 1
+        if i < 0:
+            i = 0
+        while candidate + size - 1 <= hi:
+            # Skip past any range overlapping [candidate, candidate+size-1]
+            while i < len(self._starts) and self._ends[i] < candidate:
+                i += 1
+            if i >= len(self._starts) or self._starts[i] > candidate + size - 1:
+                return candidate
+            candidate = aligned(self._ends[i] + 1)
+        return None
+
+
+def _compress(values: Iterable[int]) -> List[Tuple[int, int]]:
+    """Sorted integers -> list of (start, end) runs."""
+    ranges: List[Tuple[int, int]] = []
+    for value in sorted(set(values)):
+        if ranges and value == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], value)
+        else:
+            ranges.append((value, value))
+    return ranges
+
+
+def _inventory_used(session, cluster_id: Optional[str]) -> List[Tuple[int, int]]:
+    from app.models import VMInventory
+
+    key = cluster_id or '*'
+    cached = _inventory_ranges.get(key)
+    if cached is not None:
+        return cached
+    query = session.query(VMInventory.vmid)
+    if cluster_id:
+        query = query.filter(VMInventory.cluster_id == cluster_id)
+    ranges = _compress(row.vmid for row in query.all())
+    _inventory_ranges.set(key, ranges)
+    return ranges
+
+
+def invalidate_inventory_ranges(cluster_id: Optional[str] = None) -> None:
+    """Drop cached inventory ranges (after a sync adds/removes VMs)."""
+    if cluster_id:
+        _inventory_ranges.invalidate(cluster_id)
+        _inventory_ranges.invalidate('*')
+    else:
+        _inventory_ranges.invalidate()
+
+
+def _lock_and_purge(session, now: datetime) -> None:
+    """Take the cross-process allocation lock and drop expired reservations.
+
+    The DELETE is the transaction's first statement, so on SQLite it takes
+    the write lock before anything is read.
+    """
+    from app.models import VMIDReservation
+    from app.utils.db_dialect import advisory_xact_lock
+
+    advisory_xact_lock('vmid_allocator', session=session)
+    # A write statement takes SQLite's write lock even when no row matches
+    session.execute(
+        VMIDReservation.__table__.delete().where(VMIDReservation.expires_at < now)
+    )
+
+
+def _used_set(session, cluster_id: Optional[str], extra_used: Iterable[int] = ()) -> IntervalSet:
+    from app.models import Class, VMIDReservation
+
+    used = IntervalSet(_inventory_used(session, cluster_id))
+    for value in extra_used:
+        used.add(int(value))
+    for (prefix,) in session.query(Class.vmid_prefix).filter(Class.vmid_prefix.isnot(None)).all():
+        used.add(prefix * BLOCK_SIZE, prefix * BLOCK_SIZE + BLOCK_SIZE - 1)
+    reservations = session.query(VMIDReservation.start_vmid, VMIDReservation.end_vmid)
+    if cluster_id:
+        reservations = reservations.filter(VMIDReservation.cluster_id.in_([cluster_id, '*']))
+    for start, end in reservations.all():
+        used.add(start, end)
+    return used
+
+
+def _allocate(pick, cluster_id: Optional[str], owner: Optional[str],
+              ttl: Optional[float], extra_used: Iterable[int]) -> Optional[Tuple[int, int]]:
+    """Run pick(used_set) -> (start, end) in a locked transaction and reserve the result.
+
+    Uses its own session and commits immediately. On SQLite, call it before
+    flushing writes in the request session (that session would hold the
+    write lock this transaction waits for).
+    """
+    from sqlalchemy.orm import Session
+
+    from app.models import VMIDReservation, db
+    from app.utils.db_dialect import is_retryable_error
+
+    extra_used = list(extra_used)
+    with _local_lock:
+        for attempt in range(ALLOCATION_RETRIES):
+            with Session(db.engine) as session:
+                try:
+                    now = datetime.utcnow()
+                    _lock_and_purge(session, now)
+                    picked = pick(_used_set(session, cluster_id, extra_used))
+                    if picked is None:
+                        session.rollback()
+                        return None
+                    start, end = picked
+                    session.add(VMIDReservation(
+                        cluster_id=cluster_id or '*',
+                        start_vmid=start,
+                        end_vmid=end,
+                        owner=owner,
+                        expires_at=now + timedelta(seconds=ttl) if ttl else None,
+                    ))
+                    session.commit()
+                    return picked
+                except Exception as e:
+                    session.rollback()
+                    # Unique-start conflict or lock contention with another process: retry
+                    if attempt < ALLOCATION_RETRIES - 1 and (
+                            is_retryable_error(e) or 'unique' in str(e).lower()):
+                        logger.debug(f"VMID allocation retry {attempt + 1}: {e}")
+                        continue
+                    raise
+    return None
+
+
+def allocate_vmid(start: int = 200, end: int = VMID_MAX, cluster_id: Optional[str] = None,
+                  owner: Optional[str] = None, ttl: Optional[float] = DEFAULT_RESERVATION_TTL,
+                  extra_used: Iterable[int] = ()) -> Optional[int]:
+    """Reserve and return the lowest free VMID in [start, end].
+
+    Args:
+        cluster_id: Restrict the inventory check to one cluster (None = all)
+        owner: Tag for release_reservations()
+        ttl: Seconds the reservation is held (None = until released)
+        extra_used: VMIDs known to be taken (e.g. from a fresh cluster/resources call)
+    """
+    def pick(used: IntervalSet):
+        vmid = used.first_free(max(start, VMID_MIN), end)
+        return (vmid, vmid) if vmid is not None else None
+
+    picked = _allocate(pick, cluster_id, owner, ttl, extra_used)
+    if picked:
+        logger.debug(f"Allocated VMID {picked[0]} (owner={owner})")
+    return picked[0] if picked else None
+
+
+def allocate_vmid_block(size: int = BLOCK_SIZE, lo: int = PREFIX_MIN * BLOCK_SIZE,
+                        hi: int = PREFIX_MAX * BLOCK_SIZE + BLOCK_SIZE - 1, align: int = BLOCK_SIZE,
+                        cluster_id: Optional[str] = None, owner: Optional[str] = None,
+                        ttl: Optional[float] = DEFAULT_RESERVATION_TTL,
+                        extra_used: Iterable[int] = ()) -> Optional[int]:
+    """Reserve the lowest free aligned block of `size` IDs in [lo, hi]; returns its first VMID."""
+    def pick(used: IntervalSet):
+        block = used.first_free_block(size, lo, hi, align=align)
+        return (block, block + size - 1) if block is not None else None
+
+    picked = _allocate(pick, cluster_id, owner, ttl, extra_used)
+    return picked[0] if picked else None
+
+
+def allocate_vmid_prefix(owner: Optional[str] = None, ttl: Optional[float] = DEFAULT_RESERVATION_TTL,
+                         extra_used: Iterable[int] = ()) -> Optional[int]:
+    """Reserve a free class prefix (200-999): VMIDs prefix*100 .. prefix*100+99."""
+    block = allocate_vmid_block(owner=owner, ttl=ttl, extra_used=extra_used)
+    if block is None:
+        logger.error("No free VMID prefix block left (200-999)")
+        return None
+    prefix = block // BLOCK_SIZE
+    logger.info(f"Allocated VMID prefix {prefix} (range {block}-{block + BLOCK_SIZE - 1})")
+    return prefix
+
+
+def release_reservations(owner: str, keep: Iterable[int] = ()) -> int:
+    """Release every reservation held by owner; returns rows removed.
+
+    Args:
+        keep: VMIDs that stay reserved (e.g. the VMs a partly failed
+            deployment did create); the rest of their ranges is released
+    """
+    from sqlalchemy.orm import Session
+
+    from app.models import VMIDReservation, db
+
+    keep = set(keep)
+    with Session(db.engine) as session:
+        rows = session.query(VMIDReservation).filter(VMIDReservation.owner == owner).all()
+        for row in rows:
+            session.delete(row)
+        session.flush()
+        for row in rows:
+            for start, end in _compress(v for v in keep if row.start_vmid <= v <= row.end_vmid):
+                session.add(VMIDReservation(cluster_id=row.cluster_id, start_vmid=start, end_vmid=end,
+                                            owner=owner, expires_at=row.expires_at))
+        session.commit()
+    return len(rows)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+VMID Prefix Index - inventory VMs grouped by class VMID prefix.
+
+Class VMs follow a VMID layout of {3-digit prefix}{2-digit slot}:
+- Teacher VM: prefix*100 + 0   (e.g. 12300)
+- Student VMs: prefix*100 + 1..98
+- Base VM:    prefix*100 + 99
+
+Instead of pulling the whole inventory and regrouping it every time the
+class import or VM recovery screens open, this module keeps an in-process
+index of prefix -> {(cluster_id, vmid): summary}. It is built once from
+VMInventory (narrow query) and then maintained incrementally by inventory
+sync (persist_vm_inventory, quick sync). A periodic rebuild picks up writes
+made by other worker processes.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TEACHER_SLOT = 0
+BASE_SLOT = 99
+
+# Full rebuild interval (catches writes from other processes)
+INDEX_REBUILD_INTERVAL = 600
+
+_lock = threading.RLock()
+_groups: Dict[int, Dict[Tuple[str, int], Dict[str, Any]]] = {}
+_unmatched: Dict[Tuple[str, int], Dict[str, Any]] = {}
+_built_at: Optional[float] = None
+
+
+def classify_vmid(vmid: Any) -> Tuple[Optional[int], Optional[str]]:
+    """Return (prefix, slot kind) for a class-pattern VMID, else (None, None).
+
+    Slot kind is 'teacher', 'base' or 'student'.
+    """
+    try:
+        vmid = int(vmid)
+    except (TypeError, ValueError):
+        return None, None
+    if not 10000 <= vmid <= 99999:
+        return None, None
+    prefix, slot = divmod(vmid, 100)
+    if slot == TEACHER_SLOT:
+        return prefix, 'teacher'
+    if slot == BASE_SLOT:
+        return prefix, 'base'
+    return prefix, 'student'
+
+
+def _summary(vmid: int, name: Optional[str], node: Optional[str], status: Optional[str]) -> Dict[str, Any]:
+    return {'vmid': vmid, 'name': name or '', 'node': node, 'status': status}
+
+
+def _put(cluster_id: str, vmid: int, name, node, status) -> None:
+    """Insert/replace one VM (lock held)."""
+    key = (cluster_id, vmid)
+    prefix, _ = classify_vmid(vmid)
+    if prefix is None:
+        _unmatched[key] = _summary(vmid, name, node, status)
+    else:
+        _groups.setdefault(prefix, {})[key] = _summary(vmid, name, node, status)
+
+
+def _drop(cluster_id: str, vmid: int) -> None:
+    """Remove one VM (lock held)."""
+    key = (cluster_id, vmid)
+    prefix, _ = classify_vmid(vmid)
+    if prefix is None:
+        _unmatched.pop(key, None)
+        return
+    members = _groups.get(prefix)
+    if members is not None:
+        members.pop(key, None)
+        if not members:
+            del _groups[prefix]
+
+
+def rebuild_index() -> int:
+    """Rebuild the whole index from VMInventory; returns VMs indexed."""
+    global _built_at
+    from app.models import VMInventory
+
+    rows = VMInventory.query.with_entities(
+        VMInventory.cluster_id, VMInventory.vmid, VMInventory.name,
+        VMInventory.node, VMInventory.status,
+    ).filter(VMInventory.is_template.isnot(True)).all()
+
+    with _lock:
+        _groups.clear()
+        _unmatched.clear()
+        for row in rows:
+            _put(row.cluster_id, row.vmid, row.name, row.node, row.status)
+        _built_at = time.time()
+    logger.debug(f"VMID index rebuilt: {len(rows)} VMs, {len(_groups)} prefixes")
+    return len(rows)
+
+
+def _ensure_built() -> None:
+    if _built_at is None or time.time() - _built_at > INDEX_REBUILD_INTERVAL:
+        rebuild_index()
+
+
+def index_vms(vms: Iterable[Dict[str, Any]]) -> None:
+    """Apply VM dicts (from sync) to the index. No-op until the index is built."""
+    with _lock:
+        if _built_at is None:
+            return
+        for vm in vms:
+            vmid = vm.get('vmid')
+            if not vmid:
+                continue
+            cluster_id = vm.get('cluster_id', 'default')
+            if vm.get('is_template') or vm.get('template'):
+                _drop(cluster_id, int(vmid))
+            else:
+                _put(cluster_id, int(vmid), vm.get('name'), vm.get('node'), vm.get('status'))
+
+
+def unindex_vms(keys: Iterable[Tuple[str, int]]) -> None:
+    """Remove (cluster_id, vmid) pairs (VMs deleted from the inventory)."""
+    with _lock:
+        if _built_at is None:
+            return
+        for cluster_id, vmid in keys:
+            _drop(cluster_id, int(vmid))
+
+
+def update_index_status(cluster_id: str, vmid: int, status: str, node: Optional[str] = None) -> None:
+    """Refresh the status/node of an indexed VM (quick sync)."""
+    with _lock:
+        prefix, _ = classify_vmid(vmid)
+        bucket = _unmatched if prefix is None else _groups.get(prefix, {})
+        entry = bucket.get((cluster_id, int(vmid)))
+        if entry is not None:
+            entry['status'] = status
+            if node:
+                entry['node'] = node
+
+
+def get_prefix_group(prefix: int, cluster_id: Optional[str] = None) -> Dict[int, Dict[str, Any]]:
+    """VMs in one prefix block as {vmid: summary}."""
+    with _lock:
+        _ensure_built()
+        return {
+            vmid: dict(summary)
+            for (cid, vmid), summary in _groups.get(int(prefix), {}).items()
+            if cluster_id is None or cid == cluster_id
+        }
+
+
+def get_candidate_classes(cluster_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+    """Prefix groups that look like classes (at least one student VM).
+
+    Returns:
+        (groups, unmatched_vms, total_vms) - groups sorted by prefix, in the
+        shape the class import dialog expects
+    """
+    with _lock:
+        _ensure_built()
+        groups = []
+        total = 0
+        for prefix in sorted(_groups):
+            members = [s for (cid, _), s in _groups[prefix].items() if cluster_id is None or cid == cluster_id]
+            total += len(members)
+            teacher = base = None
+            students = []
+            for summary in members:
+                _, kind = classify_vmid(summary['vmid'])
+                if kind == 'teacher':
+                    teacher = dict(summary)
+                elif kind == 'base':
+                    base = dict(summary)
+                else:
+                    students.append(dict(summary, suffix=f"{summary['vmid'] % 100:02d}"))
+            if not students:
+                continue
+            students.sort(key=lambda s: s['vmid'])
+            prefix_str = str(prefix)
+            suggested = (teacher['name'] if teacher else None) or f"Class {prefix_str}"
+            groups.append({
+                'prefix': prefix_str,
+                'classname': (teacher or students[0])['name'] or f"Class {prefix_str}",
+                'teacher_vm': teacher,
+                'base_vm': base,
+                'student_vms': students,
+                'student_count': len(students),
+                'suggested_name': suggested.replace('-', ' ').replace('_', ' ').title(),
+            })
+        unmatched = [
+            {'vmid': s['vmid'], 'name': s['name']}
+            for (cid, _), s in _unmatched.items()
+            if cluster_id is None or cid == cluster_id
+        ]
+        total += len(unmatched)
+    return groups, unmatched, total
+
+
+def validate_import_group(prefix: Any, teacher_vmid: Optional[int], base_vmid: Optional[int],
+                          student_vmids: Iterable[int], cluster_id: Optional[str] = None) -> List[str]:
+    """Check a requested import against the index in one pass.
+
+    Only applies to numeric VMID prefixes (the scan's groups); returns a list
+    of problems (empty when the group is consistent).
+    """
+    try:
+        prefix = int(prefix)
+    except (TypeError, ValueError):
+        return []
+    members = get_prefix_group(prefix, cluster_id)
+    errors = []
+    expected = [(teacher_vmid, 'teacher'), (base_vmid, 'base')] + [(v, 'student') for v in student_vmids]
+    for vmid, kind in expected:
+        if not vmid:
+            continue
+        vm_prefix, vm_kind = classify_vmid(vmid)
+        if vm_prefix != prefix or vm_kind != kind:
+            errors.append(f"VMID {vmid} is not a {kind} VM of prefix {prefix}")
+        elif int(vmid) not in members:
+            errors.append(f"VMID {vmid} not found in inventory")
+    return errors
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Warm Pool - spare student VMs kept ready per class.
+
+Joining a class used to assign only VMs that already existed; once a class
+ran out, the teacher had to deploy more and the student waited. Classes with
+warm_pool_size > 0 now keep that many unassigned student VMs around:
+- A background job (WARM_POOL_INTERVAL) tops each class up through the
+  normal deployment pipeline (deploy_class_vms); joins and VM swaps trigger
+  an immediate refill as well
+- Students who joined while the class was empty are counted into the
+  deficit and assigned once the new VMs exist
+- With warm_pool_boot the spares are started (bulk priority through the
+  start scheduler), so inventory sync already knows their IPs
+- Allocation hands out "ready" spares (running, IP known) first
+- A student reverting their VM can be swapped onto a spare instead of
+  waiting for a rollback and boot; the old VM is destroyed in the background
+
+Refills of one class never overlap within a process, and classes whose
+initial deployment is still running are left alone. Only overlay
+(config_clone) classes have a warm pool: linked clone deployment always
+recreates the teacher VM at fixed VMIDs, so it cannot top a class up, and
+those classes keep reverting to their baseline snapshot.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from app.models import Class, VMAssignment, VMInventory, db
+from app.utils.db_dialect import for_allocation
+
+logger = logging.getLogger(__name__)
+
+# Classes with a refill in progress (this process)
+_refilling: Set[int] = set()
+_refill_lock = threading.Lock()
+
+# Deployment methods that can add student VMs to an existing class
+WARM_POOL_METHODS = ('config_clone',)
+
+
+def supports_warm_pool(class_) -> bool:
+    """Whether the class's deployment method can keep a warm pool."""
+    return (class_.deployment_method or 'config_clone') in WARM_POOL_METHODS
+
+
+def spare_query(class_id: int):
+    """Unassigned student VMs of a class that may be handed out automatically."""
+    return VMAssignment.query.filter_by(
+        class_id=class_id,
+        assigned_user_id=None,
+        status='available',
+        is_template_vm=False,
+        is_teacher_vm=False,
+        manually_added=False,  # Don't auto-assign manually added VMs
+    )
+
+
+def ready_vmids(vmids: List[int]) -> Set[int]:
+    """VMIDs that inventory sync reports running with a known IP."""
+    if not vmids:
+        return set()
+    rows = VMInventory.query.filter(
+        VMInventory.vmid.in_(vmids),
+        VMInventory.status == 'running',
+        VMInventory.ip.isnot(None),
+        VMInventory.ip != '',
+    ).with_entities(VMInventory.vmid).all()
+    return {row.vmid for row in rows}
+
+
+def claim_spares(class_id: int, count: int = 1) -> List[VMAssignment]:
+    """Lock up to count spares of a class, ready ones first.
+
+    Rows another worker is claiming are skipped (PostgreSQL FOR UPDATE SKIP
+    LOCKED). The caller assigns the VMs and commits.
+    """
+    if count <= 0:
+        return []
+    spare_vmids = [row.proxmox_vmid for row in spare_query(class_id).with_entities(VMAssignment.proxmox_vmid)]
+    ready = ready_vmids(spare_vmids)
+
+    claimed: List[VMAssignment] = []
+    if ready:
+        claimed = for_allocation(spare_query(class_id).filter(
+            VMAssignment.proxmox_vmid.in_(ready)
+        ).order_by(VMAssignment.proxmox_vmid).limit(count)).all()
+    if len(claimed) < count:
+        query = spare_query(class_id)
+        if claimed:
+            query = query.filter(~VMAssignment.id.in_([vm.id for vm in claimed]))
+        claimed += for_allocation(query.order_by(VMAssignment.proxmox_vmid).limit(count - len(claimed))).all()
+    return claimed
+
+
+def waiting_student_count(class_) -> int:
+    """Enrolled students of a class without a VM."""
+    assigned = {row.assigned_user_id for row in VMAssignment.query.filter(
+        VMAssignment.class_id == class_.id,
+        VMAssignment.assigned_user_id.isnot(None),
+    ).with_entities(VMAssignment.assigned_user_id)}
+    return sum(1 for student in class_.students if student.id not in assigned)
+
+
+def pool_status(class_) -> Dict[str, Any]:
+    """Target, spare and ready counts of a class's warm pool."""
+    spare_vmids = [row.proxmox_vmid for row in spare_query(class_.id).with_entities(VMAssignment.proxmox_vmid)]
+    with _refill_lock:
+        refilling = class_.id in _refilling
+    return {
+        'target': class_.warm_pool_size or 0,
+        'boot': bool(class_.warm_pool_boot),
+        'spares': len(spare_vmids),
+        'ready': len(ready_vmids(spare_vmids)),
+        'waiting_students': waiting_student_count(class_),
+        'refilling': refilling,
+    }
+
+
+def _deployment_running(class_) -> bool:
+    from app.services.clone_progress import get_clone_progress
+
+    if not class_.clone_task_id:
+        return False
+    return get_clone_progress(class_.clone_task_id).get('status') == 'in_progress'
+
+
+def _cluster_for_class(class_) -> Optional[Dict[str, Any]]:
+    from app.services.proxmox_service import get_clusters_from_db
+
+    clusters = get_clusters_from_db()
+    cluster_ip = class_.template.cluster_ip if class_.template else None
+    return next((c for c in clusters if c["host"] == cluster_ip), clusters[0] if clusters else None)
+
+
+def _ssh_for_cluster(cluster: Dict[str, Any]):
+    from app.services.ssh_executor import get_pooled_ssh_executor
+
+    # Extract username without realm (root@pam -> root)
+    username = cluster["user"].split("@")[0] if "@" in cluster["user"] else cluster["user"]
+    return get_pooled_ssh_executor(host=cluster["host"], username=username, password=cluster["password"])
+
+
+def boot_spares(class_) -> int:
+    """Start the class's stopped spares as bulk starts. Returns the number started."""
+    from app.services.class_vm_service import start_vms_bulk
+
+    spare_vmids = [row.proxmox_vmid for row in spare_query(class_.id).with_entities(VMAssignment.proxmox_vmid)]
+    if not spare_vmids:
+        return 0
+    running = {row.vmid for row in VMInventory.query.filter(
+        VMInventory.vmid.in_(spare_vmids), VMInventory.status == 'running'
+    ).with_entities(VMInventory.vmid)}
+    to_start = [vmid for vmid in spare_vmids if vmid not in running]
+    if not to_start:
+        return 0
+
+    cluster = _cluster_for_class(class_)
+    if not cluster:
+        logger.warning(f"Warm pool of class {class_.id}: no cluster to start spares on")
+        return 0
+    return start_vms_bulk(_ssh_for_cluster(cluster), to_start, cluster["host"])
+
+
+def refill_class(class_id: int) -> Dict[str, Any]:
+    """Top a class's warm pool up to its target and assign waiting students.
+
+    Returns:
+        Stats dict: class_id, created, assigned, booted, skipped/error if any
+    """
+    from app.services.class_service import auto_assign_vms_to_waiting_students
+    from app.services.class_vm_service import deploy_class_vms
+
+    stats: Dict[str, Any] = {'class_id': class_id, 'created': 0, 'assigned': 0, 'booted': 0}
+    with _refill_lock:
+        if class_id in _refilling:
+            stats['skipped'] = 'refill already running'
+            return stats
+        _refilling.add(class_id)
+
+    try:
+        class_ = Class.query.get(class_id)
+        if not class_ or not class_.warm_pool_size:
+            return stats
+        if not supports_warm_pool(class_):
+            stats['skipped'] = f"{class_.deployment_method} classes have no warm pool"
+            return stats
+        if _deployment_running(class_):
+            stats['skipped'] = 'deployment in progress'
+            return stats
+        # Only top up classes whose infrastructure (teacher VM, class base) exists
+        if not VMAssignment.query.filter_by(class_id=class_id).first():
+            stats['skipped'] = 'class not deployed yet'
+            return stats
+
+        deficit = class_.warm_pool_size + waiting_student_count(class_) - spare_query(class_id).count()
+        if deficit > 0:
+            logger.info(f"Warm pool of class {class_.name}: creating {deficit} spare VMs")
+            ok, message, vm_info = deploy_class_vms(class_id=class_id, num_students=deficit)
+            if not ok:
+                logger.warning(f"Warm pool refill of class {class_.name} failed: {message}")
+                stats['error'] = message
+            else:
+                stats['created'] = vm_info.get('student_vm_count', 0)
+            stats['assigned'] = auto_assign_vms_to_waiting_students(class_id)
+
+        if class_.warm_pool_boot:
+            stats['booted'] = boot_spares(class_)
+        return stats
+    finally:
+        with _refill_lock:
+            _refilling.discard(class_id)
+
+
+def refill_warm_pools() -> Dict[str, Any]:
+    """Refill every class with a warm pool. Returns aggregate stats."""
+    stats: Dict[str, Any] = {'classes': 0, 'created': 0, 'assigned': 0, 'booted': 0, 'failed': 0}
+    class_ids = [row.id for row in Class.query.filter(
+        Class.warm_pool_size > 0, Class.deployment_method.in_(WARM_POOL_METHODS)
+    ).with_entities(Class.id)]
+    for class_id in class_ids:
+        stats['classes'] += 1
+        try:
+            result = refill_class(class_id)
+        except Exception as e:
+            logger.exception(f"Warm pool refill of class {class_id} failed: {e}")
+            db.session.rollback()
+            stats['failed'] += 1
+            continue
+        for key in ('created', 'assigned', 'booted'):
+            stats[key] += result.get(key, 0)
+        stats['failed'] += int('error' in result)
+    return stats
+
+
+def swap_for_spare(assignment: VMAssignment, user) -> Optional[VMAssignment]:
+    """Give the assignment's user a spare VM and release the old one.
+
+    The old VM is marked 'deleting' so it is never handed out again; pass it
+    to refill_async(retire=...) to destroy it. The caller commits.
+
+    Returns:
+        The new assignment, or None if the class has no spare
+    """
+    spares = claim_spares(assignment.class_id, 1)
+    if not spares:
+        return None
+    spare = spares[0]
+    spare.assign_to_user(user)
+    assignment.unassign()
+    assignment.status = 'deleting'
+    return spare
+
+
+def retire_vm(class_id: int, assignment_id: int) -> bool:
+    """Destroy a VM released by swap_for_spare and drop its assignment row."""
+    from app.services.class_teardown import TeardownJob
+    from app.services.proxmox_service import get_proxmox_admin_for_cluster
+
+    assignment = VMAssignment.query.get(assignment_id)
+    class_ = Class.query.get(class_id)
+    if not assignment or not class_ or assignment.status != 'deleting':
+        return False
+    cluster = _cluster_for_class(class_)
+    if not cluster:
+        logger.warning(f"No cluster to delete retired VM {assignment.proxmox_vmid}")
+        return False
+
+    try:
+        ssh_executor = _ssh_for_cluster(cluster)
+    except Exception as e:
+        logger.warning(f"No SSH connection for overlay cleanup of VM {assignment.proxmox_vmid}: {e}")
+        ssh_executor = None
+    result = TeardownJob(get_proxmox_admin_for_cluster(cluster["id"]),
+                         [{'vmid': assignment.proxmox_vmid, 'node': assignment.node}],
+                         ssh_executor=ssh_executor).run()
+    if assignment.proxmox_vmid not in result['deleted']:
+        logger.warning(f"Retired VM {assignment.proxmox_vmid} of class {class_id} was not deleted")
+        return False
+    db.session.delete(assignment)
+    db.session.commit()
+    return True
+
+
+def refill_async(class_id: int, retire: Optional[int] = None) -> None:
+    """Refill a class's warm pool in a background thread.
+
+    Args:
+        class_id: Class to refill
+        retire: Assignment ID of a swapped-out VM to destroy first
+    """
+    from flask import current_app
+
+    app = current_app._get_current_object()
+
+    def _run():
+        with app.app_context():
+            try:
+                if retire is not None:
+                    retire_vm(class_id, retire)
+                refill_class(class_id)
+            except Exception as e:
+                logger.exception(f"Background warm pool refill of class {class_id} failed: {e}")
+
+    threading.Thread(target=_run, daemon=True, name=f"warm-pool-{class_id}").start()
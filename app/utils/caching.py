@@ -2,95 +2,294 @@
 """
 Caching utilities for the application.
 
-This module provides thread-safe caching infrastructure used across the application.
+This module provides thread-safe caching infrastructure used across the application:
+- ThreadSafeCache: in-memory LRU/TTL hybrid with entry and byte bounds,
+  periodic expiry sweeping and hit/miss counters
+- PersistentCache: TTL cache persisted as an append-only JSON-lines log
+  with periodic compaction
+- SingleFlight: coalesces concurrent calls for the same key
 """
 
 import json
 import logging
 import os
+import sys
 import threading
 import time
-from typing import Any, Dict, List, Optional
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Named caches, for diagnostics (weak so short-lived caches don't leak)
+_cache_registry: "weakref.WeakValueDictionary[str, ThreadSafeCache]" = weakref.WeakValueDictionary()
+
+
+def estimate_size(value: Any) -> int:
+    """Rough byte estimate of a cached value.
+    
+    Shallow sizes of the container plus one level of items (and dict values),
+    which is accurate enough for decoded JSON payloads and cheap to compute.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(v) for v in value.values())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += sys.getsizeof(item)
+            if isinstance(item, dict):
+                size += sum(sys.getsizeof(v) for v in item.values())
+    return size
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Return stats for every named ThreadSafeCache."""
+    return {name: cache.stats() for name, cache in list(_cache_registry.items())}
+
+
+class _CacheEntry:
+    """One cached value with its store time, expiry and size estimate."""
+    
+    __slots__ = ("value", "stored_at", "expires_at", "size")
+    
+    def __init__(self, value: Any, stored_at: float, ttl: float, size: int):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = stored_at + ttl
+        self.size = size
+
 
 class ThreadSafeCache:
-    """A simple thread-safe cache with TTL support."""
+    """A thread-safe LRU/TTL cache with size bounds and metrics.
     
-    def __init__(self, ttl: int = 300):
-        """Initialize cache with TTL in seconds."""
-        self._data: Dict[str, Any] = {}
-        self._timestamps: Dict[str, float] = {}
+    - Entries expire after ``ttl`` seconds (per-entry override on set())
+    - Least recently used entries are evicted beyond ``max_entries`` or
+      ``max_bytes`` (estimated with estimate_size())
+    - Expired entries are swept periodically during normal get/set traffic,
+      not only when the same key is read again
+    - Supports dict-style access (``cache[key] = v``, ``key in cache``) so it
+      can replace module-level dict caches directly
+    """
+    
+    def __init__(self, ttl: int = 300, max_entries: int = 10000,
+                 max_bytes: Optional[int] = None, sweep_interval: float = 60.0,
+                 name: Optional[str] = None):
+        """Initialize cache.
+        
+        Args:
+            ttl: Default time-to-live in seconds
+            max_entries: Maximum number of entries (LRU eviction beyond this)
+            max_bytes: Optional bound on estimated total size in bytes
+            sweep_interval: Seconds between expiry sweeps
+            name: Register under this name for get_cache_stats()
+        """
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
         self._lock = threading.Lock()
         self._ttl = ttl
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "expirations": 0, "evictions": 0}
+        self.name = name
+        if name:
+            _cache_registry[name] = self
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get value from cache if not expired."""
+    # -- internal helpers (call with lock held) ------------------------------
+    
+    def _remove(self, key: Hashable) -> Optional[_CacheEntry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+    
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep >= self._sweep_interval:
+            self._sweep(now)
+    
+    def _sweep(self, now: float) -> int:
+        expired = [k for k, e in self._entries.items() if e.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self._stats["expirations"] += len(expired)
+        self._last_sweep = now
+        return len(expired)
+    
+    def _enforce_bounds(self) -> None:
+        while self._entries and (
+            len(self._entries) > self._max_entries
+            or (self._max_bytes is not None and self._bytes > self._max_bytes)
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._stats["evictions"] += 1
+    
+    # -- public API ----------------------------------------------------------
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value from cache if not expired (refreshes LRU position)."""
+        now = time.time()
         with self._lock:
-            if key in self._data:
-                if time.time() - self._timestamps.get(key, 0) < self._ttl:
-                    return self._data[key]
-                else:
-                    # Expired, remove
-                    del self._data[key]
-                    del self._timestamps[key]
+            self._maybe_sweep(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry.value
+                # Expired, remove
+                self._remove(key)
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+        return default
+    
+    def peek(self, key: Hashable, touch: bool = False) -> Optional[Tuple[Any, float]]:
+        """Return (value, age_seconds) for an unexpired entry, or None.
+        
+        Does not update hit/miss counters. With touch=True the entry is
+        marked most recently used (for callers doing their own freshness
+        checks, e.g. stale-while-revalidate).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                if touch:
+                    self._entries.move_to_end(key)
+                return entry.value, now - entry.stored_at
         return None
     
-    def set(self, key: str, value: Any) -> None:
-        """Set value in cache."""
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Set value in cache (optionally with a per-entry TTL)."""
+        now = time.time()
+        size = estimate_size(value)
         with self._lock:
-            self._data[key] = value
-            self._timestamps[key] = time.time()
+            self._maybe_sweep(now)
+            self._remove(key)
+            self._entries[key] = _CacheEntry(value, now, self._ttl if ttl is None else ttl, size)
+            self._bytes += size
+            self._enforce_bounds()
     
-    def invalidate(self, key: Optional[str] = None) -> None:
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
         """Invalidate cache entry or entire cache."""
         with self._lock:
             if key is None:
-                self._data.clear()
-                self._timestamps.clear()
-            elif key in self._data:
-                del self._data[key]
-                if key in self._timestamps:
-                    del self._timestamps[key]
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._remove(key)
     
-    def get_age(self, key: str) -> float:
+    def get_age(self, key: Hashable) -> float:
         """Get age of cache entry in seconds, or -1 if not found."""
         with self._lock:
-            if key in self._timestamps:
-                return time.time() - self._timestamps[key]
+            entry = self._entries.get(key)
+            if entry is not None:
+                return time.time() - entry.stored_at
         return -1
+    
+    def sweep(self) -> int:
+        """Remove all expired entries now. Returns number removed."""
+        with self._lock:
+            return self._sweep(time.time())
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters and current size."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self._max_entries,
+                "max_bytes": self._max_bytes,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            }
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+    
+    def __getitem__(self, key: Hashable) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
 
 
 class PersistentCache:
-    """Thread-safe cache that persists to a JSON file."""
+    """Thread-safe TTL cache persisted to an append-only JSON-lines log.
+    
+    Each set()/invalidate() appends one record instead of rewriting the file.
+    The log is compacted (rewritten with only live entries) once it holds
+    more than ``compact_ratio`` times as many records as live entries.
+    Legacy whole-file JSON caches are read transparently and converted on
+    the first compaction.
+    """
     
-    def __init__(self, file_path: str, ttl: int = 3600):
+    def __init__(self, file_path: str, ttl: int = 3600,
+                 compact_ratio: float = 2.0, compact_min_records: int = 1000):
         """Initialize persistent cache.
         
         Args:
-            file_path: Path to JSON file for persistence
+            file_path: Path to the cache log file
             ttl: Time-to-live in seconds
+            compact_ratio: Compact when records > ratio * live entries
+            compact_min_records: Never compact logs smaller than this
         """
         self._file_path = file_path
         self._ttl = ttl
+        self._compact_ratio = compact_ratio
+        self._compact_min_records = compact_min_records
         self._data: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
         self._loaded = False
+        self._records = 0
     
     def _load(self) -> None:
-        """Load cache from disk if not already loaded."""
+        """Load cache from disk if not already loaded (replays the log)."""
         if self._loaded:
             return
         
+        self._data = {}
+        self._records = 0
         if not os.path.exists(self._file_path):
-            self._data = {}
             self._loaded = True
             return
         
         try:
             with open(self._file_path, "r", encoding="utf-8") as f:
-                self._data = json.load(f)
+                content = f.read()
+            
+            legacy = None
+            try:
+                legacy = json.loads(content) if content.strip() else None
+            except ValueError:
+                legacy = None
+            
+            if isinstance(legacy, dict) and "op" not in legacy:
+                # Legacy format: one JSON object {key: {"value", "timestamp"}}
+                self._data = legacy
+                self._records = len(legacy) * 2 + self._compact_min_records  # force compaction
+            else:
+                for line in content.splitlines():
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write at the end of the log - ignore
+                        continue
+                    self._apply(record)
+                    self._records += 1
             logger.debug("Loaded cache from %s: %d entries", self._file_path, len(self._data))
         except Exception as e:
             logger.warning("Failed to load cache from %s: %s", self._file_path, e)
@@ -98,14 +297,50 @@ class PersistentCache:
         
         self._loaded = True
     
-    def _save(self) -> None:
-        """Save cache to disk."""
+    def _apply(self, record: Dict[str, Any]) -> None:
+        op = record.get("op")
+        if op == "set":
+            self._data[record["key"]] = {"value": record.get("value"), "timestamp": record.get("timestamp", 0)}
+        elif op == "del":
+            self._data.pop(record.get("key"), None)
+        elif op == "clear":
+            self._data.clear()
+    
+    def _append(self, record: Dict[str, Any]) -> None:
+        """Append one record to the log, compacting when it has grown too large."""
+        try:
+            with open(self._file_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self._records += 1
+        except Exception as e:
+            logger.warning("Failed to append to cache %s: %s", self._file_path, e)
+            return
+        
+        if self._records >= self._compact_min_records and \
+                self._records > self._compact_ratio * max(len(self._data), 1):
+            self._compact()
+    
+    def _compact(self) -> None:
+        """Rewrite the log with only live entries (atomic replace)."""
+        now = time.time()
+        live = {k: v for k, v in self._data.items() if now - v.get("timestamp", 0) < self._ttl}
+        tmp_path = f"{self._file_path}.tmp"
         try:
-            with open(self._file_path, "w", encoding="utf-8") as f:
-                json.dump(self._data, f, indent=2)
-            logger.debug("Saved cache to %s: %d entries", self._file_path, len(self._data))
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, entry in live.items():
+                    f.write(json.dumps({"op": "set", "key": key, **entry}) + "\n")
+            os.replace(tmp_path, self._file_path)
+            self._data = live
+            self._records = len(live)
+            logger.debug("Compacted cache %s: %d entries", self._file_path, len(live))
         except Exception as e:
-            logger.warning("Failed to save cache to %s: %s", self._file_path, e)
+            logger.warning("Failed to compact cache %s: %s", self._file_path, e)
+    
+    def compact(self) -> None:
+        """Force a compaction now."""
+        with self._lock:
+            self._load()
+            self._compact()
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache if not expired."""
@@ -121,11 +356,9 @@ class PersistentCache:
         """Set value in cache."""
         with self._lock:
             self._load()
-            self._data[key] = {
-                "value": value,
-                "timestamp": time.time()
-            }
-            self._save()
+            entry = {"value": value, "timestamp": time.time()}
+            self._data[key] = entry
+            self._append({"op": "set", "key": key, **entry})
     
     def invalidate(self, key: Optional[str] = None) -> None:
         """Invalidate cache entry or entire cache."""
@@ -133,9 +366,10 @@ class PersistentCache:
             self._load()
             if key is None:
                 self._data.clear()
+                self._append({"op": "clear"})
             elif key in self._data:
                 del self._data[key]
-            self._save()
+                self._append({"op": "del", "key": key})
     
     def get_batch(self, keys: List[str]) -> Dict[str, Any]:
         """Get multiple values from cache efficiently."""
@@ -151,3 +385,76 @@ class PersistentCache:
                         results[key] = entry.get("value")
         
         return results
+
+
+class _InFlightCall:
+    """State for one in-flight SingleFlight call."""
+    
+    __slots__ = ("event", "result", "error", "waiters")
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution.
+    
+    The first caller for a key runs the function; callers arriving while it
+    is in flight block and receive the same result (or exception). Nothing is
+    cached once the call completes - pair with a TTL cache for memoization.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "executions": 0, "shared": 0}
+    
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn() once per key across concurrent callers.
+        
+        Returns:
+            (result, shared) - shared is True if this caller reused another
+            caller's in-flight execution.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self._stats["executions"] += 1
+                leader = True
+        
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+    
+    def in_flight(self) -> int:
+        """Number of keys currently executing."""
+        with self._lock:
+            return len(self._calls)
+    
+    def stats(self) -> Dict[str, int]:
+        """Return call/execution/shared counters."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Database dialect helpers (SQLite default, PostgreSQL for multi-worker deployments).
+
+The backend is selected by SQLALCHEMY_DATABASE_URI (see app/config.py).
+SQLite keeps the single-file lab_portal.db with WAL mode; PostgreSQL gets a
+real connection pool and row-level locking, so several gunicorn workers can
+share one database.
+
+Helpers here hide the dialect differences from services:
+- engine_options_for(uri): pool / connect args per backend
+- upsert(model, rows, ...): INSERT ... ON CONFLICT DO UPDATE/NOTHING
+- for_allocation(query): SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL
+- advisory_xact_lock(name): cross-worker mutex held until commit (PostgreSQL)
+- is_retryable_error(e): "database is locked" / serialization / deadlock
+"""
+
+import logging
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL SQLSTATEs worth retrying: serialization_failure, deadlock_detected
+_PG_RETRYABLE_CODES = {'40001', '40P01'}
+
+
+def engine_options_for(uri: str, pool_size: int = 10, max_overflow: int = 20,
+                       pool_timeout: int = 30) -> Dict[str, Any]:
+    """SQLAlchemy engine options for the given database URI."""
+    if uri.startswith('sqlite'):
+        return {
+            'connect_args': {
+                'check_same_thread': False,
+                'timeout': 60,  # 60 second timeout for write locks (handles background thread contention)
+            },
+            'pool_pre_ping': True,
+            'pool_recycle': 3600,
+            'pool_size': 20,  # Background threads each hold a connection
+            'max_overflow': 30,
+        }
+    # Server databases: pool per worker process (total = workers * (pool_size + max_overflow))
+    return {
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+    }
+
+
+def install_sqlite_pragmas(engine) -> None:
+    """Apply WAL / busy timeout pragmas on every new SQLite connection."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL allows concurrent readers alongside the single writer
+            cursor.execute("PRAGMA journal_mode=WAL;")
+            cursor.execute("PRAGMA busy_timeout=60000;")
+            cursor.execute("PRAGMA synchronous=NORMAL;")  # Still crash-safe with WAL
+        finally:
+            cursor.close()
+
+
+def dialect_name(session=None) -> str:
+    """Name of the active dialect ('sqlite', 'postgresql', ...)."""
+    if session is None:
+        from app.models import db
+        session = db.session
+    return session.get_bind().dialect.name
+
+
+def is_postgres(session=None) -> bool:
+    return dialect_name(session) == 'postgresql'
+
+
+def is_sqlite(session=None) -> bool:
+    return dialect_name(session) == 'sqlite'
+
+
+def _insert_for(dialect: str, table):
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(table)
+
+
+def upsert(model, rows: Sequence[Dict[str, Any]], conflict_columns: Iterable[str],
+           update_columns: Optional[Iterable[str]] = None, session=None) -> int:
+    """Insert rows, resolving unique-key conflicts in the database.
+
+    Args:
+        model: Mapped model class
+        rows: Column dicts (all with the same keys)
+        conflict_columns: Columns of the unique constraint to resolve on
+        update_columns: Columns overwritten on conflict; None updates every
+            non-conflict column in the row, [] keeps the existing row
+            (ON CONFLICT DO NOTHING)
+        session: Session to execute on (default db.session; caller commits)
+
+    Returns:
+        Number of rows passed in
+    """
+    if not rows:
+        return 0
+    if session is None:
+        from app.models import db
+        session = db.session
+
+    conflict_columns = list(conflict_columns)
+    if update_columns is None:
+        update_columns = [c for c in rows[0] if c not in conflict_columns]
+    else:
+        update_columns = list(update_columns)
+
+    stmt = _insert_for(dialect_name(session), model.__table__)
+    if stmt is None:
+        # Other dialects: per-row merge on the unique key
+        for row in rows:
+            key = {c: row[c] for c in conflict_columns}
+            existing = session.query(model).filter_by(**key).first()
+            if existing is None:
+                session.add(model(**row))
+            else:
+                for column in update_columns:
+                    setattr(existing, column, row[column])
+        session.flush()
+        return len(rows)
+
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={c: stmt.excluded[c] for c in update_columns},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+    session.execute(stmt, list(rows))
+    return len(rows)
+
+
+def for_allocation(query):
+    """Lock rows claimed by an allocation query without blocking on rows others hold.
+
+    PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers each
+    claim a different free row. SQLite serializes writers already and has no
+    row locks, so the query is returned unchanged.
+    """
+    if is_postgres(query.session):
+        return query.with_for_update(skip_locked=True)
+    return query
+
+
+def advisory_xact_lock(name: str, session=None) -> None:
+    """Take a transaction-scoped mutex shared by all workers (PostgreSQL only).
+
+    Released automatically on commit/rollback. On SQLite this is a no-op;
+    callers keep their in-process lock for single-process deployments.
+    """
+    if session is None:
+        from app.models import db
+        session = db.session
+    if dialect_name(session) != 'postgresql':
+        return
+    key = zlib.crc32(name.encode('utf-8')) & 0x7FFFFFFF
+    session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': key})
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """True for transient concurrency errors that a retry may resolve."""
+    if 'database is locked' in str(error).lower():
+        return True
+    orig = getattr(error, 'orig', None)
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    return code in _PG_RETRYABLE_CODES
+
+
+def _load_order(metadata) -> list:
+    """Tables in FK dependency order with the cycle-forming nullable FKs ignored.
+
+    metadata.sorted_tables gives up on every dependency of tables inside a
+    cycle (it would load classes before users); here only the nullable FKs
+    of the cycle are dropped, and _deferred_fk_columns() covers those.
+    """
+    from sqlalchemy.schema import sort_tables, sort_tables_and_constraints
+
+    tables = list(metadata.tables.values())
+    ordered = sort_tables_and_constraints(tables)
+    cyclic = set(ordered[-1][1]) if ordered and ordered[-1][0] is None else set()
+    return sort_tables(tables, skip_fn=lambda fk: fk.constraint in cyclic and fk.parent.nullable)
+
+
+def _deferred_fk_columns(table, loaded: set) -> List[str]:
+    """Nullable FK columns of table referencing a table not loaded yet (or itself).
+
+    Foreign-key cycles (classes.template_id <-> templates.class_id) and
+    self-references (templates.original_template_id) cannot be satisfied by
+    any table order, so these columns are inserted as NULL and backfilled
+    once every table is loaded.
+    """
+    return [
+        column.name for column in table.columns
+        if column.nullable and any(
+            fk.column.table is table or fk.column.table.name not in loaded
+            for fk in column.foreign_keys
+        )
+    ]
+
+
+def copy_tables(source_engine, target_engine, metadata, batch_size: int = 1000,
+                tables: Optional[List[str]] = None) -> Dict[str, int]:
+    """Copy every table in metadata from source to target (schema created on target).
+
+    Only columns present in both databases are copied, so an older SQLite
+    file without the latest columns migrates cleanly (new columns get their
+    defaults). Values are read through the model column types, which turns
+    SQLite's 0/1 booleans and text timestamps into proper Python values.
+    Foreign keys that point forward in the load order (cycles, self
+    references) are backfilled in a second pass, so the target's FK
+    constraints hold after every statement. PostgreSQL id sequences are
+    advanced past the copied ids.
+
+    Returns:
+        Dict of table name -> rows copied
+    """
+    from sqlalchemy import bindparam, inspect, select
+
+    metadata.create_all(target_engine)
+    source_columns = {
+        name: {c['name'] for c in inspect(source_engine).get_columns(name)}
+        for name in inspect(source_engine).get_table_names()
+    }
+
+    copied: Dict[str, int] = {}
+    loaded: set = set()
+    backfills = []  # (table, key columns, deferred columns, rows)
+    with source_engine.connect() as src, target_engine.begin() as dst:
+        for table in _load_order(metadata):
+            if tables and table.name not in tables:
+                continue
+            if table.name not in source_columns:
+                logger.info("Skipping %s (not in source database)", table.name)
+                continue
+            columns = [c for c in table.columns if c.name in source_columns[table.name]]
+            deferred = [name for name in _deferred_fk_columns(table, loaded)
+                        if name in source_columns[table.name]]
+            keys = [c.name for c in table.primary_key.columns]
+            later = []
+            count = 0
+            result = src.execution_options(stream_results=True).execute(select(*columns))
+            while True:
+                batch = result.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows = [dict(row._mapping) for row in batch]
+                for row in rows:
+                    if any(row[name] is not None for name in deferred):
+                        later.append({**{f"k_{k}": row[k] for k in keys},
+                                      **{f"v_{name}": row[name] for name in deferred}})
+                        row.update({name: None for name in deferred})
+                dst.execute(table.insert(), rows)
+                count += len(batch)
+            copied[table.name] = count
+            loaded.add(table.name)
+            if later:
+                backfills.append((table, keys, deferred, later))
+
+            if target_engine.dialect.name == 'postgresql' and 'id' in table.columns and count:
+                dst.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"(SELECT MAX(id) FROM {table.name}))"
+                ))
+
+        for table, keys, deferred, rows in backfills:
+            statement = table.update().where(
+                *[table.c[k] == bindparam(f"k_{k}") for k in keys]
+            ).values({name: bindparam(f"v_{name}") for name in deferred})
+            for start in range(0, len(rows), batch_size):
+                dst.execute(statement, rows[start:start + batch_size])
+            logger.info("Backfilled %s.%s for %d rows", table.name, "/".join(deferred), len(rows))
+    return copied
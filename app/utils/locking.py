@@ -106,61 +106,44 @@ def pessimistic_lock(record_id: int, model_class,
             class_obj.name = "New Name"
             db.session.commit()
     """
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
     from app.models import db
-    from sqlalchemy import select
+    from app.utils.db_dialect import is_postgres
     
     lock_name = lock_name or model_class.__name__
-    start_time = time.time()
-    acquired = False
+    logger.debug(f"Acquiring pessimistic lock: {lock_name}(id={record_id})")
     
-    try:
-        # Try to acquire exclusive lock with timeout
-        logger.debug(f"Acquiring pessimistic lock: {lock_name}(id={record_id})")
-        
-        while time.time() - start_time < timeout:
-            try:
-                # Use FOR UPDATE for pessimistic lock
-                record = db.session.query(model_class)\
-                    .filter(model_class.id == record_id)\
-                    .with_for_update(timeout=5)\
-                    .first()
-                
-                if record is None:
-                    raise ValueError(f"Record {lock_name}(id={record_id}) not found")
-                
-                acquired = True
-                logger.debug(f"Pessimistic lock acquired: {lock_name}(id={record_id})")
-                
-                try:
-                    yield record
-                finally:
-                    # Lock automatically released when session ends/rolls back
-                    logger.debug(f"Pessimistic lock released: {lock_name}(id={record_id})")
-                
-                return
-            
-            except Exception as e:
-                if 'timeout' in str(e).lower():
-                    # Lock is held by another transaction, retry
-                    elapsed = time.time() - start_time
-                    remaining = timeout - elapsed
-                    logger.debug(f"Lock contention on {lock_name}(id={record_id}), "
-                               f"retrying ({elapsed:.1f}s/{timeout}s)...")
-                    time.sleep(0.5)
-                    continue
-                
-                # Other error, fail immediately
-                raise
-        
-        # Timeout occurred
-        raise PessimisticLockTimeout(
-            f"Could not acquire lock on {lock_name}(id={record_id}) within {timeout}s. "
-            f"Another operation may be in progress. Please try again."
-        )
+    query = db.session.query(model_class).filter(model_class.id == record_id)
+    if is_postgres():
+        # Real row lock: blocks in the database (no polling) for up to `timeout`
+        db.session.execute(text(f"SET LOCAL lock_timeout = '{int(timeout * 1000)}ms'"))
+        query = query.with_for_update()
+    # SQLite has no row locks - its single writer lock serializes the update
     
-    except Exception as e:
+    try:
+        record = query.first()
+    except OperationalError as e:
+        db.session.rollback()
+        # 55P03 lock_not_available: "canceling statement due to lock timeout"
+        if getattr(e.orig, 'pgcode', None) == '55P03' or 'lock timeout' in str(e).lower():
+            raise PessimisticLockTimeout(
+                f"Could not acquire lock on {lock_name}(id={record_id}) within {timeout}s. "
+                f"Another operation may be in progress. Please try again."
+            ) from e
         logger.error(f"Pessimistic lock error on {lock_name}(id={record_id}): {e}")
         raise
+    
+    if record is None:
+        raise ValueError(f"Record {lock_name}(id={record_id}) not found")
+    
+    logger.debug(f"Pessimistic lock acquired: {lock_name}(id={record_id})")
+    try:
+        yield record
+    finally:
+        # Lock automatically released when the transaction commits/rolls back
+        logger.debug(f"Pessimistic lock released: {lock_name}(id={record_id})")
 
 
 class OptimisticLockMixin:
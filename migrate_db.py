@@ -3,6 +3,10 @@
 Comprehensive database migration script.
 Ensures all tables and columns exist as defined in models.py.
 Migrates cluster configuration from clusters.json to database.
+
+With SQLALCHEMY_DATABASE_URI pointing at another database (PostgreSQL),
+only the column migrations run there - Flask creates missing tables on
+startup, and the remaining steps concern the SQLite file.
 """
 
 import os
@@ -30,6 +34,8 @@ CRITICAL_MIGRATIONS = [
     ('classes', 'hours_start', 'INTEGER', '0'),  # Start hour (0-23)
     ('classes', 'hours_end', 'INTEGER', '23'),  # End hour (0-23)
     ('classes', 'max_usage_hours', 'INTEGER', '0'),  # Max cumulative hours students can use VM (0=unlimited)
+    ('classes', 'warm_pool_size', 'INTEGER', '0'),  # Spare student VMs kept ready for joins/reverts
+    ('classes', 'warm_pool_boot', 'BOOLEAN', '0'),  # Keep warm spares running
     ('vm_assignments', 'manually_added', 'BOOLEAN', '0'),
     ('vm_assignments', 'is_teacher_vm', 'BOOLEAN', '0'),
     ('vm_assignments', 'vm_name', 'TEXT', 'NULL'),
@@ -70,6 +76,8 @@ CRITICAL_MIGRATIONS = [
     ('clusters', 'description', 'TEXT', 'NULL'),
     # Encryption support - increase password column size for encrypted data
     ('clusters', 'password_expanded', 'VARCHAR(512)', 'NULL'),  # Placeholder for password size migration
+    # Storage probe results
+    ('node_storage_probes', 'error_at', 'TIMESTAMP', 'NULL'),  # Last storage probe failure (probed_at = last success)
 ]
 
 # System settings table schema
@@ -450,6 +458,61 @@ def migrate_clusters_from_json(cursor):
         return 0
 
 
+def _column_default(dialect, col_type, default_value):
+    """DEFAULT clause value for the dialect (PostgreSQL booleans take TRUE/FALSE, not 1/0)."""
+    if col_type == 'BOOLEAN' and dialect != 'sqlite' and default_value in ('0', '1'):
+        return 'TRUE' if default_value == '1' else 'FALSE'
+    return default_value
+
+
+def add_missing_columns(engine):
+    """Add CRITICAL_MIGRATIONS columns missing from the engine's database. Returns columns added."""
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    added = 0
+    for table_name, col_name, col_type, default_value in CRITICAL_MIGRATIONS:
+        if table_name not in tables:
+            print(f"⚠ Table '{table_name}' does not exist - skipping")
+            continue
+        
+        existing_columns = {col['name'] for col in inspector.get_columns(table_name)}
+        if col_name in existing_columns:
+            print(f"✓ {table_name}.{col_name} already exists")
+            continue
+        
+        default_sql = _column_default(engine.dialect.name, col_type, default_value)
+        print(f"➕ Adding {table_name}.{col_name} ({col_type} DEFAULT {default_sql})")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {col_name} {col_type} DEFAULT {default_sql}"))
+            added += 1
+            print("   ✓ Successfully added")
+        except Exception as e:
+            print(f"   ❌ Failed: {e}")
+    return added
+
+
+def migrate_configured_database(uri):
+    """Column migrations for a non-SQLite SQLALCHEMY_DATABASE_URI. Returns an exit code."""
+    from sqlalchemy import create_engine
+
+    engine = create_engine(uri)
+    print(f"✓ Database: {engine.url.render_as_string(hide_password=True)}")
+    try:
+        print("\n📋 Checking column migrations...")
+        added = add_missing_columns(engine)
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        engine.dispose()
+    print(f"\n✅ Migration completed - {added} column(s) added" if added
+          else "\n✅ Database is up to date - no changes needed")
+    return 0
+
+
 def migrate():
     """Add all missing columns to existing tables and migrate clusters."""
     
@@ -479,31 +542,15 @@ def migrate():
         if create_clusters_table(cursor):
             total_changes += 1
         
-        # Step 2: Migrate column additions
+        # Step 2: Migrate column additions (own connection - release our write lock first)
         print("\n📋 Checking column migrations...")
-        for table_name, col_name, col_type, default_value in CRITICAL_MIGRATIONS:
-            # Check if table exists
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-            if not cursor.fetchone():
-                print(f"⚠ Table '{table_name}' does not exist - skipping")
-                continue
-            
-            # Get existing columns
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            existing_columns = [col[1] for col in cursor.fetchall()]
-            
-            if col_name not in existing_columns:
-                # Add missing column
-                print(f"➕ Adding {table_name}.{col_name} ({col_type} DEFAULT {default_value})")
-                
-                try:
-                    cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col_name} {col_type} DEFAULT {default_value}")
-                    total_changes += 1
-                    print("   ✓ Successfully added")
-                except Exception as e:
-                    print(f"   ❌ Failed: {e}")
-            else:
-                print(f"✓ {table_name}.{col_name} already exists")
+        conn.commit()
+        from sqlalchemy import create_engine
+        engine = create_engine(f"sqlite:///{os.path.abspath(DB_PATH)}")
+        try:
+            total_changes += add_missing_columns(engine)
+        finally:
+            engine.dispose()
         
         # Step 2.5: Regenerate join tokens to use new simple format
         print("\n🔄 Checking join token format...")
@@ -590,4 +637,7 @@ def migrate():
         conn.close()
 
 if __name__ == '__main__':
+    from app.config import SQLALCHEMY_DATABASE_URI as database_uri
+    if database_uri and not database_uri.startswith('sqlite'):
+        sys.exit(migrate_configured_database(database_uri))
     sys.exit(migrate())
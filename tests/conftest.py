@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures.
+
+`app` is the real application from create_app() (TESTING, with background
+services switched off) on a fresh database with every table created, inside an app
+context. The database is in-memory SQLite unless a test module asks for a
+file-backed one (needed when another thread, such as the DB writer, opens
+its own connection):
+
+    pytestmark = pytest.mark.parametrize("app", ["file"], indirect=True)
+
+Other values are used as the database URI.
+"""
+
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+@pytest.fixture
+def app(request, tmp_path):
+    from app import create_app
+    from app.models import db
+
+    uri = getattr(request, "param", None) or "sqlite://"
+    if uri == "file":
+        uri = f"sqlite:///{tmp_path / 'test.db'}"
+
+    application = create_app({"SQLALCHEMY_DATABASE_URI": uri, "TESTING": True, "BACKGROUND_SERVICES": False})
+    with application.app_context():
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
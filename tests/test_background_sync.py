@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Tests for the background sync pipelines (templates, ISOs).
+
+Uses an in-memory SQLite database and a fake Proxmox API.
+
+Run with: python -m pytest tests/test_background_sync.py -v
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+class FakeProxmox:
+    """Path-routed fake: responses[path] -> value (or Exception to raise)."""
+
+    def __init__(self, responses, path=""):
+        self._responses = responses
+        self._path = path
+        self.calls = responses.setdefault("__calls__", [])
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return FakeProxmox(self._responses, f"{self._path}/{item}".strip("/"))
+
+    def __call__(self, resource_id):
+        return FakeProxmox(self._responses, f"{self._path}/{resource_id}")
+
+    def get(self, **params):
+        self.calls.append(self._path)
+        value = self._responses[self._path]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+@pytest.fixture
+def sync_env(app, monkeypatch):
+    from app.services import background_sync, proxmox_service
+
+    responses = {
+        "version": {"version": "8.1"},
+        "nodes": [{"node": "pve1"}, {"node": "pve2"}],
+        "nodes/pve1/qemu": [
+            {"vmid": 9000, "name": "ubuntu", "template": 1, "cpus": 2, "maxmem": 2 << 30},
+            {"vmid": 101, "name": "running-vm", "template": 0},
+        ],
+        "nodes/pve2/qemu": [
+            {"vmid": 9001, "name": "win11", "template": 1, "cpus": 4, "maxmem": 8 << 30},
+        ],
+        "nodes/pve1/qemu/9000/config": {"cores": 2, "memory": 2048, "scsi0": "local:9000/base.qcow2,size=32G"},
+        "nodes/pve2/qemu/9001/config": {"cores": 4, "memory": 8192, "net0": "virtio,bridge=vmbr1"},
+        "nodes/pve1/storage": [
+            {"storage": "local", "content": "iso,vztmpl", "active": 1},
+            {"storage": "nfs-iso", "content": "iso", "shared": 1, "active": 1},
+            {"storage": "local-lvm", "content": "images", "active": 1},
+        ],
+        "nodes/pve2/storage": [
+            {"storage": "local", "content": "iso,vztmpl", "active": 1},
+            {"storage": "nfs-iso", "content": "iso", "shared": 1, "active": 1},
+        ],
+        "nodes/pve1/storage/local/content": [{"volid": "local:iso/debian.iso", "size": 100}],
+        "nodes/pve2/storage/local/content": [],
+        "nodes/pve1/storage/nfs-iso/content": [
+            {"volid": "nfs-iso:iso/ubuntu.iso", "size": 200},
+            {"volid": "nfs-iso:iso/readme.txt", "size": 1},
+        ],
+    }
+    fake = FakeProxmox(responses)
+
+    monkeypatch.setattr(proxmox_service, "get_clusters_from_db",
+                        lambda: [{"id": "c1", "host": "10.0.0.1", "name": "C1"}])
+    monkeypatch.setattr(proxmox_service, "get_proxmox_admin_for_cluster", lambda cluster_id: fake)
+    background_sync._template_digests.invalidate()
+    background_sync._iso_listing_hashes.invalidate()
+
+    return responses
+
+
+def _config_calls(responses):
+    return [c for c in responses["__calls__"] if c.endswith("/config")]
+
+
+def test_template_sync_adds_templates_with_specs(sync_env):
+    from app.models import Template
+    from app.services.background_sync import _sync_stats, sync_templates_from_proxmox
+
+    stats = sync_templates_from_proxmox(full_sync=True)
+
+    assert stats["templates_found"] == 2
+    assert stats["templates_added"] == 2
+    assert stats["errors"] == []
+    ubuntu = Template.query.filter_by(proxmox_vmid=9000).one()
+    assert ubuntu.node == "pve1"
+    assert ubuntu.disk_size_gb == 32.0
+    assert Template.query.filter_by(proxmox_vmid=9001).one().network_bridge == "vmbr1"
+    assert _sync_stats["template_cluster_timings"]["c1"]["templates"] == 2
+
+
+def test_template_sync_skips_unchanged_configs(sync_env):
+    from app.services.background_sync import sync_templates_from_proxmox
+
+    sync_templates_from_proxmox(full_sync=True)
+    assert len(_config_calls(sync_env)) == 2
+
+    stats = sync_templates_from_proxmox(full_sync=True)
+    assert len(_config_calls(sync_env)) == 2  # nothing changed -> no config fetches
+    assert stats["configs_skipped"] == 2
+
+    sync_env["nodes/pve2/qemu"][0]["maxmem"] = 16 << 30
+    sync_env["nodes/pve2/qemu/9001/config"]["memory"] = 16384
+    sync_templates_from_proxmox(full_sync=True)
+    assert _config_calls(sync_env)[-1] == "nodes/pve2/qemu/9001/config"
+    assert len(_config_calls(sync_env)) == 3
+
+
+def test_template_sync_keeps_rows_of_offline_nodes(sync_env):
+    from app.models import Template
+    from app.services.background_sync import sync_templates_from_proxmox
+
+    sync_templates_from_proxmox(full_sync=True)
+    sync_env["nodes/pve2/qemu"] = Exception("595 Errors during connection establishment")
+    sync_env["nodes/pve1/qemu"] = [{"vmid": 101, "name": "running-vm", "template": 0}]
+
+    stats = sync_templates_from_proxmox(full_sync=True)
+
+    assert stats["templates_removed"] == 1  # 9000 gone from a reachable node
+    assert Template.query.filter_by(proxmox_vmid=9001).count() == 1  # pve2 offline: kept
+
+
+def test_node_listings_run_in_parallel(sync_env):
+    from app.services import background_sync
+
+    barrier = threading.Barrier(2, timeout=2)
+
+    class BarrierProxmox(FakeProxmox):
+        def get(self, **params):
+            if self._path.endswith("/qemu"):
+                barrier.wait()  # deadlocks (BrokenBarrierError) if listings are serial
+            return super().get(**params)
+
+    listed, errors = background_sync._list_node_templates(BarrierProxmox(sync_env), ["pve1", "pve2"])
+    assert errors == {}
+    assert [vm["vmid"] for vm in listed["pve1"]] == [9000]
+
+
+def _content_calls(responses):
+    return [c for c in responses["__calls__"] if c.endswith("/content")]
+
+
+def test_iso_sync_scans_shared_storage_once(sync_env):
+    from app.models import ISOImage
+    from app.services.background_sync import sync_isos_from_proxmox
+
+    stats = sync_isos_from_proxmox(full_sync=True)
+
+    assert stats["errors"] == []
+    assert stats["isos_added"] == 2
+    assert sorted(i.volid for i in ISOImage.query.all()) == ["local:iso/debian.iso", "nfs-iso:iso/ubuntu.iso"]
+    # nfs-iso is mounted on both nodes but listed once; local is per node
+    assert sorted(_content_calls(sync_env)) == [
+        "nodes/pve1/storage/local/content",
+        "nodes/pve1/storage/nfs-iso/content",
+        "nodes/pve2/storage/local/content",
+    ]
+
+
+def test_iso_sync_unchanged_storages_skip_diff(sync_env):
+    from app.models import ISOImage
+    from app.services.background_sync import sync_isos_from_proxmox
+
+    sync_isos_from_proxmox(full_sync=True)
+    stats = sync_isos_from_proxmox(full_sync=True)
+    assert stats["storages_unchanged"] == 3
+    assert stats["isos_added"] == stats["isos_updated"] == stats["isos_removed"] == 0
+
+    sync_env["nodes/pve1/storage/nfs-iso/content"] = [{"volid": "nfs-iso:iso/fedora.iso", "size": 300}]
+    stats = sync_isos_from_proxmox(full_sync=True)
+    assert stats["isos_added"] == 1
+    assert stats["isos_removed"] == 1
+    assert ISOImage.query.filter_by(volid="nfs-iso:iso/ubuntu.iso").count() == 0
+
+
+def test_iso_sync_keeps_isos_of_failed_storages(sync_env):
+    from app.models import ISOImage
+    from app.services.background_sync import sync_isos_from_proxmox
+
+    sync_isos_from_proxmox(full_sync=True)
+    sync_env["nodes/pve1/storage/nfs-iso/content"] = Exception("storage 'nfs-iso' is not online")
+
+    stats = sync_isos_from_proxmox(full_sync=True)
+
+    assert stats["isos_removed"] == 0
+    assert ISOImage.query.filter_by(volid="nfs-iso:iso/ubuntu.iso").count() == 1
+
+
+def test_iso_sync_failed_storage_does_not_shield_node_of_same_name(sync_env):
+    from app.models import ISOImage
+    from app.services.background_sync import sync_isos_from_proxmox
+
+    sync_env["nodes/pve2/storage/local/content"] = [{"volid": "local:iso/pve2-only.iso", "size": 50}]
+    sync_isos_from_proxmox(full_sync=True)
+
+    # The ISO is gone from pve2, while an unrelated storage named "pve2" fails on pve1
+    sync_env["nodes/pve2/storage/local/content"] = []
+    sync_env["nodes/pve1/storage"] = sync_env["nodes/pve1/storage"] + [
+        {"storage": "pve2", "content": "iso", "active": 1}]
+    sync_env["nodes/pve1/storage/pve2/content"] = Exception("storage 'pve2' is not online")
+
+    stats = sync_isos_from_proxmox(full_sync=True)
+
+    assert stats["isos_removed"] == 1
+    assert ISOImage.query.filter_by(volid="local:iso/pve2-only.iso").count() == 0
+
+
+def _seed_inventory(count, cluster_id="c1", status="stopped"):
+    from app.models import VMInventory, db
+
+    for vmid in range(100, 100 + count):
+        db.session.add(VMInventory(cluster_id=cluster_id, vmid=vmid, name=f"vm{vmid}",
+                                   node="pve1", status=status, type="qemu"))
+    db.session.commit()
+
+
+def test_quick_sync_covers_whole_fleet_with_one_call(sync_env):
+    from app.models import VMInventory
+    from app.services.background_sync import _perform_quick_sync, _sync_stats
+
+    _seed_inventory(120)
+    sync_env["cluster/resources"] = [
+        {"vmid": vmid, "node": "pve1", "status": "running" if vmid % 2 else "stopped", "type": "qemu"}
+        for vmid in range(100, 220)
+    ]
+
+    _perform_quick_sync()
+
+    assert sync_env["__calls__"] == ["cluster/resources"]
+    assert VMInventory.query.filter_by(status="running").count() == 60
+    assert _sync_stats["quick_sync_last"]["vms_checked"] == 120
+    assert _sync_stats["quick_sync_last"]["vms_changed"] == 60
+
+
+def test_quick_sync_writes_only_changed_rows(sync_env):
+    from app.models import VMInventory, db
+    from app.services.background_sync import _perform_quick_sync, _sync_stats
+
+    _seed_inventory(3)
+    sync_env["cluster/resources"] = [
+        {"vmid": 100, "node": "pve1", "status": "stopped"},
+        {"vmid": 101, "node": "pve2", "status": "stopped"},  # migrated
+        {"vmid": 102, "node": "pve1", "status": "running"},
+        {"vmid": 555, "node": "pve1", "status": "running"},  # not inventoried yet
+    ]
+
+    _perform_quick_sync()
+
+    assert _sync_stats["quick_sync_last"]["vms_changed"] == 2
+    assert _sync_stats["quick_sync_last"]["vms_unknown"] == 1
+    db.session.expire_all()
+    assert VMInventory.query.filter_by(vmid=100).one().last_status_check is None
+    assert VMInventory.query.filter_by(vmid=101).one().node == "pve2"
+    assert VMInventory.query.filter_by(vmid=102).one().status == "running"
+    assert VMInventory.query.filter_by(vmid=555).count() == 0
+
+    _perform_quick_sync()
+    assert _sync_stats["quick_sync_last"]["vms_changed"] == 0
+
+
+def test_quick_sync_fails_only_when_every_cluster_fails(sync_env):
+    from app.services.background_sync import _perform_quick_sync
+
+    sync_env["cluster/resources"] = Exception("595 Errors during connection establishment")
+    with pytest.raises(RuntimeError):
+        _perform_quick_sync()
+
+
+def test_quick_sync_resolves_connections_in_app_context(sync_env, monkeypatch):
+    from flask import has_app_context
+
+    from app.services import proxmox_service
+    from app.services.background_sync import _perform_quick_sync, _sync_stats
+
+    real = proxmox_service.get_proxmox_admin_for_cluster
+    contexts = []
+
+    def lookup(cluster_id):
+        # The real lookup needs the database (app context) for cluster IDs
+        contexts.append(has_app_context())
+        return real(cluster_id)
+
+    monkeypatch.setattr(proxmox_service, "get_proxmox_admin_for_cluster", lookup)
+    _seed_inventory(2)
+    sync_env["cluster/resources"] = [{"vmid": 100, "node": "pve1", "status": "running"}]
+
+    _perform_quick_sync()
+
+    assert contexts == [True]
+    assert _sync_stats["quick_sync_last"]["vms_changed"] == 1
+
+
+def test_immediate_sync_without_scheduler_runs_only_that_job(monkeypatch):
+    from app.services import background_sync
+
+    ran = []
+    for name, func_name, _, _ in background_sync.SYNC_JOBS:
+        monkeypatch.setattr(background_sync, func_name, lambda name=name: ran.append(name))
+    monkeypatch.setattr(background_sync, "_scheduler", None)
+
+    assert background_sync.trigger_immediate_sync('iso_quick_sync')
+    assert background_sync.trigger_immediate_sync()
+    assert not background_sync.trigger_immediate_sync('no_such_job')
+    assert ran == ['iso_quick_sync', 'vm_full_sync']
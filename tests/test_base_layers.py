@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental base publishing and base chain flattening.
+
+Run with: python -m pytest tests/test_base_layers.py -v
+"""
+
+import json
+import os
+import shlex
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+DIR = "/mnt/pve/nfs/images"
+BASE = f"{DIR}/web101-base.qcow2"
+STAGING = f"{DIR}/web101-staging.qcow2"
+TEACHER = "/mnt/pve/nfs/images/10100/vm-10100-disk-0.qcow2"
+
+
+class ScriptedSSH:
+    """Records commands; replies from the first (substring, reply) rule that matches.
+
+    reply is (exit, stdout, stderr) or a callable returning one.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.commands = []
+
+    def execute(self, cmd, check=True, timeout=None):
+        self.commands.append(cmd)
+        for needle, reply in self.rules:
+            if needle in cmd:
+                return reply() if callable(reply) else reply
+        return 0, '', ''
+
+    def ran(self, needle):
+        return [c for c in self.commands if needle in c]
+
+
+def test_incremental_publish_writes_delta_layer_and_resets_teacher():
+    from app.services.base_layers import publish_incremental
+
+    ssh = ScriptedSSH([
+        ('qm status', (0, 'status: stopped\n', '')),
+        ('qemu-img info --output=json', (0, json.dumps({'backing-filename': BASE}), '')),
+        ('find ', (0, '', '')),  # base not yet linked as a layer
+        ('stat -c', (0, '5242880\n', '')),
+    ])
+
+    ok, detail = publish_incremental(ssh, 10100, TEACHER, BASE, STAGING, 'web101')
+
+    assert ok and detail == '5.0 MiB delta layer'
+    parent = ssh.ran(f'ln {BASE} ')[0].split()[-1]
+    assert parent.startswith(f"{DIR}/web101-layer-")
+    convert = ssh.ran('qemu-img convert')[0]
+    # Only the teacher overlay's clusters, on top of the immutable parent name
+    assert f"-B {parent} -F qcow2 {TEACHER} " in convert
+    new_layer = convert.split()[-1]
+    assert new_layer != parent and new_layer.startswith(f"{DIR}/web101-layer-")
+    assert ssh.ran(f"ln {new_layer} {STAGING}")
+    assert ssh.ran(f"qemu-img create -f qcow2 -F qcow2 -b {new_layer} {TEACHER}.publish-tmp")
+
+
+def test_incremental_publish_declines_foreign_or_running_teacher():
+    from app.services.base_layers import publish_incremental
+
+    running = ScriptedSSH([('qm status', (0, 'status: running\n', ''))])
+    assert publish_incremental(running, 10100, TEACHER, BASE, STAGING, 'web101')[0] is False
+
+    foreign = ScriptedSSH([
+        ('qm status', (0, 'status: stopped\n', '')),
+        ('qemu-img info --output=json', (0, json.dumps({'full-backing-filename': '/mnt/pve/nfs/images/t9000-base.qcow2'}), '')),
+    ])
+    ok, detail = publish_incremental(foreign, 10100, TEACHER, BASE, STAGING, 'web101')
+    assert ok is False and 'not the class base' in detail
+    assert not foreign.ran('qemu-img convert')
+
+
+def test_flatten_collapses_long_chain_and_removes_unreferenced_layers():
+    from app.services.base_layers import flatten_base
+
+    layers = [f"{DIR}/web101-layer-{n}.qcow2" for n in range(1, 6)]
+    stray = f"{DIR}/web101-layer-0 copy.qcow2"  # a name with a space in it
+    chain = [{'filename': BASE}] + [{'filename': path} for path in reversed(layers[:4])]
+
+    def base_chain():
+        flattened = ssh.ran(f"mv -f {DIR}/web101-flat.tmp {BASE}")
+        return 0, json.dumps(chain[:1] if flattened else chain), ''
+
+    ssh = ScriptedSSH([
+        (f'--backing-chain --output=json {BASE}', base_chain),
+        # Teacher was reset onto the newest (unpushed) layer
+        (f'--backing-chain --output=json {TEACHER}', (0, json.dumps([{'filename': TEACHER}, {'filename': layers[4]}, {'filename': layers[3]}]), '')),
+        ('--backing-chain', (1, '', 'No such file')),
+        ('-print0', (0, '\0'.join([stray] + layers) + '\0', '')),
+        ('find ', (0, layers[3] + '\n', '')),
+    ])
+
+    result = flatten_base(ssh, BASE, STAGING, 'web101', keep_paths=[TEACHER], max_depth=4)
+
+    assert result['depth'] == 5 and result['flattened']
+    assert ssh.ran(f"qemu-img convert -f qcow2 -O qcow2 {BASE} {DIR}/web101-flat.tmp")
+    assert ssh.ran(f"mv -f {layers[3]}.new {layers[3]}")
+    assert ssh.ran(f"mv -f {DIR}/web101-flat.tmp {BASE}")
+    assert result['removed'] == [stray] + layers[:3]
+    assert ssh.ran(f"rm -f {shlex.quote(stray)}")
+
+    short = ScriptedSSH([('--backing-chain', (0, json.dumps(chain[:2]), ''))])
+    assert flatten_base(short, BASE, STAGING, 'web101', max_depth=4)['flattened'] is False
+    assert not short.ran('qemu-img convert')
+
+
+def test_push_publishes_staging_under_a_layer_name_and_promotes_it_last():
+    from app.services.base_layers import promote_base, publish_staging
+
+    # Full export: staging has no layer name yet
+    ssh = ScriptedSSH([('find ', (0, '', ''))])
+    layer = publish_staging(ssh, STAGING, BASE, 'web101')
+    assert layer.startswith(f"{DIR}/web101-layer-")
+    assert ssh.ran(f"ln {STAGING} {layer}")
+    assert not ssh.ran(BASE + ' ')  # the base students read is untouched
+
+    # Incremental publish: staging already is a layer
+    linked = ScriptedSSH([('find ', (0, f"{DIR}/web101-layer-7.qcow2\n", ''))])
+    assert publish_staging(linked, STAGING, BASE, 'web101') == f"{DIR}/web101-layer-7.qcow2"
+    assert not linked.ran('ln ')
+
+    promote_base(ssh, layer, BASE, STAGING)
+    assert ssh.commands[-2] == f"ln -f {layer} {BASE}.new && mv -f {BASE}.new {BASE}"
+    assert ssh.commands[-1] == f"rm -f {STAGING}"
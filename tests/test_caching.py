@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the caching utilities (ThreadSafeCache, PersistentCache).
+
+Run with: python -m pytest tests/test_caching.py -v
+"""
+
+import json
+import os
+import sys
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+def test_thread_safe_cache_lru_eviction():
+    from app.utils.caching import ThreadSafeCache
+
+    cache = ThreadSafeCache(ttl=60, max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper())
+    assert cache.get("a") == "A"  # a becomes most recently used
+    cache.set("d", "D")
+
+    assert "b" not in cache
+    assert cache.get("a") == "A"
+    assert len(cache) == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_thread_safe_cache_byte_bound():
+    from app.utils.caching import ThreadSafeCache, estimate_size
+
+    payload = "x" * 1000
+    cache = ThreadSafeCache(ttl=60, max_bytes=estimate_size(payload) * 2)
+    for i in range(5):
+        cache.set(i, payload)
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert 4 in cache and 0 not in cache
+
+
+def test_thread_safe_cache_expiry_and_sweep():
+    from app.utils.caching import ThreadSafeCache
+
+    cache = ThreadSafeCache(ttl=60, sweep_interval=3600)
+    cache.set("short", 1, ttl=0.05)
+    cache.set("long", 2)
+    time.sleep(0.1)
+
+    assert cache.peek("short") is None
+    assert len(cache) == 2  # expired but not yet swept
+    assert cache.sweep() == 1
+    assert len(cache) == 1
+    assert cache.stats()["expirations"] == 1
+
+
+def test_thread_safe_cache_stats_and_dict_access():
+    from app.utils.caching import ThreadSafeCache, get_cache_stats
+
+    cache = ThreadSafeCache(ttl=60, name="test-dict-access")
+    cache["k"] = "v"
+    assert cache["k"] == "v"
+    try:
+        cache["missing"]
+        assert False, "expected KeyError"
+    except KeyError:
+        pass
+
+    stats = get_cache_stats()["test-dict-access"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+    value, age = cache.peek("k")
+    assert value == "v" and age >= 0
+    cache.invalidate("k")
+    assert cache.get_age("k") == -1
+
+
+def test_persistent_cache_appends_and_replays(tmp_path):
+    from app.utils.caching import PersistentCache
+
+    path = str(tmp_path / "cache.jsonl")
+    cache = PersistentCache(path, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", {"x": 2})
+    cache.invalidate("a")
+
+    with open(path) as f:
+        assert len(f.read().splitlines()) == 3  # one record per write
+
+    reloaded = PersistentCache(path, ttl=60)
+    assert reloaded.get("a") is None
+    assert reloaded.get("b") == {"x": 2}
+    assert reloaded.get_batch(["a", "b"]) == {"b": {"x": 2}}
+
+
+def test_persistent_cache_compacts_log(tmp_path):
+    from app.utils.caching import PersistentCache
+
+    path = str(tmp_path / "cache.jsonl")
+    cache = PersistentCache(path, ttl=60, compact_ratio=2.0, compact_min_records=10)
+    for i in range(25):
+        cache.set("same", i)
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) < 10
+    assert PersistentCache(path, ttl=60).get("same") == 24
+
+
+def test_persistent_cache_reads_legacy_json(tmp_path):
+    from app.utils.caching import PersistentCache
+
+    path = str(tmp_path / "legacy.json")
+    with open(path, "w") as f:
+        json.dump({"old": {"value": "kept", "timestamp": time.time()}}, f)
+
+    cache = PersistentCache(path, ttl=60)
+    assert cache.get("old") == "kept"
+    cache.set("new", "added")  # first append converts the file to a log
+
+    reloaded = PersistentCache(path, ttl=60)
+    assert reloaded.get("old") == "kept"
+    assert reloaded.get("new") == "added"
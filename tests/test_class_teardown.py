@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Tests for the bulk class teardown job.
+
+Run with: python -m pytest tests/test_class_teardown.py -v
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+IMAGES = "/mnt/pve/TRUENAS-NFS/images"
+
+
+class FakeProxmox:
+    """Stop/delete return UPIDs; tracks per-node concurrency and call order."""
+
+    def __init__(self, resources, configs=None, fail_delete=()):
+        self.resources = resources
+        self.configs = configs or {}
+        self.fail_delete = set(fail_delete)
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+        self.calls = []
+        self.cluster = self._Cluster(self)
+
+    class _Cluster:
+        def __init__(self, api):
+            self.resources = _Get(lambda **kw: api.resources)
+
+    def nodes(self, node):
+        return _Node(self, node)
+
+    def task(self, kind, node, vmid):
+        with self.lock:
+            self.calls.append((kind, node, vmid))
+            self.active[node] = self.active.get(node, 0) + 1
+            self.max_active[node] = max(self.max_active.get(node, 0), self.active[node])
+        time.sleep(0.02)
+        with self.lock:
+            self.active[node] -= 1
+        status = 'fail' if kind == 'delete' and vmid in self.fail_delete else 'ok'
+        return f"UPID:{node}:0001:{kind}:{vmid}:{status}:"
+
+
+class _Get:
+    def __init__(self, func):
+        self.get = func
+
+
+class _Node:
+    def __init__(self, api, node):
+        self.api, self.node = api, node
+
+    def qemu(self, vmid):
+        return _Vm(self.api, self.node, vmid)
+
+    def tasks(self, upid):
+        class _Task:
+            status = _Get(lambda: {'status': 'stopped',
+                                   'exitstatus': 'OK' if upid.split(':')[5] == 'ok' else 'storage busy'})
+
+        return _Task()
+
+
+class _Vm:
+    def __init__(self, api, node, vmid):
+        self.api, self.node, self.vmid = api, node, vmid
+        self.config = _Get(lambda: api.configs.get(vmid, {}))
+
+        class _Status:
+            class stop:
+                post = staticmethod(lambda: api.task('stop', node, vmid))
+
+        self.status = _Status()
+
+    def delete(self, **kwargs):
+        assert kwargs.get('purge') == 1
+        return self.api.task('delete', self.node, self.vmid)
+
+
+class RecordingSSH:
+    def __init__(self):
+        self.commands = []
+
+    def execute(self, cmd, timeout=None, check=True):
+        self.commands.append(cmd)
+        return 0, '', ''
+
+
+def test_unmanaged_disk_files_and_cleanup_commands():
+    from app.services.class_teardown import TeardownVM, cleanup_commands, unmanaged_disk_files
+
+    config = {
+        'scsi0': f'{IMAGES}/201/vm-201-disk-0.qcow2,size=32G',
+        'scsi1': f'{IMAGES}/web101-base.qcow2',  # never the class base
+        'ide2': 'none,media=cdrom',
+        'efidisk0': 'TRUENAS-NFS:201/vm-201-disk-1.qcow2',  # storage-managed, purge removes it
+    }
+    assert unmanaged_disk_files(201, config) == [f'{IMAGES}/201/vm-201-disk-0.qcow2']
+
+    vms = [
+        TeardownVM(201, 'pve1', files=[f'{IMAGES}/201/vm-201-disk-0.qcow2'], deleted=True),
+        TeardownVM(202, 'pve1', files=[f'{IMAGES}/202/vm-202-disk-0.qcow2'], deleted=True),
+        TeardownVM(203, 'pve1', files=[f'{IMAGES}/203/vm-203-disk-0.qcow2']),  # not destroyed
+    ]
+    assert cleanup_commands(vms) == [(
+        'pve1',
+        f"cd {IMAGES} && rm -f -- 201/vm-201-disk-0.qcow2 202/vm-202-disk-0.qcow2 "
+        f"&& rmdir --ignore-fail-on-non-empty -- 201 202",
+    )]
+
+
+def test_teardown_job_bounds_per_node_and_reports_progress():
+    from app.services.class_teardown import TeardownJob
+    from app.services.clone_progress import get_clone_progress, start_clone_progress
+
+    resources = [{'vmid': 300 + i, 'node': 'pve1' if i < 6 else 'pve2', 'status': 'running' if i % 2 else 'stopped'}
+                 for i in range(8)]
+    configs = {300 + i: {'scsi0': f'{IMAGES}/{300 + i}/vm-{300 + i}-disk-0.qcow2'} for i in range(8)}
+    api = FakeProxmox(resources, configs, fail_delete={307})
+    ssh = RecordingSSH()
+    # DB had 301 on the wrong node, 399 no longer exists
+    vms = [{'vmid': 300 + i, 'node': 'pve2' if i == 1 else 'pve1'} for i in range(8)] + [{'vmid': 399, 'node': 'pve1'}]
+
+    start_clone_progress('teardown-test', len(vms))
+    result = TeardownJob(api, vms, ssh_executor=ssh, task_id='teardown-test', per_node=2, poll_interval=0).run()
+
+    assert result['deleted'] == [300, 301, 302, 303, 304, 305, 306, 399]
+    assert result['failed'] == [{'vmid': 307, 'error': 'destroy of VM 307 failed: storage busy'}]
+    assert api.max_active['pve1'] <= 2 and api.max_active['pve2'] <= 2
+    # Only running VMs are stopped, and always before their destroy
+    stops = [c for c in api.calls if c[0] == 'stop']
+    assert sorted(c[2] for c in stops) == [301, 303, 305, 307]
+    assert ('stop', 'pve1', 301) in stops
+    order = [(kind, vmid) for kind, _, vmid in api.calls]
+    for _, _, vmid in stops:
+        assert order.index(('stop', vmid)) < order.index(('delete', vmid))
+    # One cleanup per node and images directory; the failed VM's disk is kept
+    assert len(ssh.commands) == 2
+    assert 'vm-307-disk-0' not in ' '.join(ssh.commands)
+
+    progress = get_clone_progress('teardown-test')
+    assert progress['status'] == 'completed'
+    assert progress['completed'] == 8 and progress['failed'] == 1
+    assert progress['progress_percent'] == 100
+
+
+def test_locate_ignores_cached_cluster_resources():
+    from app.services.class_teardown import TeardownJob
+    from app.services.proxmox_cache import invalidate_reads, wrap_connection
+
+    fake = FakeProxmox([], {})
+    api = wrap_connection(fake, "test-teardown-locate")
+    invalidate_reads("test-teardown-locate")
+    assert api.cluster.resources.get(type='vm') == []  # cached before the VM existed
+
+    # Created and started over SSH since (no API write cleared the cache)
+    fake.resources = [{'vmid': 501, 'node': 'pve1', 'status': 'running'}]
+    result = TeardownJob(api, [{'vmid': 501, 'node': 'pve1'}], poll_interval=0).run()
+
+    assert result['deleted'] == [501]
+    assert [kind for kind, _, _ in fake.calls] == ['stop', 'delete']
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for the database dialect helpers and the SQLite -> PostgreSQL copy tool.
+
+PostgreSQL behaviour is checked by compiling statements against the
+postgresql dialect (no server needed); data paths run on SQLite.
+
+Run with: python -m pytest tests/test_db_dialect.py -v
+"""
+
+import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+def test_upsert_inserts_updates_and_ignores(app):
+    from app.models import VMInventory, db
+    from app.utils.db_dialect import upsert
+
+    row = {"cluster_id": "c1", "vmid": 100, "name": "a", "node": "pve1", "status": "stopped", "type": "qemu"}
+    upsert(VMInventory, [row], conflict_columns=["cluster_id", "vmid"])
+    upsert(VMInventory, [dict(row, status="running")], conflict_columns=["cluster_id", "vmid"])
+    upsert(VMInventory, [dict(row, name="ignored")], conflict_columns=["cluster_id", "vmid"], update_columns=[])
+    db.session.commit()
+
+    vm = VMInventory.query.one()
+    assert (vm.status, vm.name) == ("running", "a")
+
+
+def test_for_allocation_uses_skip_locked_on_postgres(app, monkeypatch):
+    from sqlalchemy.dialects import postgresql
+
+    from app.models import VMAssignment
+    from app.utils import db_dialect
+
+    query = VMAssignment.query.filter_by(assigned_user_id=None)
+    assert "FOR UPDATE" not in str(db_dialect.for_allocation(query).statement.compile(dialect=postgresql.dialect()))
+
+    monkeypatch.setattr(db_dialect, "dialect_name", lambda session=None: "postgresql")
+    sql = str(db_dialect.for_allocation(query).statement.compile(dialect=postgresql.dialect()))
+    assert sql.endswith("FOR UPDATE SKIP LOCKED")
+
+
+def test_engine_options_per_backend():
+    from app.utils.db_dialect import engine_options_for
+
+    assert engine_options_for("sqlite:///x.db")["connect_args"]["check_same_thread"] is False
+    pg = engine_options_for("postgresql+psycopg2://u@h/db", pool_size=5, max_overflow=7)
+    assert "connect_args" not in pg
+    assert (pg["pool_size"], pg["max_overflow"]) == (5, 7)
+
+
+def test_is_retryable_error():
+    from app.utils.db_dialect import is_retryable_error
+
+    class Orig(Exception):
+        pgcode = "40001"
+
+    class Wrapped(Exception):
+        orig = Orig()
+
+    assert is_retryable_error(Exception("(sqlite3.OperationalError) database is locked"))
+    assert is_retryable_error(Wrapped("could not serialize access"))
+    assert not is_retryable_error(ValueError("bad value"))
+
+
+def test_migration_tool_copies_rows(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from app.models import User, VMInventory, db
+    import migrate_sqlite_to_postgres
+
+    source = tmp_path / "lab_portal.db"
+    target_uri = f"sqlite:///{tmp_path / 'target.db'}"
+    engine = create_engine(f"sqlite:///{source}")
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(username="teacher1", password_hash="x", role="teacher"))
+        session.add(VMInventory(cluster_id="c1", vmid=100, name="vm", node="pve1",
+                                status="running", is_template=True))
+        session.commit()
+
+    assert migrate_sqlite_to_postgres.migrate(str(source), target_uri) == 0
+
+    with Session(create_engine(target_uri)) as session:
+        assert session.query(User).one().username == "teacher1"
+        assert session.query(VMInventory).one().is_template is True
+
+    # A populated target is refused unless --force
+    assert migrate_sqlite_to_postgres.migrate(str(source), target_uri) == 1
+
+
+def test_copy_tables_resolves_foreign_key_cycles(tmp_path):
+    from sqlalchemy import create_engine, event, select
+
+    from app.models import Class, Template, User, db
+    from app.utils.db_dialect import copy_tables
+
+    source = create_engine(f"sqlite:///{tmp_path / 'source.db'}")
+    db.metadata.create_all(source)
+    with source.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"id": 1, "username": "teacher1", "password_hash": "x",
+                                                 "role": "teacher"}])
+        # classes.template_id <-> templates.class_id, plus templates.original_template_id
+        conn.execute(Template.__table__.insert(), [
+            {"id": 1, "name": "ubuntu", "proxmox_vmid": 9000, "class_id": None, "original_template_id": None},
+            {"id": 2, "name": "net-101-base", "proxmox_vmid": 12399, "class_id": 1, "original_template_id": 1},
+        ])
+        conn.execute(Class.__table__.insert(), [{"id": 1, "name": "Networks", "teacher_id": 1, "template_id": 2}])
+
+    # Enforce foreign keys on the target like PostgreSQL does
+    target = create_engine(f"sqlite:///{tmp_path / 'target.db'}")
+    event.listen(target, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+
+    copied = copy_tables(source, target, db.metadata)
+
+    assert copied["classes"] == 1 and copied["templates"] == 2
+    with target.connect() as conn:
+        assert conn.execute(select(Class.__table__.c.template_id)).scalar() == 2
+        templates = conn.execute(select(Template.__table__.c.id, Template.__table__.c.class_id,
+                                        Template.__table__.c.original_template_id)
+                                 .order_by(Template.__table__.c.id)).all()
+        assert [tuple(row) for row in templates] == [(1, None, None), (2, 1, 1)]
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite single-writer queue.
+
+Run with: python -m pytest tests/test_db_writer.py -v
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+# The writer thread opens its own connection, so the database must be a file
+pytestmark = pytest.mark.parametrize("app", ["file"], indirect=True)
+
+
+@pytest.fixture
+def writer_app(app):
+    from app.models import VMInventory, db
+
+    for vmid in (100, 101):
+        db.session.add(VMInventory(cluster_id="c1", vmid=vmid, name=f"vm{vmid}", node="pve1", status="stopped"))
+    db.session.commit()
+    return app
+
+
+def _status(vmid):
+    from app.models import VMInventory, db
+
+    db.session.expire_all()
+    return VMInventory.query.filter_by(cluster_id="c1", vmid=vmid).one().status
+
+
+def test_updates_to_same_row_merge_last_write_wins(writer_app):
+    from app.models import VMInventory
+    from app.services.db_writer import DBWriter
+
+    writer = DBWriter(writer_app, linger=0.2)
+    gate = threading.Event()
+    writer.submit(gate.wait)  # hold the first batch so the updates queue up together
+    writer.start()
+    try:
+        key = {"cluster_id": "c1", "vmid": 100}
+        futures = [writer.submit_update(VMInventory, key, {"status": s}) for s in ("running", "paused", "stopped", "running")]
+        futures.append(writer.submit_update(VMInventory, {"cluster_id": "c1", "vmid": 101}, {"node": "pve2"}))
+        gate.set()
+        assert writer.flush(timeout=5)
+
+        assert [f.result(timeout=1) for f in futures] == [1, 1, 1, 1, 1]
+        assert _status(100) == "running"
+        assert writer.stats()["merged"] == 3
+    finally:
+        writer.stop()
+
+
+def test_failing_intent_does_not_fail_its_batch(writer_app):
+    from app.models import VMInventory
+    from app.services.db_writer import DBWriter
+
+    def boom():
+        raise ValueError("bad write")
+
+    writer = DBWriter(writer_app, linger=0.2)
+    writer.start()
+    try:
+        ok = writer.submit_update(VMInventory, {"cluster_id": "c1", "vmid": 101}, {"status": "running"})
+        bad = writer.submit(boom)
+        assert writer.flush(timeout=5)
+
+        assert ok.result(timeout=1) == 1
+        with pytest.raises(ValueError):
+            bad.result(timeout=1)
+        assert _status(101) == "running"
+        assert writer.stats()["failed"] == 1
+    finally:
+        writer.stop()
+
+
+def test_callable_rollback_does_not_discard_queued_updates(writer_app):
+    from app.models import VMInventory, db
+    from app.services.db_writer import DBWriter
+
+    def self_committing():
+        # Like persist_vm_inventory: owns its transaction and rolls back on error
+        db.session.rollback()
+        return "persisted"
+
+    writer = DBWriter(writer_app, linger=0.2)
+    gate = threading.Event()
+    writer.submit(gate.wait)
+    writer.start()
+    try:
+        before = writer.submit_update(VMInventory, {"cluster_id": "c1", "vmid": 100}, {"status": "running"})
+        persisted = writer.submit(self_committing)
+        after = writer.submit_update(VMInventory, {"cluster_id": "c1", "vmid": 101}, {"status": "paused"})
+        gate.set()
+        assert writer.flush(timeout=5)
+
+        assert (before.result(timeout=1), persisted.result(timeout=1), after.result(timeout=1)) == (1, "persisted", 1)
+        assert _status(100) == "running" and _status(101) == "paused"
+    finally:
+        writer.stop()
+
+
+def test_queue_update_applies_inline_without_writer(writer_app):
+    from app.models import VMInventory
+    from app.services.db_writer import get_db_writer, queue_update
+
+    assert get_db_writer() is None
+    future = queue_update(VMInventory, {"cluster_id": "c1", "vmid": 100}, {"status": "running"})
+    assert future.done() and future.result() == 1
+    assert _status(100) == "running"
+
+    created = queue_update(VMInventory, {"cluster_id": "c1", "vmid": 555},
+                           {"name": "new", "node": "pve1", "status": "running"}, upsert=True)
+    assert created.result() == 1
+    assert _status(555) == "running"
+
+
+def test_inline_write_leaves_the_callers_session_alone(writer_app):
+    from app.models import VMInventory, db
+    from app.services.db_writer import queue_update, queue_write
+
+    # Pending (uncommitted) change of the caller
+    db.session.add(VMInventory(cluster_id="c1", vmid=777, name="draft", node="pve1", status="stopped"))
+    assert queue_update(VMInventory, {"cluster_id": "c1", "vmid": 100}, {"status": "running"}).result() == 1
+    failed = queue_write(lambda: 1 / 0)
+    assert isinstance(failed.exception(), ZeroDivisionError)
+    # Neither the inline commit nor the inline rollback touched the pending row
+    assert db.session.new
+    db.session.rollback()
+
+    assert _status(100) == "running"
+    assert VMInventory.query.filter_by(cluster_id="c1", vmid=777).first() is None
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for the fleet update engine used by template push.
+
+Run with: python -m pytest tests/test_fleet_update.py -v
+"""
+
+import os
+import shlex
+import sys
+import threading
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+class FakeProxmox:
+    """Just enough of the proxmoxer API: cluster/resources, status stop/start, task status."""
+
+    def __init__(self, vms):
+        self.vms = vms  # {vmid: {'node', 'status'}}
+        self.calls = []
+        self.lock = threading.Lock()
+        self.cluster = self
+        self.resources = self
+
+    def get(self, type=None):
+        return [{'vmid': v, 'node': s['node'], 'status': s['status']} for v, s in self.vms.items()]
+
+    def nodes(self, node):
+        return _Path(self, node)
+
+
+class _Path:
+    def __init__(self, api, node, parts=()):
+        self.api, self.node, self.parts = api, node, parts
+
+    def __getattr__(self, name):
+        return _Path(self.api, self.node, self.parts + (name,))
+
+    def __call__(self, arg):
+        return _Path(self.api, self.node, self.parts + (arg,))
+
+    def post(self):
+        # parts: ('qemu', vmid, 'status', 'stop'|'start')
+        vmid, action = self.parts[1], self.parts[3]
+        with self.api.lock:
+            self.api.calls.append((action, vmid))
+            self.api.vms[vmid]['status'] = 'stopped' if action == 'stop' else 'running'
+        return f"UPID:{self.node}:{action}:{vmid}"
+
+    def get(self):
+        # parts: ('tasks', upid, 'status')
+        return {'status': 'stopped', 'exitstatus': 'OK'}
+
+
+class FakeSSH:
+    """Answers node rebase batches with OK lines (FAIL for vmids in fail)."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.commands = []
+
+    def execute(self, cmd, timeout=None, check=True):
+        self.commands.append(cmd)
+        script = shlex.split(cmd)[-1]
+        vmids = script.split('for vmid in ', 1)[1].split(';', 1)[0].split()
+        out = '\n'.join(f"FAIL {v} backing file missing" if int(v) in self.fail else f"OK {v}" for v in vmids)
+        return 0, out + '\n', ''
+
+
+def _updater(api, ssh):
+    from app.services.fleet_update import FleetUpdater
+    return FleetUpdater(api, ssh, parallelism=4, poll_interval=0)
+
+
+def test_rebase_script_and_output_parsing():
+    from app.services.fleet_update import build_rebase_script, parse_rebase_output
+
+    script = build_rebase_script([101, 102], "/mnt/pve/TRUENAS NFS/images/a b-base.qcow2")
+    assert script.startswith("for vmid in 101 102; do")
+    assert "-b '/mnt/pve/TRUENAS NFS/images/a b-base.qcow2'" in script
+    assert "pvesm path" in script and "media=cdrom" in script
+
+    ok, failed = parse_rebase_output("OK 101\nFAIL 102 qemu-img: Could not open\nnoise\n")
+    assert ok == [101]
+    assert failed == {102: 'qemu-img: Could not open'}
+
+
+def test_update_stops_running_vms_and_batches_per_node():
+    api = FakeProxmox({
+        101: {'node': 'pve1', 'status': 'running'},
+        102: {'node': 'pve1', 'status': 'stopped'},
+        103: {'node': 'pve2', 'status': 'running'},
+        104: {'node': 'pve2', 'status': 'running'},
+    })
+    ssh = FakeSSH(fail={104})
+
+    result = _updater(api, ssh).update([101, 102, 103, 104], '/mnt/pve/nfs/c-layer-1.qcow2')
+
+    # Only running VMs get a stop
+    assert sorted(api.calls) == [('stop', 101), ('stop', 103), ('stop', 104)]
+    # One remote batch per node, run on the node itself
+    assert len(ssh.commands) == 2
+    assert all(c.startswith('ssh -o BatchMode=yes') and ' pve' in c for c in ssh.commands)
+    assert result['updated'] == [101, 102, 103]
+    assert list(result['failed']) == [104] and result['aborted'] is False
+    # Not rolling: VMs are left stopped, as before
+    assert all(s['status'] == 'stopped' for s in api.vms.values())
+
+
+def test_update_aborts_before_rebasing_when_a_stop_fails():
+    api = FakeProxmox({
+        101: {'node': 'pve1', 'status': 'running'},
+        102: {'node': 'pve1', 'status': 'running'},
+        103: {'node': 'pve2', 'status': 'stopped'},
+    })
+    updater = _updater(api, FakeSSH())
+    power = updater._power
+    updater._power = lambda action, vmid, node: (
+        (vmid, False, 'VM is locked (backup)') if (action, vmid) == ('stop', 102) else power(action, vmid, node))
+
+    result = updater.update([101, 102, 103], '/mnt/pve/nfs/c-layer-1.qcow2')
+
+    assert result['aborted'] is True and result['updated'] == []
+    assert result['failed'][102] == 'VM is locked (backup)'
+    assert result['failed'][101].startswith('aborted') and result['failed'][103].startswith('aborted')
+    assert updater.ssh_executor.commands == []
+    # The VM that was stopped for the update runs again
+    assert api.calls[-1] == ('start', 101) and api.vms[101]['status'] == 'running'
+
+
+def test_rolling_update_rebases_cohort_by_cohort():
+    from app.services.fleet_update import make_cohorts
+
+    api = FakeProxmox({
+        201: {'node': 'pve1', 'status': 'running'},
+        202: {'node': 'pve2', 'status': 'running'},
+        203: {'node': 'pve1', 'status': 'stopped'},
+        204: {'node': 'pve2', 'status': 'running'},
+    })
+    states = {v: dict(s) for v, s in api.vms.items()}
+    assert make_cohorts([201, 202, 203, 204], states, 2) == [[203], [201, 202], [204]]
+
+    ssh = FakeSSH()
+    running_at_rebase = []
+    execute = ssh.execute
+
+    def record(cmd, timeout=None, check=True):
+        running_at_rebase.append(sorted(v for v, s in api.vms.items() if s['status'] == 'running'))
+        return execute(cmd, timeout, check)
+
+    ssh.execute = record
+    result = _updater(api, ssh).update([201, 202, 203, 204], '/layer.qcow2', rolling=True, cohort_size=2)
+
+    assert result['cohorts'] == 3
+    assert result['updated'] == [201, 202, 203, 204]
+    assert result['failed'] == {}
+    # VMs outside the cohort being rebased keep running on their old base
+    assert running_at_rebase[0] == [201, 202, 204]
+    assert running_at_rebase[-1] == [201, 202]
+    # Running VMs were restarted, the stopped one stays off
+    assert {v: s['status'] for v, s in api.vms.items()} == {
+        201: 'running', 202: 'running', 203: 'stopped', 204: 'running'}
+    assert ('start', 203) not in api.calls
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared node placement engine.
+
+Run with: python -m pytest tests/test_placement.py -v
+"""
+
+import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.services.placement import GIB, NodeSnapshot, place, place_batch, plan_rebalance  # noqa: E402
+
+
+def _cluster(*nodes):
+    """nodes: (name, total_gb, used_gb, cores, cpu_fraction)"""
+    return NodeSnapshot.from_nodes(
+        {'node': name, 'status': 'online', 'maxmem': total * GIB, 'mem': used * GIB,
+         'maxcpu': cores, 'cpu': cpu}
+        for name, total, used, cores, cpu in nodes
+    )
+
+
+def test_from_nodes_skips_offline_and_sorts():
+    snapshot = NodeSnapshot.from_nodes([
+        {'node': 'pve2', 'status': 'online', 'maxmem': GIB, 'mem': 0, 'maxcpu': 4, 'cpu': 0},
+        {'node': 'pve3', 'status': 'offline'},
+        {'node': 'pve1', 'status': 'online', 'maxmem': 'bad', 'mem': 0},
+        {'node': 'pve0', 'status': 'online', 'maxmem': GIB, 'mem': 0, 'maxcpu': 4, 'cpu': 0},
+    ])
+    assert snapshot.names == ['pve0', 'pve2']
+
+
+def test_batch_of_sixty_spreads_by_capacity():
+    snapshot = _cluster(('pve1', 256, 64, 32, 0.1), ('pve2', 128, 32, 32, 0.1), ('pve3', 128, 96, 32, 0.1))
+    nodes = place_batch(snapshot, [(2 * GIB, 2)] * 60)
+
+    counts = {name: nodes.count(name) for name in snapshot.names}
+    assert sum(counts.values()) == 60
+    assert counts['pve1'] > counts['pve2'] > counts['pve3']
+    # Deterministic: same snapshot -> same plan
+    again = place_batch(_cluster(('pve1', 256, 64, 32, 0.1), ('pve2', 128, 32, 32, 0.1),
+                                 ('pve3', 128, 96, 32, 0.1)), [(2 * GIB, 2)] * 60)
+    assert again == nodes
+
+
+def test_place_prefers_nodes_with_room_and_handles_empty():
+    snapshot = _cluster(('big', 64, 60, 8, 0.0), ('small', 8, 1, 8, 0.9))
+    # 'big' scores better on CPU but cannot hold 6GB
+    assert place(snapshot, 6 * GIB, 1) == 'small'
+    assert place(NodeSnapshot(), GIB) is None
+
+
+def test_batch_places_largest_first_in_demand_order():
+    snapshot = _cluster(('a', 16, 0, 8, 0.0), ('b', 16, 0, 8, 0.0))
+    nodes = place_batch(snapshot, [(2 * GIB, 1), (12 * GIB, 1), (2 * GIB, 1)])
+    assert nodes[1] == 'a'  # the big VM goes first, onto the first tied node
+    assert nodes[0] == nodes[2] == 'b'
+
+
+def test_rebalance_minimal_moves_and_respects_running_vms():
+    snapshot = _cluster(('pve1', 64, 8, 16, 0.2), ('pve2', 64, 8, 16, 0.2))
+    for vmid in range(101, 107):
+        snapshot.add_vm(vmid, 'pve1', 8 * GIB, 2, status='stopped', reserve=True)
+    snapshot.add_vm(200, 'pve1', 8 * GIB, 2, status='running')
+
+    plan = plan_rebalance(snapshot)
+
+    assert [m['vmid'] for m in plan] == [101, 102, 103]  # 3 of 6 stopped VMs even it out
+    assert all(m['from_node'] == 'pve1' and m['to_node'] == 'pve2' for m in plan)
+    assert snapshot.vm_node.count(snapshot.index('pve1')) == 7  # input snapshot untouched
+
+
+def test_rebalance_moves_running_vms_only_off_critical_nodes():
+    snapshot = _cluster(('pve1', 32, 31, 16, 0.5), ('pve2', 32, 4, 16, 0.1))
+    snapshot.add_vm(300, 'pve1', 8 * GIB, 2, status='running')
+    assert [m['vmid'] for m in plan_rebalance(snapshot)] == [300]
+
+    relaxed = _cluster(('pve1', 32, 20, 16, 0.5), ('pve2', 32, 4, 16, 0.1))
+    relaxed.add_vm(300, 'pve1', 8 * GIB, 2, status='running')
+    assert plan_rebalance(relaxed) == []
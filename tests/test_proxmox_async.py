@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for the async Proxmox client (proxmox_async).
+
+Runs a tiny fake Proxmox API on localhost with aiohttp.web.
+
+Run with: python -m pytest tests/test_proxmox_async.py -v
+"""
+
+import os
+import socket
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def fake_proxmox():
+    """Start a fake Proxmox API on the shared loop; yields (port, state)."""
+    from app.services.proxmox_async import get_event_loop, run_sync
+
+    state = {"ticket_calls": 0, "requests": 0}
+
+    async def ticket(request):
+        form = await request.post()
+        state["ticket_calls"] += 1
+        if form.get("password") not in ("secret", "PVE:ticket"):
+            return web.json_response({"data": None}, status=401)
+        return web.json_response({"data": {"ticket": "PVE:ticket", "CSRFPreventionToken": "csrf"}})
+
+    def _authed(request):
+        return request.cookies.get("PVEAuthCookie") == "PVE:ticket"
+
+    async def status(request):
+        state["requests"] += 1
+        if not _authed(request):
+            return web.json_response({"data": None}, status=401)
+        vmid = int(request.match_info["vmid"])
+        return web.json_response({"data": {"vmid": vmid, "status": "running"}})
+
+    async def start(request):
+        if request.headers.get("CSRFPreventionToken") != "csrf":
+            return web.json_response({"data": None}, status=401)
+        return web.json_response({"data": "UPID:pve1:start"})
+
+    async def resources(request):
+        return web.json_response({"data": [{"type": request.query.get("type")}]})
+
+    async def broken(request):
+        return web.json_response({"data": None, "errors": {"vmid": "invalid"}}, status=500)
+
+    app = web.Application()
+    app.router.add_post("/api2/json/access/ticket", ticket)
+    app.router.add_get("/api2/json/nodes/{node}/qemu/{vmid}/status/current", status)
+    app.router.add_post("/api2/json/nodes/{node}/qemu/{vmid}/status/start", start)
+    app.router.add_get("/api2/json/cluster/resources", resources)
+    app.router.add_get("/api2/json/broken", broken)
+
+    port = _free_port()
+    runner = web.AppRunner(app)
+
+    async def _start():
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    get_event_loop()
+    run_sync(_start(), timeout=10)
+    yield port, state
+    run_sync(runner.cleanup(), timeout=10)
+
+
+def _make_api(port, password="secret"):
+    from app.services.proxmox_async import AsyncProxmoxClient, SyncProxmoxAPI
+
+    client = AsyncProxmoxClient("127.0.0.1", user="root@pam", password=password, port=port)
+    client._base_url = f"http://127.0.0.1:{port}/api2/json"
+    return SyncProxmoxAPI(client)
+
+
+def test_resource_paths_match_proxmoxer(fake_proxmox):
+    """nodes(n).qemu(v).status.current.get() resolves to the same URL as proxmoxer."""
+    port, _ = fake_proxmox
+    api = _make_api(port)
+    try:
+        assert api.nodes("pve1").qemu(100).status.current.get() == {"vmid": 100, "status": "running"}
+        assert api.nodes("pve1/qemu/101/status/current").get()["vmid"] == 101
+        assert api.cluster.resources.get(type="vm") == [{"type": "vm"}]
+        assert api.nodes("pve1").qemu(100).status.start.post() == "UPID:pve1:start"
+    finally:
+        api.close()
+
+
+def test_bad_credentials_raise_authentication_error(fake_proxmox):
+    from proxmoxer.core import AuthenticationError
+
+    port, _ = fake_proxmox
+    with pytest.raises(AuthenticationError):
+        _make_api(port, password="wrong")
+
+
+def test_http_errors_raise_resource_exception(fake_proxmox):
+    from proxmoxer.core import ResourceException
+
+    port, _ = fake_proxmox
+    api = _make_api(port)
+    try:
+        with pytest.raises(ResourceException) as exc:
+            api.broken.get()
+        assert exc.value.status_code == 500
+        assert "vmid" in str(exc.value)
+    finally:
+        api.close()
+
+
+def test_gather_fans_out_on_one_ticket(fake_proxmox):
+    """Concurrent fan-out shares one ticket and returns results in order."""
+    port, state = fake_proxmox
+    api = _make_api(port)
+    try:
+        tickets_before = state["ticket_calls"]
+        results = api.gather(api.aio.nodes("pve1").qemu(vmid).status.current.get() for vmid in range(200, 300))
+        assert [r["vmid"] for r in results] == list(range(200, 300))
+        assert state["ticket_calls"] == tickets_before
+    finally:
+        api.close()
+
+
+def test_encode_values_matches_requests_semantics():
+    from app.services.proxmox_async import _encode_values
+
+    assert _encode_values({"a": 1, "b": None, "c": True, "d": ["x", "y"]}) == [
+        ("a", "1"), ("c", "True"), ("d", "x"), ("d", "y"),
+    ]
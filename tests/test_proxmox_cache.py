@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Tests for the Proxmox read path (request coalescing / read cache).
+
+Run with: python -m pytest tests/test_proxmox_cache.py -v
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+class FakeResource:
+    """Minimal proxmoxer-like resource recording every GET it performs."""
+
+    def __init__(self, api, path=""):
+        self._api = api
+        self._path = path
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return FakeResource(self._api, f"{self._path}/{item}".strip("/"))
+
+    def __call__(self, resource_id=None):
+        if resource_id in (None, "", ()):
+            return self
+        if isinstance(resource_id, (tuple, list)):
+            resource_id = "/".join(str(p) for p in resource_id)
+        return FakeResource(self._api, f"{self._path}/{resource_id}".strip("/"))
+
+    def get(self, **params):
+        with self._api.lock:
+            self._api.calls.append((self._path, params))
+        time.sleep(self._api.delay)
+        return [{"path": self._path, "n": len(self._api.calls)}]
+
+    def post(self, **data):
+        return "UPID:fake"
+
+
+class FakeAPI(FakeResource):
+    def __init__(self, delay=0.05):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.delay = delay
+        super().__init__(self, "")
+
+
+def test_single_flight_shares_one_execution():
+    from app.utils.caching import SingleFlight
+
+    flight = SingleFlight()
+    executions = []
+    results = []
+
+    def slow():
+        executions.append(1)
+        time.sleep(0.1)
+        return 42
+
+    def worker():
+        results.append(flight.do("key", slow))
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(executions) == 1
+    assert [r[0] for r in results] == [42] * 20
+    assert sum(1 for r in results if r[1]) == 19
+    assert flight.in_flight() == 0
+
+
+def test_single_flight_propagates_errors_without_caching():
+    from app.utils.caching import SingleFlight
+
+    flight = SingleFlight()
+
+    def boom():
+        raise ValueError("nope")
+
+    for _ in range(2):
+        try:
+            flight.do("k", boom)
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    assert flight.stats()["executions"] == 2
+
+
+def test_concurrent_identical_gets_coalesce():
+    """A burst of identical cluster/resources reads costs one API call."""
+    from app.services.proxmox_cache import invalidate_reads, wrap_connection
+
+    fake = FakeAPI(delay=0.1)
+    api = wrap_connection(fake, "test-coalesce")
+    invalidate_reads("test-coalesce")
+
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(api.cluster.resources.get(type="vm")))
+               for _ in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(fake.calls) == 1
+    assert len(out) == 50
+    # Callers get independent copies
+    out[0][0]["path"] = "mutated"
+    assert out[1][0]["path"] == "cluster/resources"
+
+
+def test_different_params_are_not_coalesced():
+    from app.services.proxmox_cache import wrap_connection
+
+    fake = FakeAPI(delay=0)
+    api = wrap_connection(fake, "test-params")
+    api.cluster.resources.get(type="vm")
+    api.cluster.resources.get(type="node")
+    assert len(fake.calls) == 2
+
+
+def test_writes_invalidate_memo():
+    from app.services.proxmox_cache import invalidate_reads, wrap_connection
+
+    fake = FakeAPI(delay=0)
+    api = wrap_connection(fake, "test-writes")
+    invalidate_reads("test-writes")
+
+    api.nodes("pve1").qemu(100).status.current.get()
+    api.nodes("pve1").qemu(100).status.current.get()
+    assert len(fake.calls) == 1  # memoized
+
+    api.nodes("pve1").qemu(100).status.start.post()
+    api.nodes("pve1").qemu(100).status.current.get()
+    assert len(fake.calls) == 2
+    assert fake.calls[-1][0] == "nodes/pve1/qemu/100/status/current"
+
+
+def test_stale_while_revalidate_never_blocks(monkeypatch):
+    """An expired entry inside the stale window is served instantly and refreshed in the background."""
+    from app.services import proxmox_cache
+
+    monkeypatch.setattr(proxmox_cache, "READ_CACHE_POLICIES", [
+        proxmox_cache.CachePolicy(r"^nodes$", ttl=0.05, stale=60),
+    ])
+    fake = FakeAPI(delay=0)
+    api = proxmox_cache.wrap_connection(fake, "test-swr")
+    proxmox_cache.invalidate_reads("test-swr")
+
+    first = api.nodes.get()
+    time.sleep(0.1)  # past TTL, inside stale window
+    fake.delay = 0.5
+
+    started = time.time()
+    stale = api.nodes.get()
+    assert time.time() - started < 0.2, "stale read must not wait for Proxmox"
+    assert stale == first
+
+    time.sleep(0.7)  # background refresh completes
+    assert len(fake.calls) == 2
+    stats = proxmox_cache.get_read_stats()["test-swr"]
+    assert stats["stale_hits"] >= 1
+    assert stats["refreshes"] == 1
+
+
+def test_fresh_reads_bypass_cache():
+    from app.services.proxmox_cache import fresh_reads, invalidate_reads, wrap_connection
+
+    fake = FakeAPI(delay=0)
+    api = wrap_connection(fake, "test-fresh")
+    invalidate_reads("test-fresh")
+
+    api.cluster.resources.get(type="vm")
+    api.cluster.resources.get(type="vm")
+    assert len(fake.calls) == 1
+    with fresh_reads():
+        api.cluster.resources.get(type="vm")
+    assert len(fake.calls) == 2
+
+
+def test_lru_bound_evicts_oldest(monkeypatch):
+    from app.services import proxmox_cache
+
+    monkeypatch.setattr(proxmox_cache, "MAX_CACHE_ENTRIES", 3)
+    fake = FakeAPI(delay=0)
+    api = proxmox_cache.wrap_connection(fake, "test-lru")
+    proxmox_cache.invalidate_reads("test-lru")
+
+    for node in ("a", "b", "c", "d"):
+        api.nodes(node).storage.get()
+    stats = proxmox_cache.get_read_stats()["test-lru"]
+    assert stats["entries"] == 3
+    assert stats["evictions"] == 1
+
+    api.nodes("a").storage.get()  # evicted -> refetch
+    assert len(fake.calls) == 5
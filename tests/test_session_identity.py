@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for the session identity claim (roles resolved once per session).
+
+Run with: python -m pytest tests/test_session_identity.py -v
+"""
+
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+@pytest.fixture
+def request_ctx(app, monkeypatch):
+    """Request context with admin resolution counted."""
+    from flask import session
+
+    from app.services import user_manager
+
+    calls = []
+
+    def fake_resolve(user):
+        calls.append(user)
+        return user == "root@pam"
+
+    monkeypatch.setattr(user_manager, "_resolve_is_admin", fake_resolve)
+    user_manager._roles_epoch_cache.invalidate()  # shared epoch of an earlier test's database
+
+    with app.test_request_context("/"):
+        session["user"] = "root@pam"
+        yield session, calls
+
+
+def test_roles_resolved_once_per_session(request_ctx):
+    from app.services.user_manager import establish_session_identity, is_admin_user
+
+    session, calls = request_ctx
+    establish_session_identity("root@pam")
+    assert calls == ["root@pam"]
+
+    for _ in range(10):
+        assert is_admin_user("root@pam") is True
+    assert calls == ["root@pam"]
+    assert session["identity"]["is_admin"] is True
+
+
+def test_claim_revalidated_after_ttl(request_ctx, monkeypatch):
+    from app.services import user_manager
+
+    session, calls = request_ctx
+    user_manager.establish_session_identity("root@pam")
+    session["identity"]["resolved_at"] -= user_manager.IDENTITY_REVALIDATE_TTL + 1
+
+    assert user_manager.get_session_identity()["is_admin"] is True
+    assert len(calls) == 2
+
+
+def test_role_change_invalidates_claims(request_ctx):
+    from app.services import user_manager
+
+    session, calls = request_ctx
+    user_manager.establish_session_identity("root@pam")
+    user_manager._invalidate_admin_group_cache()  # bumps the roles epoch
+
+    user_manager.get_session_identity()
+    assert len(calls) == 2
+
+
+def test_role_change_in_another_worker_invalidates_claims(request_ctx):
+    from app.models import SystemSettings, db
+    from app.services import user_manager
+
+    session, calls = request_ctx
+    user_manager.establish_session_identity("root@pam")
+
+    # Another worker process bumps the shared epoch; this one re-reads it
+    # once its ROLES_EPOCH_CHECK_SECONDS cache expires
+    SystemSettings.set(user_manager.ROLES_EPOCH_SETTING, "bumped-elsewhere")
+    db.session.commit()
+    user_manager.get_session_identity()
+    assert len(calls) == 1
+    user_manager._roles_epoch_cache.invalidate()
+    user_manager.get_session_identity()
+    assert len(calls) == 2
+
+    # A local bump is shared through the database
+    user_manager.bump_roles_epoch()
+    assert SystemSettings.get(user_manager.ROLES_EPOCH_SETTING) != "bumped-elsewhere"
+
+
+def test_claim_for_other_user_is_ignored(request_ctx):
+    from app.services import user_manager
+
+    session, calls = request_ctx
+    user_manager.establish_session_identity("root@pam")
+    session["user"] = "student1@pve"
+
+    assert user_manager.is_admin_user("student1@pve") is False
+    assert session["identity"]["user"] == "student1@pve"
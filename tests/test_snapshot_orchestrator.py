@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for batched snapshot listing, creation and rollback.
+
+Run with: python -m pytest tests/test_snapshot_orchestrator.py -v
+"""
+
+import os
+import shlex
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+LISTING = """@@vm 301
+`-> baseline                    2024-09-01 10:00:00     Baseline snapshot
+    `-> current                                         You are here!
+@@vm 302
+`-> current                                             You are here!
+@@vm 303
+@@error 303
+"""
+
+
+class NodeSSH:
+    """Answers node-hop commands: listings per node, snapshot/rollback with a short delay."""
+
+    def __init__(self, snapshots, fail=(), delays=None):
+        self.snapshots = snapshots  # {vmid: [names]}
+        self.fail = set(fail)
+        self.delays = delays or {}  # {node: seconds per operation}
+        self.finished = {}
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+        self.commands = []
+
+    def execute(self, cmd, timeout=None, check=True):
+        node, script = shlex.split(cmd)[-2:]
+        with self.lock:
+            self.commands.append((node, script))
+        if script.startswith('for v in'):
+            vmids = script.split('for v in ')[1].split(';')[0].split()
+            out = ''
+            for vmid in vmids:
+                out += f"@@vm {vmid}\n"
+                for name in self.snapshots.get(int(vmid), []):
+                    out += f"`-> {name}   2024-09-01 10:00:00   desc\n"
+                out += "    `-> current   You are here!\n"
+            return 0, out, ''
+        vmid = int(script.split()[2])
+        with self.lock:
+            self.active[node] = self.active.get(node, 0) + 1
+            self.max_active[node] = max(self.max_active.get(node, 0), self.active[node])
+        time.sleep(self.delays.get(node, 0.02))
+        with self.lock:
+            self.active[node] -= 1
+            self.finished[node] = time.monotonic()
+        if vmid in self.fail:
+            return 255, '', 'snapshot feature is not available'
+        return 0, '', ''
+
+
+def test_parse_snapshot_listing():
+    from app.services.snapshot_orchestrator import list_snapshots_script, parse_snapshot_listing
+
+    assert parse_snapshot_listing(LISTING) == {301: {'baseline'}, 302: set(), 303: None}
+    assert list_snapshots_script([301, 302]).startswith('for v in 301 302; do')
+
+
+def test_ensure_lists_once_per_node_and_creates_missing_concurrently():
+    from app.services.snapshot_orchestrator import SnapshotOrchestrator
+
+    vms = [{'vmid': 400 + i, 'node': 'pve1' if i < 6 else 'pve2'} for i in range(8)]
+    ssh = NodeSSH({400: ['baseline'], 406: ['baseline', 'pre-exam']}, fail={407})
+
+    results = SnapshotOrchestrator(ssh, per_node=2).ensure(vms, snapname='baseline', description="Initial state")
+
+    listings = [c for c in ssh.commands if c[1].startswith('for v in')]
+    assert sorted(node for node, _ in listings) == ['pve1', 'pve2']
+    by_vmid = {r.vmid: r for r in results}
+    assert by_vmid[400].action == 'skipped' and by_vmid[406].action == 'skipped'
+    assert [v for v in sorted(by_vmid) if by_vmid[v].action == 'created'] == [401, 402, 403, 404, 405]
+    assert by_vmid[407].action == 'failed' and 'not available' in by_vmid[407].error
+    assert ('pve1', "qm snapshot 401 baseline --description 'Initial state'") in ssh.commands
+    assert ssh.max_active['pve1'] <= 2
+
+
+def test_revert_rolls_back_every_vm_on_its_node():
+    from app.services.snapshot_orchestrator import SnapshotOrchestrator
+
+    vms = [{'vmid': 500 + i, 'node': f'pve{i % 3 + 1}'} for i in range(9)]
+    ssh = NodeSSH({})
+
+    results = SnapshotOrchestrator(ssh, per_node=1).revert(vms)
+
+    assert all(r.action == 'reverted' for r in results)
+    assert sorted(ssh.commands) == sorted((vm['node'], f"qm rollback {vm['vmid']} baseline") for vm in vms)
+    assert max(ssh.max_active.values()) == 1
+    assert not any(c[1].startswith('for v in') for c in ssh.commands)
+
+
+def test_slow_node_does_not_starve_other_nodes():
+    from app.services.snapshot_orchestrator import SnapshotOrchestrator
+
+    # The slow node's VMs come first, so a shared pool would fill up with them
+    vms = [{'vmid': 600 + i, 'node': 'pve1' if i < 8 else 'pve2'} for i in range(16)]
+    ssh = NodeSSH({}, delays={'pve1': 0.1, 'pve2': 0.01})
+
+    results = SnapshotOrchestrator(ssh, per_node=2).revert(vms)
+
+    assert [r.vmid for r in results] == [vm['vmid'] for vm in vms]
+    assert ssh.max_active == {'pve1': 2, 'pve2': 2}
+    # pve2 is done while pve1 is still on its first operations
+    assert ssh.finished['pve2'] < ssh.finished['pve1'] - 0.2
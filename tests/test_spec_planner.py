@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the class spec-change planner (in-place qm set vs disk recreation).
+
+Run with: python -m pytest tests/test_spec_planner.py -v
+"""
+
+import os
+import shlex
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+DISK = "TRUENAS-NFS:{vmid}/vm-{vmid}-disk-0.qcow2,size=32G"
+
+
+class NodeSSH:
+    """Answers node-hop commands: config listings per node, batches with a short delay."""
+
+    def __init__(self, configs, fail=()):
+        self.configs = configs  # {vmid: config dict, 'status' included}
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.commands = []
+
+    def execute(self, cmd, timeout=None, check=True):
+        node, script = shlex.split(cmd)[-2:]
+        with self.lock:
+            self.commands.append((node, script))
+        if script.startswith('for v in'):
+            out = ''
+            for vmid in script.split('for v in ')[1].split(';')[0].split():
+                out += f"@@vm {vmid}\n"
+                config = dict(self.configs[int(vmid)])
+                out += f"status: {config.pop('status', 'stopped')}\n"
+                out += ''.join(f"{key}: {value}\n" for key, value in config.items())
+            return 0, out, ''
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        out = ''
+        for line in script.splitlines():
+            vmid = int(line.split('@@ok ')[1].split('"')[0])
+            out += f"@@error {vmid} locked\n" if vmid in self.fail else f"@@ok {vmid}\n"
+        return 0, out, ''
+
+
+def _config(vmid, cores=2, memory=2048, status='stopped', disk=True):
+    config = {'cores': str(cores), 'memory': str(memory), 'status': status, 'boot': 'order=scsi0'}
+    if disk:
+        config['scsi0'] = DISK.format(vmid=vmid)
+    return config
+
+
+def test_plan_picks_cheapest_change():
+    from app.services.spec_planner import parse_config_listing, plan_vm
+
+    listing = "@@vm 301\nstatus: running\ncores: 2\nmemory: 2048\nscsi0: nfs:301/vm-301-disk-0.qcow2,size=32G\n@@vm 302\n@@error 302\n"
+    configs = parse_config_listing(listing)
+    assert configs[302] is None and configs[301]['status'] == 'running'
+
+    change = plan_vm(301, 'pve1', configs[301], {'cores': 2, 'memory': 4096})
+    assert change.action == 'in_place' and change.set_args == {'memory': 4096} and change.running
+    assert plan_vm(301, 'pve1', configs[301], {'cores': 2, 'memory': 2048}).action == 'unchanged'
+    assert plan_vm(301, 'pve1', configs[301], {'disk_gb': 40}).resize_gb == 40
+    assert plan_vm(301, 'pve1', configs[301], {'disk_gb': 20}).action == 'failed'
+    assert plan_vm(303, 'pve1', _config(303, disk=False), {'cores': 2}).action == 'recreate_disk'
+    assert plan_vm(302, 'pve1', None, {'cores': 2}).action == 'failed'
+
+
+def test_apply_batches_per_node_concurrently():
+    from app.services.spec_planner import SpecPlanner
+
+    vms = [{'vmid': 400 + i, 'node': f"pve{i % 3 + 1}"} for i in range(9)]
+    configs = {vm['vmid']: _config(vm['vmid'], status='running' if vm['vmid'] % 2 else 'stopped') for vm in vms}
+    configs[400]['memory'] = '4096'  # already at spec
+    configs[404] = _config(404, disk=False)
+    ssh = NodeSSH(configs, fail={405})
+    planner = SpecPlanner(ssh)
+
+    changes = planner.plan(vms, {'cores': 2, 'memory': 4096})
+    planner.apply(changes, base_path='/mnt/pve/nfs/images/class-base.qcow2', images_path='/mnt/pve/nfs/images')
+
+    by_vmid = {c.vmid: c for c in changes}
+    assert by_vmid[400].action == 'unchanged'
+    assert by_vmid[404].action == 'recreate_disk'
+    assert by_vmid[405].action == 'failed' and by_vmid[405].error == 'locked'
+    assert sorted(v for v, c in by_vmid.items() if c.action == 'in_place') == [401, 402, 403, 406, 407, 408]
+
+    listings = [c for c in ssh.commands if c[1].startswith('for v in')]
+    batches = [c for c in ssh.commands if not c[1].startswith('for v in')]
+    assert sorted(node for node, _ in listings) == ['pve1', 'pve2', 'pve3']
+    assert sorted(node for node, _ in batches) == ['pve1', 'pve2', 'pve3']
+    assert ssh.max_active > 1
+    # Only the diskless VM gets an overlay; nothing is destroyed
+    scripts = '\n'.join(script for _, script in batches)
+    assert scripts.count('qemu-img create') == 1 and 'vm-404-disk-0.qcow2' in scripts
+    assert 'qm destroy' not in scripts and 'qm set 401 --memory 4096' in scripts
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for the storage probe and storage-aware placement.
+
+Run with: python -m pytest tests/test_storage_probe.py -v
+"""
+
+import os
+import shlex
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+DD_OUTPUT = (
+    "16777216 bytes (17 MB, 16 MiB) copied, 0,25 s, 67,1 MB/s\n"
+    "262144 bytes (262 kB, 256 KiB) copied, 0.032 s, 8.2 MB/s\n"
+)
+
+
+def test_parse_probe_output_handles_comma_decimals():
+    from app.services.storage_probe import PROBE_READS, parse_probe_output
+
+    latency, throughput = parse_probe_output(DD_OUTPUT, size_mb=16)
+    assert throughput == 64.0
+    assert latency == round(0.032 / PROBE_READS * 1000, 3)
+    with pytest.raises(ValueError):
+        parse_probe_output("ssh: connect to host pve9 port 22: No route to host")
+
+
+def test_probe_command_quotes_paths():
+    from app.services.storage_probe import build_probe_command
+
+    args = shlex.split(build_probe_command("pve1", "/mnt/pve/TRUENAS NFS/", size_mb=8))
+    assert args[0] == "ssh" and args[-2] == "pve1"
+    script = args[-1]
+    assert "count=8 oflag=direct" in script
+    assert "of='/mnt/pve/TRUENAS NFS/.lab-portal-probe-pve1'" in script
+
+
+def test_probe_targets_only_shared_image_storage():
+    from app.services.storage_probe import probe_targets
+
+    class Api:
+        class _Nodes:
+            def get(self):
+                return [{'node': 'pve2', 'status': 'online'}, {'node': 'pve1', 'status': 'online'},
+                        {'node': 'pve3', 'status': 'offline'}]
+
+        class _Storage:
+            def get(self):
+                return [
+                    {'storage': 'nfs', 'type': 'nfs', 'shared': 1, 'content': 'images,iso'},
+                    {'storage': 'nfs-iso', 'type': 'nfs', 'shared': 1, 'content': 'iso'},
+                    {'storage': 'local', 'type': 'dir', 'content': 'images', 'path': '/var/lib/vz'},
+                    {'storage': 'gfs', 'type': 'glusterfs', 'shared': 1, 'content': 'images',
+                     'path': '/mnt/gfs', 'nodes': 'pve2'},
+                ]
+
+        nodes = _Nodes()
+        storage = _Storage()
+
+    assert probe_targets(Api()) == [
+        ('pve1', 'nfs', '/mnt/pve/nfs'),
+        ('pve2', 'nfs', '/mnt/pve/nfs'),
+        ('pve2', 'gfs', '/mnt/gfs'),
+    ]
+
+
+def test_saved_probes_steer_overlay_placement(app):
+    from app.models import NodeStorageProbe, db
+    from app.services.placement import GIB, NodeSnapshot, place_batch
+    from app.services.storage_probe import apply_storage_probes, save_probe_results
+
+    save_probe_results([
+        {'cluster_id': 'c1', 'node': 'pve1', 'storage': 'nfs', 'latency_ms': 0.4, 'throughput_mbps': 900.0},
+        {'cluster_id': 'c1', 'node': 'pve2', 'storage': 'nfs', 'latency_ms': 4.0, 'throughput_mbps': 90.0},
+    ])
+    db.session.commit()
+    measured_at = NodeStorageProbe.query.filter_by(node='pve2').one().probed_at
+    # A failed probe keeps the previous measurement and its age
+    save_probe_results([{'cluster_id': 'c1', 'node': 'pve2', 'storage': 'nfs', 'error': 'timeout'},
+                        {'cluster_id': 'c1', 'node': 'pve3', 'storage': 'nfs', 'error': 'timeout'}])
+    db.session.commit()
+    row = NodeStorageProbe.query.filter_by(node='pve2').one()
+    assert (row.latency_ms, row.error, row.probed_at) == (4.0, 'timeout', measured_at)
+    assert row.error_at is not None
+    # A node that never measured has no probed_at
+    assert NodeStorageProbe.query.filter_by(node='pve3').one().probed_at is None
+
+    def snapshot():
+        # pve2 has slightly more free RAM - it wins when storage is ignored
+        return NodeSnapshot.from_nodes([
+            {'node': 'pve1', 'status': 'online', 'maxmem': 128 * GIB, 'mem': 40 * GIB, 'maxcpu': 32, 'cpu': 0.1},
+            {'node': 'pve2', 'status': 'online', 'maxmem': 128 * GIB, 'mem': 36 * GIB, 'maxcpu': 32, 'cpu': 0.1},
+        ])
+
+    demands = [(2 * GIB, 2)] * 20
+    plain = place_batch(snapshot(), demands)
+    probed = snapshot()
+    assert apply_storage_probes(probed, 'nfs', cluster_id='c1') == 2
+    aware = place_batch(probed, demands, io=True)
+
+    assert aware.count('pve1') > plain.count('pve1')
+    assert aware.count('pve2') > 0  # contention still spreads the boot storm
+    assert place_batch(snapshot(), demands, io=True) == plain  # no probe data -> RAM/CPU only
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests for the background sync job scheduler.
+
+Run with: python -m pytest tests/test_sync_scheduler.py -v
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+def _wait_for(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_slow_job_does_not_starve_fast_job():
+    from app.services.sync_scheduler import JobScheduler
+
+    release = threading.Event()
+    fast_runs = []
+
+    scheduler = JobScheduler(name="test-starve")
+    scheduler.register("slow", lambda: release.wait(5), interval=60, jitter=0)
+    scheduler.register("fast", lambda: fast_runs.append(time.time()), interval=0.05, jitter=0)
+    scheduler.start()
+    try:
+        assert _wait_for(lambda: len(fast_runs) >= 5), "fast job must keep running while slow job blocks"
+        assert scheduler.stats()["slow"]["running"] is True
+    finally:
+        release.set()
+        scheduler.stop(wait=True)
+
+
+def test_job_never_runs_concurrently_and_trigger_coalesces():
+    from app.services.sync_scheduler import JobScheduler
+
+    active = []
+    max_active = []
+    release = threading.Event()
+
+    def job():
+        active.append(1)
+        max_active.append(len(active))
+        release.wait(5)
+        active.pop()
+
+    scheduler = JobScheduler(name="test-concurrency")
+    scheduler.register("job", job, interval=60, jitter=0)
+    scheduler.start()
+    try:
+        assert _wait_for(lambda: scheduler.stats()["job"]["running"])
+        for _ in range(5):
+            assert scheduler.trigger("job") is True
+        release.set()
+        # The triggers collapse into exactly one re-run after the first run
+        assert _wait_for(lambda: scheduler.stats()["job"]["runs"] == 2)
+        time.sleep(0.1)
+        assert scheduler.stats()["job"]["runs"] == 2
+        assert max(max_active) == 1
+    finally:
+        scheduler.stop(wait=True)
+
+
+def test_manual_trigger_runs_before_next_due():
+    from app.services.sync_scheduler import JobScheduler
+
+    runs = []
+    scheduler = JobScheduler(name="test-trigger")
+    scheduler.register("job", lambda: runs.append(1), interval=3600, jitter=0, initial_delay=3600)
+    scheduler.start()
+    try:
+        assert scheduler.trigger("job") is True
+        assert _wait_for(lambda: scheduler.stats()["job"]["runs"] == 1)
+        assert scheduler.trigger("unknown") is False
+    finally:
+        scheduler.stop(wait=True)
+
+
+def test_failures_back_off_and_are_reported():
+    from app.services.sync_scheduler import JobScheduler
+
+    errors = []
+
+    def boom():
+        raise RuntimeError("proxmox down")
+
+    scheduler = JobScheduler(name="test-errors")
+    scheduler.register("job", boom, interval=3600, jitter=0,
+                       on_error=lambda job, e: errors.append(str(e)))
+    scheduler.start()
+    try:
+        assert _wait_for(lambda: errors)
+        stats = scheduler.stats()["job"]
+        assert stats["failures"] == 1
+        assert stats["last_error"] == "proxmox down"
+        # First retry uses the short backoff, not the 1h interval
+        assert stats["next_due_in"] <= 5.0
+    finally:
+        scheduler.stop(wait=True)
+
+
+def test_runtime_histogram_quantiles():
+    from app.services.sync_scheduler import RuntimeHistogram
+
+    hist = RuntimeHistogram(buckets=(1, 10, 100))
+    for seconds in (0.5, 0.5, 0.5, 5, 500):
+        hist.observe(seconds)
+
+    snap = hist.snapshot()
+    assert snap["count"] == 5
+    assert snap["buckets"] == {"le_1": 3, "le_10": 1, "le_100": 0, "inf": 1}
+    assert snap["p50"] == 1
+    assert snap["p95"] == 500
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for the template replication planner and runner.
+
+Run with: python -m pytest tests/test_template_replication.py -v
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+NODES = ['pve1', 'pve2', 'pve3']
+NODE_STORAGES = {node: {'local-lvm': False, 'nfs': True} for node in NODES}
+
+
+def test_plan_lists_missing_pairs_and_skips_shared_storage():
+    from app.services.template_replication import disk_storages, plan_replication
+
+    assert disk_storages({'scsi0': 'local-lvm:base-100-disk-0,size=32G', 'ide2': 'nfs:iso/x.iso,media=cdrom',
+                          'efidisk0': 'local-lvm:base-100-disk-1', 'scsihw': 'virtio-scsi-pci'}) == {'local-lvm'}
+
+    templates = [
+        {'vmid': 100, 'name': 'win11', 'node': 'pve1'},
+        {'vmid': 101, 'name': 'ubuntu', 'node': 'pve1'},
+        {'vmid': 102, 'name': 'ubuntu', 'node': 'pve2'},
+        {'vmid': 103, 'name': 'kali', 'node': 'pve1'},
+    ]
+    storages = {('pve1', 100): {'local-lvm'}, ('pve1', 101): {'local-lvm'},
+                ('pve2', 102): {'local-lvm'}, ('pve1', 103): {'nfs'}}
+
+    plan = plan_replication(templates, NODES, storages, NODE_STORAGES)
+
+    assert [(t.name, t.source_node, t.target_node) for t in plan.tasks] == [
+        ('ubuntu', 'pve1', 'pve3'),
+        ('win11', 'pve1', 'pve2'),
+        ('win11', 'pve1', 'pve3'),
+    ]
+    # kali lives on shared NFS - every node already sees it
+    assert sorted(plan.skipped_shared) == [('kali', 'pve2'), ('kali', 'pve3')]
+
+
+class FakeProxmox:
+    """Clone/migrate return UPIDs that finish after a short delay; tracks concurrency."""
+
+    def __init__(self, fail_migrate=(), fail_delete=()):
+        self.fail_migrate = set(fail_migrate)
+        self.fail_delete = set(fail_delete)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+
+    def nodes(self, node):
+        return _Node(self, node)
+
+    def task(self, kind, node, vmid):
+        if (kind == 'migrate' and vmid in self.fail_migrate) or (kind == 'delete' and vmid in self.fail_delete):
+            raise RuntimeError(f"{kind} of {vmid} refused")
+        with self.lock:
+            self.calls.append((kind, node, vmid))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        return f"UPID:{node}:0001:{kind}:{vmid}:root@pam:"
+
+
+class _Node:
+    def __init__(self, api, node):
+        self.api, self.node = api, node
+
+    def qemu(self, vmid):
+        return _Vm(self.api, self.node, vmid)
+
+    def tasks(self, upid):
+        class _Status:
+            def get(self):
+                return {'status': 'stopped', 'exitstatus': 'OK'}
+
+        class _Task:
+            status = _Status()
+
+        return _Task()
+
+
+class _Vm:
+    def __init__(self, api, node, vmid):
+        self.api, self.node, self.vmid = api, node, vmid
+        self.clone = _Action(lambda **kw: api.task('clone', node, kw['newid']))
+        self.migrate = _Action(lambda **kw: api.task('migrate', kw['target'], vmid))
+        self.template = _Action(lambda **kw: api.calls.append(('template', node, vmid)))
+
+    def delete(self, **kwargs):
+        return self.api.task('delete', self.node, self.vmid)
+
+
+class _Action:
+    def __init__(self, func):
+        self.post = func
+
+
+def test_run_replication_limits_per_storage_and_migrates_cross_node():
+    from app.services.template_replication import ReplicaTask, run_replication
+
+    tasks = [ReplicaTask(name=f"tpl{i}", source_node='pve1', source_vmid=100 + i, target_node='pve2',
+                         storages=('local-lvm',), vmid=500 + i) for i in range(6)]
+    api = FakeProxmox()
+
+    run_replication(api, tasks, NODE_STORAGES, per_storage=2, workers=6)
+
+    assert all(t.done and t.error is None for t in tasks)
+    assert api.max_active <= 2
+    assert sorted(c for c in api.calls if c[0] == 'migrate') == [('migrate', 'pve2', 500 + i) for i in range(6)]
+    assert sorted(c for c in api.calls if c[0] == 'template') == [('template', 'pve2', 500 + i) for i in range(6)]
+
+
+def test_failed_migrate_destroys_clone_or_records_orphan():
+    from app.services.template_replication import ReplicaTask, run_replication
+
+    tasks = [ReplicaTask(name=f"tpl{i}", source_node='pve1', source_vmid=100 + i, target_node='pve2',
+                         storages=('local-lvm',), vmid=600 + i) for i in range(3)]
+    api = FakeProxmox(fail_migrate={600, 601}, fail_delete={601})
+
+    run_replication(api, tasks, NODE_STORAGES, per_storage=2, workers=3)
+
+    # The clone left on the source node is purged
+    assert tasks[0].error and not tasks[0].done and tasks[0].orphan_node is None
+    assert ('delete', 'pve1', 600) in api.calls
+    # A clone that cannot be destroyed is recorded, so its VMID stays reserved
+    assert tasks[1].error and tasks[1].orphan_node == 'pve1'
+    assert tasks[2].done and tasks[2].orphan_node is None
+    assert not any(c[0] == 'delete' and c[2] == 602 for c in api.calls)
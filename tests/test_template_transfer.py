@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the cross-cluster template transfer engine.
+
+Run with: python -m pytest tests/test_template_transfer.py -v
+"""
+
+import json
+import os
+import shlex
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+MIB = 1024 * 1024
+
+
+class ScriptedSSH:
+    """Records commands; replies from the first (substring, reply) rule that matches."""
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.commands = []
+
+    def execute(self, cmd, timeout=None, check=True):
+        self.commands.append(cmd)
+        for needle, reply in self.rules:
+            if needle in cmd:
+                return reply
+        return 0, '', ''
+
+
+def test_allocated_bytes_and_resume_point():
+    from app.services.template_transfer import allocated_bytes, chunk_count, resume_chunk
+
+    extents = [
+        {'start': 0, 'length': 4 * MIB, 'data': True, 'zero': False},
+        {'start': 4 * MIB, 'length': 60 * 1024 * MIB, 'data': False, 'zero': True},
+        {'start': 0, 'length': 2 * MIB, 'data': True, 'zero': True},
+        {'start': 0, 'length': 6 * MIB, 'data': True, 'zero': False},
+    ]
+    assert allocated_bytes(json.dumps(extents)) == 10 * MIB
+
+    total = 1000 * MIB
+    assert chunk_count(total, 256) == 4
+    assert resume_chunk(600 * MIB, str(total), total, 256) == 2  # partial third chunk is resent
+    assert resume_chunk(600 * MIB, '12345', total, 256) == 0  # different export
+    assert resume_chunk(total, str(total), total, 256) == 4
+
+
+def test_chunk_command_streams_compressed_to_destination_node():
+    from app.services.template_transfer import DiskTransfer
+
+    transfer = DiskTransfer(None, 'src1', None, 'dst2', '10.0.0.5', 'template-a-100-scsi0-to-b',
+                            chunk_mb=64, compress='zstd', workdir='/var/tmp/xfer')
+    cmd = transfer.chunk_command(3)
+    sender, wire, hop = cmd.split(' | ', 2)
+    assert sender.startswith('set -o pipefail; dd if=/var/tmp/xfer/template-a-100-scsi0-to-b.qcow2 bs=1M skip=192 count=64')
+    assert wire.startswith('zstd')
+    outer = shlex.split(hop)
+    assert outer[-2] == 'root@10.0.0.5'
+    inner = shlex.split(outer[-1])
+    assert inner[-2] == 'dst2'
+    assert inner[-1].startswith('set -o pipefail; zstd -q -d -c | dd of=/var/tmp/xfer/template-a-100-scsi0-to-b.qcow2.part')
+    assert 'seek=192' in inner[-1] and 'conv=notrunc' in inner[-1]
+
+
+def test_interrupted_transfer_resumes_from_checkpoint():
+    from app.services.template_transfer import DiskTransfer
+
+    total = 5 * 64 * MIB - 123
+    digest = 'ab' * 32
+    source = ScriptedSSH([('stat -c %s', (0, f'{total}\n', '')),  # export already on the source
+                          ('sha256sum', (0, f'{digest}\n', ''))])
+    dest = ScriptedSSH([('manifest=', (0, f'manifest={total} size={2 * 64 * MIB + 999}\n', ''))])
+
+    transfer = DiskTransfer(source, 'src1', dest, 'dst2', '10.0.0.5', 'tid', chunk_mb=64, workdir='/var/tmp/x')
+    path = transfer.run('/dev/zvol/rpool/data/vm-100-disk-0', 'raw')
+
+    assert path == '/var/tmp/x/tid.qcow2'
+    # No re-export; chunks 2, 3 and 4 sent
+    assert not [c for c in source.commands if 'qemu-img convert' in c]
+    sent = [c for c in source.commands if ' dd if=' in c]
+    assert [c.split('skip=')[1].split()[0] for c in sent] == ['128', '192', '256']
+    assert transfer.stats['resumed_at_chunk'] == 2
+    assert transfer.stats['sent_bytes'] == total - 2 * 64 * MIB
+    # The existing .part was kept, then verified and moved into place
+    assert not [c for c in dest.commands if 'rm -f' in c and '.part' in c and f'echo {total}' in c]
+    verify = [c for c in dest.commands if 'qemu-img check' in c]
+    assert len(verify) == 1 and digest in verify[0] and 'sha256sum' in verify[0]
+
+
+def test_checksum_mismatch_discards_the_received_file():
+    from app.services.template_transfer import DiskTransfer
+
+    total = 64 * MIB
+    source = ScriptedSSH([('stat -c %s', (0, f'{total}\n', '')), ('sha256sum', (0, 'cd' * 32 + '\n', ''))])
+    dest = ScriptedSSH([('qemu-img check', (1, '', 'sha256 mismatch\n'))])
+
+    transfer = DiskTransfer(source, 'src1', dest, 'dst2', '10.0.0.5', 'tid', chunk_mb=64, workdir='/var/tmp/x')
+    try:
+        transfer.run('/dev/zvol/rpool/data/vm-100-disk-0', 'raw')
+        assert False, 'a mismatched transfer must not be imported'
+    except RuntimeError as e:
+        assert 'sha256 mismatch' in str(e)
+    # The .part and manifest are removed so the next attempt starts over; the export is kept
+    assert [c for c in dest.commands if 'rm -f' in c and '.part' in c and 'manifest' in c and 'qemu-img' not in c]
+    assert not [c for c in source.commands if c.endswith("rm -f /var/tmp/x/tid.qcow2 /var/tmp/x/tid.qcow2.sha256'")]
+
+
+def test_template_disks_and_imported_volume():
+    from app.services.template_transfer import parse_imported_volume, template_disks
+
+    config = {
+        'scsi0': 'local-zfs:base-100-disk-0,size=60G',
+        'ide2': 'local:iso/win.iso,media=cdrom',
+        'ide0': 'local-zfs:vm-100-cloudinit,media=cdrom',
+        'sata1': 'local-zfs:base-100-disk-1,size=10G',
+        'scsihw': 'virtio-scsi-pci',
+    }
+    assert template_disks(config) == [('sata1', 'local-zfs:base-100-disk-1'), ('scsi0', 'local-zfs:base-100-disk-0')]
+    output = "transferred 60.0 GiB of 60.0 GiB (100.00%)\nSuccessfully imported disk as 'unused0:TRUENAS-NFS:512/vm-512-disk-0.qcow2'\n"
+    assert parse_imported_volume(output) == 'TRUENAS-NFS:512/vm-512-disk-0.qcow2'
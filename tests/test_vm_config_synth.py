@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for VM config synthesis (template config plus overrides, written once).
+
+Run with: python -m pytest tests/test_vm_config_synth.py -v
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+TEMPLATE_CONF = """#Windows 11 lab image
+bios: ovmf
+boot: order=scsi0;ide2;net0
+cores: 4
+efidisk0: TRUENAS-NFS:100/base-100-disk-1.raw,efitype=4m,pre-enrolled-keys=1,size=528K
+ide2: none,media=cdrom
+memory: 8192
+name: win11-template
+net0: virtio=BC:24:11:AA:BB:CC,bridge=vmbr0,firewall=1
+parent: before-sysprep
+scsi0: TRUENAS-NFS:100/base-100-disk-0.raw,format=raw,size=64G
+template: 1
+tpmstate0: TRUENAS-NFS:100/base-100-disk-2.raw,size=4M,version=v2.0
+
+[before-sysprep]
+cores: 2
+snaptime: 1700000000
+"""
+
+
+class WriteSSH:
+    """Runs config-write scripts: decodes the written config and answers like pvesh."""
+
+    def __init__(self):
+        self.commands = []
+        self.files = {}
+
+    def execute(self, cmd, timeout=None, check=True):
+        self.commands.append(cmd)
+        if cmd.startswith('cat '):
+            return 0, TEMPLATE_CONF, ''
+        match = re.search(r'echo (\S+) \| base64 -d > (\S+)', cmd)
+        text = base64.b64decode(match.group(1)).decode('utf-8')
+        self.files[match.group(2)] = text
+        config = {line.split(': ', 1)[0]: line.split(': ', 1)[1]
+                  for line in text.splitlines() if not line.startswith('#')}
+        config['digest'] = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return 0, json.dumps(config), ''
+
+
+def test_synthesize_clone_config():
+    from app.services.vm_config_synth import parse_vm_config, render_vm_config, synthesize_clone_config
+
+    comments, settings = parse_vm_config(TEMPLATE_CONF)
+    assert comments == ['#Windows 11 lab image']
+    # Snapshot sections are not part of the current config
+    assert settings['cores'] == '4' and 'snaptime' not in settings
+
+    config = synthesize_clone_config(settings, 200, 'win11-student-1', '200/vm-200-disk-0.qcow2',
+                                     'TRUENAS-NFS', '02:11:22:33:44:55')
+    assert 'template' not in config and 'parent' not in config
+    assert config['name'] == 'win11-student-1'
+    assert config['scsi0'] == 'TRUENAS-NFS:200/vm-200-disk-0.qcow2,format=qcow2,size=64G'
+    assert config['ide2'] == 'none,media=cdrom'
+    assert config['efidisk0'].startswith('TRUENAS-NFS:200/vm-200-disk-1.raw,efitype=4m')
+    assert config['tpmstate0'] == 'TRUENAS-NFS:200/vm-200-disk-2.raw,size=4M,version=v2.0'
+    assert config['net0'] == 'virtio=02:11:22:33:44:55,bridge=vmbr0,firewall=1'
+    assert render_vm_config(config, comments).startswith('#Windows 11 lab image\nbios: ovmf\n')
+
+
+def test_clone_writes_config_in_one_call():
+    from app.services.vm_config_clone import clone_vm_config
+
+    ssh = WriteSSH()
+    ok, error, mac = clone_vm_config(ssh, 100, 200, 'win11-student-1', '200/vm-200-disk-0.qcow2',
+                                     source_node='pve2', disk_dir='/mnt/pve/TRUENAS-NFS/images/200')
+    assert ok, error
+
+    # Template read once from the cluster filesystem, then a single write
+    assert ssh.commands[0] == 'cat /etc/pve/nodes/pve2/qemu-server/100.conf'
+    assert len(ssh.commands) == 2
+    script = ssh.commands[1]
+    assert 'vm-200-disk-1.raw 528K' in script and 'vm-200-disk-2.raw 4M' in script
+    written = ssh.files['/etc/pve/qemu-server/200.conf']
+    assert f"net0: virtio={mac},bridge=vmbr0" in written
+
+    # A second VM from the same template reuses the cached template config
+    ok, _, _ = clone_vm_config(ssh, 100, 201, 'win11-student-2', '201/vm-201-disk-0.qcow2', source_node='pve2')
+    assert ok and len(ssh.commands) == 3 and 'qemu-img' not in ssh.commands[2]
+
+
+def test_qm_create_command_quotes_options():
+    from app.services.vm_config_synth import parse_written_config, qm_create_command
+
+    cmd = qm_create_command(300, {'name': 'lab-vm', 'boot': 'order=scsi0;ide2;net0', 'cpu': None,
+                                  'digest': 'abc', 'agent': 'enabled=1,fstrim_cloned_disks=1'})
+    assert cmd.startswith("qm create 300 --name lab-vm --boot 'order=scsi0;ide2;net0' "
+                          "--agent enabled=1,fstrim_cloned_disks=1 && pvesh get")
+    assert '--cpu' not in cmd and '--digest' not in cmd
+
+    config, warnings = parse_written_config('@@warn TPM state file could not be created\n{"name": "lab-vm"}\n')
+    assert config == {'name': 'lab-vm'} and warnings == ['TPM state file could not be created']
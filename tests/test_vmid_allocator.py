@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the interval-set VMID allocator.
+
+Run with: python -m pytest tests/test_vmid_allocator.py -v
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+@pytest.fixture
+def alloc_db(app):
+    from app.models import db
+    from app.services import vmid_allocator
+
+    vmid_allocator.invalidate_inventory_ranges()
+    return db
+
+
+def test_interval_set_merges_and_splits():
+    from app.services.vmid_allocator import IntervalSet
+
+    ranges = IntervalSet([(10, 20), (30, 40)])
+    ranges.add(21, 29)  # bridges both -> one range
+    assert ranges.intervals() == [(10, 40)]
+    ranges.discard(15, 16)
+    assert ranges.intervals() == [(10, 14), (17, 40)]
+    assert 14 in ranges and 15 not in ranges
+    assert ranges.first_free(10, 100) == 15
+    assert ranges.first_free(17, 40) is None
+
+
+def test_interval_set_aligned_blocks():
+    from app.services.vmid_allocator import IntervalSet
+
+    used = IntervalSet([(20000, 20099), (20150, 20150), (20300, 20399)])
+    assert used.first_free_block(100, 20000, 99999, align=100) == 20200
+    assert used.first_free_block(100, 20000, 20299, align=100) == 20200
+    assert used.first_free_block(100, 20000, 20198, align=100) is None
+
+
+def test_single_vmids_skip_inventory_and_reservations(alloc_db):
+    from app.models import VMInventory
+    from app.services.vmid_allocator import allocate_vmid
+
+    db = alloc_db
+    for vmid in (200, 201, 203):
+        db.session.add(VMInventory(cluster_id="c1", vmid=vmid, name="vm", node="pve1"))
+    db.session.commit()
+
+    assert allocate_vmid(start=200) == 202
+    assert allocate_vmid(start=200) == 204  # 202 is reserved now
+    assert allocate_vmid(start=200, extra_used={205}) == 206
+
+
+def test_prefix_blocks_avoid_classes_and_stray_vms(alloc_db):
+    from app.models import Class, User, VMInventory
+    from app.services.vmid_allocator import allocate_vmid_prefix
+
+    db = alloc_db
+    teacher = User(username="t", password_hash="x", role="teacher")
+    db.session.add(teacher)
+    db.session.flush()
+    db.session.add(Class(name="c", teacher_id=teacher.id, vmid_prefix=200))
+    db.session.add(VMInventory(cluster_id="c1", vmid=20142, name="stray", node="pve1"))
+    db.session.commit()
+
+    assert allocate_vmid_prefix() == 202
+    assert allocate_vmid_prefix() == 203
+
+
+def test_expired_and_released_reservations_free_ids(alloc_db):
+    from app.models import VMIDReservation
+    from app.services.vmid_allocator import allocate_vmid, release_reservations
+
+    db = alloc_db
+    assert allocate_vmid(start=500, owner="deploy:1") == 500
+    assert allocate_vmid(start=500, owner="deploy:2") == 501
+    release_reservations("deploy:1")
+    assert allocate_vmid(start=500, owner="deploy:3") == 500
+
+    VMIDReservation.query.filter_by(owner="deploy:2").update(
+        {"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert allocate_vmid(start=500, owner="deploy:4") == 501
+
+
+class _NoVMsSSH:
+    """Every `qm status` reports a missing VM."""
+
+    def execute(self, cmd, timeout=None, check=True):
+        return 2, '', 'Configuration file does not exist'
+
+
+def test_deployment_reserves_its_block_and_releases_unused_ids(alloc_db, monkeypatch):
+    from app.models import VMIDReservation
+    from app.services import vm_template
+    from app.services.vmid_allocator import allocate_vmid
+
+    # Another deployment in flight holds 200
+    assert allocate_vmid(start=200, owner="deploy-other") == 200
+    held = []
+
+    def create_overlay_vm(**kw):
+        # Every ID of the deployment is reserved before the first VM is built
+        held.append(sorted((r.start_vmid, r.end_vmid) for r in VMIDReservation.query.all()))
+        return (kw['vmid'] != 202, "qemu-img failed", "02:00:00:00:00:01")
+
+    monkeypatch.setattr(vm_template, "create_overlay_vm", create_overlay_vm)
+
+    created, successful, failed = vm_template.create_student_overlays(
+        _NoVMsSSH(), "/mnt/pve/nfs/images/base.qcow2", "lab", 3, "pve1")
+
+    assert [vm['vmid'] for vm in created] == [201, 203] and (successful, failed) == (2, 1)
+    assert held[0] == [(200, 200), (201, 203)]
+    # The failed VM's ID is free again; created VMs stay reserved until inventory sync
+    remaining = {(r.owner == "deploy-other", r.start_vmid, r.end_vmid) for r in VMIDReservation.query.all()}
+    assert remaining == {(True, 200, 200), (False, 201, 201), (False, 203, 203)}
+    assert allocate_vmid(start=200) == 202
+
+
+def test_class_creation_hands_its_prefix_to_the_class_row(alloc_db):
+    from app.models import Class, User, VMIDReservation
+    from app.services.class_service import create_class
+    from app.services.vmid_allocator import allocate_vmid_prefix
+
+    db = alloc_db
+    db.session.add(User(username="teacher1", password_hash="x", role="teacher"))
+    db.session.commit()
+    # A class being created elsewhere holds prefix 200
+    assert allocate_vmid_prefix(owner="class-prefix-other") == 200
+
+    class_, message = create_class("Networks", teacher_id=User.query.first().id)
+
+    assert class_ is not None, message
+    assert Class.query.get(class_.id).vmid_prefix == 201
+    # The class row covers 20100-20199 now; only the other creation's reservation is left
+    assert [r.owner for r in VMIDReservation.query.all()] == ["class-prefix-other"]
+    assert allocate_vmid_prefix() == 202
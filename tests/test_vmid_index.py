@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for the VMID prefix index used by class import and VM recovery.
+
+Run with: python -m pytest tests/test_vmid_index.py -v
+"""
+
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+@pytest.fixture
+def index_db(app):
+    from app.models import VMInventory, db
+    from app.services import vmid_index
+
+    rows = [(12300, "bio-teacher"), (12301, "bio-1"), (12302, "bio-2"), (12399, "bio-base"),
+            (45600, "lonely-teacher"), (150, "router")]
+    for vmid, name in rows:
+        db.session.add(VMInventory(cluster_id="c1", vmid=vmid, name=name, node="pve1", status="stopped"))
+    db.session.add(VMInventory(cluster_id="c1", vmid=12398, name="tpl", node="pve1", is_template=True))
+    db.session.commit()
+    vmid_index.rebuild_index()
+    return db
+
+
+def test_classify_vmid_slots():
+    from app.services.vmid_index import classify_vmid
+
+    assert classify_vmid(12300) == (123, 'teacher')
+    assert classify_vmid(12399) == (123, 'base')
+    assert classify_vmid("12342") == (123, 'student')
+    assert classify_vmid(150) == (None, None)
+    assert classify_vmid(None) == (None, None)
+
+
+def test_candidate_classes_group_by_prefix(index_db):
+    from app.services.vmid_index import get_candidate_classes
+
+    groups, unmatched, total = get_candidate_classes("c1")
+
+    assert [g['prefix'] for g in groups] == ['123']  # 456 has no students, templates skipped
+    group = groups[0]
+    assert group['teacher_vm']['vmid'] == 12300
+    assert group['base_vm']['vmid'] == 12399
+    assert [s['suffix'] for s in group['student_vms']] == ['01', '02']
+    assert group['suggested_name'] == 'Bio Teacher'
+    assert unmatched == [{'vmid': 150, 'name': 'router'}]
+    assert total == 6
+    assert get_candidate_classes("other")[0] == []
+
+
+def test_sync_updates_index_incrementally(index_db):
+    from app.services.inventory_service import persist_vm_inventory
+    from app.services.vmid_index import get_prefix_group, update_index_status
+
+    vms = [
+        {'cluster_id': 'c1', 'vmid': vmid, 'name': name, 'node': 'pve1', 'status': 'running', 'type': 'qemu'}
+        for vmid, name in [(12300, "bio-teacher"), (12301, "bio-1"), (12303, "bio-3"), (12399, "bio-base"), (150, "router")]
+    ]
+    persist_vm_inventory(vms)
+
+    group = get_prefix_group(123, "c1")
+    assert sorted(group) == [12300, 12301, 12303, 12399]  # 12302 removed, 12303 added
+    assert group[12301]['status'] == 'running'
+    assert get_prefix_group(456) == {}
+
+    update_index_status("c1", 12301, "stopped", node="pve2")
+    assert get_prefix_group(123)[12301] == {'vmid': 12301, 'name': 'bio-1', 'node': 'pve2', 'status': 'stopped'}
+
+
+def test_validate_import_group(index_db):
+    from app.services.vmid_index import validate_import_group
+
+    assert validate_import_group("123", 12300, 12399, [12301, 12302], "c1") == []
+    errors = validate_import_group("123", 12301, None, [12305, 45601], "c1")
+    assert errors == [
+        "VMID 12301 is not a teacher VM of prefix 123",
+        "VMID 12305 not found in inventory",
+        "VMID 45601 is not a student VM of prefix 123",
+    ]
+    assert validate_import_group("ABC", 1, 2, [3]) == []  # name-based prefixes are not checked
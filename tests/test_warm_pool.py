@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-class warm pool of spare student VMs.
+
+Uses an in-memory SQLite database; the deployment pipeline is faked.
+
+Run with: python -m pytest tests/test_warm_pool.py -v
+"""
+
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+@pytest.fixture
+def pool_db(app):
+    from app.models import Class, User, VMAssignment, VMInventory, db
+
+    teacher = User(username="teacher", role="teacher", password_hash="x")
+    db.session.add(teacher)
+    db.session.flush()
+    class_ = Class(name="Networks", teacher_id=teacher.id, join_token="networks-123",
+                   token_never_expires=True, warm_pool_size=2)
+    db.session.add(class_)
+    db.session.flush()
+    db.session.add(VMAssignment(class_id=class_.id, proxmox_vmid=12399, node="pve1", is_template_vm=True,
+                                status="reserved"))
+    db.session.add(VMAssignment(class_id=class_.id, proxmox_vmid=12300, node="pve1", is_teacher_vm=True,
+                                assigned_user_id=teacher.id, status="assigned"))
+    for vmid in (12301, 12302, 12303):
+        db.session.add(VMAssignment(class_id=class_.id, proxmox_vmid=vmid, node="pve1"))
+    # 12303 is booted with a known IP, 12302 is running without one yet
+    db.session.add(VMInventory(cluster_id="1", vmid=12303, name="s3", node="pve1", status="running",
+                               ip="10.0.0.33"))
+    db.session.add(VMInventory(cluster_id="1", vmid=12302, name="s2", node="pve1", status="running"))
+    db.session.commit()
+    return db, class_.id
+
+
+def _student(db, name):
+    from app.models import User
+
+    user = User(username=name, role="user", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_claim_prefers_ready_spares(pool_db):
+    from app.services.warm_pool import claim_spares, pool_status
+    from app.models import Class
+
+    db, class_id = pool_db
+    assert [vm.proxmox_vmid for vm in claim_spares(class_id, 2)] == [12303, 12301]
+
+    status = pool_status(Class.query.get(class_id))
+    assert status['spares'] == 3 and status['ready'] == 1 and status['target'] == 2
+
+
+def test_join_assigns_ready_spare_and_triggers_refill(pool_db, monkeypatch):
+    from app.services import class_service
+
+    db, class_id = pool_db
+    refills = []
+    monkeypatch.setattr(class_service, "refill_async", lambda cid, retire=None: refills.append(cid))
+
+    alice = _student(db, "alice")
+    ok, _, assignment = class_service.join_class_via_token("networks-123", alice.id)
+
+    assert ok and assignment.proxmox_vmid == 12303 and assignment.assigned_user_id == alice.id
+    assert refills == [class_id]
+
+
+def test_refill_tops_up_for_target_and_waiting_students(pool_db, monkeypatch):
+    from app.models import Class, VMAssignment
+    from app.services import class_vm_service, warm_pool
+
+    db, class_id = pool_db
+    class_ = Class.query.get(class_id)
+    # Two assigned students leave one spare; one more student is waiting
+    for name, vmid in (("bob", 12301), ("carol", 12302)):
+        student = _student(db, name)
+        class_.students.append(student)
+        VMAssignment.query.filter_by(proxmox_vmid=vmid).first().assign_to_user(student)
+    class_.students.append(_student(db, "dave"))
+    db.session.commit()
+
+    requested = []
+
+    def fake_deploy(class_id, num_students=0):
+        requested.append(num_students)
+        for i in range(num_students):
+            db.session.add(VMAssignment(class_id=class_id, proxmox_vmid=12310 + i, node="pve2"))
+        db.session.commit()
+        return True, "ok", {'student_vm_count': num_students}
+
+    monkeypatch.setattr(class_vm_service, "deploy_class_vms", fake_deploy)
+
+    stats = warm_pool.refill_class(class_id)
+
+    # target 2 + 1 waiting - 1 spare
+    assert requested == [2]
+    assert stats['created'] == 2 and stats['assigned'] == 1
+    assert warm_pool.spare_query(class_id).count() == 2
+    # A second run has nothing to do
+    assert warm_pool.refill_class(class_id)['created'] == 0 and requested == [2]
+
+
+def test_swap_releases_old_vm_for_deletion(pool_db):
+    from app.models import VMAssignment
+    from app.services.warm_pool import claim_spares, swap_for_spare
+
+    db, class_id = pool_db
+    erin = _student(db, "erin")
+    old = VMAssignment.query.filter_by(proxmox_vmid=12301).first()
+    old.assign_to_user(erin)
+    db.session.commit()
+
+    spare = swap_for_spare(old, erin)
+    db.session.commit()
+
+    assert spare.proxmox_vmid == 12303 and spare.assigned_user_id == erin.id
+    assert old.assigned_user_id is None and old.status == 'deleting'
+    # The retired VM is never handed out again
+    assert [vm.proxmox_vmid for vm in claim_spares(class_id, 5)] == [12302]
+
+
+def test_linked_clone_class_keeps_no_warm_pool(pool_db, monkeypatch):
+    from app.models import Class
+    from app.services import class_vm_service, warm_pool
+
+    db, class_id = pool_db
+    class_ = Class.query.get(class_id)
+    class_.deployment_method = 'linked_clone'
+    class_.warm_pool_size = 5
+    db.session.commit()
+    monkeypatch.setattr(class_vm_service, "deploy_class_vms",
+                        lambda *args, **kwargs: pytest.fail("overlay deployment for a linked clone class"))
+
+    assert not warm_pool.supports_warm_pool(class_)
+    assert 'skipped' in warm_pool.refill_class(class_id)
+    assert warm_pool.refill_warm_pools()['classes'] == 0